@@ -0,0 +1,105 @@
+"""
+Load test of /k8s/pod on a single uvicorn worker: the previous sync handler (spec then usage,
+on the threadpool) versus the async handler (spec and usage concurrently on the event loop).
+
+Both upstreams are local stub servers with an artificial per-response delay:
+
+    python -m benchmarks.bench_async_endpoint [requests] [concurrency] [upstream_delay_ms]
+"""
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import aiohttp
+from fastapi import FastAPI
+
+from benchmarks.stubs import StubApiHandler, StubPrometheusHandler, server_url, start_server, write_kubeconfig
+from services import metrics_analyzer
+
+# The handler as it was before the async pipeline, served by `uvicorn benchmarks.bench_async_endpoint:sync_app`.
+sync_app = FastAPI()
+
+
+@sync_app.get("/k8s/pod")
+def get_k8s_pod_sync(pod_name: str, namespace: str):
+    return metrics_analyzer.analyze_pod_resource_usage(pod_name=pod_name, namespace=namespace)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_until_up(url: str, timeout: float = 20.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=1.0).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"server at {url} did not start")
+
+
+async def fire(url: str, requests: int, concurrency: int) -> float:
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=60.0)) as client:
+        queue = asyncio.Queue()
+        for _ in range(requests):
+            queue.put_nowait(None)
+
+        async def worker():
+            while not queue.empty():
+                queue.get_nowait()
+                async with client.get(url) as response:
+                    response.raise_for_status()
+                    await response.read()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return time.perf_counter() - start
+
+
+def run(requests: int = 2000, concurrency: int = 100, delay_ms: float = 20.0):
+    k8s = start_server(StubApiHandler, delay=delay_ms / 1000)
+    prometheus = start_server(StubPrometheusHandler, delay=delay_ms / 1000)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, KUBECONFIG=write_kubeconfig(tmp, server_url(k8s)),
+                   PROMETHEUS_URL=server_url(prometheus))
+        env.pop("KUBERNETES_SERVICE_HOST", None)
+
+        for label, target in (("sync handler", "benchmarks.bench_async_endpoint:sync_app"),
+                              ("async handler", "main:app")):
+            port = free_port()
+            server = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", target, "--port", str(port), "--workers", "1",
+                 "--log-level", "warning", "--no-access-log"],
+                env=env, stdout=subprocess.DEVNULL,
+            )
+            try:
+                wait_until_up(f"http://127.0.0.1:{port}/openapi.json")
+                url = f"http://127.0.0.1:{port}/k8s/pod?pod_name=bench-pod&namespace=default"
+                asyncio.run(fire(url, min(requests, 100), concurrency))  # warm-up
+                elapsed = asyncio.run(fire(url, requests, concurrency))
+                print(f"{label:<14} {requests / elapsed:8.1f} req/s  "
+                      f"({requests} requests, concurrency {concurrency}, upstream delay {delay_ms:g} ms)")
+            finally:
+                server.terminate()
+                server.wait()
+
+    k8s.shutdown()
+    prometheus.shutdown()
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    run(int(args[0]) if len(args) > 0 else 2000,
+        int(args[1]) if len(args) > 1 else 100,
+        float(args[2]) if len(args) > 2 else 20.0)
@@ -0,0 +1,63 @@
+"""
+The capacity stage alone, at the scale it has to handle: 100k pods on 5k nodes, with requests and
+usage already in memory (no upstream calls). Cold sync of an empty model, bin-packing, report
+building, and the incremental path when a handful of pods change.
+
+    python -m benchmarks.bench_capacity [pods] [nodes] [changed]
+"""
+import sys
+import time
+
+from benchmarks import fixtures
+from services import capacity, pod_inventory, quantity
+
+
+def make_pods(pods: int, nodes: int):
+    fixture = fixtures.generate(pods)
+    inventory = pod_inventory.PodInventory()
+    usage_pods = []
+    for i, item in enumerate(fixture.pods):
+        record = inventory._record_from_pod(item, {})
+        containers = []
+        for name, cpu_request, memory_request in record.containers:
+            cpu, memory = fixture.usage[(record.namespace, record.name, name)]
+            containers.append((name, cpu_request, memory_request, cpu * 1000, memory))
+        usage_pods.append(capacity.PodUsage(record.namespace, record.name, f"node-{i % nodes:05d}",
+                                            record.workload, tuple(containers)))
+    allocatable = (quantity.cpu_to_millicores(fixtures.NODE_ALLOCATABLE["cpu"]),
+                   quantity.memory_to_bytes(fixtures.NODE_ALLOCATABLE["memory"]))
+    return usage_pods, {f"node-{i:05d}": allocatable for i in range(nodes)}
+
+
+def timed(label: str, function):
+    start = time.perf_counter()
+    result = function()
+    print(f"{label:34} {(time.perf_counter() - start) * 1000:9.1f} ms")
+    return result
+
+
+def run(pods: int = 100_000, nodes: int = 5_000, changed: int = 10):
+    usage_pods, node_allocatable = make_pods(pods, nodes)
+    model = capacity.CapacityModel()
+    model.set_nodes(node_allocatable)
+    print(f"{pods} pods, {nodes} nodes")
+
+    timed("cold sync", lambda: model.sync(usage_pods))
+    timed("bin-packing", model.simulate)
+    timed("report", model.report)
+    timed("sync, nothing changed", lambda: model.sync(usage_pods))
+
+    step = max(1, len(usage_pods) // changed)
+    for i in range(0, step * changed, step):
+        pod = usage_pods[i]
+        (name, cpu_request, memory_request, cpu, memory), *others = pod.containers
+        usage_pods[i] = capacity.PodUsage(pod.namespace, pod.name, pod.node_name, pod.workload,
+                                          ((name, cpu_request, memory_request, cpu * 2, memory), *others))
+    timed(f"sync + report, {changed} pods changed", lambda: (model.sync(usage_pods), model.report()))
+    simulation = model.simulate()
+    print(f"nodes needed {simulation['nodes_needed']} of {simulation['current_nodes']}, "
+          f"packing cpu {simulation['cpu_packing_ratio']:.2f} memory {simulation['memory_packing_ratio']:.2f}")
+
+
+if __name__ == "__main__":
+    run(*(int(arg) for arg in sys.argv[1:]))
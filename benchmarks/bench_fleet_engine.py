@@ -0,0 +1,60 @@
+"""
+Per-dict analysis loop (analyze_container_usage per container) versus the columnar engine, stage by
+stage and end to end: from pod requests and usage to the list of dicts the batch API returns.
+
+    python -m benchmarks.bench_fleet_engine [sizes...]
+"""
+import random
+import sys
+import time
+
+from services import fleet_engine, metrics_analyzer
+
+CONTAINERS_PER_POD = 2
+PODS_PER_NAMESPACE = 500
+
+
+def generate(containers: int, seed: int = 1):
+    rng = random.Random(seed)
+    pod_requests, utilization = [], {}
+    for p in range(containers // CONTAINERS_PER_POD):
+        namespace = f"ns-{p // PODS_PER_NAMESPACE}"
+        pod_name = f"pod-{p}"
+        requests_data = []
+        for c in range(CONTAINERS_PER_POD):
+            name = f"c{c}"
+            requests_data.append({"name": name, "cpu_request_millicores": rng.choice([0, 100, 250, 500]),
+                                  "memory_request_bytes": rng.choice([0, 2**27, 2**28, 2**30])})
+            if rng.random() < 0.9:
+                utilization.setdefault(namespace, {})[(pod_name, name)] = {
+                    "name": name, "cpu_utilization_millicores": rng.uniform(0, 600),
+                    "memory_utilization_bytes": rng.uniform(0, 2**30)}
+        pod_requests.append((namespace, pod_name, requests_data))
+    return pod_requests, utilization
+
+
+def engine_records(pod_requests, utilization):
+    return fleet_engine.to_records(fleet_engine.analyze_frame(fleet_engine.build_frame(pod_requests, utilization)))
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def run(sizes):
+    print(f"{'containers':>10} {'per-dict':>10} {'build':>9} {'analyze':>9} {'to_records':>11} {'engine e2e':>11}  (ms)")
+    for size in sizes:
+        pod_requests, utilization = generate(size)
+        expected, loop_ms = timed(metrics_analyzer.analyze_requests_with_usage, pod_requests, utilization)
+        frame, build_ms = timed(fleet_engine.build_frame, pod_requests, utilization)
+        analysis, analyze_ms = timed(fleet_engine.analyze_frame, frame)
+        _, records_ms = timed(fleet_engine.to_records, analysis)
+        records, engine_ms = timed(engine_records, pod_requests, utilization)
+        assert len(records) == len(expected)
+        print(f"{size:>10} {loop_ms:>10.1f} {build_ms:>9.1f} {analyze_ms:>9.2f} {records_ms:>11.1f} {engine_ms:>11.1f}")
+
+
+if __name__ == "__main__":
+    run([int(a) for a in sys.argv[1:]] or [1_000, 100_000, 1_000_000])
@@ -0,0 +1,60 @@
+"""
+Cost of the built-in instrumentation: per call of the stage/upstream timers, and on a whole
+namespace analysis, with metrics on (the default) and off (METRICS_ENABLED=false).
+
+    python -m benchmarks.bench_instrumentation [containers]
+"""
+import sys
+import time
+
+from services import instrumentation, metrics_analyzer
+from benchmarks.bench_streaming import make_inputs
+
+CALLS = 200_000
+
+
+def per_call(make):
+    start = time.perf_counter()
+    for _ in range(CALLS):
+        with make():
+            pass
+    return (time.perf_counter() - start) / CALLS
+
+
+def best_of(runs, fn):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def run(containers: int = 20_000):
+    pod_requests, usage = make_inputs(containers)
+    metrics_analyzer.extract_namespaces_utilization_from_prometheus = lambda namespaces, use_cache=True: {ns: usage[ns] for ns in namespaces}
+    analyze = lambda: metrics_analyzer.analyze_pod_requests_usage(pod_requests)
+    stream = lambda: sum(len(a.frame) for a in metrics_analyzer.iter_pod_requests_analysis(pod_requests))
+
+    analyze()  # Warm-up: first-call imports and allocations would count against whichever runs first.
+    results = {}
+    for enabled in (False, True):
+        instrumentation.METRICS_ENABLED = enabled
+        results[enabled] = (
+            per_call(lambda: instrumentation.stage("analysis")),
+            per_call(lambda: instrumentation.upstream("prometheus", "query")),
+            best_of(15, analyze),
+            best_of(15, stream),
+        )
+
+    off, on = results[False], results[True]
+    print(f"calls: {CALLS}   containers: {containers}")
+    print(f"stage timer      off {off[0] * 1e9:7.0f} ns   on {on[0] * 1e9:7.0f} ns")
+    print(f"upstream timer   off {off[1] * 1e9:7.0f} ns   on {on[1] * 1e9:7.0f} ns")
+    for name, index in (("analysis", 2), ("stream", 3)):
+        print(f"{name:16} off {off[index] * 1000:7.1f} ms   on {on[index] * 1000:7.1f} ms   "
+              f"{(on[index] / off[index] - 1) * 100:+5.1f} %")
+
+
+if __name__ == "__main__":
+    run(*(int(arg) for arg in sys.argv[1:]))
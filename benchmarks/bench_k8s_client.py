@@ -0,0 +1,57 @@
+"""
+Per-request latency of reading a pod, with a fresh kubeconfig load + CoreV1Api per request
+(the previous behaviour) versus the shared client from services.k8s_client.
+
+Runs against a local stub API server, so no cluster is needed:
+
+    python -m benchmarks.bench_k8s_client [requests]
+"""
+import statistics
+import sys
+import tempfile
+import time
+
+from kubernetes import client, config
+
+from benchmarks.stubs import StubApiHandler, server_url, start_server, write_kubeconfig
+from services.k8s_client import KubeClientManager
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    p50 = statistics.median(samples)
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    return p50 * 1000, p99 * 1000
+
+
+def run(requests: int = 500):
+    server = start_server(StubApiHandler)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        kubeconfig = write_kubeconfig(tmp, server_url(server))
+
+        def per_request():
+            config.load_kube_config(config_file=kubeconfig)
+            client.CoreV1Api().read_namespaced_pod(name="bench-pod", namespace="default")
+
+        manager = KubeClientManager(config_file=kubeconfig)
+
+        def shared():
+            manager.core_v1().read_namespaced_pod(name="bench-pod", namespace="default")
+
+        for label, fn in (("per-request client", per_request), ("shared client", shared)):
+            fn()  # warm-up
+            samples = []
+            for _ in range(requests):
+                start = time.perf_counter()
+                fn()
+                samples.append(time.perf_counter() - start)
+            p50, p99 = percentiles(samples)
+            print(f"{label:<20} p50={p50:7.3f} ms  p99={p99:7.3f} ms  ({requests} requests)")
+
+        manager.close()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
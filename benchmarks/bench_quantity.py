@@ -0,0 +1,87 @@
+"""
+Quantity parsing: the previous endswith chain versus the memoized grammar parser and the bulk API.
+
+    python -m benchmarks.bench_quantity [values]
+"""
+import random
+import sys
+import time
+
+from services import quantity
+
+CPU_VOCABULARY = ["100m", "250m", "500m", "1", "2", "50m", "10m", "1500m", "200m", "4"]
+MEM_VOCABULARY = ["128Mi", "256Mi", "512Mi", "1Gi", "2Gi", "64Mi", "40Mi", "4Gi", "100M", "1G"]
+
+
+def previous_mem_to_bytes(mem_request: str) -> float:
+    if mem_request.endswith("Ki"):
+        return float(mem_request[:-2]) * 1024
+    elif mem_request.endswith("Mi"):
+        return float(mem_request[:-2]) * 1024 * 1024
+    elif mem_request.endswith("Gi"):
+        return float(mem_request[:-2]) * 1024 * 1024 * 1024
+    elif mem_request.endswith("Ti"):
+        return float(mem_request[:-2]) * 1024 * 1024 * 1024 * 1024
+    elif mem_request.endswith("Pi"):
+        return float(mem_request[:-2]) * 1024 * 1024 * 1024 * 1024 * 1024
+    elif mem_request.endswith("Ei"):
+        return float(mem_request[:-2]) * 1024 * 1024 * 1024 * 1024 * 1024 * 1024
+    elif mem_request.endswith("K"):
+        return float(mem_request[:-1]) * 1000
+    elif mem_request.endswith("M"):
+        return float(mem_request[:-1]) * 1000 * 1000
+    elif mem_request.endswith("G"):
+        return float(mem_request[:-1]) * 1000 * 1000 * 1000
+    elif mem_request.endswith("T"):
+        return float(mem_request[:-1]) * 1000 * 1000 * 1000 * 1000
+    elif mem_request.endswith("P"):
+        return float(mem_request[:-1]) * 1000 * 1000 * 1000 * 1000 * 1000
+    elif mem_request.endswith("E"):
+        return float(mem_request[:-1]) * 1000 * 1000 * 1000 * 1000 * 1000 * 1000
+    else:
+        return float(mem_request)
+
+
+def previous_cpu_to_millicores(cpu_request: str) -> int:
+    if cpu_request.endswith("n"):
+        return int(cpu_request[:-1]) / 1_000_000
+    elif cpu_request.endswith("u"):
+        return int(cpu_request[:-1]) / 1_000
+    elif cpu_request.endswith("m"):
+        return int(cpu_request[:-1])
+    else:
+        return int(cpu_request)
+
+
+def timed(label, fn, count):
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {elapsed * 1000:8.1f} ms  {elapsed / count * 1e9:7.0f} ns/value")
+
+
+def run(count: int = 200_000):
+    rng = random.Random(7)
+    cpu = [rng.choice(CPU_VOCABULARY) for _ in range(count)]
+    mem = [rng.choice(MEM_VOCABULARY) for _ in range(count)]
+    quantity.cpu_to_millicores("1")  # warm the module, not the per-string caches
+    print(f"{count} CPU + {count} memory values from a {len(CPU_VOCABULARY)}-string vocabulary")
+
+    timed("previous endswith chain", lambda: ([previous_cpu_to_millicores(v) for v in cpu],
+                                              [previous_mem_to_bytes(v) for v in mem]), 2 * count)
+    quantity.cpu_to_millicores.cache_clear()
+    quantity.memory_to_bytes.cache_clear()
+    quantity.parse_quantity.cache_clear()
+    timed("memoized parser", lambda: ([quantity.cpu_to_millicores(v) for v in cpu],
+                                      [quantity.memory_to_bytes(v) for v in mem]), 2 * count)
+    timed("bulk API", lambda: (quantity.cpu_to_millicores_bulk(cpu), quantity.memory_to_bytes_bulk(mem)), 2 * count)
+
+    unique = [f"{i}m" for i in range(count)]
+    quantity.cpu_to_millicores.cache_clear()
+    quantity.parse_quantity.cache_clear()
+    timed("memoized parser, all unique", lambda: [quantity.cpu_to_millicores(v) for v in unique], count)
+    timed("previous, all unique", lambda: [previous_cpu_to_millicores(v) for v in unique], count)
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 200_000)
@@ -0,0 +1,73 @@
+"""
+Cost of keeping the recommendation sketches up to date and of serving from them.
+
+Update feeds one collection of a full cluster (default 175k containers, 5 replicas per workload)
+into the store: the first one writes every row, the next ones update them in place; reads are a cold load of the workload sketches
+by another process, a namespace and the whole cluster.
+
+    python -m benchmarks.bench_recommender [containers] [replicas]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from services import fleet_engine, recommender
+
+NAMESPACES = 400
+START = 1790812800
+
+
+def make_frame(count: int, replicas: int, cpu: np.ndarray, memory: np.ndarray,
+               rng: np.random.Generator) -> fleet_engine.FleetFrame:
+    pods = np.arange(count) // 2
+    workloads = pods // replicas
+    zeros = np.zeros(count)
+    return fleet_engine.FleetFrame(
+        namespace=np.array([f"ns-{w % NAMESPACES}" for w in workloads.tolist()], dtype=object),
+        pod=np.array([f"deploy-{w}-{p % replicas}" for w, p in zip(workloads.tolist(), pods.tolist())], dtype=object),
+        container=np.array(["app" if i % 2 == 0 else "istio-proxy" for i in range(count)], dtype=object),
+        cpu_request=zeros, cpu_usage=cpu * rng.lognormal(0, 0.3, count),
+        memory_request=zeros, memory_usage=memory * rng.lognormal(0, 0.05, count),
+        workload=np.array([f"Deployment/deploy-{w}" for w in workloads.tolist()], dtype=object),
+    )
+
+
+def run(containers: int = 175_000, replicas: int = 5):
+    rng = np.random.default_rng(1)
+    cpu, memory = rng.gamma(2.0, 50.0, containers), rng.gamma(2.0, 2.0 ** 26, containers)
+    path = tempfile.mkdtemp(prefix="recommender-bench-")
+    try:
+        store = recommender.RecommenderStore(path)
+        timings = []
+        for minute in range(10):
+            frame = make_frame(containers, replicas, cpu, memory, rng)
+            begin = time.perf_counter()
+            store.update(frame, timestamp=START + minute * 60)
+            timings.append(time.perf_counter() - begin)
+        size = sum(os.path.getsize(os.path.join(directory, name))
+                   for directory, _, names in os.walk(path) for name in names)
+        print(f"update {containers} containers: first {timings[0] * 1000:.0f} ms, "
+              f"then {np.median(timings[1:]) * 1000:.0f} ms/collection; files {size / 2 ** 20:.0f} MiB")
+
+        reader = recommender.RecommenderStore(path)
+        begin = time.perf_counter()
+        reader.recommendations(namespace="ns-7")
+        cold = time.perf_counter() - begin
+        begin = time.perf_counter()
+        count = len(reader.recommendations(namespace="ns-8"))
+        namespace = time.perf_counter() - begin
+        begin = time.perf_counter()
+        total = len(reader.recommendations())
+        cluster = time.perf_counter() - begin
+        print(f"recommendations: cold load {cold * 1000:.0f} ms, namespace ({count} workload containers) "
+              f"{namespace * 1000:.1f} ms, cluster ({total}) {cluster * 1000:.0f} ms")
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == "__main__":
+    run(*(int(arg) for arg in sys.argv[1:]))
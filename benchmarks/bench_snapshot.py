@@ -0,0 +1,143 @@
+"""
+Serving mode: writing the analysis snapshot of a full cluster (default 175k containers in 400
+namespaces), then answering namespace and pod queries from it in several processes at once, as
+uvicorn workers would. Each reader process reports its throughput and how much its own memory grew
+while serving: the snapshot itself is file-backed page cache, mapped once for all of them. Then the
+next collection, where 1% of the containers are resized and the others' usage moves by 1%: how long
+its versioned write takes, and what a polling client costs with a full response, a revalidation
+(If-None-Match) and a delta since the previous version.
+
+    python -m benchmarks.bench_snapshot [containers] [processes] [seconds]
+"""
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from services import fleet_engine, snapshot
+
+NAMESPACES = 400
+
+
+def make_frame(count: int) -> fleet_engine.FleetFrame:
+    rng = np.random.default_rng(1)
+    pods = np.arange(count) // 2
+    requests = rng.gamma(2.0, 100.0, count)
+    return fleet_engine.FleetFrame(
+        namespace=np.array([f"ns-{p % NAMESPACES}" for p in pods.tolist()], dtype=object),
+        pod=np.array([f"pod-{p}" for p in pods.tolist()], dtype=object),
+        container=np.array(["app" if i % 2 == 0 else "istio-proxy" for i in range(count)], dtype=object),
+        cpu_request=requests, cpu_usage=requests * rng.lognormal(-0.5, 0.5, count),
+        memory_request=requests * 2 ** 20, memory_usage=requests * 2 ** 20 * rng.lognormal(-0.3, 0.3, count),
+    )
+
+
+def anonymous_kib() -> int:
+    # The process's own memory (heap and copies); mapped file pages are not counted.
+    with open("/proc/self/smaps_rollup") as f:
+        return sum(int(line.split()[1]) for line in f if line.startswith("Anonymous:"))
+
+
+def serve(path: str, seconds: float, start, results) -> None:
+    reader = snapshot.SnapshotReader(path)
+    before = anonymous_kib()
+    reader.current().cluster_json()  # Touch every page once.
+    start.wait()
+    queries, end = 0, time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        current = reader.current()
+        current.namespace_json(f"ns-{queries % NAMESPACES}")
+        current.pod_json(f"ns-{queries % NAMESPACES}", f"pod-{queries % NAMESPACES + NAMESPACES}")
+        queries += 1
+    results.put((queries / seconds, anonymous_kib() - before))
+
+
+def run(containers: int = 175_000, processes: int = 0, seconds: float = 3.0):
+    processes = processes or os.cpu_count()
+    path = tempfile.mkdtemp(prefix="snapshot-bench-")
+    try:
+        frame = make_frame(containers)
+        begin = time.perf_counter()
+        snapshot.write_snapshot(frame, path=path)
+        written = time.perf_counter() - begin
+        size = os.path.getsize(os.path.join(path, "analysis.snap"))
+        print(f"write {containers} containers: {written * 1000:.0f} ms, file {size / 2 ** 20:.1f} MiB")
+
+        reader = snapshot.SnapshotReader(path)
+        begin = time.perf_counter()
+        current = reader.current()
+        mapped = time.perf_counter() - begin
+        begin = time.perf_counter()
+        for i in range(1000):
+            current.namespace_json(f"ns-{i % NAMESPACES}")
+        namespace = (time.perf_counter() - begin) / 1000
+        begin = time.perf_counter()
+        for i in range(1000):
+            current.pod_json(f"ns-{i % NAMESPACES}", f"pod-{i}")
+        pod = (time.perf_counter() - begin) / 1000
+        begin = time.perf_counter()
+        current.cluster_json()
+        cluster = time.perf_counter() - begin
+        # What a worker does without the snapshot, Prometheus and the API server aside.
+        rows = frame.namespace == "ns-7"
+        one = fleet_engine.FleetFrame(*(getattr(frame, name)[rows] for name in (
+            "namespace", "pod", "container", "cpu_request", "cpu_usage", "memory_request", "memory_usage")))
+        begin = time.perf_counter()
+        json.dumps(fleet_engine.to_records(fleet_engine.analyze_frame(one)))
+        live = time.perf_counter() - begin
+        print(f"map {mapped * 1000:.2f} ms; namespace {namespace * 1e6:.0f} us (analyze + encode live: "
+              f"{live * 1e6:.0f} us), pod {pod * 1e6:.1f} us, cluster {cluster * 1000:.1f} ms")
+
+        context = multiprocessing.get_context("fork")
+        for count in sorted({1, processes}):
+            start, results = context.Barrier(count), context.Queue()
+            workers = [context.Process(target=serve, args=(path, seconds, start, results)) for _ in range(count)]
+            for worker in workers:
+                worker.start()
+            measured = [results.get() for _ in workers]
+            for worker in workers:
+                worker.join()
+            rate = sum(qps for qps, _ in measured)
+            grown = max(kib for _, kib in measured)
+            print(f"{count} reader process(es): {rate:,.0f} namespace+pod queries/s in total, "
+                  f"memory grew at most {grown / 1024:.1f} MiB per process")
+        poll(path, frame, current)
+    finally:
+        shutil.rmtree(path)
+
+
+def timed(call, repeat: int = 20):
+    begin = time.perf_counter()
+    for _ in range(repeat):
+        result = call()
+    return (time.perf_counter() - begin) / repeat, result
+
+
+def poll(path: str, frame: fleet_engine.FleetFrame, previous: snapshot.Snapshot) -> None:
+    resized = np.zeros(len(frame), dtype=bool)
+    resized[::100] = True
+    cpu_request = np.where(resized, frame.cpu_request * 2, frame.cpu_request)
+    nxt = fleet_engine.FleetFrame(frame.namespace, frame.pod, frame.container, cpu_request, frame.cpu_usage * 1.01,
+                                  frame.memory_request, frame.memory_usage)
+    begin = time.perf_counter()
+    snapshot.write_snapshot(nxt, path=path)
+    written = time.perf_counter() - begin
+    current = snapshot.SnapshotReader(path).current()
+    etag = previous.etag()
+    full_seconds, full = timed(current.cluster_json)
+    tag_seconds, tag = timed(current.etag)
+    delta_seconds, delta = timed(lambda: current.changes(previous.version))
+    changed = json.loads(delta)["changed"]
+    print(f"next version, {changed} containers changed: write {written * 1000:.0f} ms")
+    print(f"poll the cluster: full {full_seconds * 1000:.1f} ms, {len(full) / 2 ** 20:.1f} MiB; "
+          f"revalidate {tag_seconds * 1e6:.1f} us ({'304' if tag == etag else '200, changed'}); "
+          f"delta {delta_seconds * 1000:.1f} ms, {len(delta) / 2 ** 20:.2f} MiB")
+
+
+if __name__ == "__main__":
+    run(*(float(arg) if i == 2 else int(arg) for i, arg in enumerate(sys.argv[1:])))
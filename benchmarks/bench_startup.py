@@ -0,0 +1,85 @@
+"""
+Cold start of the API: how long `import main` takes in a fresh interpreter, and, for each
+STARTUP_WARMUP mode, how long a new uvicorn worker takes to accept connections and to answer its
+first /k8s/pod (async upstream sessions) and then its first /k8s/pods (the kubernetes client, whose
+CoreV1Api import alone is over a second). Upstreams are local stubs with no delay. "background,
+after 2 s" sends the first request once the warm-up has had time to finish, as a readiness probe
+interval would.
+
+    python -m benchmarks.bench_startup [runs]
+"""
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from benchmarks.bench_async_endpoint import free_port
+from benchmarks.stubs import StubApiHandler, StubPrometheusHandler, server_url, start_server, write_kubeconfig
+
+IMPORT_MAIN = "import time; begin = time.perf_counter(); import main; print(time.perf_counter() - begin)"
+SCENARIOS = (("off", "off", 0.0), ("blocking", "blocking", 0.0), ("background", "background", 0.0),
+             ("background, after 2 s", "background", 2.0))
+
+
+def import_seconds(env) -> float:
+    return float(subprocess.check_output([sys.executable, "-c", IMPORT_MAIN], env=env))
+
+
+def wait_for_port(port: int, timeout: float = 20.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1.0).close()
+            return
+        except OSError:
+            time.sleep(0.005)
+    raise RuntimeError(f"server on port {port} did not start")
+
+
+def cold_start(env, mode: str, pause: float):
+    port = free_port()
+    begin = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--workers", "1",
+         "--log-level", "warning", "--no-access-log"],
+        env=dict(env, STARTUP_WARMUP=mode), stdout=subprocess.DEVNULL,
+    )
+    try:
+        wait_for_port(port)
+        ready = time.perf_counter() - begin
+        time.sleep(pause)
+        latencies = []
+        for path in ("/k8s/pod?pod_name=bench-pod&namespace=default", "/k8s/pods?namespace=default"):
+            begin = time.perf_counter()
+            urllib.request.urlopen(f"http://127.0.0.1:{port}{path}&use_cache=false", timeout=30.0).read()
+            latencies.append(time.perf_counter() - begin)
+        return ready, *latencies
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def run(runs: int = 5):
+    k8s = start_server(StubApiHandler)
+    prometheus = start_server(StubPrometheusHandler)
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, KUBECONFIG=write_kubeconfig(tmp, server_url(k8s)),
+                   PROMETHEUS_URL=server_url(prometheus), METRICS_ENABLED="false")
+        env.pop("KUBERNETES_SERVICE_HOST", None)
+
+        imports = sorted(import_seconds(env) for _ in range(runs))
+        print(f"{'import main':24} {imports[len(imports) // 2] * 1000:8.0f} ms (median of {runs})")
+        for label, mode, pause in SCENARIOS:
+            measured = [cold_start(env, mode, pause) for _ in range(runs)]
+            ready, pod, pods = (sorted(column)[runs // 2] for column in zip(*measured))
+            print(f"{label:24} ready {ready * 1000:6.0f} ms   first /k8s/pod {pod * 1000:6.1f} ms   "
+                  f"then /k8s/pods {pods * 1000:6.1f} ms")
+    k8s.shutdown()
+    prometheus.shutdown()
+
+
+if __name__ == "__main__":
+    run(*(int(arg) for arg in sys.argv[1:]))
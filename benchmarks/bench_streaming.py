@@ -0,0 +1,75 @@
+"""
+Peak memory and time to first byte of the list response vs the NDJSON stream, in process.
+
+The list path is what /k8s/pods does: every record built, then one JSON document encoded.
+The stream path is /k8s/pods/stream: chunks encoded and handed off as they are analyzed.
+
+    python -m benchmarks.bench_streaming [containers]
+"""
+import json
+import sys
+import time
+import tracemalloc
+
+from services import metrics_analyzer, streaming
+
+NAMESPACES = 20
+
+
+def make_inputs(containers: int):
+    pod_requests = [
+        (f"ns-{i % NAMESPACES}", f"pod-{i}", [{"name": "app", "cpu_request_millicores": 250.0, "memory_request_bytes": 2.0 ** 28}])
+        for i in range(containers)
+    ]
+    usage = {}
+    for namespace, pod, _ in pod_requests:
+        usage.setdefault(namespace, {})[(pod, "app")] = {
+            "name": "app", "cpu_utilization_millicores": 100.0, "memory_utilization_bytes": 2.0 ** 27}
+    return pod_requests, usage
+
+
+def consume(produce):
+    start = time.perf_counter()
+    first = None
+    total = 0
+    for chunk in produce():
+        if first is None:
+            first = time.perf_counter() - start
+        total += len(chunk)
+    return first, time.perf_counter() - start, total
+
+
+def measure(label, produce):
+    # Timed without tracemalloc, which slows allocation-heavy code down several times.
+    first, elapsed, total = consume(produce)
+    tracemalloc.start()
+    consume(produce)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"{label:7} first byte {first * 1000:8.1f} ms   total {elapsed * 1000:8.0f} ms   "
+          f"peak {peak / 2 ** 20:7.1f} MiB   {total / 2 ** 20:6.1f} MiB out")
+
+
+def run(containers: int = 200_000):
+    pod_requests, usage = make_inputs(containers)
+    metrics_analyzer.extract_namespaces_utilization_from_prometheus = lambda namespaces, use_cache=True: {ns: usage[ns] for ns in namespaces}
+
+    def as_list():
+        records = metrics_analyzer.analyze_pod_requests_usage(pod_requests)
+        yield json.dumps(records, separators=(",", ":")).encode()
+
+    def as_stream():
+        return streaming.ndjson_stream(metrics_analyzer.iter_pod_requests_analysis(pod_requests))
+
+    print(f"containers: {containers}  (input pod requests are shared by both and not counted)")
+    measure("list", as_list)
+    measure("ndjson", as_stream)
+    if streaming.orjson is not None:
+        orjson, streaming.orjson = streaming.orjson, None
+        measure("ndjson*", as_stream)
+        streaming.orjson = orjson
+        print("* stdlib json encoder")
+
+
+if __name__ == "__main__":
+    run(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,98 @@
+"""
+Ingest and read speed of the local time-series store.
+
+Ingest appends one collection of a full cluster (default 100k containers); the read covers a
+30-day window of one namespace from hourly rollups, as the collector leaves them after a month.
+
+    python -m benchmarks.bench_tsdb [containers] [rollup_containers]
+"""
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from services import fleet_engine, tsdb
+
+NAMESPACES = 200
+DAY = 86400
+
+
+def make_frame(count: int, rng: np.random.Generator) -> fleet_engine.FleetFrame:
+    return fleet_engine.FleetFrame(
+        namespace=np.array([f"ns-{i % NAMESPACES}" for i in range(count)], dtype=object),
+        pod=np.array([f"deploy-{i // 2}-x7k2p" for i in range(count)], dtype=object),
+        container=np.array(["app" if i % 2 == 0 else "istio-proxy" for i in range(count)], dtype=object),
+        cpu_request=np.full(count, 250.0), cpu_usage=rng.gamma(2.0, 50.0, count),
+        memory_request=np.full(count, 2.0 ** 28), memory_usage=rng.gamma(2.0, 2.0 ** 26, count),
+    )
+
+
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def run(containers: int = 100_000, rollup_containers: int = 20_000):
+    rng = np.random.default_rng(1)
+    start_of_month = 1790812800
+    path = tempfile.mkdtemp(prefix="tsdb-bench-")
+    try:
+        # Ingest: one minute of the whole cluster, the first append also registers every series.
+        clock = Clock(start_of_month)
+        store = tsdb.TimeSeriesStore(path, clock=clock)
+        frame = make_frame(containers, rng)
+        timings = []
+        for minute in range(10):
+            clock.now = start_of_month + minute * 60
+            begin = time.perf_counter()
+            store.append(frame)
+            timings.append(time.perf_counter() - begin)
+        clock.now = start_of_month + 3600
+        begin = time.perf_counter()
+        store.compact()
+        seal = time.perf_counter() - begin
+        print(f"ingest {containers} containers: first {timings[0] * 1000:.0f} ms, then {np.median(timings[1:]) * 1000:.1f} ms/collection")
+        print(f"seal one hour ({containers * 10} rows): {seal * 1000:.0f} ms")
+    finally:
+        shutil.rmtree(path)
+
+    path = tempfile.mkdtemp(prefix="tsdb-bench-")
+    try:
+        # A month of rollups: one sample per container per hour is enough to produce them.
+        clock = Clock(start_of_month)
+        store = tsdb.TimeSeriesStore(path, raw_retention_hours=48, clock=clock)
+        frame = make_frame(rollup_containers, rng)
+        for hour in range(30 * 24):
+            clock.now = start_of_month + hour * 3600
+            store.append(frame)
+            if hour % 24 == 23:
+                clock.now += 3600
+                store.compact()
+        end = start_of_month + 30 * DAY
+
+        reader = tsdb.TimeSeriesStore(path, clock=clock)
+        cold = time.perf_counter()
+        rows = len(reader.read("ns-7", end - 30 * DAY, end)["ts"])
+        cold = time.perf_counter() - cold
+        timings = []
+        for i in range(50):
+            begin = time.perf_counter()
+            reader.read(f"ns-{i % NAMESPACES}", end - 30 * DAY, end)
+            timings.append(time.perf_counter() - begin)
+        begin = time.perf_counter()
+        reader.usage_percentiles("ns-7", end - 30 * DAY, end)
+        percentiles = time.perf_counter() - begin
+        print(f"30-day namespace read ({rollup_containers // NAMESPACES} containers, {rows} rollup rows): "
+              f"cold {cold * 1000:.1f} ms, warm p50 {np.median(timings) * 1000:.2f} ms")
+        print(f"30-day namespace percentiles: {percentiles * 1000:.1f} ms")
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == "__main__":
+    run(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,69 @@
+"""
+Cost of keeping the waste ranking up to date and of querying it, for a full cluster (default 175k
+containers in 400 namespaces): one collection (with and without an hour change, which re-sums the
+window), then from another process a cold load and the cluster-wide top 100 by each ranking, and the
+top 10 of every namespace.
+
+    python -m benchmarks.bench_waste [containers]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from services import fleet_engine, waste
+
+NAMESPACES = 400
+START = 1790812800
+
+
+def make_frame(count: int, minute: int, rng: np.random.Generator) -> fleet_engine.FleetFrame:
+    pods = np.arange(count) // 2
+    requests = np.random.default_rng(1).gamma(2.0, 100.0, count)
+    # A few hundred containers leak memory; their usage grows with every collection.
+    leak = np.where(np.arange(count) % 500 == 0, 1 + minute / 600, 1.0)
+    return fleet_engine.FleetFrame(
+        namespace=np.array([f"ns-{p % NAMESPACES}" for p in pods.tolist()], dtype=object),
+        pod=np.array([f"pod-{p}" for p in pods.tolist()], dtype=object),
+        container=np.array(["app" if i % 2 == 0 else "istio-proxy" for i in range(count)], dtype=object),
+        cpu_request=requests, cpu_usage=requests * rng.lognormal(-0.7, 0.5, count),
+        memory_request=requests * 2 ** 20, memory_usage=requests * 2 ** 19 * leak,
+    )
+
+
+def timed(label: str, function):
+    begin = time.perf_counter()
+    result = function()
+    print(f"{label:42} {(time.perf_counter() - begin) * 1000:8.1f} ms")
+    return result
+
+
+def run(containers: int = 175_000):
+    rng = np.random.default_rng(2)
+    path = tempfile.mkdtemp(prefix="waste-bench-")
+    try:
+        store = waste.WasteStore(path)
+        frames = [make_frame(containers, minute, rng) for minute in range(3)]
+        # 00:58, 00:59 and 01:00: the last collection starts a new hour.
+        timed("first collection", lambda: store.update(frames[0], timestamp=START + 58 * 60))
+        timed("collection", lambda: store.update(frames[1], timestamp=START + 59 * 60))
+        timed("collection, new hour", lambda: store.update(frames[2], timestamp=START + 60 * 60))
+        size = sum(os.path.getsize(os.path.join(directory, name))
+                   for directory, _, names in os.walk(path) for name in names)
+        print(f"files {size / 2 ** 20:.0f} MiB")
+
+        reader = waste.WasteStore(path)
+        timed("cold load + top 100 by cpu_waste", lambda: reader.ranking("cpu_waste"))
+        for by in waste.RANKINGS:
+            timed(f"top 100 by {by}", lambda: reader.ranking(by))
+        timed("top 10 of every namespace by memory_waste", lambda: reader.namespace_rankings("memory_waste", top=10))
+        timed("top 100 of one namespace by cpu_waste", lambda: reader.ranking("cpu_waste", namespace="ns-7"))
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == "__main__":
+    run(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,177 @@
+"""
+Cluster fixtures for the benchmark suite: pods as the API server returns them and the usage
+Prometheus reports for their containers.
+
+Fixtures are generated from a seed, so every run and every machine sees the same cluster; a real
+cluster can be recorded once and replayed instead:
+
+    python -m benchmarks.fixtures record cluster.json.gz      # needs a kubeconfig and PROMETHEUS_URL
+"""
+import gzip
+import json
+import random
+import sys
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+SIZES = {"small": 10, "medium": 1_000, "large": 100_000}
+
+PODS_PER_NAMESPACE = 250
+PODS_PER_NODE = 30
+# Allocatable of every generated node: 64 cores, 128 GiB, less the system reservations.
+NODE_ALLOCATABLE = {"cpu": "63770m", "memory": "126000Mi", "pods": "110"}
+CPU_VOCABULARY = ["10m", "50m", "100m", "200m", "250m", "500m", "1", "1500m", "2", "4"]
+MEM_VOCABULARY = ["32Mi", "64Mi", "128Mi", "256Mi", "512Mi", "1Gi", "2Gi", "4Gi", "100M", "1G"]
+SIDECARS = ["istio-proxy", "log-shipper", "metrics-exporter"]
+
+
+class ClusterFixture:
+    """
+    Pods and nodes (API server JSON) plus container usage, indexed the way the stub servers look them
+    up. usage maps (namespace, pod, container) to (cpu cores, memory bytes). Without recorded nodes,
+    every node a pod runs on gets NODE_ALLOCATABLE.
+    """
+
+    def __init__(self, pods: List[Dict[str, Any]], usage: Dict[Tuple[str, str, str], Tuple[float, float]],
+                 nodes: Optional[List[Dict[str, Any]]] = None):
+        self.pods = pods
+        self.usage = usage
+        if nodes is None:
+            names = sorted({pod["spec"].get("nodeName") for pod in pods} - {None})
+            nodes = [{"apiVersion": "v1", "kind": "Node", "metadata": {"name": name},
+                      "status": {"allocatable": dict(NODE_ALLOCATABLE), "capacity": dict(NODE_ALLOCATABLE)}}
+                     for name in names]
+        self.nodes = nodes
+        self.by_namespace: Dict[str, List[Dict[str, Any]]] = {}
+        self.by_name: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        for pod in pods:
+            metadata = pod["metadata"]
+            self.by_namespace.setdefault(metadata["namespace"], []).append(pod)
+            self.by_name[(metadata["namespace"], metadata["name"])] = pod
+
+    @property
+    def namespaces(self) -> List[str]:
+        return list(self.by_namespace)
+
+    @property
+    def containers(self) -> int:
+        return sum(len(pod["spec"]["containers"]) for pod in self.pods)
+
+    def quantities(self) -> Tuple[List[Optional[str]], List[Optional[str]]]:
+        """
+        Every CPU and memory request string of the fixture, in pod order.
+        """
+        cpu, memory = [], []
+        for pod in self.pods:
+            for container in pod["spec"]["containers"]:
+                requests = container.get("resources", {}).get("requests", {})
+                cpu.append(requests.get("cpu"))
+                memory.append(requests.get("memory"))
+        return cpu, memory
+
+    def save(self, path: str) -> None:
+        usage = [[ns, pod, container, cpu, memory] for (ns, pod, container), (cpu, memory) in self.usage.items()]
+        with gzip.open(path, "wt") as f:
+            json.dump({"pods": self.pods, "nodes": self.nodes, "usage": usage}, f, separators=(",", ":"))
+
+
+def load(path: str) -> ClusterFixture:
+    with gzip.open(path, "rt") as f:
+        data = json.load(f)
+    return ClusterFixture(data["pods"], {(ns, pod, c): (cpu, mem) for ns, pod, c, cpu, mem in data["usage"]},
+                          data.get("nodes"))
+
+
+def generate(pods: int, seed: int = 0) -> ClusterFixture:
+    """
+    A cluster of the given number of pods, 250 per namespace, with one to three containers each.
+    Usage is drawn around the request, so over and under provisioned containers are both present.
+    Workloads of five replicas each are Deployments, except the first of every namespace, a StatefulSet.
+    """
+    rng = random.Random(seed)
+    items, usage = [], {}
+    templates: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+    for i in range(pods):
+        namespace = f"team-{i // PODS_PER_NAMESPACE:03d}"
+        workload = f"svc-{(i % PODS_PER_NAMESPACE) // 5}"
+        name = f"{workload}-{rng.getrandbits(32):08x}"
+        # Replicas share their workload's pod template; only their usage differs.
+        containers = templates.get((namespace, workload))
+        if containers is None:
+            containers = templates[(namespace, workload)] = []
+            for container_name in ["app"] + rng.sample(SIDECARS, rng.choice((0, 0, 1, 2))):
+                requests = {"cpu": rng.choice(CPU_VOCABULARY), "memory": rng.choice(MEM_VOCABULARY)}
+                if rng.random() < 0.05:
+                    requests = {}  # Best effort containers request nothing.
+                containers.append({"name": container_name, "image": f"registry.local/{container_name}:1",
+                                   "resources": {"requests": requests}})
+        for container in containers:
+            requests = container["resources"]["requests"]
+            usage[(namespace, name, container["name"])] = (
+                round(_base_cpu(requests.get("cpu", "100m")) * rng.uniform(0.05, 1.6), 6),
+                float(int(_base_memory(requests.get("memory", "128Mi")) * rng.uniform(0.2, 1.3))),
+            )
+        labels = {"app": workload}
+        if workload == "svc-0":
+            owner = {"kind": "StatefulSet", "name": workload}
+        else:
+            template_hash = f"{zlib.crc32(f'{namespace}/{workload}'.encode()):08x}"
+            labels["pod-template-hash"] = template_hash
+            owner = {"kind": "ReplicaSet", "name": f"{workload}-{template_hash}"}
+        owner.update(apiVersion="apps/v1", controller=True, uid=f"{namespace}-{owner['name']}")
+        items.append({
+            "apiVersion": "v1", "kind": "Pod",
+            "metadata": {"name": name, "namespace": namespace, "uid": f"{i:08d}-0000-4000-8000-{seed:012d}",
+                         "resourceVersion": str(1000 + i), "labels": labels, "ownerReferences": [owner]},
+            "spec": {"nodeName": f"node-{i % max(1, pods // PODS_PER_NODE):04d}", "containers": containers},
+            "status": {"phase": "Running"},
+        })
+    return ClusterFixture(items, usage)
+
+
+def _base_cpu(quantity: str) -> float:
+    return float(quantity[:-1]) / 1000 if quantity.endswith("m") else float(quantity)
+
+
+def _base_memory(quantity: str) -> float:
+    units = {"Mi": 2 ** 20, "Gi": 2 ** 30, "M": 10 ** 6, "G": 10 ** 9}
+    for suffix in ("Mi", "Gi", "M", "G"):
+        if quantity.endswith(suffix):
+            return float(quantity[:-len(suffix)]) * units[suffix]
+    return float(quantity)
+
+
+def fixture_for(size: str, seed: int = 0) -> ClusterFixture:
+    """
+    A named size ("small", "medium", "large"), or the path of a recorded fixture.
+    """
+    if size in SIZES:
+        return generate(SIZES[size], seed)
+    return load(size)
+
+
+def record(path: str) -> ClusterFixture:
+    """
+    Snapshots the pods and nodes of the current cluster and the pods' usage into a fixture file.
+    """
+    from services import k8s_client, metrics_analyzer
+
+    response = k8s_client.core_v1_api().list_pod_for_all_namespaces(_preload_content=False)
+    pods = json.loads(response.data)["items"]
+    nodes = json.loads(k8s_client.core_v1_api().list_node(_preload_content=False).data)["items"]
+    usage = {}
+    namespaces = sorted({pod["metadata"]["namespace"] for pod in pods})
+    for namespace, containers in metrics_analyzer.fetch_namespaces_utilization_from_prometheus(namespaces).items():
+        for (pod, container), values in containers.items():
+            usage[(namespace, pod, container)] = (values["cpu_utilization_millicores"] / 1000,
+                                                  values["memory_utilization_bytes"])
+    fixture = ClusterFixture(pods, usage, nodes)
+    fixture.save(path)
+    return fixture
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] != "record":
+        sys.exit("usage: python -m benchmarks.fixtures record <path.json.gz>")
+    recorded = record(sys.argv[2])
+    print(f"recorded {len(recorded.pods)} pods, {len(recorded.usage)} containers with usage")
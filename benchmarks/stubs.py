@@ -0,0 +1,408 @@
+"""
+Local stand-ins for the Kubernetes API server, Prometheus and Redis, used by the benchmarks and tests.
+"""
+import json
+import multiprocessing
+import os
+import re
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import StreamRequestHandler, ThreadingTCPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+POD_SPEC = {
+    "apiVersion": "v1",
+    "kind": "Pod",
+    "metadata": {"name": "bench-pod", "namespace": "default"},
+    "spec": {"containers": [
+        {"name": "app", "image": "app", "resources": {"requests": {"cpu": "100m", "memory": "128Mi"}}},
+        {"name": "sidecar", "image": "sidecar", "resources": {"requests": {"cpu": "10m", "memory": "32Mi"}}},
+    ]},
+}
+
+_POD_LABELS = {"namespace": "default", "pod": "bench-pod"}
+CPU_RESULT = [
+    {"metric": dict(_POD_LABELS, container="app", resource="cpu"), "value": [0, "0.05"]},
+    {"metric": dict(_POD_LABELS, container="sidecar", resource="cpu"), "value": [0, "0.02"]},
+]
+MEM_RESULT = [
+    {"metric": dict(_POD_LABELS, container="app", resource="memory"), "value": [0, "67108864"]},
+    {"metric": dict(_POD_LABELS, container="sidecar", resource="memory"), "value": [0, "16777216"]},
+]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    delay = 0.0
+
+    def setup(self):
+        super().setup()
+        # Headers and body go out in separate writes; without this, Nagle + delayed ACK
+        # add ~40 ms to every request on a kept-alive connection.
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def body(self) -> Optional[bytes]:
+        """
+        Response body for self.path, or None for a 404.
+        """
+        raise NotImplementedError
+
+    def params(self) -> Dict[str, str]:
+        """
+        Query string parameters, plus the form fields of a POST.
+        """
+        params = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+        params.update({k: v[0] for k, v in parse_qs(self.form).items()})
+        return params
+
+    def do_POST(self):
+        self.form = self.rfile.read(int(self.headers.get("Content-Length") or 0)).decode()
+        self.respond()
+
+    def do_GET(self):
+        self.form = ""
+        self.respond()
+
+    def respond(self):
+        if self.delay:
+            time.sleep(self.delay)
+        body = self.body()
+        status = 200
+        if body is None:
+            status, body = 404, json.dumps({"kind": "Status", "status": "Failure", "reason": "NotFound", "code": 404}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubApiHandler(StubHandler):
+    pod_body = json.dumps(POD_SPEC).encode()
+
+    def body(self) -> bytes:
+        return self.pod_body
+
+
+class StubPrometheusHandler(StubHandler):
+    usage_body = json.dumps({"status": "success", "data": {"resultType": "vector", "result": CPU_RESULT + MEM_RESULT}}).encode()
+
+    def body(self) -> bytes:
+        return self.usage_body
+
+
+class ClusterApiHandler(StubHandler):
+    """
+    API server backed by a benchmarks.fixtures.ClusterFixture: pod reads, namespaced and cluster-wide
+    pod lists (paged with limit/continue, filtered by an equality label selector), node lists and pod
+    metrics.
+    """
+    cluster = None
+
+    def body(self) -> Optional[bytes]:
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        parts = url.path.strip("/").split("/")
+        if parts == ["api", "v1", "nodes"]:
+            return json.dumps({"kind": "NodeList", "apiVersion": "v1", "metadata": {}, "items": self.cluster.nodes}).encode()
+        if parts[:3] == ["api", "v1", "pods"]:
+            return self.pod_list(self.cluster.pods, params)
+        if parts[:3] == ["api", "v1", "namespaces"] and len(parts) == 5 and parts[4] == "pods":
+            return self.pod_list(self.cluster.by_namespace.get(parts[3], []), params)
+        if parts[:3] == ["api", "v1", "namespaces"] and len(parts) == 6 and parts[4] == "pods":
+            pod = self.cluster.by_name.get((parts[3], parts[5]))
+            return json.dumps(pod).encode() if pod else None
+        if parts[:3] == ["apis", "metrics.k8s.io", "v1beta1"] and len(parts) == 6:
+            return self.pod_metrics(parts[4])
+        return None
+
+    def pod_list(self, pods: List[Dict[str, Any]], params: Dict[str, str]) -> bytes:
+        selector = params.get("labelSelector")
+        if selector:
+            wanted = dict(term.split("=", 1) for term in selector.split(","))
+            pods = [p for p in pods if all(p["metadata"].get("labels", {}).get(k) == v for k, v in wanted.items())]
+        start = int(params.get("continue") or 0)
+        limit = int(params.get("limit") or 0) or len(pods)
+        page = pods[start:start + limit]
+        metadata = {"resourceVersion": str(1000 + len(self.cluster.pods))}
+        if start + limit < len(pods):
+            metadata["continue"] = str(start + limit)
+        return json.dumps({"kind": "PodList", "apiVersion": "v1", "metadata": metadata, "items": page}).encode()
+
+    def pod_metrics(self, namespace: str) -> bytes:
+        items = []
+        for pod in self.cluster.by_namespace.get(namespace, []):
+            name = pod["metadata"]["name"]
+            containers = []
+            for container in pod["spec"]["containers"]:
+                cpu, memory = self.cluster.usage.get((namespace, name, container["name"]), (0.0, 0.0))
+                containers.append({"name": container["name"],
+                                   "usage": {"cpu": f"{int(cpu * 1e9)}n", "memory": f"{int(memory / 1024)}Ki"}})
+            items.append({"metadata": {"name": name, "namespace": namespace}, "containers": containers})
+        return json.dumps({"kind": "PodMetricsList", "items": items}).encode()
+
+
+class ClusterPrometheusHandler(StubHandler):
+    """
+    Prometheus backed by a ClusterFixture. Answers instant CPU / memory queries selecting namespaces
+    and/or pods (with = or =~ alternations), with one sample per container, labelled the way the
+    query groups them. The merged query of services.prometheus_query.usage_query gets both series,
+    told apart by a "resource" label.
+    """
+    cluster = None
+    _label = re.compile(r'\b(namespace|pod)(=~?)"([^"]*)"')
+    _by = re.compile(r"by \(([^)]*)\)")
+    _escape = re.compile(r"\\(.)")
+
+    def body(self) -> bytes:
+        query = self.params().get("query", "")
+        selected = {}
+        for name, operator, value in self._label.findall(query):
+            value = value.replace("\\\\", "\\")
+            selected[name] = set(self._escape.sub(r"\1", v) for v in value.split("|")) if operator == "=~" else {value}
+        grouping = self._by.search(query)
+        labels = [name.strip() for name in grouping.group(1).split(",")] if grouping else ["namespace", "pod", "container"]
+        resources = ["cpu", "memory"] if "label_replace" in query else ["cpu" if "cpu" in query else "memory"]
+        result = []
+        for (namespace, pod, container), (cpu_cores, memory_bytes) in self.usage_for(selected):
+            metric = {"namespace": namespace, "pod": pod, "container": container}
+            metric = {name: metric[name] for name in labels if name in metric}
+            for resource in resources:
+                if len(resources) > 1:
+                    metric = dict(metric, resource=resource)
+                result.append({"metric": metric, "value": [0, repr(cpu_cores if resource == "cpu" else memory_bytes)]})
+        return json.dumps({"status": "success", "data": {"resultType": "vector", "result": result}}).encode()
+
+    def usage_for(self, selected: Dict[str, set]):
+        namespaces, pods = selected.get("namespace"), selected.get("pod")
+        if namespaces is not None:
+            items = [pod for namespace in namespaces for pod in self.cluster.by_namespace.get(namespace, [])]
+        else:
+            items = self.cluster.pods
+        for item in items:
+            metadata = item["metadata"]
+            if pods is not None and metadata["name"] not in pods:
+                continue
+            for container in item["spec"]["containers"]:
+                key = (metadata["namespace"], metadata["name"], container["name"])
+                if key in self.cluster.usage:
+                    yield key, self.cluster.usage[key]
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def start_server(handler, delay: float = 0.0, **attributes) -> ThreadingHTTPServer:
+    """
+    Starts a stub server on a free local port in a daemon thread. delay is added to every response;
+    attributes are set on the handler class (e.g. cluster=<ClusterFixture>).
+    """
+    handler = type(handler.__name__, (handler,), {"delay": delay, **attributes})
+    server = StubServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_server_process(handler, delay: float = 0.0, **attributes):
+    """
+    Like start_server, but serves from a forked child process, so the stub's CPU time and memory
+    stay out of the measurements of the benchmarked process. Returns (url, process); the fixture
+    passed in attributes is inherited by the child. Stop it with process.terminate().
+    """
+    handler = type(handler.__name__, (handler,), {"delay": delay, **attributes})
+    server = StubServer(("127.0.0.1", 0), handler)
+    process = multiprocessing.get_context("fork").Process(target=server.serve_forever, daemon=True)
+    process.start()
+    server.server_close()  # The child keeps its own copy of the listening socket.
+    return f"http://127.0.0.1:{server.server_port}", process
+
+
+def server_url(server: ThreadingHTTPServer) -> str:
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def write_kubeconfig(directory: str, server: str) -> str:
+    path = os.path.join(directory, "config")
+    with open(path, "w") as f:
+        f.write(f"""apiVersion: v1
+kind: Config
+clusters:
+- name: stub
+  cluster:
+    server: {server}
+contexts:
+- name: stub
+  context:
+    cluster: stub
+    user: stub
+current-context: stub
+users:
+- name: stub
+  user:
+    token: bench
+""")
+    return path
+
+
+class StubRedisHandler(StreamRequestHandler):
+    """
+    The subset of the Redis protocol (RESP2) and commands the collection scheduler uses: strings,
+    counters, hashes and sorted sets, with expiry. One lock for the whole dataset, as Redis runs one
+    command at a time.
+    """
+
+    def setup(self):
+        super().setup()
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            args = []
+            for _ in range(int(line[1:])):
+                length = int(self.rfile.readline()[1:])
+                args.append(self.rfile.read(length + 2)[:-2])
+            with self.server.lock:
+                try:
+                    reply = self.server.execute(args[0].decode().upper(), args[1:])
+                except Exception as e:
+                    reply = RedisError(str(e))
+            self.wfile.write(encode_resp(reply))
+
+
+class RedisError(Exception):
+    pass
+
+
+def encode_resp(value) -> bytes:
+    if isinstance(value, RedisError):
+        return f"-ERR {value}\r\n".encode()
+    if value is True:
+        return b"+OK\r\n"
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, (list, tuple)):
+        return b"*%d\r\n" % len(value) + b"".join(encode_resp(item) for item in value)
+    if isinstance(value, float):
+        value = repr(value).encode()
+    return b"$%d\r\n%s\r\n" % (len(value), value)
+
+
+class StubRedisServer(ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, clock=time.time):
+        super().__init__(address, StubRedisHandler)
+        self.lock = threading.Lock()
+        self.clock = clock
+        self.data: Dict[bytes, Any] = {}
+        self.expires: Dict[bytes, float] = {}
+
+    def _get(self, key: bytes, default=None):
+        if key in self.expires and self.expires[key] <= self.clock():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return self.data.get(key, default)
+
+    def _container(self, key: bytes, kind):
+        value = self._get(key)
+        if value is None:
+            value = self.data[key] = kind()
+        return value
+
+    def execute(self, command: str, args: List[bytes]):
+        if command == "PING":
+            return b"PONG"
+        if command in ("CLIENT", "SELECT"):
+            return True
+        if command == "FLUSHALL":
+            self.data.clear()
+            self.expires.clear()
+            return True
+        if command == "GET":
+            return self._get(args[0])
+        if command == "MGET":
+            return [self._get(key) for key in args]
+        if command == "SET":
+            self.data[args[0]] = args[1]
+            self.expires.pop(args[0], None)
+            if len(args) > 3 and args[2].upper() == b"EX":
+                self.expires[args[0]] = self.clock() + int(args[3])
+            return True
+        if command == "DEL":
+            deleted = 0
+            for key in args:
+                deleted += self._get(key) is not None
+                self.data.pop(key, None)
+                self.expires.pop(key, None)
+            return deleted
+        if command in ("INCRBY", "DECRBY"):
+            value = int(self._get(args[0], b"0")) + int(args[1]) * (1 if command == "INCRBY" else -1)
+            self.data[args[0]] = str(value).encode()
+            return value
+        if command == "EXPIRE":
+            if self._get(args[0]) is None:
+                return 0
+            self.expires[args[0]] = self.clock() + int(args[1])
+            return 1
+        if command == "HGET":
+            return self._container(args[0], dict).get(args[1])
+        if command == "HMGET":
+            fields = self._container(args[0], dict)
+            return [fields.get(field) for field in args[1:]]
+        if command == "HGETALL":
+            return [value for item in self._container(args[0], dict).items() for value in item]
+        if command == "HSET":
+            fields = self._container(args[0], dict)
+            added = sum(field not in fields for field in args[1::2])
+            fields.update(zip(args[1::2], args[2::2]))
+            return added
+        if command == "HDEL":
+            fields = self._container(args[0], dict)
+            return sum(fields.pop(field, None) is not None for field in args[1:])
+        if command == "ZADD":
+            members = self._container(args[0], dict)
+            added = sum(member not in members for member in args[2::2])
+            members.update((member, float(score)) for score, member in zip(args[1::2], args[2::2]))
+            return added
+        if command == "ZREM":
+            members = self._container(args[0], dict)
+            return sum(members.pop(member, None) is not None for member in args[1:])
+        if command in ("ZRANGE", "ZRANGEBYSCORE"):
+            members = sorted(self._container(args[0], dict).items(), key=lambda item: (item[1], item[0]))
+            options = [arg.upper() for arg in args[3:]]
+            if command == "ZRANGE":
+                start, stop = int(args[1]), int(args[2])
+                members = members[start:(stop + 1) or None]
+            else:
+                low, high = float(args[1]), float(args[2])
+                members = [item for item in members if low <= item[1] <= high]
+                if b"LIMIT" in options:
+                    offset, count = (int(arg) for arg in args[3 + options.index(b"LIMIT") + 1:][:2])
+                    members = members[offset:offset + count if count >= 0 else None]
+            if b"WITHSCORES" in options:
+                return [value for member, score in members for value in (member, score)]
+            return [member for member, _ in members]
+        raise RedisError(f"unknown command '{command}'")
+
+
+def start_redis(clock=time.time) -> Tuple[StubRedisServer, str]:
+    """
+    Starts a Redis stand-in on a free local port in a daemon thread. Returns the server and its URL.
+    """
+    server = StubRedisServer(("127.0.0.1", 0), clock=clock)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"redis://127.0.0.1:{server.server_address[1]}/0"
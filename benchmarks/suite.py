@@ -0,0 +1,401 @@
+"""
+Benchmark suite: the main code paths against a stub API server and a stub Prometheus serving a
+generated cluster, no real cluster needed. Every scenario reports latency (min, median and p95 of
+the timed runs), throughput (items per second at the median) and peak traced memory, and is
+compared with the stored baseline of the same size in benchmarks/baselines/.
+
+    python -m benchmarks.suite [--size small|medium|large|<recorded.json.gz>] [--only a,b]
+                               [--repeat 7] [--check] [--save-baseline] [--output results.json]
+
+--check exits with status 1 when a scenario is slower, has lower throughput or uses more memory
+than its baseline by more than the thresholds. Baselines are only comparable on the same machine
+class; "machine" in the report says where the baseline was recorded.
+"""
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from benchmarks import fixtures
+from benchmarks.stubs import ClusterApiHandler, ClusterPrometheusHandler, start_server_process, write_kubeconfig
+
+BASELINE_DIR = os.path.join(os.path.dirname(__file__), "baselines")
+LATENCY_THRESHOLD = 0.25
+MEMORY_THRESHOLD = 0.20
+# Smaller differences are timer and scheduler noise, whatever their percentage.
+NOISE_FLOOR_MS = 1.0
+NOISE_FLOOR_MIB = 0.5
+# The quantity scenarios go over the fixture's strings this many times per run, to be measurable.
+QUANTITY_PASSES = 100
+
+# name -> setup(cluster) returning (run, items handled per run)
+SCENARIOS: Dict[str, Callable[["StubCluster"], Tuple[Callable[[], Any], int]]] = {}
+
+
+def scenario(name: str):
+    def register(setup):
+        SCENARIOS[name] = setup
+        return setup
+    return register
+
+
+class StubCluster:
+    """
+    Serves a fixture from stub servers and points the services at them for the duration of a
+    with block: kubeconfig, Prometheus URL, rate limits off, pod inventory off and a temporary
+    local store. Everything is restored on exit.
+    """
+
+    def __init__(self, fixture: fixtures.ClusterFixture):
+        self.fixture = fixture
+
+    def __enter__(self):
+        from services import k8s_client, metrics_analyzer, pod_inventory, prometheus_query, rate_limit, recommender, tsdb, waste
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.stack = contextlib.ExitStack()
+        self._client = None
+        self.k8s_url, self.k8s_process = start_server_process(ClusterApiHandler, cluster=self.fixture)
+        self.prometheus_url, self.prometheus_process = start_server_process(ClusterPrometheusHandler, cluster=self.fixture)
+        self.saved_env = {name: os.environ.get(name) for name in ("KUBECONFIG", "KUBERNETES_SERVICE_HOST")}
+        os.environ["KUBECONFIG"] = write_kubeconfig(self.tmp.name, self.k8s_url)
+        os.environ.pop("KUBERNETES_SERVICE_HOST", None)
+        self.saved = [
+            (prometheus_query, "PROMETHEUS_URL", self.prometheus_url),
+            (rate_limit, "k8s_limiter", rate_limit.TokenBucket(rate=0)),
+            (rate_limit, "prometheus_limiter", rate_limit.TokenBucket(rate=0)),
+            (pod_inventory, "POD_INVENTORY_ENABLED", False),
+            (tsdb, "TSDB_ENABLED", True),
+            (tsdb, "_store", tsdb.TimeSeriesStore(os.path.join(self.tmp.name, "tsdb"))),
+            (recommender, "RECOMMENDER_ENABLED", True),
+            (recommender, "_store", recommender.RecommenderStore(os.path.join(self.tmp.name, "recommender"))),
+            (waste, "WASTE_ENABLED", True),
+            (waste, "_store", waste.WasteStore(os.path.join(self.tmp.name, "waste"))),
+        ]
+        self.saved = [(module, name, getattr(module, name), value) for module, name, value in self.saved]
+        for module, name, _, value in self.saved:
+            setattr(module, name, value)
+        k8s_client.get_client_manager().reset()
+        return self
+
+    def __exit__(self, *exc):
+        from services import k8s_client
+
+        self.stack.close()
+        for module, name, previous, _ in self.saved:
+            setattr(module, name, previous)
+        for name, value in self.saved_env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        k8s_client.get_client_manager().reset()
+        for process in (self.k8s_process, self.prometheus_process):
+            process.terminate()
+            process.join()
+        self.tmp.cleanup()
+        return False
+
+    def client(self):
+        """
+        One TestClient for every route scenario, entered once so the app's lifespan (and the event
+        loop its upstream sessions belong to) lasts until the stub cluster exits.
+        """
+        if self._client is None:
+            from fastapi.testclient import TestClient
+            from main import app
+            self._client = self.stack.enter_context(TestClient(app))
+        return self._client
+
+    def largest_namespace(self) -> str:
+        return max(self.fixture.by_namespace, key=lambda ns: len(self.fixture.by_namespace[ns]))
+
+    def sample_pods(self, count: int) -> List[Tuple[str, str]]:
+        step = max(1, len(self.fixture.pods) // count)
+        return [(p["metadata"]["namespace"], p["metadata"]["name"]) for p in self.fixture.pods[::step][:count]]
+
+
+@scenario("quantity_bulk")
+def quantity_bulk(cluster: StubCluster):
+    from services import quantity
+    cpu, memory = cluster.fixture.quantities()
+
+    def run():
+        for _ in range(QUANTITY_PASSES):
+            quantity.cpu_to_millicores.cache_clear()
+            quantity.memory_to_bytes.cache_clear()
+            quantity.cpu_to_millicores_bulk(cpu)
+            quantity.memory_to_bytes_bulk(memory)
+    return run, QUANTITY_PASSES * (len(cpu) + len(memory))
+
+
+@scenario("quantity_scalar")
+def quantity_scalar(cluster: StubCluster):
+    from services import metrics_analyzer
+    cpu, memory = cluster.fixture.quantities()
+    pairs = [(c, m) for c, m in zip(cpu, memory) if c and m]
+
+    def run():
+        for _ in range(QUANTITY_PASSES):
+            for c, m in pairs:
+                metrics_analyzer.convert_cpu_to_millicores(c)
+                metrics_analyzer.convert_mem_to_bytes(m)
+    return run, QUANTITY_PASSES * 2 * len(pairs)
+
+
+@scenario("analyze_pod")
+def analyze_pod(cluster: StubCluster):
+    from services import metrics_analyzer
+    pods = cluster.sample_pods(20)
+
+    def run():
+        for namespace, name in pods:
+            metrics_analyzer.analyze_pod_resource_usage(name, namespace, use_cache=False)
+    return run, len(pods)
+
+
+@scenario("analyze_namespace")
+def analyze_namespace(cluster: StubCluster):
+    from services import metrics_analyzer
+    namespace = cluster.largest_namespace()
+    return (lambda: metrics_analyzer.analyze_namespace_resource_usage(namespace, use_cache=False),
+            sum(len(p["spec"]["containers"]) for p in cluster.fixture.by_namespace[namespace]))
+
+
+@scenario("analyze_cluster")
+def analyze_cluster(cluster: StubCluster):
+    from services import metrics_analyzer
+    return lambda: metrics_analyzer.analyze_cluster_resource_usage(use_cache=False), cluster.fixture.containers
+
+
+@scenario("route_pod")
+def route_pod(cluster: StubCluster):
+    pods = cluster.sample_pods(20)
+    client = cluster.client()
+
+    def run():
+        for namespace, name in pods:
+            client.get("/k8s/pod", params={"pod_name": name, "namespace": namespace, "use_cache": "false"}).raise_for_status()
+    return run, len(pods)
+
+
+@scenario("route_pods")
+def route_pods(cluster: StubCluster):
+    namespace = cluster.largest_namespace()
+    client = cluster.client()
+
+    def run():
+        client.get("/k8s/pods", params={"namespace": namespace, "use_cache": "false"}).raise_for_status()
+    return run, sum(len(p["spec"]["containers"]) for p in cluster.fixture.by_namespace[namespace])
+
+
+@scenario("collector")
+def collector_run(cluster: StubCluster):
+    from services import Celery_tasks
+    conf = Celery_tasks.celery_app.conf
+
+    def run():
+        previous, conf.task_always_eager = conf.task_always_eager, True
+        try:
+            Celery_tasks.collect_pod_utilization.delay().get()
+        finally:
+            conf.task_always_eager = previous
+    return run, cluster.fixture.containers
+
+
+@scenario("capacity")
+def capacity_report(cluster: StubCluster):
+    from services import capacity
+
+    def run():
+        capacity._models.clear()  # A cold report: every pod is new to the model.
+        capacity.analyze_cluster_capacity(use_cache=False)
+    return run, len(cluster.fixture.pods)
+
+
+@scenario("capacity_incremental")
+def capacity_incremental(cluster: StubCluster):
+    from services import capacity
+    capacity._models.clear()
+    capacity.analyze_cluster_capacity(use_cache=False)
+    model = capacity.get_model()
+    pods = list(model._pods.values())
+    changed = list(range(0, len(pods), max(1, len(pods) // 10)))[:10]
+    passes = [0]
+
+    def run():
+        # Ten pods' usage moves, the rest is as the model last saw it.
+        passes[0] += 1
+        factor = 1.5 if passes[0] % 2 else 1 / 1.5
+        for i in changed:
+            pod = pods[i]
+            (name, cpu_req, mem_req, cpu_use, mem_use), *others = pod.containers
+            pods[i] = capacity.PodUsage(pod.namespace, pod.name, pod.node_name, pod.workload,
+                                        ((name, cpu_req, mem_req, cpu_use * factor, mem_use), *others))
+        model.sync(pods)
+        model.report()
+    return run, len(changed)
+
+
+def measure(run: Callable[[], Any], items: int, repeat: int) -> Dict[str, float]:
+    run()  # Warm-up: imports, connection pools, memoization.
+    samples = []
+    for _ in range(repeat):
+        gc.collect()  # Garbage left by the previous run is not this run's cost.
+        start = time.perf_counter()
+        run()
+        samples.append(time.perf_counter() - start)
+    # Memory in a separate pass: tracemalloc slows allocation-heavy code down several times.
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    samples.sort()
+    median = statistics.median(samples)
+    return {
+        "items": items,
+        "min_ms": round(samples[0] * 1000, 3),
+        "median_ms": round(median * 1000, 3),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 3),
+        "throughput_per_s": round(items / median, 1) if median else 0.0,
+        "peak_mib": round(peak / 2 ** 20, 2),
+    }
+
+
+def run_suite(size: str = "medium", only: Optional[List[str]] = None, repeat: int = 7,
+              verbose: bool = False) -> Dict[str, Any]:
+    """
+    Runs the selected scenarios (all by default) against a fixture and returns the results.
+    What the services print while running is dropped unless verbose is set.
+    """
+    fixture = fixtures.fixture_for(size)
+    results = {}
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    with StubCluster(fixture) as cluster, output:
+        for name, setup in SCENARIOS.items():
+            if only and name not in only:
+                continue
+            run, items = setup(cluster)
+            results[name] = measure(run, items, repeat)
+    return {
+        "size": size,
+        "pods": len(fixture.pods),
+        "containers": fixture.containers,
+        "machine": f"{platform.machine()}, {os.cpu_count()} cpu, python {platform.python_version()}",
+        "recorded_at": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "scenarios": results,
+    }
+
+
+def compare(results: Dict[str, Any], baseline: Optional[Dict[str, Any]],
+            latency_threshold: float = LATENCY_THRESHOLD, memory_threshold: float = MEMORY_THRESHOLD) -> List[str]:
+    """
+    Names of the scenarios that regressed against the baseline, as "scenario: metric +x%".
+    Throughput is only checked when the number of items changed; otherwise it is the latency again.
+    """
+    regressions = []
+    for name, current in results["scenarios"].items():
+        before = (baseline or {}).get("scenarios", {}).get(name)
+        if not before:
+            continue
+        # The fastest run is the one least disturbed by the rest of the machine.
+        if current["min_ms"] - before["min_ms"] > NOISE_FLOOR_MS:
+            change = current["min_ms"] / before["min_ms"] - 1
+            if change > latency_threshold:
+                regressions.append(f"{name}: min_ms {change * 100:+.0f}%")
+        if current.get("items") != before.get("items"):
+            change = before["throughput_per_s"] / current["throughput_per_s"] - 1 if current["throughput_per_s"] else float("inf")
+            if change > latency_threshold:
+                regressions.append(f"{name}: throughput_per_s {-change / (1 + change) * 100:+.0f}%")
+        if current["peak_mib"] - before["peak_mib"] > NOISE_FLOOR_MIB:
+            change = current["peak_mib"] / before["peak_mib"] - 1 if before["peak_mib"] else float("inf")
+            if change > memory_threshold:
+                regressions.append(f"{name}: peak_mib {change * 100:+.0f}%")
+    return regressions
+
+
+def report(results: Dict[str, Any], baseline: Optional[Dict[str, Any]], regressions: List[str]) -> str:
+    lines = [f"size {results['size']}: {results['pods']} pods, {results['containers']} containers   ({results['machine']})"]
+    if baseline:
+        lines.append(f"baseline recorded {baseline['recorded_at']} on {baseline['machine']}")
+    lines.append(f"{'scenario':18} {'min ms':>10} {'median ms':>10} {'p95 ms':>10} {'items/s':>12} {'peak MiB':>9}   vs baseline")
+    for name, r in results["scenarios"].items():
+        before = (baseline or {}).get("scenarios", {}).get(name)
+        delta = ""
+        if before:
+            delta = (f"{_change(r['min_ms'], before['min_ms'])} time, "
+                     f"{_change(r['peak_mib'], before['peak_mib'])} memory")
+        lines.append(f"{name:18} {r['min_ms']:10.2f} {r['median_ms']:10.2f} {r['p95_ms']:10.2f} {r['throughput_per_s']:12.1f} "
+                     f"{r['peak_mib']:9.2f}   {delta}")
+    if regressions:
+        lines.append("REGRESSIONS: " + "; ".join(regressions))
+    return "\n".join(lines)
+
+
+def _change(current: float, before: float) -> str:
+    return f"{(current / before - 1) * 100:+5.1f}%" if before else "  n/a"
+
+
+def baseline_path(size: str) -> str:
+    name = size if size in fixtures.SIZES else os.path.basename(size).split(".")[0]
+    return os.path.join(BASELINE_DIR, f"{name}.json")
+
+
+def load_baseline(size: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(baseline_path(size)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--size", default="medium", help="small, medium, large or a recorded fixture path")
+    parser.add_argument("--only", default="", help="comma-separated scenario names")
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--latency-threshold", type=float, default=LATENCY_THRESHOLD)
+    parser.add_argument("--memory-threshold", type=float, default=MEMORY_THRESHOLD)
+    parser.add_argument("--check", action="store_true", help="exit with status 1 on a regression")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--output", help="also write the results as JSON to this path")
+    parser.add_argument("--verbose", action="store_true", help="show what the services print")
+    args = parser.parse_args(argv)
+
+    only = [name for name in args.only.split(",") if name]
+    unknown = set(only) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}; known: {', '.join(SCENARIOS)}")
+
+    results = run_suite(args.size, only, args.repeat, args.verbose)
+    baseline = load_baseline(args.size)
+    regressions = compare(results, baseline, args.latency_threshold, args.memory_threshold)
+    print(report(results, baseline, regressions))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        if baseline:
+            # Scenarios left out with --only keep their previous baseline.
+            results["scenarios"] = {**baseline.get("scenarios", {}), **results["scenarios"]}
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(baseline_path(args.size), "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+        print(f"baseline written to {baseline_path(args.size)}")
+    return 1 if args.check and regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
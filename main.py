@@ -1,16 +1,239 @@
+from services import startup
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from typing import List
+from services import k8s_client, pod_inventory
 
-app = FastAPI()
-from fastapi import HTTPException
-from typing import Any
-from services import metrics_analyzer
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+  # One Kubernetes client and connection pool for the whole process; released on shutdown.
+  # The client libraries are imported and the clients built by the warm-up (STARTUP_WARMUP), in the
+  # background by default, so the process serves before they are ready rather than after.
+  startup.mark("import")
+  if pod_inventory.POD_INVENTORY_ENABLED:
+    pod_inventory.start_inventory()
+  warm_up = await startup.warm_up_api()
+  startup.mark("ready")
+  yield
+  if warm_up is not None:
+    await warm_up
+  pod_inventory.stop_inventory()
+  await async_analyzer.get_upstreams().aclose()
+  k8s_client.get_client_manager().close()
+
+app = FastAPI(lifespan=lifespan)
+from fastapi import Header, HTTPException
+from typing import Any, Optional
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response, StreamingResponse
+import time
+from services import async_analyzer, cache, capacity, instrumentation, metrics_analyzer, quantity, recommender, snapshot, streaming, tsdb, usage_history, waste
+
+app.add_middleware(instrumentation.MetricsMiddleware)
+app.add_middleware(startup.FirstRequestTimer)
+
+def check_history_params(percentile: Optional[str], window: Optional[str]) -> None:
+  if percentile is not None and percentile not in usage_history.PERCENTILES:
+    raise HTTPException(status_code=400, detail=f"percentile must be one of {', '.join(usage_history.PERCENTILES)}")
+  if window is not None:
+    try:
+      usage_history.parse_duration(window)
+    except ValueError:
+      raise HTTPException(status_code=400, detail="window must be a Prometheus duration such as 1h, 7d or 2w")
+
+def check_pod_params(pod_name: Optional[str], namespace: Optional[str]) -> None:
+  # They end up in API server paths and Prometheus selectors; anything but a Kubernetes name is
+  # rejected before that. None is an omitted optional parameter.
+  if namespace is not None and not k8s_client.is_namespace_name(namespace):
+    raise HTTPException(status_code=400, detail="namespace must be a Kubernetes namespace name")
+  if pod_name is not None and not k8s_client.is_pod_name(pod_name):
+    raise HTTPException(status_code=400, detail="pod_name must be a Kubernetes pod name")
+
+def not_modified(etag: str, if_none_match: Optional[str]) -> bool:
+  # Weak comparison, as for GET: W/"1-2" matches "1-2", W/"1-2" or *.
+  if not if_none_match:
+    return False
+  tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+  return "*" in tags or etag.removeprefix("W/") in tags
+
+def snapshot_response(read, tag, if_none_match: Optional[str] = None) -> Optional[Response]:
+  # Serving mode: the collector's analysis snapshot, mapped from disk and shared by every worker process.
+  # None (analyze live) when it is off, missing, stale or does not cover the request. Tagged with the
+  # version the records last changed in; a client that has it gets a 304 and no body.
+  reader = snapshot.get_reader()
+  current = reader.current() if reader is not None else None
+  etag = tag(current) if current is not None else None
+  if etag is None:
+    return None
+  headers = {"Age": str(int(current.age())), "ETag": etag}
+  if not_modified(etag, if_none_match):
+    return Response(status_code=304, headers=headers)
+  content = read(current)
+  if content is None:
+    return None
+  return Response(content=content, media_type="application/json", headers=headers)
 
 @app.get("/k8s/pod")
-def get_k8s_pod() -> Any:
-  pod_name="multi-container-resource-pod"
-  namespace="kube-system"
-  pod = metrics_analyzer.analyze_pod_resource_usage(pod_name=pod_name , namespace=namespace)
-  #pod = metrics_analyzer.extract_pod_cpu_utilization(pod_name=pod_name , namespace=namespace)
+async def get_k8s_pod(pod_name: str, namespace: str, use_cache: bool = True,
+                      percentile: Optional[str] = None, window: Optional[str] = None,
+                      if_none_match: Optional[str] = Header(None)) -> Any:
+  # Spec and usage are fetched concurrently on the event loop; no threadpool worker is held.
+  # use_cache=false skips the TTL caches for this request (and refreshes them).
+  # percentile=p95&window=7d compares requests with the usage history instead of the current usage.
+  check_pod_params(pod_name, namespace)
+  check_history_params(percentile, window)
+  if use_cache and not percentile:
+    response = snapshot_response(lambda current: current.pod_json(namespace, pod_name),
+                                 lambda current: current.etag(namespace, pod_name), if_none_match)
+    if response is not None:
+      return response
+  if percentile:
+    return await run_in_threadpool(metrics_analyzer.analyze_pod_resource_usage, pod_name, namespace,
+                                   use_cache=use_cache, percentile=percentile, window=window)
+  pod = await async_analyzer.analyze_pod_resource_usage_async(pod_name=pod_name , namespace=namespace, use_cache=use_cache)
   return pod
 
+@app.get("/k8s/pod/history")
+def get_k8s_pod_history(pod_name: str, namespace: str, window: Optional[str] = None,
+                        include_series: bool = False, use_cache: bool = True) -> Any:
+  # p50/p95/p99/max usage per container over the window, computed by Prometheus.
+  check_pod_params(pod_name, namespace)
+  check_history_params(None, window)
+  window = window or usage_history.HISTORY_DEFAULT_WINDOW
+  history = {
+    "window": window,
+    "containers": usage_history.extract_pod_usage_percentiles(pod_name, namespace, window, use_cache=use_cache),
+  }
+  if include_series:
+    history["series"] = usage_history.fetch_pod_usage_series(pod_name, namespace, window)
+  return history
+
+@app.get("/k8s/history")
+def get_k8s_history(namespace: str, pod_name: Optional[str] = None, window: str = "1d",
+                    resolution: Optional[str] = None) -> Any:
+  # Trend of what the collector stored, read from the local store; Prometheus is not queried.
+  check_pod_params(pod_name, namespace)
+  check_history_params(None, window)
+  if resolution not in (None, tsdb.RAW, tsdb.ROLLUP):
+    raise HTTPException(status_code=400, detail=f"resolution must be {tsdb.RAW} or {tsdb.ROLLUP}")
+  store = tsdb.get_store()
+  if store is None:
+    raise HTTPException(status_code=503, detail="The local time-series store is disabled")
+  end = time.time()
+  return store.trend(namespace, end - usage_history.parse_duration(window), end, resolution=resolution, pod_name=pod_name)
+
+@app.get("/k8s/pods")
+def get_k8s_pods(namespace: Optional[str] = None, label_selector: Optional[str] = None, use_cache: bool = True,
+                 percentile: Optional[str] = None, window: Optional[str] = None,
+                 if_none_match: Optional[str] = Header(None)) -> Any:
+  # Without a namespace the whole cluster is analyzed in one pass.
+  check_pod_params(None, namespace)
+  check_history_params(percentile, window)
+  if use_cache and not percentile and not label_selector:
+    response = snapshot_response(lambda current: current.namespace_json(namespace) if namespace else current.cluster_json(),
+                                 lambda current: current.etag(namespace), if_none_match)
+    if response is not None:
+      return response
+  if namespace:
+    return metrics_analyzer.analyze_namespace_resource_usage(namespace=namespace, label_selector=label_selector, use_cache=use_cache,
+                                                             percentile=percentile, window=window)
+  return metrics_analyzer.analyze_cluster_resource_usage(label_selector=label_selector, use_cache=use_cache,
+                                                         percentile=percentile, window=window)
+
+@app.get("/k8s/pods/changes")
+def get_k8s_pods_changes(since: Optional[str] = None, namespace: Optional[str] = None) -> Any:
+  # For polling clients: the records (of the cluster, or of a namespace) whose requests, usage bucket or
+  # provisioning flags changed after version since, and the containers removed, from the analysis
+  # snapshot. Without since, or with one the change log no longer covers, every record ("full": true).
+  # The response's version is the since of the next poll.
+  check_pod_params(None, namespace)
+  reader = snapshot.get_reader()
+  current = reader.current() if reader is not None else None
+  if current is None:
+    raise HTTPException(status_code=503, detail="No analysis snapshot is being served")
+  try:
+    content = current.changes(since, namespace)
+  except ValueError:
+    raise HTTPException(status_code=400, detail="since must be a version returned by this endpoint")
+  if content is None:
+    raise HTTPException(status_code=404, detail="The analysis snapshot does not cover this namespace")
+  return Response(content=content, media_type="application/json", headers={"Age": str(int(current.age()))})
+
+@app.get("/k8s/pods/stream")
+def get_k8s_pods_stream(namespace: Optional[str] = None, label_selector: Optional[str] = None, use_cache: bool = True,
+                        percentile: Optional[str] = None, window: Optional[str] = None, format: str = "ndjson") -> Any:
+  # Same records as /k8s/pods, written chunk by chunk as they are analyzed: NDJSON, or an Arrow IPC stream.
+  check_pod_params(None, namespace)
+  check_history_params(percentile, window)
+  if format not in ("ndjson", "arrow"):
+    raise HTTPException(status_code=400, detail="format must be ndjson or arrow")
+  analyses = metrics_analyzer.iter_resource_usage(namespace=namespace, label_selector=label_selector, use_cache=use_cache,
+                                                  percentile=percentile, window=window)
+  if format == "arrow":
+    try:
+      return StreamingResponse(streaming.arrow_stream(analyses), media_type=streaming.ARROW_STREAM_MEDIA_TYPE)
+    except ImportError:
+      raise HTTPException(status_code=501, detail="Arrow output needs pyarrow, which is not installed")
+  return StreamingResponse(streaming.ndjson_stream(analyses), media_type=streaming.NDJSON_MEDIA_TYPE)
+
+@app.get("/k8s/capacity")
+def get_k8s_capacity(use_cache: bool = True, percentile: Optional[str] = None, window: Optional[str] = None,
+                     node_cpu: Optional[str] = None, node_memory: Optional[str] = None) -> Any:
+  # Requested and used resources per node, namespace and workload, and how many nodes the workloads
+  # would need at right-sized requests. node_cpu / node_memory ("64", "256Gi") set the simulated node;
+  # by default it is the most common current one.
+  check_history_params(percentile, window)
+  try:
+    cpu = quantity.cpu_to_millicores(node_cpu) if node_cpu else None
+    memory = quantity.memory_to_bytes(node_memory) if node_memory else None
+  except ValueError:
+    raise HTTPException(status_code=400, detail="node_cpu and node_memory must be Kubernetes quantities such as 64 or 256Gi")
+  return capacity.analyze_cluster_capacity(use_cache=use_cache, percentile=percentile, window=window,
+                                           node_cpu=cpu, node_memory=memory)
+
+@app.get("/k8s/recommendations")
+def get_k8s_recommendations(namespace: Optional[str] = None, workload: Optional[str] = None, pod_name: Optional[str] = None,
+                            percentile: str = "p95", safety_margin: float = recommender.RECOMMENDER_SAFETY_MARGIN) -> Any:
+  # Requests (the percentile of the usage seen by the collector) and limits (the peak), both plus the
+  # safety margin, per workload container (workload="Deployment/web" narrows it to one) or per container of one pod.
+  check_pod_params(pod_name, namespace)
+  if percentile not in recommender.PERCENTILES:
+    raise HTTPException(status_code=400, detail=f"percentile must be one of {', '.join(recommender.PERCENTILES)}")
+  if safety_margin < 0:
+    raise HTTPException(status_code=400, detail="safety_margin must not be negative")
+  if pod_name and not namespace:
+    raise HTTPException(status_code=400, detail="pod_name needs a namespace")
+  store = recommender.get_store()
+  if store is None:
+    raise HTTPException(status_code=503, detail="The recommender is disabled")
+  if pod_name:
+    return store.pod_recommendations(namespace, pod_name, percentile=percentile, margin=safety_margin)
+  return store.recommendations(namespace=namespace, workload=workload, percentile=percentile, margin=safety_margin)
+
+@app.get("/k8s/waste")
+def get_k8s_waste(namespace: Optional[str] = None, by: str = "cpu_waste", top: int = 100, per_namespace: bool = False) -> Any:
+  # The top containers by CPU or memory wasted (millicore-hours, GiB-hours requested but unused over
+  # the last WASTE_WINDOW_HOURS), by OOM risk or by throttling risk, from what the collector sampled.
+  # per_namespace=true returns the top of every namespace.
+  check_pod_params(None, namespace)
+  if by not in waste.RANKINGS:
+    raise HTTPException(status_code=400, detail=f"by must be one of {', '.join(waste.RANKINGS)}")
+  if top < 1:
+    raise HTTPException(status_code=400, detail="top must be at least 1")
+  store = waste.get_store()
+  if store is None:
+    raise HTTPException(status_code=503, detail="Waste ranking is disabled")
+  if per_namespace:
+    return store.namespace_rankings(by=by, top=top)
+  return store.ranking(by=by, namespace=namespace, top=top)
+
+@app.get("/k8s/cache")
+def get_k8s_cache_stats() -> Any:
+  return cache.cache_stats()
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics() -> Response:
+  # Prometheus text format: stage and upstream latencies, upstream errors, cache hit ratios.
+  data, content_type = instrumentation.render()
+  return Response(content=data, media_type=content_type)
+
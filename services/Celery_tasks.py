@@ -1,20 +1,145 @@
-from celery import Celery
-from services import metrics_analyzer
-celery_app = Celery("worker", broker="redis://localhost:6379/0")
+from services import startup
+from celery import Celery, chord, group
+from celery.signals import worker_init, worker_process_init, worker_process_shutdown
+import os
+import time
+from services import collector, instrumentation, k8s_client, pod_inventory, rate_limit, recommender, scheduler, snapshot, tsdb, waste
+# Empty collects the whole cluster.
+COLLECTOR_NAMESPACE = os.environ.get("COLLECTOR_NAMESPACE", "")
+# The chord that merges chunk results needs a result backend.
+celery_app = Celery("worker", broker=os.environ.get("CELERY_BROKER_URL", "redis://localhost:6379/0"),
+                    backend=os.environ.get("CELERY_RESULT_BACKEND", "redis://localhost:6379/1"))
+celery_app.conf.result_expires = 600
+
+@worker_init.connect
+def import_clients(**kwargs):
+  # Imported once in the parent, before the pool forks, instead of by every child on its first task.
+  startup.import_clients()
+
+@worker_process_init.connect
+def init_k8s_client(**kwargs):
+  # Each prefork child builds its own client and connection pool once, then reuses it for every task.
+  k8s_client.get_client_manager().reset()
+  if pod_inventory.POD_INVENTORY_ENABLED:
+    pod_inventory.start_inventory()
+  startup.start_warm_up()
+
+@worker_process_shutdown.connect
+def close_k8s_client(**kwargs):
+  pod_inventory.stop_inventory()
+  k8s_client.get_client_manager().close()
+  instrumentation.mark_process_dead(os.getpid())
+
 @celery_app.task
 def collect_pod_utilization():
-  pod_name="multi-container-resource-pod"
-  namespace="kube-system"
-  pod = metrics_analyzer.extract_pod_requests(pod_name=pod_name , namespace=namespace)
-  print (pod)
+  # Runs at every beat tick. Lists the target pods when a namespace is due, then fans the usage queries
+  # for the due namespaces out to the workers as chunks (all namespaces without the scheduler);
+  # the chord callback merges the chunks, adds them to the usage sketches and the waste ranking, writes
+  # the analysis snapshot and appends them to the local store in one write.
+  schedule = scheduler.get_scheduler()
+  try:
+    if schedule is not None and not schedule.collection_due():
+      return 0
+  except Exception as e:
+    print(f"An unexpected error occurred while reading the collection schedule, collecting every namespace: {e}")
+    schedule = None
+  rate_limit.k8s_limiter.acquire()
+  listing = time.perf_counter()
+  pod_requests, workloads = collector.list_targets(namespace=COLLECTOR_NAMESPACE or None)
+  chunks = None
+  if schedule is not None:
+    schedule.record_latency("kubernetes", time.perf_counter() - listing)
+    try:
+      chunks = schedule.plan(pod_requests)
+    except Exception as e:
+      print(f"An unexpected error occurred while planning the collection, collecting every namespace: {e}")
+  if chunks is None:
+    chunks = collector.plan_chunks(pod_requests)
+  if not chunks:
+    print("No pods to collect" if not pod_requests else "No namespace due")
+    return 0
+  # No expires on the header: a revoked chunk would fail the whole chord. Late chunks return no rows instead.
+  deadline = time.time() + collector.COLLECTOR_DEADLINE_SECONDS
+  header = group(collect_utilization_chunk.s(chunk, [workloads[(namespace, pod)] for namespace, pod, _ in chunk], deadline)
+                 for chunk in chunks)
+  listed = sorted({namespace for namespace, _, _ in pod_requests})
+  chord(header)(store_collected_chunks.s(int(time.time()), listed))
+  print(f"Collecting {sum(len(chunk) for chunk in chunks)} of {len(pod_requests)} pods in {len(chunks)} chunks")
+  return len(chunks)
+
+@celery_app.task
+def collect_utilization_chunk(pod_requests, workloads=None, deadline=None):
+  if deadline is not None and time.time() > deadline:
+    print(f"Chunk of {len(pod_requests)} pods started after the collection deadline; skipped")
+    return collector.empty_columns()
+  began = time.perf_counter()
+  with instrumentation.stage("collect_chunk"):
+    columns = collector.collect_chunk(pod_requests, workloads)
+  schedule = scheduler.get_scheduler()
+  if schedule is not None:
+    schedule.record_latency("prometheus", time.perf_counter() - began)
+  return columns
+
+@celery_app.task
+def store_collected_chunks(chunks, timestamp, listed=None):
+  # listed: the namespaces in scope at this tick, of which the chunks may hold only the due ones.
+  # Containers without usage (Prometheus failed or had no series for them) are left out: the snapshot
+  # keeps their last records, and nothing else sees a sample.
+  frame = collector.merge_chunks(chunks)
+  missing = len(frame)
+  frame = collector.observed(frame)
+  missing -= len(frame)
+  if missing:
+    print(f"No usage for {missing} containers; not stored")
+  schedule = scheduler.get_scheduler()
+  if schedule is not None:
+    # When each collected namespace is due again, from what its containers did since the last sample.
+    try:
+      with instrumentation.stage("collect_schedule"):
+        schedule.observe(frame, timestamp=timestamp)
+    except Exception as e:
+      print(f"An unexpected error occurred while updating the collection schedule: {e}")
+  sketches = recommender.get_store()
+  if sketches is not None:
+    # Usage sketches for the recommendations; independent of whether the samples themselves are kept.
+    try:
+      with instrumentation.stage("collect_sketches"):
+        sketches.update(frame, timestamp=timestamp)
+    except Exception as e:
+      print(f"An unexpected error occurred while updating the usage sketches: {e}")
+  ranking = waste.get_store()
+  if ranking is not None:
+    try:
+      with instrumentation.stage("collect_waste"):
+        ranking.update(frame, timestamp=timestamp)
+    except Exception as e:
+      print(f"An unexpected error occurred while updating the waste ranking: {e}")
+  if snapshot.SNAPSHOT_ENABLED:
+    # The analysis the API workers serve in serving mode; this callback is its only writer.
+    try:
+      with instrumentation.stage("collect_snapshot"):
+        snapshot.write_snapshot(frame, taken_at=timestamp, scope=COLLECTOR_NAMESPACE or None, listed=listed)
+    except Exception as e:
+      print(f"An unexpected error occurred while writing the analysis snapshot: {e}")
+  store = tsdb.get_store()
+  if store is None:
+    print(f"Collected {len(frame)} containers; local store disabled, nothing stored")
+    return 0
+  with instrumentation.stage("collect_store"):
+    rows = store.append(frame, timestamp=timestamp)
+    store.compact()
+  instrumentation.items("collected_containers", rows)
+  print(f"Stored {rows} container samples, {time.time() - timestamp:.1f} s after the collection started")
+  return rows
 
 
 from celery.schedules import crontab
 
 celery_app.conf.beat_schedule = {
-    "collect-every-minute": {
+    # With the scheduler, beat only ticks; each tick collects the namespaces that are due.
+    "collect-pod-utilization": {
         "task": "services.Celery_tasks.collect_pod_utilization",
-        "schedule": crontab(minute="*"),
+        "schedule": scheduler.SCHEDULER_TICK_SECONDS if scheduler.SCHEDULER_ENABLED else crontab(minute="*"),
     },
 }
 
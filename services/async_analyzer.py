@@ -0,0 +1,304 @@
+import asyncio
+import os
+import ssl
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+from urllib.parse import quote
+
+from services import cache, instrumentation, k8s_client, metrics_analyzer, pod_inventory, prometheus_query
+
+if TYPE_CHECKING:
+    # Imported with the first session (or by the startup warm-up), not when the app is imported.
+    import aiohttp
+
+# Per-upstream timeouts (seconds) for a single HTTP call.
+K8S_TIMEOUT_SECONDS = float(os.environ.get("K8S_TIMEOUT_SECONDS", "5"))
+PROMETHEUS_TIMEOUT_SECONDS = float(os.environ.get("PROMETHEUS_TIMEOUT_SECONDS", "10"))
+
+# Maximum number of in-flight requests per upstream, shared by every request the process serves.
+MAX_CONCURRENCY = int(os.environ.get("ASYNC_MAX_CONCURRENCY", "64"))
+
+
+class AsyncUpstreams:
+    """
+    Async HTTP clients for the Kubernetes API server and Prometheus.
+
+    Each upstream gets its own keep-alive aiohttp session, timeout and concurrency cap. Sessions and
+    semaphores are bound to the event loop they were created on and are rebuilt if the loop changes.
+    The Kubernetes endpoint and credentials come from the process-wide KubeClientManager, so a
+    kubeconfig or token reload is picked up here as well.
+    """
+
+    def __init__(self, max_concurrency: int = MAX_CONCURRENCY,
+                 k8s_timeout: float = K8S_TIMEOUT_SECONDS,
+                 prometheus_timeout: float = PROMETHEUS_TIMEOUT_SECONDS):
+        self.max_concurrency = max_concurrency
+        self.k8s_timeout = k8s_timeout
+        self.prometheus_timeout = prometheus_timeout
+        self._loop = None
+        self._k8s = None
+        self._k8s_configuration = None
+        self._prometheus = None
+        self._prometheus_url = None
+        self._k8s_limit = None
+        self._prometheus_limit = None
+
+    def _bind_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Connections and semaphores from another loop cannot be awaited here; start over.
+            previous, self._loop = self._loop, loop
+            for session in (self._k8s, self._prometheus):
+                if session is not None:
+                    self._abandon(session, previous)
+            self._k8s = None
+            self._prometheus = None
+            self._k8s_limit = asyncio.Semaphore(self.max_concurrency)
+            self._prometheus_limit = asyncio.Semaphore(self.max_concurrency)
+
+    @staticmethod
+    def _abandon(session: "aiohttp.ClientSession", loop: Optional[asyncio.AbstractEventLoop]) -> None:
+        """
+        Drops a session bound to another event loop: closed on that loop while it still runs there.
+        A closed loop already closed its transports; a stopped one leaves them to the connector's finalizer.
+        """
+        if loop is not None and loop.is_running() and not loop.is_closed():
+            asyncio.run_coroutine_threadsafe(session.close(), loop)
+        else:
+            session.detach()
+
+    def _session(self, timeout: float, ssl_context: Any = False) -> "aiohttp.ClientSession":
+        import aiohttp
+
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency, ssl=ssl_context)
+        return aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout))
+
+    def _k8s_client(self):
+        configuration = k8s_client.get_client_manager().api_client().configuration
+        if self._k8s is None or self._k8s_configuration is not configuration:
+            ssl_context: Any = False
+            if configuration.verify_ssl:
+                ssl_context = ssl.create_default_context(cafile=configuration.ssl_ca_cert)
+                if configuration.cert_file:
+                    ssl_context.load_cert_chain(configuration.cert_file, configuration.key_file)
+            if self._k8s is not None:
+                # The previous session belongs to the old configuration; close it once in-flight calls finish.
+                asyncio.get_running_loop().create_task(self._close_later(self._k8s))
+            self._k8s = self._session(self.k8s_timeout, ssl_context)
+            self._k8s_configuration = configuration
+        return self._k8s, configuration
+
+    def _prometheus_client(self) -> "aiohttp.ClientSession":
+        if self._prometheus is None or self._prometheus_url != prometheus_query.PROMETHEUS_URL:
+            self._prometheus_url = prometheus_query.PROMETHEUS_URL
+            self._prometheus = self._session(self.prometheus_timeout)
+        return self._prometheus
+
+    async def _close_later(self, session: "aiohttp.ClientSession") -> None:
+        await asyncio.sleep(self.k8s_timeout)
+        await session.close()
+
+    def warm(self) -> None:
+        """
+        Builds both sessions, and the API server's TLS context, ahead of the first request. Must run on
+        the serving event loop.
+        """
+        self._bind_loop()
+        self._prometheus_client()
+        self._k8s_client()
+
+    async def get_pod(self, pod_name: str, namespace: str) -> Optional[Dict[str, Any]]:
+        """
+        Reads one pod from the API server. Returns the pod as a dict, or None if it does not exist.
+        """
+        self._bind_loop()
+        session, configuration = self._k8s_client()
+        headers = {}
+        # get_api_key_with_prefix also runs the refresh hook for exec/OIDC based credentials.
+        token = configuration.get_api_key_with_prefix("authorization")
+        if token:
+            headers["Authorization"] = token
+        async with self._k8s_limit:
+            # Quoted whole: a "/" or ".." in a name must not reach another API path with our credentials.
+            url = (f"{configuration.host.rstrip('/')}/api/v1/namespaces/{quote(namespace, safe='')}"
+                   f"/pods/{quote(pod_name, safe='')}")
+            with instrumentation.upstream("kubernetes", "read_pod"):
+                async with session.get(url, headers=headers) as response:
+                    if response.status == 404:
+                        return None
+                    response.raise_for_status()
+                    return await response.json()
+
+    async def query_prometheus(self, query: str) -> List[Dict[str, Any]]:
+        """
+        Runs an instant query and returns the result vector, at most PROMETHEUS_SERIES_LIMIT series.
+        """
+        self._bind_loop()
+        session = self._prometheus_client()
+        limit = prometheus_query.PROMETHEUS_SERIES_LIMIT
+        data = {"query": query}
+        if limit:
+            data["limit"] = str(limit)
+        async with self._prometheus_limit:
+            url = f"{self._prometheus_url.rstrip('/')}/api/v1/query"
+            with instrumentation.upstream("prometheus", "query"):
+                async with session.post(url, data=data) as response:
+                    response.raise_for_status()
+                    # aiohttp asks for gzip and inflates it; orjson decodes when installed.
+                    body = await response.json(loads=prometheus_query.loads)
+        return prometheus_query.truncate_result(body["data"]["result"], limit, query)
+
+    async def aclose(self) -> None:
+        for session in (self._k8s, self._prometheus):
+            if session is not None:
+                await session.close()
+        self._k8s = None
+        self._prometheus = None
+
+
+_upstreams: Optional[AsyncUpstreams] = None
+
+
+def get_upstreams() -> AsyncUpstreams:
+    global _upstreams
+    if _upstreams is None:
+        _upstreams = AsyncUpstreams()
+    return _upstreams
+
+
+def extract_requests_from_pod_dict(pod: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Same as metrics_analyzer.extract_requests_from_pod, for a pod decoded straight from API JSON.
+    """
+    container_list = []
+    for container in pod.get("spec", {}).get("containers", []):
+        requests = (container.get("resources") or {}).get("requests") or {}
+        cpu_val = 0.0
+        mem_val = 0.0
+
+        cpu_request = requests.get("cpu")
+        if cpu_request:
+            try:
+                cpu_val = metrics_analyzer.convert_cpu_to_millicores(cpu_request)
+            except Exception:
+                cpu_val = 0.0
+
+        mem_request = requests.get("memory")
+        if mem_request:
+            try:
+                mem_val = metrics_analyzer.convert_mem_to_bytes(mem_request)
+            except Exception:
+                mem_val = 0.0
+
+        container_list.append({
+            "name": container.get("name"),
+            "cpu_request_millicores": cpu_val,
+            "memory_request_bytes": mem_val,
+        })
+    return container_list
+
+
+async def extract_pod_requests_async(pod_name: str, namespace: str, upstreams: Optional[AsyncUpstreams] = None,
+                                     use_cache: bool = True) -> List[Dict[str, Any]]:
+    """
+    Container requests of a pod, served from the pod inventory when it is running, otherwise from
+    the pod spec cache when fresh. Concurrent callers for the same pod share one API call.
+    """
+    inventory = pod_inventory.get_inventory()
+    if inventory is not None and inventory.covers(namespace):
+        record = inventory.get(namespace, pod_name)
+        return record.requests() if record else []
+
+    upstreams = upstreams or get_upstreams()
+    return await cache.pod_spec_cache.aget_or_load(
+        ("pod_requests", namespace, pod_name),
+        lambda: fetch_pod_requests_async(pod_name, namespace, upstreams), bypass=not use_cache)
+
+
+async def fetch_pod_requests_async(pod_name: str, namespace: str, upstreams: AsyncUpstreams) -> List[Dict[str, Any]]:
+    try:
+        pod = await upstreams.get_pod(pod_name, namespace)
+        if not pod:
+            print(f"Pod '{pod_name}' not found in namespace '{namespace}'.")
+            return []
+        return extract_requests_from_pod_dict(pod)
+    except asyncio.TimeoutError:
+        print(f"Timed out fetching pod '{pod_name}' in namespace '{namespace}' from the Kubernetes API.")
+        return []
+    except Exception as e:
+        print(f"An unexpected error occurred while fetching pod '{pod_name}' in namespace '{namespace}': {e}")
+        return []
+
+
+async def extract_pod_utilization_async(pod_name: str, namespace: str, upstreams: Optional[AsyncUpstreams] = None,
+                                        use_cache: bool = True) -> List[Dict[str, Any]]:
+    """
+    Container utilization of a pod, served from the usage cache when fresh. Concurrent callers
+    for the same pod share one pair of Prometheus queries.
+    """
+    upstreams = upstreams or get_upstreams()
+    return await cache.usage_cache.aget_or_load(
+        ("pod_usage", namespace, pod_name),
+        lambda: fetch_pod_utilization_async(pod_name, namespace, upstreams), bypass=not use_cache)
+
+
+async def fetch_pod_utilization_async(pod_name: str, namespace: str, upstreams: AsyncUpstreams) -> List[Dict[str, Any]]:
+    """
+    Fetches CPU and memory utilization per container of a pod, with one Prometheus query for both.
+    """
+    try:
+        result = await upstreams.query_prometheus(prometheus_query.usage_query([namespace], [pod_name]))
+    except asyncio.TimeoutError:
+        print(f"Timed out fetching Prometheus metrics for pod '{pod_name}' in namespace '{namespace}'.")
+        return []
+    except Exception as e:
+        print(f"An error occurred while fetching Prometheus metrics for pod '{pod_name}' in namespace '{namespace}': {e}")
+        return []
+
+    return list(prometheus_query.parse_usage(result).get(namespace, {}).values())
+
+
+async def analyze_pod_resource_usage_async(pod_name: str, namespace: str, upstreams: Optional[AsyncUpstreams] = None,
+                                           use_cache: bool = True) -> List[Dict[str, Any]]:
+    """
+    Async counterpart of metrics_analyzer.analyze_pod_resource_usage.
+
+    The pod spec and the Prometheus usage are fetched concurrently, so latency is the slower of the
+    two upstreams instead of their sum, and no threadpool worker is held while waiting.
+
+    Args:
+        pod_name (str): The name of the pod.
+        namespace (str): The namespace of the pod.
+        upstreams (Optional[AsyncUpstreams]): Clients to use; defaults to the process-wide ones.
+        use_cache (bool): Serve the pod spec and utilization from the TTL caches when fresh.
+                          False always queries the upstreams (and refreshes the caches).
+
+    Returns:
+        List[Dict[str, Any]]: One record per container, in the same format as analyze_pod_resource_usage.
+    """
+    upstreams = upstreams or get_upstreams()
+    try:
+        # Both fetches overlap, so they are timed as one stage.
+        with instrumentation.stage("pod_fetch"):
+            requests_data, utilization_data = await asyncio.gather(
+                extract_pod_requests_async(pod_name, namespace, upstreams, use_cache=use_cache),
+                extract_pod_utilization_async(pod_name, namespace, upstreams, use_cache=use_cache),
+            )
+        if not requests_data:
+            print(f"Warning: Could not retrieve resource requests for pod '{pod_name}' in namespace '{namespace}'.")
+            return []
+        if not utilization_data:
+            print(f"Warning: Could not retrieve CPU and Memory utilization for pod '{pod_name}' in namespace '{namespace}'.")
+
+        utilization_map = {item["name"]: item for item in utilization_data}
+        with instrumentation.stage("analysis"):
+            records = [
+                metrics_analyzer.analyze_container_usage(pod_name, namespace, req_container,
+                                                         utilization_map.get(req_container["name"]))
+                for req_container in requests_data
+            ]
+        instrumentation.items("containers", len(records))
+        return records
+
+    except Exception as e:
+        print(f"An unexpected error occurred during pod resource analysis for '{pod_name}' in namespace '{namespace}': {e}")
+        return []
@@ -0,0 +1,221 @@
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List
+
+# Pod specs (and so requests) change rarely; usage moves with every Prometheus scrape.
+POD_SPEC_CACHE_TTL_SECONDS = float(os.environ.get("POD_SPEC_CACHE_TTL_SECONDS", "60"))
+USAGE_CACHE_TTL_SECONDS = float(os.environ.get("USAGE_CACHE_TTL_SECONDS", "15"))
+# Percentiles over days of history barely move between two scrapes and are expensive to compute.
+HISTORY_CACHE_TTL_SECONDS = float(os.environ.get("HISTORY_CACHE_TTL_SECONDS", "300"))
+CACHE_MAXSIZE = int(os.environ.get("CACHE_MAXSIZE", "10000"))
+
+
+class _Flight:
+    """
+    One in-progress load that concurrent callers for the same key wait on.
+    """
+    __slots__ = ("event", "value", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache with a fixed TTL per entry and single-flight loading.
+
+    Concurrent misses for the same key are coalesced into one call of the loader; the other callers
+    wait for its result. Only truthy results are stored, so "not found" and error results (None / [])
+    are shared with the callers that were waiting but never cached. Cached values are shared between
+    callers and must be treated as read-only.
+
+    Works for both threads (get_or_load) and asyncio tasks (aget_or_load).
+    """
+
+    def __init__(self, name: str, ttl: float, maxsize: int = CACHE_MAXSIZE,
+                 clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key -> (expires_at, value)
+        self._inflight: Dict[Hashable, _Flight] = {}
+        self._async_inflight: Dict[Hashable, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.coalesced = 0
+        self.bypasses = 0
+
+    def _lookup(self, key: Hashable):
+        """
+        Returns (True, value) on a fresh hit, (False, None) otherwise. Must hold the lock.
+        """
+        entry = self._data.get(key)
+        if entry is None:
+            return False, None
+        if entry[0] <= self._clock():
+            del self._data[key]
+            self.expirations += 1
+            return False, None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return True, entry[1]
+
+    def _store(self, key: Hashable, value: Any) -> None:
+        if not value:
+            return
+        with self._lock:
+            self._data[key] = (self._clock() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any], bypass: bool = False) -> Any:
+        """
+        Returns the cached value for key, or calls loader() once for all concurrent callers.
+        With bypass=True the loader is always called and its result refreshes the cache.
+        """
+        if bypass:
+            with self._lock:
+                self.bypasses += 1
+            value = loader()
+            self._store(key, value)
+            return value
+
+        with self._lock:
+            found, value = self._lookup(key)
+            if found:
+                return value
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = loader()
+            self._store(key, flight.value)
+            return flight.value
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.event.set()
+
+    def get_many_or_load(self, keys: Iterable[Hashable], loader: Callable[[List[Hashable]], Dict[Hashable, Any]],
+                         bypass: bool = False) -> Dict[Hashable, Any]:
+        """
+        Batch form of get_or_load: fresh keys are served from the cache and loader(missing_keys) is
+        called once for all the others, returning key -> value; each value is cached on its own.
+        Keys the loader leaves out map to None. Unlike get_or_load, concurrent batch loads of the
+        same keys are not coalesced.
+        """
+        keys = list(dict.fromkeys(keys))
+        found_values: Dict[Hashable, Any] = {}
+        with self._lock:
+            if bypass:
+                self.bypasses += len(keys)
+                missing = keys
+            else:
+                missing = []
+                for key in keys:
+                    found, value = self._lookup(key)
+                    if found:
+                        found_values[key] = value
+                    else:
+                        missing.append(key)
+                        self.misses += 1
+        if missing:
+            loaded = loader(missing)
+            for key in missing:
+                value = loaded.get(key)
+                self._store(key, value)
+                found_values[key] = value
+        return {key: found_values[key] for key in keys}
+
+    async def aget_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]], bypass: bool = False) -> Any:
+        """
+        Async counterpart of get_or_load. The load runs as its own task, so a caller that is
+        cancelled does not cancel the fetch the other callers are waiting on.
+        """
+        if bypass:
+            with self._lock:
+                self.bypasses += 1
+            value = await loader()
+            self._store(key, value)
+            return value
+
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            found, value = self._lookup(key)
+            if found:
+                return value
+            task = self._async_inflight.get(key)
+            if task is None or task.get_loop() is not loop:
+                task = self._async_inflight[key] = loop.create_task(self._aload(key, loader))
+                self.misses += 1
+            else:
+                self.coalesced += 1
+        return await asyncio.shield(task)
+
+    async def _aload(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            value = await loader()
+            self._store(key, value)
+            return value
+        finally:
+            with self._lock:
+                self._async_inflight.pop(key, None)
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                "name": self.name,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "bypasses": self.bypasses,
+                "hit_ratio": (self.hits + self.coalesced) / lookups if lookups else None,
+            }
+
+
+pod_spec_cache = TTLCache("pod_spec", ttl=POD_SPEC_CACHE_TTL_SECONDS)
+usage_cache = TTLCache("usage", ttl=USAGE_CACHE_TTL_SECONDS)
+history_cache = TTLCache("history", ttl=HISTORY_CACHE_TTL_SECONDS)
+
+
+def cache_stats() -> Dict[str, Dict[str, Any]]:
+    return {c.name: c.stats() for c in (pod_spec_cache, usage_cache, history_cache)}
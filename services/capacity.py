@@ -0,0 +1,450 @@
+import json
+import math
+import os
+import threading
+from collections import Counter, OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from services import (cache, fleet_engine, instrumentation, k8s_client, metrics_analyzer, pod_inventory, quantity,
+                      usage_history)
+
+# Right-sized requests are the peak usage across a workload's replicas plus this much headroom,
+# rounded up to these steps (which are also the smallest request ever recommended).
+CAPACITY_HEADROOM = float(os.environ.get("CAPACITY_HEADROOM", "0.15"))
+CAPACITY_CPU_STEP_MILLICORES = float(os.environ.get("CAPACITY_CPU_STEP_MILLICORES", "10"))
+CAPACITY_MEMORY_STEP_BYTES = float(os.environ.get("CAPACITY_MEMORY_STEP_BYTES", str(16 * 1024 ** 2)))
+# Models kept for usage sources (current usage, a percentile over a window), least recently used dropped first.
+CAPACITY_MODELS = int(os.environ.get("CAPACITY_MODELS", "4"))
+
+PodKey = Tuple[str, str]  # (namespace, pod name)
+WorkloadKey = Tuple[str, str, str]  # (namespace, kind, name)
+Container = Tuple[str, float, float, float, float]  # (name, cpu request, memory request, cpu usage, memory usage)
+
+# Index of each total in the lists kept per node, namespace and workload.
+_CPU_REQUEST, _MEMORY_REQUEST, _CPU_USAGE, _MEMORY_USAGE, _PODS, _NO_USAGE = range(6)
+_EMPTY_TOTALS = (0.0, 0.0, 0.0, 0.0, 0, 0)
+
+
+class PodUsage:
+    """
+    One pod's placement and the requests and usage of its containers. Two PodUsage are equal when
+    nothing the capacity model depends on differs, which is how CapacityModel.sync finds changes.
+    """
+    __slots__ = ("namespace", "name", "node_name", "workload", "containers")
+
+    def __init__(self, namespace: str, name: str, node_name: Optional[str], workload: pod_inventory.Workload,
+                 containers: Tuple[Container, ...]):
+        self.namespace = namespace
+        self.name = name
+        self.node_name = node_name
+        self.workload = workload
+        self.containers = containers
+
+    @property
+    def key(self) -> PodKey:
+        return (self.namespace, self.name)
+
+    @property
+    def workload_key(self) -> WorkloadKey:
+        return (self.namespace,) + tuple(self.workload)
+
+    def __eq__(self, other) -> bool:
+        return (isinstance(other, PodUsage) and self.node_name == other.node_name
+                and self.workload == other.workload and self.containers == other.containers)
+
+    def totals(self) -> Tuple[float, float, float, float, int, int]:
+        cpu_request = memory_request = cpu_usage = memory_usage = 0.0
+        no_usage = 0
+        for _, cpu_req, mem_req, cpu_use, mem_use in self.containers:
+            cpu_request += cpu_req
+            memory_request += mem_req
+            cpu_usage += cpu_use
+            memory_usage += mem_use
+            no_usage += not cpu_use and not mem_use
+        return (cpu_request, memory_request, cpu_usage, memory_usage, 1, no_usage)
+
+
+def pods_from_frame(frame: fleet_engine.FleetFrame, records: List[pod_inventory.PodRecord]) -> List[PodUsage]:
+    """
+    Regroups the per-container rows of an analysis frame into pods.
+
+    Args:
+        frame: requests and usage, built from the requests of records in the same order (as
+            fleet_engine.build_frame builds it).
+        records: the parsed pods, for their node and workload.
+    """
+    names = frame.container.tolist()
+    columns = list(zip(names, frame.cpu_request.tolist(), frame.memory_request.tolist(),
+                       frame.cpu_usage.tolist(), frame.memory_usage.tolist()))
+    pods, row = [], 0
+    for record in records:
+        end = row + len(record.containers)
+        pods.append(PodUsage(record.namespace, record.name, record.node_name, record.workload, tuple(columns[row:end])))
+        row = end
+    return pods
+
+
+def _round_up(value: float, step: float) -> float:
+    return max(step, math.ceil(value / step) * step)
+
+
+def pack(cpu: np.ndarray, memory: np.ndarray, counts: np.ndarray,
+         node_cpu: float, node_memory: float) -> Tuple[np.ndarray, np.ndarray, int]:
+    """
+    First-fit decreasing bin packing of counts[i] identical pods of cpu[i] x memory[i] into nodes of
+    node_cpu x node_memory.
+
+    Pods are placed largest first by their dominant share of a node. All the replicas of one size
+    are placed in one vectorized step over the open nodes, so the cost grows with the number of
+    distinct sizes times the number of nodes, not with the number of pods.
+
+    Returns:
+        Tuple of the CPU and memory used on each node needed, and the number of pods too large for
+        any node.
+    """
+    fits = (cpu <= node_cpu) & (memory <= node_memory) & (counts > 0)
+    unplaceable = int(counts[~fits & (counts > 0)].sum())
+    # Right-sized pods are never empty, but the divisions below must stay finite for any input.
+    cpu, memory, counts = np.maximum(cpu[fits], 1e-9), np.maximum(memory[fits], 1e-9), counts[fits]
+    if not len(counts):
+        return np.zeros(0), np.zeros(0), unplaceable
+
+    order = np.argsort(-np.maximum(cpu / node_cpu, memory / node_memory), kind="stable")
+    cpu, memory, counts = cpu[order], memory[order], counts[order]
+    # Nodes with less room than every pod still to place are never looked at again.
+    smallest_cpu = np.minimum.accumulate(cpu[::-1])[::-1].tolist()
+    smallest_memory = np.minimum.accumulate(memory[::-1])[::-1].tolist()
+    # The slack absorbs rounding errors, so a pod that exactly fills a node still fits.
+    free_cpu = np.full(int(counts.sum()), node_cpu + 1e-6)
+    free_memory = np.full(len(free_cpu), node_memory + 1e-6)
+    opened = start = 0
+    for i, (size_cpu, size_memory, remaining) in enumerate(zip(cpu.tolist(), memory.tolist(), counts.tolist())):
+        while start < opened and (free_cpu[start] < smallest_cpu[i] or free_memory[start] < smallest_memory[i]):
+            start += 1
+        if opened > start:
+            open_cpu, open_memory = free_cpu[start:opened], free_memory[start:opened]
+            # floor(a / b) is several times faster than a // b on float arrays.
+            room = np.floor(np.minimum(open_cpu / size_cpu, open_memory / size_memory))
+            placed = np.cumsum(room)
+            if placed[-1] >= remaining:
+                last = int(np.searchsorted(placed, remaining))
+                room = room[:last + 1]
+                room[-1] -= placed[last] - remaining
+                remaining = 0
+            else:
+                remaining -= int(placed[-1])
+            open_cpu[:len(room)] -= room * size_cpu
+            open_memory[:len(room)] -= room * size_memory
+        if remaining:
+            per_node = int(min((node_cpu + 1e-6) // size_cpu, (node_memory + 1e-6) // size_memory))
+            new = -(-remaining // per_node)
+            room = np.full(new, float(per_node))
+            room[-1] = remaining - per_node * (new - 1)
+            free_cpu[opened:opened + new] -= room * size_cpu
+            free_memory[opened:opened + new] -= room * size_memory
+            opened += new
+    return node_cpu + 1e-6 - free_cpu[:opened], node_memory + 1e-6 - free_memory[:opened], unplaceable
+
+
+class CapacityModel:
+    """
+    Requested and used resources per node, namespace and workload, right-sized requests per workload
+    and a bin-packing estimate of the nodes the workloads would need at those requests.
+
+    The model is updated pod by pod: sync() compares the pods it is given with the ones it holds and
+    only adds and subtracts the totals of pods that changed, and only recomputes the right-sized
+    requests of the workloads those pods belong to. The packing is rerun only when a right-sized
+    request, a replica count or the node shape changed. Not thread-safe; callers hold lock.
+    """
+
+    def __init__(self, headroom: float = CAPACITY_HEADROOM, cpu_step: float = CAPACITY_CPU_STEP_MILLICORES,
+                 memory_step: float = CAPACITY_MEMORY_STEP_BYTES):
+        self.headroom = headroom
+        self.cpu_step = cpu_step
+        self.memory_step = memory_step
+        self.lock = threading.Lock()
+        self.nodes: Dict[str, Tuple[float, float]] = {}
+        self._pods: Dict[PodKey, PodUsage] = {}
+        self._node_totals: Dict[Optional[str], List[float]] = {}
+        self._namespace_totals: Dict[str, List[float]] = {}
+        self._workload_totals: Dict[WorkloadKey, List[float]] = {}
+        self._workload_pods: Dict[WorkloadKey, Set[PodKey]] = {}
+        # Right-sized CPU and memory per replica, and the number of replicas.
+        self._workload_sizes: Dict[WorkloadKey, Tuple[float, float, int]] = {}
+        self._dirty: Set[WorkloadKey] = set()
+        self._sizes_version = 0
+        self._packing: Optional[Tuple[Any, Dict[str, Any]]] = None
+        self.changed_pods = 0
+
+    def __len__(self) -> int:
+        return len(self._pods)
+
+    def _apply(self, old: Optional[PodUsage], new: Optional[PodUsage]) -> None:
+        for pod, sign in ((old, -1), (new, 1)):
+            if pod is None:
+                continue
+            values = pod.totals()
+            if sign < 0:
+                values = tuple(-value for value in values)
+            workload = pod.workload_key
+            for totals, key in ((self._node_totals, pod.node_name), (self._namespace_totals, pod.namespace),
+                                (self._workload_totals, workload)):
+                entry = totals.get(key)
+                if entry is None:
+                    totals[key] = list(values)
+                elif entry[_PODS] + values[_PODS] > 0:
+                    totals[key] = [total + value for total, value in zip(entry, values)]
+                else:
+                    del totals[key]  # Its last pod left; drop the float residue with it.
+            members = self._workload_pods.setdefault(workload, set())
+            if sign > 0:
+                members.add(pod.key)
+            else:
+                members.discard(pod.key)
+                if not members:
+                    del self._workload_pods[workload]
+            self._dirty.add(workload)
+        if new is None:
+            del self._pods[old.key]
+        else:
+            self._pods[new.key] = new
+        self.changed_pods += 1
+
+    def sync(self, pods: Iterable[PodUsage]) -> int:
+        """
+        Makes the model hold exactly these pods. Returns how many pods were added, changed or removed.
+        """
+        before = self.changed_pods
+        seen: Set[PodKey] = set()
+        for pod in pods:
+            key = pod.key
+            seen.add(key)
+            old = self._pods.get(key)
+            if old is None or old != pod:
+                self._apply(old, pod)
+        for key in [key for key in self._pods if key not in seen]:
+            self._apply(self._pods[key], None)
+        self._refresh_sizes()
+        return self.changed_pods - before
+
+    def set_nodes(self, nodes: Dict[str, Tuple[float, float]]) -> None:
+        self.nodes = dict(nodes)
+
+    def _right_size(self, workload: WorkloadKey) -> Tuple[float, float]:
+        """
+        Per replica right-sized CPU and memory: for each container, the highest usage of any replica
+        plus headroom, rounded up to the steps.
+        """
+        peaks: Dict[str, List[float]] = {}
+        for key in self._workload_pods[workload]:
+            for name, _, _, cpu_use, mem_use in self._pods[key].containers:
+                peak = peaks.setdefault(name, [0.0, 0.0])
+                peak[0] = max(peak[0], cpu_use)
+                peak[1] = max(peak[1], mem_use)
+        scale = 1 + self.headroom
+        return (sum(_round_up(cpu * scale, self.cpu_step) for cpu, _ in peaks.values()),
+                sum(_round_up(mem * scale, self.memory_step) for _, mem in peaks.values()))
+
+    def _refresh_sizes(self) -> None:
+        for workload in self._dirty:
+            if workload in self._workload_pods:
+                size = self._right_size(workload) + (len(self._workload_pods[workload]),)
+                if self._workload_sizes.get(workload) != size:
+                    self._workload_sizes[workload] = size
+                    self._sizes_version += 1
+            elif self._workload_sizes.pop(workload, None) is not None:
+                self._sizes_version += 1
+        self._dirty.clear()
+
+    def node_shape(self) -> Tuple[float, float]:
+        """
+        The most common allocatable CPU and memory among the current nodes.
+        """
+        if not self.nodes:
+            return (0.0, 0.0)
+        return Counter(self.nodes.values()).most_common(1)[0][0]
+
+    def simulate(self, node_cpu: Optional[float] = None, node_memory: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Estimates how many nodes of the given shape (the most common current one by default) the
+        workloads would need at their right-sized requests. DaemonSet pods run on every node, so their
+        right-sized requests are taken off each node instead of being packed.
+        """
+        default_cpu, default_memory = self.node_shape()
+        node_cpu, node_memory = node_cpu or default_cpu, node_memory or default_memory
+        key = (self._sizes_version, node_cpu, node_memory)
+        if self._packing is not None and self._packing[0] == key:
+            return self._packing[1]
+
+        daemon_cpu = daemon_memory = 0.0
+        sizes: Dict[Tuple[float, float], int] = {}
+        for workload, (cpu, memory, replicas) in self._workload_sizes.items():
+            if workload[1] == "DaemonSet":
+                daemon_cpu += cpu
+                daemon_memory += memory
+            else:
+                sizes[(cpu, memory)] = sizes.get((cpu, memory), 0) + replicas
+        usable_cpu, usable_memory = max(node_cpu - daemon_cpu, 0.0), max(node_memory - daemon_memory, 0.0)
+        cpu = np.array([size[0] for size in sizes], dtype=np.float64)
+        memory = np.array([size[1] for size in sizes], dtype=np.float64)
+        counts = np.array(list(sizes.values()), dtype=np.int64)
+        if usable_cpu > 0 and usable_memory > 0:
+            used_cpu, used_memory, unplaceable = pack(cpu, memory, counts, usable_cpu, usable_memory)
+        else:
+            used_cpu, used_memory, unplaceable = np.zeros(0), np.zeros(0), int(counts.sum())
+        needed = len(used_cpu)
+        result = {
+            "node_cpu_millicores": node_cpu,
+            "node_memory_bytes": node_memory,
+            "current_nodes": len(self.nodes),
+            "nodes_needed": needed,
+            "daemonset_cpu_millicores_per_node": daemon_cpu,
+            "daemonset_memory_bytes_per_node": daemon_memory,
+            "right_sized_cpu_millicores": float((cpu * counts).sum()),
+            "right_sized_memory_bytes": float((memory * counts).sum()),
+            "cpu_packing_ratio": float(used_cpu.sum() / (needed * usable_cpu)) if needed else None,
+            "memory_packing_ratio": float(used_memory.sum() / (needed * usable_memory)) if needed else None,
+            "unplaceable_pods": unplaceable,
+            "pending_pods": int(self._node_totals.get(None, _EMPTY_TOTALS)[_PODS]),
+            # Right-sizing these to the minimum step is only right if they really use nothing.
+            "containers_without_usage": int(sum(t[_NO_USAGE] for t in self._namespace_totals.values())),
+        }
+        self._packing = (key, result)
+        return result
+
+    @staticmethod
+    def _totals_record(totals) -> Dict[str, Any]:
+        return {
+            "pods": int(totals[_PODS]),
+            "cpu_request_millicores": totals[_CPU_REQUEST],
+            "memory_request_bytes": totals[_MEMORY_REQUEST],
+            "cpu_utilization_millicores": totals[_CPU_USAGE],
+            "memory_utilization_bytes": totals[_MEMORY_USAGE],
+        }
+
+    def report(self, node_cpu: Optional[float] = None, node_memory: Optional[float] = None) -> Dict[str, Any]:
+        """
+        The capacity report: totals per node (with allocatable and request ratios), per namespace and
+        per workload (with its right-sized requests), and the bin-packing simulation.
+        """
+        nodes = []
+        for name, (cpu, memory) in sorted(self.nodes.items()):
+            record = {"name": name, "allocatable_cpu_millicores": cpu, "allocatable_memory_bytes": memory}
+            record.update(self._totals_record(self._node_totals.get(name, _EMPTY_TOTALS)))
+            record["cpu_request_ratio"] = record["cpu_request_millicores"] / cpu if cpu else None
+            record["memory_request_ratio"] = record["memory_request_bytes"] / memory if memory else None
+            nodes.append(record)
+
+        right_sized: Dict[str, List[float]] = {}
+        workloads = []
+        for workload, totals in sorted(self._workload_totals.items()):
+            namespace, kind, name = workload
+            cpu, memory, _ = self._workload_sizes[workload]
+            record = {"namespace": namespace, "kind": kind, "name": name}
+            record.update(self._totals_record(totals))
+            record["right_sized_cpu_millicores"] = cpu
+            record["right_sized_memory_bytes"] = memory
+            workloads.append(record)
+            namespace_sized = right_sized.setdefault(namespace, [0.0, 0.0])
+            namespace_sized[0] += cpu * totals[_PODS]
+            namespace_sized[1] += memory * totals[_PODS]
+
+        namespaces = []
+        for namespace, totals in sorted(self._namespace_totals.items()):
+            record = {"namespace": namespace}
+            record.update(self._totals_record(totals))
+            record["right_sized_cpu_millicores"], record["right_sized_memory_bytes"] = right_sized.get(namespace, (0.0, 0.0))
+            namespaces.append(record)
+
+        return {"nodes": nodes, "namespaces": namespaces, "workloads": workloads,
+                "simulation": self.simulate(node_cpu, node_memory)}
+
+
+def get_node_allocatable(use_cache: bool = True) -> Dict[str, Tuple[float, float]]:
+    """
+    Allocatable CPU (millicores) and memory (bytes) of every node, served from the pod spec cache
+    when fresh; use_cache=False forces a fresh list.
+    """
+    return cache.pod_spec_cache.get_or_load(("nodes",), fetch_node_allocatable, bypass=not use_cache)
+
+
+def fetch_node_allocatable() -> Dict[str, Tuple[float, float]]:
+    """
+    Lists the nodes with one API call, read as raw JSON. Returns {} on error.
+    """
+    try:
+        with instrumentation.upstream("kubernetes", "list_nodes"):
+            items = json.loads(k8s_client.core_v1_api().list_node(_preload_content=False).data)["items"]
+        allocatable = [(item.get("status") or {}).get("allocatable") or {} for item in items]
+        cpu = quantity.cpu_to_millicores_bulk(a.get("cpu") for a in allocatable).tolist()
+        memory = quantity.memory_to_bytes_bulk(a.get("memory") for a in allocatable).tolist()
+        return {item["metadata"]["name"]: (c, m) for item, c, m in zip(items, cpu, memory)}
+    except Exception as e:
+        print(f"An unexpected error occurred while listing nodes: {e}")
+        return {}
+
+
+# One model per usage source, so a percentile report does not churn the current usage one. Each holds
+# every pod, so only the CAPACITY_MODELS most recently used are kept.
+_models: "OrderedDict[Tuple[Optional[str], Optional[int]], CapacityModel]" = OrderedDict()
+_models_lock = threading.Lock()
+
+
+def get_model(percentile: Optional[str] = None, window: Optional[str] = None) -> CapacityModel:
+    # Windows are compared as durations: 1h, 60m and 3600s share one model. Without a percentile the
+    # window is not used.
+    seconds = usage_history.parse_duration(window or usage_history.HISTORY_DEFAULT_WINDOW) if percentile else None
+    key = (percentile, seconds)
+    with _models_lock:
+        model = _models.pop(key, None)
+        _models[key] = model = CapacityModel() if model is None else model
+        while len(_models) > max(1, CAPACITY_MODELS):
+            _models.popitem(last=False)
+        return model
+
+
+def analyze_cluster_capacity(use_cache: bool = True, percentile: Optional[str] = None, window: Optional[str] = None,
+                             node_cpu: Optional[float] = None, node_memory: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Builds the cluster capacity report.
+
+    Pods come from the pod inventory (or one paged raw JSON list), usage from one utilization fetch
+    for all namespaces, node allocatable from one node list. The process-wide CapacityModel is then
+    synced with the result, so only the pods that changed since the last report are recomputed.
+
+    Args:
+        use_cache (bool): Serve usage and node allocatable from the TTL caches when fresh.
+        percentile (Optional[str]): Size workloads by this statistic of the usage history instead of
+                          the current usage ("p50", "p95", "p99" or "max").
+        window (Optional[str]): History window for percentile, as a Prometheus duration ("7d").
+        node_cpu (Optional[float]): Allocatable CPU (millicores) of the simulated nodes; defaults to
+                          the most common current node.
+        node_memory (Optional[float]): Allocatable memory (bytes) of the simulated nodes.
+
+    Returns:
+        Dict[str, Any]: "nodes", "namespaces" and "workloads" totals and the "simulation" result,
+                        or {} on error.
+    """
+    try:
+        # Completed pods (Succeeded, Failed) hold no node resources.
+        records = [r for r in pod_inventory.pods_in_scope() if r.active]
+        pod_requests = [(r.namespace, r.name, r.requests()) for r in records]
+        with instrumentation.stage("namespace_usage"):
+            utilization = metrics_analyzer.namespace_utilization(
+                {r.namespace for r in records}, use_cache=use_cache, percentile=percentile, window=window)
+        nodes = get_node_allocatable(use_cache=use_cache)
+        with instrumentation.stage("capacity"):
+            pods = pods_from_frame(fleet_engine.build_frame(pod_requests, utilization), records)
+            model = get_model(percentile, window)
+            with model.lock:
+                model.set_nodes(nodes)
+                model.sync(pods)
+                report = model.report(node_cpu, node_memory)
+        instrumentation.items("pods", len(pods))
+        return report
+
+    except Exception as e:
+        print(f"An unexpected error occurred during cluster capacity analysis: {e}")
+        return {}
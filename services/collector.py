@@ -0,0 +1,116 @@
+import os
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from services import fleet_engine, metrics_analyzer, pod_inventory, rate_limit
+
+# Target size of one chunk task. Namespaces are never split: usage is queried per namespace.
+COLLECTOR_CHUNK_CONTAINERS = int(os.environ.get("COLLECTOR_CHUNK_CONTAINERS", "5000"))
+# Chunks a worker picks up later than this after the tick return no rows; the next beat collects
+# fresh data anyway, and the chord still stores the chunks that made it.
+COLLECTOR_DEADLINE_SECONDS = int(os.environ.get("COLLECTOR_DEADLINE_SECONDS", "55"))
+
+PodRequests = Sequence[Tuple[str, str, List[Dict[str, Any]]]]
+
+_NAME_COLUMNS = ("namespace", "pod", "container", "workload")
+_VALUE_COLUMNS = ("cpu_request", "cpu_usage", "memory_request", "memory_usage")
+
+
+def list_targets(namespace: Optional[str] = None) -> Tuple[PodRequests, Dict[Tuple[str, str], str]]:
+    """
+    The pods to collect as (namespace, pod_name, container requests) tuples, and the workload of each
+    pod as "Kind/name", keyed by (namespace, pod_name). Both are empty if the pods cannot be listed.
+    """
+    try:
+        records = pod_inventory.pods_in_scope(namespace)
+    except Exception as e:
+        print(f"An unexpected error occurred while listing the pods to collect: {e}")
+        return [], {}
+    return ([(record.namespace, record.name, record.requests()) for record in records],
+            {record.key: "/".join(record.workload) for record in records})
+
+
+def plan_chunks(pod_requests: PodRequests, max_containers: Optional[int] = None) -> List[List[Any]]:
+    """
+    Splits (namespace, pod_name, container requests) tuples into chunks of about max_containers
+    containers. Whole namespaces are packed largest first into the least loaded chunk, so chunks
+    come out balanced; a namespace larger than max_containers gets a chunk of its own.
+    """
+    max_containers = max_containers or COLLECTOR_CHUNK_CONTAINERS
+    by_namespace: Dict[str, List[Any]] = {}
+    sizes: Dict[str, int] = {}
+    for namespace, pod_name, requests_data in pod_requests:
+        by_namespace.setdefault(namespace, []).append((namespace, pod_name, requests_data))
+        sizes[namespace] = sizes.get(namespace, 0) + len(requests_data)
+
+    total = sum(sizes.values())
+    chunk_count = max(1, -(-total // max_containers))
+    chunks: List[List[Any]] = [[] for _ in range(chunk_count)]
+    loads = [0] * chunk_count
+    for namespace in sorted(sizes, key=sizes.get, reverse=True):
+        target = loads.index(min(loads))
+        chunks[target].extend(by_namespace[namespace])
+        loads[target] += sizes[namespace]
+    return [chunk for chunk in chunks if chunk]
+
+
+def collect_chunk(pod_requests: PodRequests, workloads: Optional[Sequence[str]] = None) -> Dict[str, list]:
+    """
+    Fetches current usage for the namespaces of one chunk with a single query, within the Prometheus
+    rate limit, and returns requests and usage as plain columns (the format Celery passes between tasks).
+    workloads, aligned with pod_requests, is the "Kind/name" of each pod's workload. Containers
+    Prometheus has no usage for (all of them when the query fails) have NaN usage.
+    """
+    try:
+        rate_limit.prometheus_limiter.acquire()
+        utilization = metrics_analyzer.extract_namespaces_utilization_from_prometheus(
+            list(dict.fromkeys(namespace for namespace, _, _ in pod_requests)), use_cache=False)
+        frame = fleet_engine.build_frame(pod_requests, utilization, missing=np.nan)
+        if workloads is not None:
+            frame.workload = np.array([workload for workload, (_, _, requests_data) in zip(workloads, pod_requests)
+                                       for _ in requests_data], dtype=object)
+        return frame_to_columns(frame)
+    except Exception as e:
+        # One failed chunk must not stop the others from being stored.
+        print(f"An unexpected error occurred while collecting a chunk of {len(pod_requests)} pods: {e}")
+        return empty_columns()
+
+
+def empty_columns() -> Dict[str, list]:
+    """
+    The result of a chunk that collected nothing.
+    """
+    return {name: [] for name in _NAME_COLUMNS + _VALUE_COLUMNS}
+
+
+def observed(frame: fleet_engine.FleetFrame) -> fleet_engine.FleetFrame:
+    """
+    The containers of a collected frame that Prometheus had usage for: the others are not samples,
+    and are kept out of the stores, the schedule and the snapshot.
+    """
+    rows = ~(np.isnan(frame.cpu_usage) | np.isnan(frame.memory_usage))
+    return frame if rows.all() else fleet_engine.take(frame, rows)
+
+
+def frame_to_columns(frame: fleet_engine.FleetFrame) -> Dict[str, list]:
+    columns = {name: getattr(frame, name).tolist() for name in _NAME_COLUMNS + _VALUE_COLUMNS if name != "workload"}
+    # Without a known workload, each pod is its own.
+    columns["workload"] = frame.workload.tolist() if frame.workload is not None else ["Pod/" + pod for pod in columns["pod"]]
+    return columns
+
+
+def merge_chunks(chunks: Sequence[Dict[str, list]]) -> fleet_engine.FleetFrame:
+    """
+    Concatenates chunk results back into one FleetFrame.
+    """
+    columns = {name: [] for name in _NAME_COLUMNS + _VALUE_COLUMNS}
+    for chunk in chunks:
+        if not chunk:
+            continue
+        for name in columns:
+            columns[name].extend(chunk.get(name, ()))
+    return fleet_engine.FleetFrame(
+        **{name: np.array(columns[name], dtype=object) for name in _NAME_COLUMNS},
+        **{name: np.asarray(columns[name], dtype=np.float64) for name in _VALUE_COLUMNS},
+    )
@@ -0,0 +1,207 @@
+import os
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+# Spans go to whatever OpenTelemetry SDK the process is configured with; off by default.
+TRACING_ENABLED = os.environ.get("TRACING_ENABLED", "").lower() in ("1", "true", "yes")
+
+# From 0.5 ms (cache hits, the analysis loop) up to 30 s (week-long history queries).
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+STAGE_DURATION = Histogram("rgsz_stage_duration_seconds", "Time spent in one stage of an analysis or collection.",
+                           ["stage"], buckets=LATENCY_BUCKETS)
+UPSTREAM_DURATION = Histogram("rgsz_upstream_request_duration_seconds", "Duration of calls to an upstream.",
+                              ["upstream", "operation"], buckets=LATENCY_BUCKETS)
+UPSTREAM_CALLS = Counter("rgsz_upstream_requests", "Calls to an upstream.", ["upstream", "operation"])
+UPSTREAM_ERRORS = Counter("rgsz_upstream_errors", "Failed calls to an upstream, by error type.",
+                          ["upstream", "operation", "error"])
+ITEMS_PROCESSED = Counter("rgsz_items_processed", "Pods, containers or samples handled.", ["kind"])
+HTTP_DURATION = Histogram("rgsz_http_request_duration_seconds", "Duration of API requests, until the last byte.",
+                          ["method", "route", "status"], buckets=LATENCY_BUCKETS)
+STARTUP_SECONDS = Gauge("rgsz_startup_seconds", "Cold start of this process: import, ready, warmup and first_request.",
+                        ["phase"])
+COLLECTION_BACKOFF = Gauge("rgsz_collection_backoff", "Factor the collection intervals are stretched by, for slow upstreams.")
+
+_tracer = None
+if TRACING_ENABLED:
+    try:
+        from opentelemetry import trace
+        _tracer = trace.get_tracer("rgsz")
+    except ImportError:
+        print("TRACING_ENABLED is set but opentelemetry-api is not installed; spans are disabled.")
+
+# Bound label children, so the hot path skips the label lookup and its lock.
+_stages: Dict[str, Any] = {}
+_upstreams: Dict[Tuple[str, str], Tuple[Any, Any]] = {}
+
+
+def error_type(error: BaseException) -> str:
+    """
+    Short label for an upstream error: http_<status> for HTTP errors of any client, timeout, or the class name.
+    """
+    status = getattr(error, "status", None)
+    if not isinstance(status, int):
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return f"http_{status}"
+    # requests and urllib3 timeouts do not derive from TimeoutError.
+    if isinstance(error, TimeoutError) or "Timeout" in type(error).__name__:
+        return "timeout"
+    return type(error).__name__
+
+
+class _Timer:
+    """
+    Times a block into a histogram child, optionally inside a span. Exceptions propagate unchanged.
+    """
+    __slots__ = ("observer", "upstream", "name", "start", "span")
+
+    def __init__(self, observer, name: str, upstream: Optional[Tuple[str, str]] = None):
+        self.observer = observer
+        self.name = name
+        self.upstream = upstream
+        self.span = None
+
+    def __enter__(self):
+        if _tracer is not None:
+            self.span = _tracer.start_as_current_span(self.name)
+            self.span.__enter__()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.observer.observe(time.perf_counter() - self.start)
+        # GeneratorExit: a streamed result that the caller stopped reading early is not an error.
+        if exc is not None and self.upstream is not None and exc_type is not GeneratorExit:
+            UPSTREAM_ERRORS.labels(self.upstream[0], self.upstream[1], error_type(exc)).inc()
+        if self.span is not None:
+            self.span.__exit__(exc_type, exc, tb)
+        return False
+
+
+class _NoopTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopTimer()
+
+
+def stage(name: str):
+    """
+    Context manager timing one stage ("pod_requests", "analysis", ...) into rgsz_stage_duration_seconds.
+    """
+    if not METRICS_ENABLED:
+        return _NOOP
+    observer = _stages.get(name)
+    if observer is None:
+        observer = _stages[name] = STAGE_DURATION.labels(name)
+    return _Timer(observer, name)
+
+
+def upstream(name: str, operation: str):
+    """
+    Context manager around one upstream call: counts it, times it and counts its error type if it raises.
+    """
+    if not METRICS_ENABLED:
+        return _NOOP
+    children = _upstreams.get((name, operation))
+    if children is None:
+        children = _upstreams[(name, operation)] = (UPSTREAM_DURATION.labels(name, operation),
+                                                    UPSTREAM_CALLS.labels(name, operation))
+    children[1].inc()
+    return _Timer(children[0], f"{name}.{operation}", (name, operation))
+
+
+def items(kind: str, count: int) -> None:
+    if METRICS_ENABLED and count:
+        ITEMS_PROCESSED.labels(kind).inc(count)
+
+
+class CacheCollector:
+    """
+    Exposes the TTL cache counters at scrape time, so the caches themselves carry no metrics code.
+    """
+
+    def collect(self):
+        from services import cache
+        stats = cache.cache_stats()
+        lookups = CounterMetricFamily("rgsz_cache_lookups", "Cache lookups by result.", labels=["cache", "result"])
+        evictions = CounterMetricFamily("rgsz_cache_evictions", "Entries dropped for size or age.", labels=["cache", "reason"])
+        size = GaugeMetricFamily("rgsz_cache_entries", "Entries currently cached.", labels=["cache"])
+        ratio = GaugeMetricFamily("rgsz_cache_hit_ratio", "Share of lookups served without a new load.", labels=["cache"])
+        for name, s in stats.items():
+            for result in ("hits", "misses", "coalesced", "bypasses"):
+                lookups.add_metric([name, result], s[result])
+            evictions.add_metric([name, "size"], s["evictions"])
+            evictions.add_metric([name, "ttl"], s["expirations"])
+            size.add_metric([name], s["size"])
+            if s["hit_ratio"] is not None:
+                ratio.add_metric([name], s["hit_ratio"])
+        return [lookups, evictions, size, ratio]
+
+
+def render() -> Tuple[bytes, str]:
+    """
+    Current metrics in the Prometheus text format. With PROMETHEUS_MULTIPROC_DIR set (several uvicorn
+    or Celery worker processes), the values of every process writing there are merged.
+    """
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        from prometheus_client import REGISTRY as registry
+    output = generate_latest(registry)
+    # Cache counters live in this process only.
+    cache_registry = CollectorRegistry()
+    cache_registry.register(CacheCollector())
+    return output + generate_latest(cache_registry), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid: int) -> None:
+    """
+    Drops a finished worker's live gauges from the multiprocess directory.
+    """
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(pid)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing every request by route template until its last byte has been sent,
+    so streamed responses are measured in full.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            # Unmatched paths share one label so that scanners cannot blow up the series count.
+            path = getattr(route, "path", None) or "unmatched"
+            HTTP_DURATION.labels(scope["method"], path, str(status[0])).observe(time.perf_counter() - start)
@@ -0,0 +1,169 @@
+import os
+import re
+import threading
+import time
+from typing import Any, List, Optional, Tuple
+
+# In-cluster service account files, as mounted by the kubelet.
+SERVICE_TOKEN_FILE = "/var/run/secrets/kubernetes.io/serviceaccount/token"
+SERVICE_CA_FILE = "/var/run/secrets/kubernetes.io/serviceaccount/ca.crt"
+
+# Namespaces are DNS-1123 labels, pod names DNS-1123 subdomains.
+_LABEL = r"[a-z0-9]([-a-z0-9]*[a-z0-9])?"
+_NAMESPACE_NAME = re.compile(_LABEL)
+_POD_NAME = re.compile(rf"{_LABEL}(\.{_LABEL})*")
+
+# Size of the urllib3 connection pool shared by every API object handed out by the manager.
+# The kubernetes client defaults to 5, which is too small for a threaded FastAPI app.
+DEFAULT_POOL_MAXSIZE = int(os.environ.get("K8S_POOL_MAXSIZE", "16"))
+
+# How often (in seconds) the kubeconfig / token files are checked for changes.
+DEFAULT_RELOAD_CHECK_INTERVAL = float(os.environ.get("K8S_RELOAD_CHECK_INTERVAL", "5"))
+
+
+def is_namespace_name(name: str) -> bool:
+    return len(name) <= 63 and _NAMESPACE_NAME.fullmatch(name) is not None
+
+
+def is_pod_name(name: str) -> bool:
+    return len(name) <= 253 and _POD_NAME.fullmatch(name) is not None
+
+
+class KubeClientManager:
+    """
+    Process-wide owner of the Kubernetes configuration and API client.
+
+    The configuration is loaded once (in-cluster when running inside a pod, kubeconfig otherwise)
+    and every CoreV1Api / CustomObjectsApi handed out shares one ApiClient, and therefore one
+    connection pool. The configuration is reloaded when the kubeconfig or the service account
+    token changes on disk, and rebuilt after a fork so Celery prefork children never share sockets
+    with their parent.
+    """
+
+    def __init__(self, pool_maxsize: int = DEFAULT_POOL_MAXSIZE,
+                 reload_check_interval: float = DEFAULT_RELOAD_CHECK_INTERVAL,
+                 config_file: Optional[str] = None):
+        self.pool_maxsize = pool_maxsize
+        self.reload_check_interval = reload_check_interval
+        self.config_file = config_file
+        self._lock = threading.Lock()
+        self._api_client = None
+        self._apis = {}
+        self._fingerprint = None
+        self._pid = None
+        self._next_check = 0.0
+
+    def in_cluster(self) -> bool:
+        return bool(os.environ.get("KUBERNETES_SERVICE_HOST")) and os.path.exists(SERVICE_TOKEN_FILE)
+
+    def _watched_files(self) -> List[str]:
+        if self.in_cluster():
+            return [SERVICE_TOKEN_FILE, SERVICE_CA_FILE]
+        if self.config_file:
+            return [self.config_file]
+        from kubernetes.config.kube_config import KUBE_CONFIG_DEFAULT_LOCATION
+        paths = os.environ.get("KUBECONFIG", KUBE_CONFIG_DEFAULT_LOCATION)
+        return [os.path.expanduser(p) for p in paths.split(os.pathsep) if p]
+
+    def _current_fingerprint(self) -> Tuple:
+        fingerprint = []
+        for path in self._watched_files():
+            try:
+                st = os.stat(path)
+                fingerprint.append((path, st.st_mtime_ns, st.st_size))
+            except OSError:
+                fingerprint.append((path, None, None))
+        return tuple(fingerprint)
+
+    def _build(self, fingerprint: Tuple) -> None:
+        from kubernetes import client, config
+
+        configuration = client.Configuration()
+        if self.in_cluster():
+            config.load_incluster_config(client_configuration=configuration)
+        else:
+            # The kubernetes package reads $KUBECONFIG once, at import; a reload must see its current value.
+            config.load_kube_config(config_file=self.config_file or os.environ.get("KUBECONFIG") or None,
+                                    client_configuration=configuration)
+        configuration.connection_pool_maxsize = self.pool_maxsize
+
+        old_client = self._api_client
+        self._api_client = client.ApiClient(configuration)
+        self._apis = {}
+        self._fingerprint = fingerprint
+        self._pid = os.getpid()
+        # Only close the old pool in the process that created it; after a fork it belongs to the parent.
+        if old_client is not None and self._pid == getattr(old_client, "_rgsz_pid", None):
+            old_client.close()
+        self._api_client._rgsz_pid = self._pid
+
+    def api_client(self):
+        """
+        Returns the shared ApiClient, loading or reloading the configuration when needed.
+        """
+        now = time.monotonic()
+        if self._api_client is not None and self._pid == os.getpid() and now < self._next_check:
+            return self._api_client
+
+        with self._lock:
+            fingerprint = self._current_fingerprint()
+            if self._api_client is None or self._pid != os.getpid() or fingerprint != self._fingerprint:
+                self._build(fingerprint)
+            self._next_check = now + self.reload_check_interval
+            return self._api_client
+
+    def _api(self, api_class) -> Any:
+        api_client = self.api_client()
+        api = self._apis.get(api_class)
+        if api is None:
+            api = self._apis[api_class] = api_class(api_client)
+        return api
+
+    def core_v1(self):
+        from kubernetes.client import CoreV1Api
+        return self._api(CoreV1Api)
+
+    def custom_objects(self):
+        from kubernetes.client import CustomObjectsApi
+        return self._api(CustomObjectsApi)
+
+    def reset(self) -> None:
+        """
+        Drops the current client so the next call reloads the configuration.
+        """
+        with self._lock:
+            self._api_client = None
+            self._apis = {}
+            self._fingerprint = None
+
+    def close(self) -> None:
+        with self._lock:
+            if self._api_client is not None and self._pid == os.getpid():
+                self._api_client.close()
+            self._api_client = None
+            self._apis = {}
+            self._fingerprint = None
+
+
+_manager: Optional[KubeClientManager] = None
+_manager_lock = threading.Lock()
+
+
+def get_client_manager() -> KubeClientManager:
+    """
+    Returns the process-wide KubeClientManager, creating it on first use.
+    """
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = KubeClientManager()
+    return _manager
+
+
+def core_v1_api():
+    return get_client_manager().core_v1()
+
+
+def custom_objects_api():
+    return get_client_manager().custom_objects()
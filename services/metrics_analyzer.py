@@ -1,60 +1,38 @@
-from typing import List,Dict,Any
+import os
+from typing import List,Dict,Any,Iterator,Optional,Tuple
+
+from services import cache, fleet_engine, instrumentation, k8s_client, pod_inventory, prometheus_query, quantity
+
+# Largest number of containers analyzed at once when streaming results.
+STREAM_CHUNK_CONTAINERS = int(os.environ.get("STREAM_CHUNK_CONTAINERS", "2000"))
 
 def convert_mem_to_bytes(mem_request: str) -> float:
-    if mem_request.endswith("Ki"):
-        return float(mem_request[:-2]) * 1024
-    elif mem_request.endswith("Mi"):
-        return float(mem_request[:-2]) * 1024 * 1024
-    elif mem_request.endswith("Gi"):
-        return float(mem_request[:-2]) * 1024 * 1024 * 1024
-    elif mem_request.endswith("Ti"):
-        return float(mem_request[:-2]) * 1024 * 1024 * 1024 * 1024
-    elif mem_request.endswith("Pi"):
-        return float(mem_request[:-2]) * 1024 * 1024 * 1024 * 1024 * 1024
-    elif mem_request.endswith("Ei"):
-        return float(mem_request[:-2]) * 1024 * 1024 * 1024 * 1024 * 1024 * 1024
-    elif mem_request.endswith("K"):
-        return float(mem_request[:-1]) * 1000
-    elif mem_request.endswith("M"):
-        return float(mem_request[:-1]) * 1000 * 1000
-    elif mem_request.endswith("G"):
-        return float(mem_request[:-1]) * 1000 * 1000 * 1000
-    elif mem_request.endswith("T"):
-        return float(mem_request[:-1]) * 1000 * 1000 * 1000 * 1000
-    elif mem_request.endswith("P"):
-        return float(mem_request[:-1]) * 1000 * 1000 * 1000 * 1000 * 1000
-    elif mem_request.endswith("E"):
-        return float(mem_request[:-1]) * 1000 * 1000 * 1000 * 1000 * 1000 * 1000
-    else:
-        return float(mem_request)
-    
+    # Any Kubernetes memory quantity ("128Mi", "1G", "1.5Gi", "1e9"), memoized in services.quantity.
+    return quantity.memory_to_bytes(mem_request)
 
-    # Helper functions
-def convert_cpu_to_millicores(cpu_request: str) -> int:
-    if cpu_request.endswith("n"):
-        return int(cpu_request[:-1]) / 1_000_000
-    elif cpu_request.endswith("u"):
-        return int(cpu_request[:-1]) / 1_000
-    elif cpu_request.endswith("m"):
-        return int(cpu_request[:-1])
-    else:
-        return int(cpu_request)
 
+def convert_cpu_to_millicores(cpu_request: str) -> float:
+    # Any Kubernetes CPU quantity ("250m", "0.5", "1.5m", "100u"), memoized in services.quantity.
+    return quantity.cpu_to_millicores(cpu_request)
 
 
+def get_k8s_pod_data(pod_name: str, namespace: str, use_cache: bool = True):
+    """
+    Returns the pod object, served from the pod spec cache when a fresh copy is available.
+    Concurrent callers for the same pod share a single API call; use_cache=False forces a fresh read.
+    """
+    return cache.pod_spec_cache.get_or_load(
+        ("pod", namespace, pod_name), lambda: fetch_k8s_pod_data(pod_name, namespace), bypass=not use_cache)
 
 
-def get_k8s_pod_data(pod_name: str, namespace: str):
+def fetch_k8s_pod_data(pod_name: str, namespace: str):
     
     try:
-        # Assumes kubernetes client is configured (e.g., via config.load_kube_config() in main.py)
-        # Omit import statements as per instructions, assuming 'client' is available in scope
-        # from kubernetes import client
-        from kubernetes import client, config
-        config.load_kube_config()
-        v1 = client.CoreV1Api()
-        namespace = "kube-system"
-        pod = v1.read_namespaced_pod(name=pod_name, namespace=namespace)
+        # The configuration and connection pool are shared process-wide by the client manager.
+        from kubernetes import client
+        v1 = k8s_client.core_v1_api()
+        with instrumentation.upstream("kubernetes", "read_pod"):
+            pod = v1.read_namespaced_pod(name=pod_name, namespace=namespace)
         return pod
     except client.ApiException as e:
         # Handle Kubernetes API specific errors, e.g., 404 Not Found
@@ -67,16 +45,54 @@ def get_k8s_pod_data(pod_name: str, namespace: str):
 
 
 
-def extract_pod_requests(pod_name: str, namespace: str):
+def list_k8s_pods(namespace: Optional[str] = None, label_selector: Optional[str] = None) -> List[Any]:
+    """
+    Lists pods with a single API call, either in one namespace or across all namespaces
+    when namespace is None. Returns the list of V1Pod objects, or [] on error.
+    """
+    try:
+        from kubernetes import client
+        v1 = k8s_client.core_v1_api()
+        kwargs = {"label_selector": label_selector} if label_selector else {}
+        with instrumentation.upstream("kubernetes", "list_pods"):
+            if namespace:
+                pod_list = v1.list_namespaced_pod(namespace=namespace, **kwargs)
+            else:
+                pod_list = v1.list_pod_for_all_namespaces(**kwargs)
+        return pod_list.items
+    except client.ApiException as e:
+        print(f"Kubernetes API error listing pods in namespace '{namespace or '*'}': {e}")
+        return []
+    except Exception as e:
+        print(f"An unexpected error occurred while listing pods in namespace '{namespace or '*'}': {e}")
+        return []
+
+
+def extract_pod_requests(pod_name: str, namespace: str, use_cache: bool = True):
     
-    pod = get_k8s_pod_data(pod_name, namespace)
-    # total_cpu_request and total_mem_request were initialized but not used, so they are removed.
-    container_list = [] 
+    # With the watch-based inventory running, requests are already parsed in memory.
+    inventory = pod_inventory.get_inventory()
+    if inventory is not None and inventory.covers(namespace):
+        record = inventory.get(namespace, pod_name)
+        return record.requests() if record else []
+
+    pod = get_k8s_pod_data(pod_name, namespace, use_cache=use_cache)
     
     # Handle cases where pod data could not be fetched (e.g., pod not found)
     if not pod:
         return []
 
+    return extract_requests_from_pod(pod)
+
+
+def extract_requests_from_pod(pod) -> List[Dict[str, Any]]:
+    """
+    Extracts the CPU and memory requests of every container in an already fetched pod object.
+    Shared by the single pod path and the namespace/cluster batch paths.
+    """
+    # total_cpu_request and total_mem_request were initialized but not used, so they are removed.
+    container_list = [] 
+
     for container in pod.spec.containers:
         resources = container.resources
         cpu_val = 0.0
@@ -112,116 +128,79 @@ def extract_pod_requests(pod_name: str, namespace: str):
     return container_list
 
 
-from typing import List, Dict, Any
-# Omit import statements for prometheus_api_client as per instructions.
-# In a real scenario, you would need to install and import:
-# from prometheus_api_client import PrometheusConnect, PrometheusApiClientException
+def extract_pod_utilization_from_prometheus(pod_name: str, namespace: str, use_cache: bool = True) -> List[Dict[str, Any]]:
+    """
+    Cached front of fetch_pod_utilization_from_prometheus; use_cache=False forces a fresh query.
+    """
+    return cache.usage_cache.get_or_load(
+        ("pod_usage", namespace, pod_name),
+        lambda: fetch_pod_utilization_from_prometheus(pod_name, namespace), bypass=not use_cache)
+
 
-def extract_pod_utilization_from_prometheus(pod_name: str, namespace: str) -> List[Dict[str, Any]]:
+def fetch_pod_utilization_from_prometheus(pod_name: str, namespace: str) -> List[Dict[str, Any]]:
     """
-    Extracts CPU and memory utilization for each container in a given pod from an internal Prometheus instance.
+    Extracts CPU and memory utilization for each container in a given pod from Prometheus, with one query.
     Returns a list of dictionaries, each containing container name, its CPU utilization in millicores,
     and its memory utilization in bytes.
     """
-
-    from prometheus_api_client import PrometheusConnect
-    # Placeholder for Prometheus connection details. In a real application, this would be configurable
-    # via environment variables or a configuration file.
-    # This assumes Prometheus is accessible within the cluster via its service name.
-    # Example for kube-prometheus-stack: "http://prometheus-kube-prometheus-oper-prometheus.monitoring.svc.cluster.local:9090"
-    # For local testing, you might port-forward Prometheus and use "http://localhost:9090".
-    prometheus_url = "http://localhost:9090"
-
     try:
-    
-        # Initialize Prometheus client.
-        # To use PrometheusConnect, you need to install the 'prometheus_api_client' library (e.g., `pip install prometheus_api_client`).
-        # The required import statement would be:
-        # from prometheus_api_client import PrometheusConnect
-        # However, as per instructions, this import statement is intentionally omitted from the code.
-        pc = PrometheusConnect(url=prometheus_url, disable_ssl=True)
-        # Note: disable_ssl=True might be necessary for internal cluster communication
-        # if Prometheus uses self-signed certificates or if you don't have proper CA configured.
-
-        container_metrics = {} # To store aggregated metrics per container
-
-        # --- Fetch CPU Utilization ---
-        # Query for CPU usage rate in cores (averaged over the last 5 minutes).
-        # 'container!=""' filters out pod-level metrics which often have an empty container label.
-        cpu_query = f'rate(container_cpu_usage_seconds_total{{pod="{pod_name}"}}[5m])'
-        
-        # Execute query against Prometheus.
-        cpu_data = pc.custom_query(query=cpu_query)
-        
-        # Mocking cpu_data for demonstration without an actual Prometheus connection.
-        # In a real scenario, this would be the result from pc.custom_query(query=cpu_query).
-        # Example structure: [{'metric': {'container': 'my-app-container'}, 'value': [timestamp, '0.0123']}]
-        # This mock data assumes a pod named "example-pod" has two containers.
-        cpu_data = []
-        if pod_name == "example-pod" and namespace == "default": # Example condition for mock data
-            cpu_data = [
-                {'metric': {'container': 'app-container'}, 'value': [0, '0.0123']},
-                {'metric': {'container': 'init-container'}, 'value': [0, '0.005']}
-            ]
-
-        for item in cpu_data:
-            container_name = item['metric'].get('container')
-            if container_name:
-                # Value is [timestamp, value_string]. Convert value_string to float.
-                cpu_cores = float(item['value'][1])
-                cpu_millicores = cpu_cores * 1000 # Convert cores to millicores
-                if container_name not in container_metrics:
-                    container_metrics[container_name] = {"name": container_name}
-                container_metrics[container_name]["cpu_utilization_millicores"] = cpu_millicores
-
-        # --- Fetch Memory Utilization ---
-        # Query for memory working set in bytes.
-        mem_query = f'sum(container_memory_working_set_bytes{{pod="{pod_name}", namespace="{namespace}", container!=""}}) by (container)'
-        
-        # Execute query against Prometheus.
-        # mem_data = pc.custom_query(query=mem_query)
-
-        # Mocking mem_data for demonstration.
-        # In a real scenario, this would be the result from pc.custom_query(query=mem_query).
-        # Example structure: [{'metric': {'container': 'my-app-container'}, 'value': [timestamp, '12345678']}]
-        mem_data = []
-        if pod_name == "example-pod" and namespace == "default": # Example condition for mock data
-            mem_data = [
-                {'metric': {'container': 'app-container'}, 'value': [0, '12345678']},
-                {'metric': {'container': 'init-container'}, 'value': [0, '5000000']}
-            ]
-
-        for item in mem_data:
-            container_name = item['metric'].get('container')
-            if container_name:
-                mem_bytes = float(item['value'][1])
-                if container_name not in container_metrics:
-                    container_metrics[container_name] = {"name": container_name}
-                container_metrics[container_name]["memory_utilization_bytes"] = mem_bytes
-
-        # Convert the dictionary of metrics to a list of dictionaries
-        result_list = list(container_metrics.values())
-
-        # Ensure all expected fields are present, even if a metric was not found for a container.
-        # Default to 0.0 if a metric is missing for a container.
-        final_result = []
-        for container_data in result_list:
-            final_result.append({
-                "name": container_data.get("name", "unknown"),
-                "cpu_utilization_millicores": container_data.get("cpu_utilization_millicores", 0.0),
-                "memory_utilization_bytes": container_data.get("memory_utilization_bytes", 0.0)
-            })
-        
-        if not final_result:
+        usage = prometheus_query.fetch_container_usage([namespace], [pod_name]).get(namespace, {})
+        if not usage:
             print(f"No Prometheus metrics found for pod '{pod_name}' in namespace '{namespace}'.")
-
-        return final_result
+        return list(usage.values())
 
     except Exception as e: # Catch broader exceptions for connection or query issues
         print(f"An error occurred while fetching Prometheus metrics for pod '{pod_name}' in namespace '{namespace}': {e}")
         return []
 
 
+def extract_namespace_utilization_from_prometheus(namespace: str, use_cache: bool = True) -> Dict[Tuple[str, str], Dict[str, Any]]:
+    """
+    Cached front of fetch_namespace_utilization_from_prometheus; use_cache=False forces a fresh query.
+    """
+    return extract_namespaces_utilization_from_prometheus([namespace], use_cache=use_cache)[namespace]
+
+
+def extract_namespaces_utilization_from_prometheus(namespaces, use_cache: bool = True) -> Dict[str, Dict[Tuple[str, str], Dict[str, Any]]]:
+    """
+    Utilization of every container of several namespaces, as namespace -> {(pod_name, container_name): usage}.
+    Namespaces with fresh cached usage are served from the usage cache; all the others are fetched
+    together with one query. use_cache=False fetches them all.
+    """
+    loaded = cache.usage_cache.get_many_or_load(
+        [("namespace_usage", namespace) for namespace in namespaces],
+        lambda keys: {("namespace_usage", namespace): usage for namespace, usage
+                      in fetch_namespaces_utilization_from_prometheus([key[1] for key in keys]).items()},
+        bypass=not use_cache)
+    return {key[1]: value or {} for key, value in loaded.items()}
+
+
+def fetch_namespace_utilization_from_prometheus(namespace: str) -> Dict[Tuple[str, str], Dict[str, Any]]:
+    """
+    Extracts CPU and memory utilization for every container in a namespace with one query.
+    Returns a dictionary keyed by (pod_name, container_name), each value holding the container name,
+    its CPU utilization in millicores and its memory utilization in bytes.
+    """
+    return fetch_namespaces_utilization_from_prometheus([namespace]).get(namespace, {})
+
+
+def fetch_namespaces_utilization_from_prometheus(namespaces) -> Dict[str, Dict[Tuple[str, str], Dict[str, Any]]]:
+    """
+    Extracts CPU and memory utilization for every container of several namespaces with a single
+    query, as namespace -> {(pod_name, container_name): usage}. Returns {} on error.
+    """
+    namespaces = list(namespaces)
+    try:
+        usage = prometheus_query.fetch_container_usage(namespaces)
+        for namespace in namespaces:
+            if not usage.get(namespace):
+                print(f"No Prometheus metrics found for namespace '{namespace}'.")
+        return usage
+
+    except Exception as e:
+        print(f"An error occurred while fetching Prometheus metrics for namespaces {', '.join(namespaces)}: {e}")
+        return {}
+
 
 def extract_pod_utilization(pod_name: str, namespace: str) -> List[Dict[str, Any]]:
     """
@@ -230,22 +209,20 @@ def extract_pod_utilization(pod_name: str, namespace: str) -> List[Dict[str, Any
     and its memory utilization in bytes.
     """
     try:
-        # Assumes kubernetes client is configured (e.g., via config.load_kube_config() in main.py or elsewhere)
-        # Omit import statements as per instructions, assuming 'client' and 'config' are available in scope
-        from kubernetes import client, config
-        config.load_kube_config() # Ensure config is loaded
-        from kubernetes.client import CustomObjectsApi
+        # The configuration and connection pool are shared process-wide by the client manager.
+        from kubernetes import client
         
-        metrics_api = CustomObjectsApi()
+        metrics_api = k8s_client.custom_objects_api()
 
         # Fetch pod metrics from metrics.k8s.io API
         # This API provides current resource usage (utilization)
-        pod_metrics_list = metrics_api.list_namespaced_custom_object(
-            group="metrics.k8s.io",
-            version="v1beta1",
-            namespace=namespace,
-            plural="pods"
-        )
+        with instrumentation.upstream("metrics_server", "list_pod_metrics"):
+            pod_metrics_list = metrics_api.list_namespaced_custom_object(
+                group="metrics.k8s.io",
+                version="v1beta1",
+                namespace=namespace,
+                plural="pods"
+            )
         target_pod_metrics = None
         for item in pod_metrics_list.get("items", []):
             if item["metadata"]["name"] == pod_name:
@@ -301,7 +278,62 @@ def extract_pod_utilization(pod_name: str, namespace: str) -> List[Dict[str, Any
         print(f"An unexpected error occurred while fetching resource utilization for pod '{pod_name}': {e}")
         return []
 
-def analyze_pod_resource_usage(pod_name: str, namespace: str) -> List[Dict[str, Any]]:
+def analyze_container_usage(pod_name: str, namespace: str, req_container: Dict[str, Any],
+                            util_container: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Compares one container's requests with its utilization and builds the analysis record
+    returned by analyze_pod_resource_usage and the namespace/cluster batch variants.
+    """
+    container_name = req_container["name"]
+    cpu_request = req_container.get("cpu_request_millicores", 0.0)
+    memory_request = req_container.get("memory_request_bytes", 0)
+
+    cpu_utilization = util_container.get("cpu_utilization_millicores", 0.0) if util_container else 0.0
+    memory_utilization = util_container.get("memory_utilization_bytes", 0) if util_container else 0
+
+    # CPU Analysis
+    cpu_usage_vs_request_ratio = None
+    if cpu_request > 0:
+        cpu_usage_vs_request_ratio = cpu_utilization / cpu_request
+    elif cpu_utilization > 0:
+        # If request is 0 but utilization is greater than 0, it indicates
+        # that resources are being consumed without a defined request.
+        cpu_usage_vs_request_ratio = float('inf') # Represent as infinite ratio
+
+    cpu_over_provisioned = cpu_utilization < cpu_request
+    cpu_under_provisioned = cpu_utilization > cpu_request
+
+    # Memory Analysis
+    memory_usage_vs_request_ratio = None
+    if memory_request > 0:
+        memory_usage_vs_request_ratio = memory_utilization / memory_request
+    elif memory_utilization > 0:
+        # If request is 0 but utilization is greater than 0, it indicates
+        # that resources are being consumed without a defined request.
+        memory_usage_vs_request_ratio = float('inf') # Represent as infinite ratio
+
+    memory_over_provisioned = memory_utilization < memory_request
+    memory_under_provisioned = memory_utilization > memory_request
+
+    return {
+        "pod_name": pod_name,
+        "namespace": namespace,
+        "name": container_name,
+        "cpu_request_millicores": cpu_request,
+        "cpu_utilization_millicores": cpu_utilization,
+        "cpu_usage_vs_request_ratio": cpu_usage_vs_request_ratio,
+        "cpu_over_provisioned": cpu_over_provisioned,
+        "cpu_under_provisioned": cpu_under_provisioned,
+        "memory_request_bytes": memory_request,
+        "memory_utilization_bytes": memory_utilization,
+        "memory_usage_vs_request_ratio": memory_usage_vs_request_ratio,
+        "memory_over_provisioned": memory_over_provisioned,
+        "memory_under_provisioned": memory_under_provisioned,
+    }
+
+
+def analyze_pod_resource_usage(pod_name: str, namespace: str, use_cache: bool = True,
+                               percentile: Optional[str] = None, window: Optional[str] = None) -> List[Dict[str, Any]]:
     """
     Analyzes and compares a pod's requested resources with its actual utilization.
 
@@ -312,6 +344,11 @@ def analyze_pod_resource_usage(pod_name: str, namespace: str) -> List[Dict[str,
     Args:
         pod_name (str): The name of the pod.
         namespace (str): The namespace of the pod.
+        use_cache (bool): Serve the pod spec and utilization from the TTL caches when fresh.
+                          False always queries the upstreams (and refreshes the caches).
+        percentile (Optional[str]): Compare requests with this statistic of the usage history
+                          ("p50", "p95", "p99" or "max") instead of the current usage.
+        window (Optional[str]): History window for percentile, as a Prometheus duration ("7d").
 
     Returns:
         List[Dict[str, Any]]: A list of dictionaries, where each dictionary
@@ -331,72 +368,280 @@ def analyze_pod_resource_usage(pod_name: str, namespace: str) -> List[Dict[str,
     """
     try:
         # Get requested resources for the pod's containers
-        requests_data = extract_pod_requests(pod_name, namespace)
+        with instrumentation.stage("pod_requests"):
+            requests_data = extract_pod_requests(pod_name, namespace, use_cache=use_cache)
         if not requests_data:
             print(f"Warning: Could not retrieve resource requests for pod '{pod_name}' in namespace '{namespace}'.")
             return []
 
         # Get actual CPU and Memory utilization for the pod's containers
-        utilization_data = extract_pod_utilization_from_prometheus(pod_name, namespace)
+        with instrumentation.stage("pod_usage"):
+            if percentile:
+                from services import usage_history
+                utilization_data = [
+                    usage_history.as_utilization(stats, percentile)
+                    for stats in usage_history.extract_pod_usage_percentiles(
+                        pod_name, namespace, window or usage_history.HISTORY_DEFAULT_WINDOW, use_cache=use_cache)
+                ]
+            else:
+                utilization_data = extract_pod_utilization_from_prometheus(pod_name, namespace, use_cache=use_cache)
         if not utilization_data:
             print(f"Warning: Could not retrieve CPU and Memory utilization for pod '{pod_name}' in namespace '{namespace}'.")
             # Proceed, but utilization values will be 0 for all containers in the analysis
 
-        analysis_results = []
         # Create a map for quick lookup of utilization data by container name
-        
         utilization_map = {item["name"]: item for item in utilization_data}
 
-        for req_container in requests_data:
-            container_name = req_container["name"]
-            cpu_request = req_container.get("cpu_request_millicores", 0.0)
-            memory_request = req_container.get("memory_request_bytes", 0)
-
-            util_container = utilization_map.get(container_name)
-            cpu_utilization = util_container.get("cpu_utilization_millicores", 0.0) if util_container else 0.0
-            memory_utilization = util_container.get("memory_utilization_bytes", 0) if util_container else 0
-
-            # CPU Analysis
-            cpu_usage_vs_request_ratio = None
-            if cpu_request > 0:
-                cpu_usage_vs_request_ratio = cpu_utilization / cpu_request
-            elif cpu_utilization > 0:
-                # If request is 0 but utilization is greater than 0, it indicates
-                # that resources are being consumed without a defined request.
-                cpu_usage_vs_request_ratio = float('inf') # Represent as infinite ratio
-
-            cpu_over_provisioned = cpu_utilization < cpu_request
-            cpu_under_provisioned = cpu_utilization > cpu_request
-
-            # Memory Analysis
-            memory_usage_vs_request_ratio = None
-            if memory_request > 0:
-                memory_usage_vs_request_ratio = memory_utilization / memory_request
-            elif memory_utilization > 0:
-                # If request is 0 but utilization is greater than 0, it indicates
-                # that resources are being consumed without a defined request.
-                memory_usage_vs_request_ratio = float('inf') # Represent as infinite ratio
-
-            memory_over_provisioned = memory_utilization < memory_request
-            memory_under_provisioned = memory_utilization > memory_request
-
-            analysis_results.append({
-                "pod_name": pod_name,
-                "namespace": namespace,
-                "name": container_name,
-                "cpu_request_millicores": cpu_request,
-                "cpu_utilization_millicores": cpu_utilization,
-                "cpu_usage_vs_request_ratio": cpu_usage_vs_request_ratio,
-                "cpu_over_provisioned": cpu_over_provisioned,
-                "cpu_under_provisioned": cpu_under_provisioned,
-                "memory_request_bytes": memory_request,
-                "memory_utilization_bytes": memory_utilization,
-                "memory_usage_vs_request_ratio": memory_usage_vs_request_ratio,
-                "memory_over_provisioned": memory_over_provisioned,
-                "memory_under_provisioned": memory_under_provisioned,
-            })
-        return analysis_results
+        with instrumentation.stage("analysis"):
+            records = [
+                analyze_container_usage(pod_name, namespace, req_container, utilization_map.get(req_container["name"]))
+                for req_container in requests_data
+            ]
+        instrumentation.items("containers", len(records))
+        return records
 
     except Exception as e:
         print(f"An unexpected error occurred during pod resource analysis for '{pod_name}' in namespace '{namespace}': {e}")
         return []
+
+
+def list_pod_requests(namespace: Optional[str] = None,
+                      label_selector: Optional[str] = None) -> List[Tuple[str, str, List[Dict[str, Any]]]]:
+    """
+    Returns (namespace, pod_name, container requests) for every pod in scope, or [] on error. Served
+    from the pod inventory when it is running and covers the scope, otherwise from a paged list in
+    raw JSON, without building V1Pod objects.
+    """
+    with instrumentation.stage("pod_requests"):
+        try:
+            records = pod_inventory.pods_in_scope(namespace, label_selector)
+        except Exception as e:
+            print(f"An unexpected error occurred while listing pods in namespace '{namespace or '*'}': {e}")
+            return []
+        return [(r.namespace, r.name, r.requests()) for r in records]
+
+
+def extract_requests_from_pods(pods: List[Any]) -> List[Tuple[str, str, List[Dict[str, Any]]]]:
+    """
+    Batch version of extract_requests_from_pod: every CPU and memory string of the pod list is
+    parsed in one bulk call, each distinct string once.
+    """
+    containers = []
+    for pod in pods:
+        for container in pod.spec.containers:
+            requests = (container.resources.requests if container.resources else None) or {}
+            containers.append((pod.metadata.namespace, pod.metadata.name, container.name,
+                               requests.get("cpu"), requests.get("memory")))
+
+    cpu_values = quantity.cpu_to_millicores_bulk(c[3] for c in containers).tolist()
+    mem_values = quantity.memory_to_bytes_bulk(c[4] for c in containers).tolist()
+
+    pod_requests: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+    for pod in pods:
+        pod_requests[(pod.metadata.namespace, pod.metadata.name)] = []
+    for (namespace, pod_name, name, _, _), cpu_val, mem_val in zip(containers, cpu_values, mem_values):
+        pod_requests[(namespace, pod_name)].append({
+            "name": name,
+            "cpu_request_millicores": cpu_val,
+            "memory_request_bytes": mem_val,
+        })
+    return [(namespace, pod_name, requests_data) for (namespace, pod_name), requests_data in pod_requests.items()]
+
+
+def analyze_pods_resource_usage(pods: List[Any], use_cache: bool = True) -> List[Dict[str, Any]]:
+    """
+    Joins already listed pods with their namespace's utilization in memory.
+
+    Args:
+        pods (List[Any]): V1Pod objects, as returned by list_k8s_pods.
+        use_cache (bool): Serve namespace utilization from the usage cache when fresh.
+
+    Returns:
+        List[Dict[str, Any]]: One record per container, in the same format as analyze_pod_resource_usage.
+    """
+    return analyze_pod_requests_usage(extract_requests_from_pods(pods), use_cache=use_cache)
+
+
+def analyze_pod_requests_usage(pod_requests: List[Tuple[str, str, List[Dict[str, Any]]]],
+                               use_cache: bool = True, percentile: Optional[str] = None,
+                               window: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Joins pod requests with their namespace's utilization in memory.
+
+    Prometheus is queried once for all the namespaces present in the list that are not in the
+    usage cache, so the number of upstream calls does not grow with the number of pods.
+
+    Args:
+        pod_requests (List[Tuple[str, str, List[Dict[str, Any]]]]): (namespace, pod_name, container requests)
+            tuples, as returned by list_pod_requests.
+        use_cache (bool): Serve namespace utilization from the usage cache when fresh.
+        percentile (Optional[str]): Use this statistic of the usage history instead of the current usage.
+        window (Optional[str]): History window for percentile, as a Prometheus duration ("7d").
+
+    Returns:
+        List[Dict[str, Any]]: One record per container, in the same format as analyze_pod_resource_usage.
+    """
+    with instrumentation.stage("namespace_usage"):
+        utilization = namespace_utilization(
+            {namespace for namespace, _, _ in pod_requests}, use_cache=use_cache, percentile=percentile, window=window)
+    with instrumentation.stage("analysis"):
+        records = analyze_requests_with_usage(pod_requests, utilization)
+    instrumentation.items("pods", len(pod_requests))
+    instrumentation.items("containers", len(records))
+    return records
+
+
+def analyze_requests_with_usage(pod_requests: List[Tuple[str, str, List[Dict[str, Any]]]],
+                                utilization: Dict[str, Dict[Tuple[str, str], Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """
+    One analyze_container_usage record per container, in the order of pod_requests.
+
+    Callers that return dicts go through here rather than fleet_engine: building a frame and turning
+    it back into dicts costs more than the vectorized analysis saves (bench_fleet_engine, "end to end").
+    """
+    records = []
+    empty: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    for namespace, pod_name, requests_data in pod_requests:
+        namespace_usage = utilization.get(namespace) or empty
+        for req_container in requests_data:
+            records.append(analyze_container_usage(
+                pod_name, namespace, req_container, namespace_usage.get((pod_name, req_container["name"]))))
+    return records
+
+
+def iter_pod_requests_analysis(pod_requests: List[Tuple[str, str, List[Dict[str, Any]]]],
+                               use_cache: bool = True, percentile: Optional[str] = None, window: Optional[str] = None,
+                               chunk_containers: Optional[int] = None) -> Iterator[fleet_engine.FleetAnalysis]:
+    """
+    Streaming counterpart of analyze_pod_requests_usage: joins and analyzes namespace by namespace and
+    yields one FleetAnalysis per chunk of pods as soon as it is ready, so only one namespace's usage and
+    one chunk are in memory at a time. Chunks start small, for a fast first result, and double up to
+    chunk_containers (STREAM_CHUNK_CONTAINERS by default) containers.
+    """
+    limit = chunk_containers or STREAM_CHUNK_CONTAINERS
+    by_namespace: Dict[str, List[Tuple[str, str, List[Dict[str, Any]]]]] = {}
+    for pod in pod_requests:
+        by_namespace.setdefault(pod[0], []).append(pod)
+
+    size = min(64, limit)
+    for namespace, pods in by_namespace.items():
+        with instrumentation.stage("namespace_usage"):
+            utilization = namespace_utilization([namespace], use_cache=use_cache, percentile=percentile, window=window)
+        instrumentation.items("pods", len(pods))
+        instrumentation.items("containers", sum(len(pod[2]) for pod in pods))
+        chunk, containers = [], 0
+        for pod in pods:
+            chunk.append(pod)
+            containers += len(pod[2])
+            if containers >= size:
+                yield fleet_engine.analyze_frame(fleet_engine.build_frame(chunk, utilization))
+                chunk, containers = [], 0
+                size = min(size * 2, limit)
+        if chunk:
+            yield fleet_engine.analyze_frame(fleet_engine.build_frame(chunk, utilization))
+
+
+def iter_resource_usage(namespace: Optional[str] = None, label_selector: Optional[str] = None, use_cache: bool = True,
+                        percentile: Optional[str] = None, window: Optional[str] = None) -> Iterator[fleet_engine.FleetAnalysis]:
+    """
+    Streams the analysis of a namespace (or of the whole cluster when namespace is None) in chunks,
+    with the same records as analyze_namespace_resource_usage / analyze_cluster_resource_usage.
+    """
+    try:
+        pod_requests = list_pod_requests(namespace=namespace, label_selector=label_selector)
+        if not pod_requests:
+            print(f"Warning: No pods found in namespace '{namespace or '*'}'.")
+            return
+        yield from iter_pod_requests_analysis(pod_requests, use_cache=use_cache, percentile=percentile, window=window)
+
+    except Exception as e:
+        # Records already sent cannot be taken back; the stream just ends early.
+        print(f"An unexpected error occurred while streaming resource analysis for namespace '{namespace or '*'}': {e}")
+
+
+def namespace_utilization(namespaces, use_cache: bool = True, percentile: Optional[str] = None,
+                          window: Optional[str] = None) -> Dict[str, Dict[Tuple[str, str], Dict[str, Any]]]:
+    """
+    Utilization of every container of the given namespaces, as namespace -> {(pod_name, container_name): usage}:
+    the current usage, or a statistic of the usage history when percentile is given.
+    """
+    if percentile:
+        from services import usage_history
+        window = window or usage_history.HISTORY_DEFAULT_WINDOW
+        return {
+            namespace: {
+                key: usage_history.as_utilization(stats, percentile)
+                for key, stats in usage_history.extract_namespace_usage_percentiles(
+                    namespace, window, use_cache=use_cache).items()
+            }
+            for namespace in namespaces
+        }
+    # Every namespace not in the usage cache is fetched with the same query.
+    return extract_namespaces_utilization_from_prometheus(namespaces, use_cache=use_cache)
+
+
+def collect_fleet_frame(namespace: Optional[str] = None, label_selector: Optional[str] = None,
+                        use_cache: bool = True) -> fleet_engine.FleetFrame:
+    """
+    Current requests and usage of every container in a namespace (or the whole cluster when
+    namespace is None) as one FleetFrame, e.g. for the collector to store.
+    """
+    pod_requests = list_pod_requests(namespace=namespace, label_selector=label_selector)
+    utilization = namespace_utilization({ns for ns, _, _ in pod_requests}, use_cache=use_cache)
+    return fleet_engine.build_frame(pod_requests, utilization)
+
+
+def analyze_namespace_resource_usage(namespace: str, label_selector: Optional[str] = None,
+                                     use_cache: bool = True, percentile: Optional[str] = None,
+                                     window: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Analyzes every pod in a namespace with one pod list call (none when the pod inventory is
+    running) and one utilization fetch.
+
+    Args:
+        namespace (str): The namespace to analyze.
+        label_selector (Optional[str]): Kubernetes label selector used to narrow the pod list, e.g. "app=web".
+        use_cache (bool): Serve namespace utilization from the usage cache when fresh.
+        percentile (Optional[str]): Use this statistic of the usage history instead of the current usage.
+        window (Optional[str]): History window for percentile, as a Prometheus duration ("7d").
+
+    Returns:
+        List[Dict[str, Any]]: One record per container, in the same format as analyze_pod_resource_usage.
+    """
+    try:
+        pod_requests = list_pod_requests(namespace=namespace, label_selector=label_selector)
+        if not pod_requests:
+            print(f"Warning: No pods found in namespace '{namespace}'.")
+            return []
+        return analyze_pod_requests_usage(pod_requests, use_cache=use_cache, percentile=percentile, window=window)
+
+    except Exception as e:
+        print(f"An unexpected error occurred during resource analysis for namespace '{namespace}': {e}")
+        return []
+
+
+def analyze_cluster_resource_usage(label_selector: Optional[str] = None, use_cache: bool = True,
+                                   percentile: Optional[str] = None, window: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Analyzes every pod in the cluster with one pod list call (none when the pod inventory is
+    running) and one utilization fetch for all its namespaces.
+
+    Args:
+        label_selector (Optional[str]): Kubernetes label selector used to narrow the pod list, e.g. "app=web".
+        use_cache (bool): Serve namespace utilization from the usage cache when fresh.
+        percentile (Optional[str]): Use this statistic of the usage history instead of the current usage.
+        window (Optional[str]): History window for percentile, as a Prometheus duration ("7d").
+
+    Returns:
+        List[Dict[str, Any]]: One record per container, in the same format as analyze_pod_resource_usage.
+    """
+    try:
+        pod_requests = list_pod_requests(namespace=None, label_selector=label_selector)
+        if not pod_requests:
+            print("Warning: No pods found in the cluster.")
+            return []
+        return analyze_pod_requests_usage(pod_requests, use_cache=use_cache, percentile=percentile, window=window)
+
+    except Exception as e:
+        print(f"An unexpected error occurred during cluster resource analysis: {e}")
+        return []
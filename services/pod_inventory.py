@@ -0,0 +1,478 @@
+import json
+import os
+import re
+import sys
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from services import instrumentation, k8s_client
+
+# Opt-in: the informer needs list/watch permission on pods for its whole scope.
+POD_INVENTORY_ENABLED = os.environ.get("POD_INVENTORY_ENABLED", "").lower() in ("1", "true", "yes")
+POD_INVENTORY_PAGE_SIZE = int(os.environ.get("POD_INVENTORY_PAGE_SIZE", "500"))
+POD_INVENTORY_WATCH_TIMEOUT_SECONDS = int(os.environ.get("POD_INVENTORY_WATCH_TIMEOUT_SECONDS", "300"))
+
+HTTP_STATUS_GONE = 410
+
+PodKey = Tuple[str, str]  # (namespace, pod name)
+Workload = Tuple[str, str]  # (kind, name), e.g. ("Deployment", "web")
+
+_TEMPLATE_HASH_LABEL = "pod-template-hash"
+# The intern table is rebuilt from the live pods once it holds this many values more than they use.
+_INTERNED_SLACK = 1024
+
+
+class ResourceVersionExpired(Exception):
+    """
+    The watch's resourceVersion is older than what the API server still keeps (410 Gone).
+    """
+
+
+class PodRecord:
+    """
+    Compact, already parsed view of one pod.
+
+    containers is a tuple of (name, cpu_request_millicores, memory_request_bytes) tuples and labels a
+    sorted tuple of (key, value) pairs. Both are interned per inventory, so replicas of the same
+    workload share one object instead of holding a copy each. workload is the (kind, name) of the
+    controller that owns the pod, see workload_of. phase is status.phase, None when unknown.
+    """
+    __slots__ = ("namespace", "name", "node_name", "labels", "containers", "workload", "phase")
+
+    def __init__(self, namespace: str, name: str, node_name: Optional[str],
+                 labels: Tuple[Tuple[str, str], ...], containers: Tuple[Tuple[str, float, float], ...],
+                 workload: Optional[Workload] = None, phase: Optional[str] = None):
+        self.namespace = namespace
+        self.name = name
+        self.node_name = node_name
+        self.labels = labels
+        self.containers = containers
+        self.workload = workload or ("Pod", name)
+        self.phase = phase
+
+    @property
+    def active(self) -> bool:
+        """
+        Whether the pod holds its requests on a node: Pending or Running (or of an unknown phase).
+        """
+        return self.phase in (None, "Pending", "Running")
+
+    @property
+    def key(self) -> PodKey:
+        return (self.namespace, self.name)
+
+    def requests(self) -> List[Dict[str, Any]]:
+        """
+        Container requests in the format returned by metrics_analyzer.extract_pod_requests.
+        """
+        return [
+            {"name": name, "cpu_request_millicores": cpu, "memory_request_bytes": mem}
+            for name, cpu, mem in self.containers
+        ]
+
+
+def workload_of(metadata: Dict[str, Any]) -> Workload:
+    """
+    The (kind, name) of the workload a pod belongs to, from its controller ownerReference.
+
+    A ReplicaSet created by a Deployment is named "<deployment>-<pod-template-hash>", so the Deployment
+    is found from the pod's own labels without reading the ReplicaSet. Pods without a controller are
+    their own workload, ("Pod", name).
+    """
+    owners = metadata.get("ownerReferences") or []
+    owner = next((o for o in owners if o.get("controller")), owners[0] if owners else None)
+    if owner is None:
+        return ("Pod", metadata.get("name", ""))
+    kind, name = owner.get("kind", ""), owner.get("name", "")
+    template_hash = (metadata.get("labels") or {}).get(_TEMPLATE_HASH_LABEL)
+    if kind == "ReplicaSet" and template_hash and name.endswith("-" + template_hash):
+        return ("Deployment", name[:-len(template_hash) - 1])
+    return (kind, name)
+
+
+_SELECTOR_TERM_SPLIT = re.compile(r",(?![^()]*\))")
+_SELECTOR_SET_TERM = re.compile(r"^\s*([^\s!=]+)\s+(in|notin)\s+\((.*)\)\s*$")
+
+
+def parse_label_selector(selector: str) -> List[Tuple[str, str, Any]]:
+    """
+    Parses a Kubernetes label selector into (op, key, value) terms. op is one of
+    "=", "!=", "in", "notin", "exists" and "!exists".
+    """
+    terms = []
+    for raw in _SELECTOR_TERM_SPLIT.split(selector or ""):
+        term = raw.strip()
+        if not term:
+            continue
+        match = _SELECTOR_SET_TERM.match(term)
+        if match:
+            key, op, values = match.groups()
+            terms.append((op, key, frozenset(v.strip() for v in values.split(",") if v.strip())))
+        elif "!=" in term:
+            key, value = term.split("!=", 1)
+            terms.append(("!=", key.strip(), value.strip()))
+        elif "=" in term:
+            key, value = term.replace("==", "=", 1).split("=", 1)
+            terms.append(("=", key.strip(), value.strip()))
+        elif term.startswith("!"):
+            terms.append(("!exists", term[1:].strip(), None))
+        else:
+            terms.append(("exists", term, None))
+    return terms
+
+
+def _matches(labels: Dict[str, str], terms: List[Tuple[str, str, Any]]) -> bool:
+    for op, key, value in terms:
+        present = key in labels
+        if op == "=" and labels.get(key) != value:
+            return False
+        if op == "!=" and present and labels[key] == value:
+            return False
+        if op == "in" and labels.get(key) not in value:
+            return False
+        if op == "notin" and present and labels[key] in value:
+            return False
+        if op == "exists" and not present:
+            return False
+        if op == "!exists" and present:
+            return False
+    return True
+
+
+class PodInventory:
+    """
+    In-memory pod index kept current by a list + watch loop (a minimal informer).
+
+    The first sync lists pods page by page; afterwards a watch streams changes from the last seen
+    resourceVersion, resuming from it whenever the server closes the stream. A 410 Gone means that
+    version has been compacted away, and the inventory relists. Both use raw JSON, so no V1Pod
+    objects are built. Lookups never touch the network.
+
+    list_func and watch_func default to the shared Kubernetes client and exist so tests can feed
+    a fake API:
+        list_func(limit, continue_token) -> PodList as a dict
+        watch_func(resource_version, timeout_seconds) -> iterable of watch events as dicts
+    """
+
+    def __init__(self, namespace: Optional[str] = None, label_selector: Optional[str] = None,
+                 page_size: int = POD_INVENTORY_PAGE_SIZE,
+                 watch_timeout_seconds: int = POD_INVENTORY_WATCH_TIMEOUT_SECONDS,
+                 list_func: Optional[Callable[[int, Optional[str]], Dict[str, Any]]] = None,
+                 watch_func: Optional[Callable[[str, int], Iterable[Dict[str, Any]]]] = None):
+        self.namespace = namespace
+        self.label_selector = label_selector
+        self.page_size = page_size
+        self.watch_timeout_seconds = watch_timeout_seconds
+        self._list_func = list_func or self._api_list
+        self._watch_func = watch_func or self._api_watch
+        self._lock = threading.Lock()
+        self._pods: Dict[PodKey, PodRecord] = {}
+        self._by_namespace: Dict[str, Set[PodKey]] = {}
+        self._by_node: Dict[str, Set[PodKey]] = {}
+        self._by_label: Dict[Tuple[str, str], Set[PodKey]] = {}
+        self._interned: Dict[Any, Any] = {}
+        self._interned_live = 0  # Size of the intern table when last built from the live pods.
+        self.resource_version: Optional[str] = None
+        self.synced = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.relists = 0
+        self.events = 0
+
+    # --- Kubernetes API access ---------------------------------------------------------------
+
+    def _list_kwargs(self) -> Dict[str, Any]:
+        return {"label_selector": self.label_selector} if self.label_selector else {}
+
+    def _list_call(self, **kwargs):
+        v1 = k8s_client.core_v1_api()
+        kwargs.update(self._list_kwargs())
+        if self.namespace:
+            return v1.list_namespaced_pod(self.namespace, _preload_content=False, **kwargs)
+        return v1.list_pod_for_all_namespaces(_preload_content=False, **kwargs)
+
+    def _api_list(self, limit: int, continue_token: Optional[str]) -> Dict[str, Any]:
+        kwargs = {"limit": limit}
+        if continue_token:
+            kwargs["_continue"] = continue_token
+        with instrumentation.upstream("kubernetes", "list_pods_page"):
+            return json.loads(self._list_call(**kwargs).data)
+
+    def _api_watch(self, resource_version: str, timeout_seconds: int) -> Iterable[Dict[str, Any]]:
+        from kubernetes.watch.watch import iter_resp_lines
+        with instrumentation.upstream("kubernetes", "watch_pods"):
+            response = self._list_call(watch=True, resource_version=resource_version,
+                                       allow_watch_bookmarks=True, timeout_seconds=timeout_seconds,
+                                       _request_timeout=timeout_seconds + 30)
+        try:
+            for line in iter_resp_lines(response):
+                if line and not line.isspace():
+                    yield json.loads(line)
+        finally:
+            response.close()
+            response.release_conn()
+
+    # --- Index maintenance -------------------------------------------------------------------
+
+    def _record_from_pod(self, pod: Dict[str, Any], interned: Dict[Any, Any]) -> PodRecord:
+        from services import metrics_analyzer
+
+        metadata = pod.get("metadata") or {}
+        spec = pod.get("spec") or {}
+        containers = []
+        for container in spec.get("containers") or []:
+            requests = (container.get("resources") or {}).get("requests") or {}
+            cpu_val = 0.0
+            mem_val = 0.0
+            if requests.get("cpu"):
+                try:
+                    cpu_val = metrics_analyzer.convert_cpu_to_millicores(requests["cpu"])
+                except Exception:
+                    cpu_val = 0.0
+            if requests.get("memory"):
+                try:
+                    mem_val = metrics_analyzer.convert_mem_to_bytes(requests["memory"])
+                except Exception:
+                    mem_val = 0.0
+            containers.append((sys.intern(container.get("name", "")), cpu_val, mem_val))
+        labels = tuple(sorted(
+            (sys.intern(k), sys.intern(v)) for k, v in (metadata.get("labels") or {}).items()
+        ))
+        node_name = spec.get("nodeName")
+        containers = tuple(containers)
+        phase = (pod.get("status") or {}).get("phase")
+        kind, workload_name = workload_of(metadata)
+        workload = (sys.intern(kind), sys.intern(workload_name)) if kind != "Pod" else None
+        return PodRecord(
+            namespace=sys.intern(metadata.get("namespace", self.namespace or "")),
+            name=metadata.get("name", ""),
+            node_name=sys.intern(node_name) if node_name else None,
+            labels=interned.setdefault(labels, labels),
+            containers=interned.setdefault(containers, containers),
+            workload=interned.setdefault(workload, workload) if workload else None,
+            phase=sys.intern(phase) if phase else None,
+        )
+
+    @staticmethod
+    def _index_add(index: Dict[Any, Set[PodKey]], value, key: PodKey) -> None:
+        if value is not None:
+            index.setdefault(value, set()).add(key)
+
+    @staticmethod
+    def _index_discard(index: Dict[Any, Set[PodKey]], value, key: PodKey) -> None:
+        keys = index.get(value)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del index[value]
+
+    @classmethod
+    def _add_to(cls, indexes, record: PodRecord) -> None:
+        pods, by_namespace, by_node, by_label = indexes
+        key = record.key
+        pods[key] = record
+        cls._index_add(by_namespace, record.namespace, key)
+        cls._index_add(by_node, record.node_name, key)
+        for label in record.labels:
+            cls._index_add(by_label, label, key)
+
+    def _add(self, record: PodRecord) -> None:
+        self._add_to((self._pods, self._by_namespace, self._by_node, self._by_label), record)
+
+    def _remove(self, key: PodKey) -> None:
+        record = self._pods.pop(key, None)
+        if record is None:
+            return
+        self._index_discard(self._by_namespace, record.namespace, key)
+        self._index_discard(self._by_node, record.node_name, key)
+        for label in record.labels:
+            self._index_discard(self._by_label, label, key)
+
+    def apply_event(self, event: Dict[str, Any]) -> None:
+        """
+        Applies one watch event to the index and advances the resourceVersion.
+        """
+        event_type = event.get("type")
+        obj = event.get("object") or {}
+        if event_type == "ERROR":
+            code = obj.get("code")
+            if code == HTTP_STATUS_GONE:
+                raise ResourceVersionExpired(obj.get("message", ""))
+            raise RuntimeError(f"Watch error {code}: {obj.get('reason')}: {obj.get('message')}")
+
+        resource_version = (obj.get("metadata") or {}).get("resourceVersion")
+        if event_type in ("ADDED", "MODIFIED"):
+            record = self._record_from_pod(obj, self._interned)
+            with self._lock:
+                self._remove(record.key)
+                self._add(record)
+        elif event_type == "DELETED":
+            metadata = obj.get("metadata") or {}
+            with self._lock:
+                self._remove((metadata.get("namespace", self.namespace or ""), metadata.get("name", "")))
+        # Values of deleted or changed pods stay interned until the table is rebuilt.
+        if len(self._interned) > 2 * self._interned_live + _INTERNED_SLACK:
+            with self._lock:
+                self._rebuild_interned()
+        if resource_version:
+            self.resource_version = resource_version
+        self.events += 1
+        instrumentation.items("inventory_events", 1)
+
+    def _rebuild_interned(self) -> None:
+        """
+        Replaces the intern table with the values live pods use. Must hold self._lock.
+        """
+        interned: Dict[Any, Any] = {}
+        for record in self._pods.values():
+            interned[record.labels] = record.labels
+            interned[record.containers] = record.containers
+            if record.workload[0] != "Pod":
+                interned[record.workload] = record.workload
+        self._interned = interned
+        self._interned_live = len(interned)
+
+    def relist(self) -> None:
+        """
+        Lists every pod in scope and atomically replaces the index with the result.
+        """
+        with instrumentation.stage("inventory_relist"):
+            self._relist()
+
+    def _relist(self) -> None:
+        # Readers keep using the current index until the new one is complete.
+        indexes = ({}, {}, {}, {})
+        interned: Dict[Any, Any] = {}
+        continue_token = None
+        resource_version = None
+        while True:
+            page = self._list_func(self.page_size, continue_token)
+            for pod in page.get("items") or []:
+                self._add_to(indexes, self._record_from_pod(pod, interned))
+            list_metadata = page.get("metadata") or {}
+            resource_version = list_metadata.get("resourceVersion") or resource_version
+            continue_token = list_metadata.get("continue")
+            if not continue_token:
+                break
+
+        with self._lock:
+            self._pods, self._by_namespace, self._by_node, self._by_label = indexes
+            self._interned, self._interned_live = interned, len(interned)
+        self.resource_version = resource_version
+        self.relists += 1
+        self.synced.set()
+        instrumentation.items("inventory_pods", len(indexes[0]))
+
+    def watch_once(self) -> None:
+        """
+        Follows one watch stream from the current resourceVersion until the server closes it.
+        """
+        for event in self._watch_func(self.resource_version, self.watch_timeout_seconds):
+            if self._stop.is_set():
+                return
+            self.apply_event(event)
+
+    def run(self) -> None:
+        backoff = 1.0
+        while not self._stop.is_set():
+            try:
+                if self.resource_version is None:
+                    self.relist()
+                self.watch_once()
+                backoff = 1.0
+            except ResourceVersionExpired:
+                print("Pod inventory watch expired (410 Gone); relisting.")
+                self.resource_version = None
+            except Exception as e:
+                # Keep the resourceVersion: the next watch resumes from it if it is still valid.
+                print(f"Pod inventory watch failed, retrying in {backoff:.0f}s: {e}")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 60.0)
+
+    def start(self) -> "PodInventory":
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run, name="pod-inventory", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    # --- Lookups -----------------------------------------------------------------------------
+
+    def covers(self, namespace: Optional[str], label_selector: Optional[str] = None) -> bool:
+        """
+        True if the inventory is synced and its scope includes every pod of the given query.
+        """
+        if not self.synced.is_set():
+            return False
+        if self.namespace is not None and namespace != self.namespace:
+            return False
+        return self.label_selector is None or self.label_selector == label_selector
+
+    def get(self, namespace: str, pod_name: str) -> Optional[PodRecord]:
+        return self._pods.get((namespace, pod_name))
+
+    def __len__(self) -> int:
+        return len(self._pods)
+
+    def pods_on_node(self, node_name: str) -> List[PodRecord]:
+        with self._lock:
+            return [self._pods[key] for key in self._by_node.get(node_name, ())]
+
+    def select(self, namespace: Optional[str] = None, label_selector: Optional[str] = None) -> List[PodRecord]:
+        """
+        Pods in a namespace (or all namespaces) matching a label selector, served from the indexes.
+        """
+        terms = parse_label_selector(label_selector) if label_selector else []
+        with self._lock:
+            candidate_sets = [self._by_label.get((key, value), set()) for op, key, value in terms if op == "="]
+            if namespace is not None:
+                candidate_sets.append(self._by_namespace.get(namespace, set()))
+            if candidate_sets:
+                smallest = min(candidate_sets, key=len)
+                keys = smallest.intersection(*(s for s in candidate_sets if s is not smallest))
+            else:
+                keys = self._pods.keys()
+            records = [self._pods[key] for key in keys]
+        if terms:
+            records = [r for r in records if _matches(dict(r.labels), terms)]
+        return records
+
+
+_inventory: Optional[PodInventory] = None
+
+
+def get_inventory() -> Optional[PodInventory]:
+    """
+    Returns the running process-wide inventory, or None when it is not enabled.
+    """
+    return _inventory
+
+
+def pods_in_scope(namespace: Optional[str] = None, label_selector: Optional[str] = None) -> List[PodRecord]:
+    """
+    Parsed pods of a namespace (or the whole cluster): from the running inventory when it covers the
+    scope, otherwise from a one-off paged list in raw JSON, which for a large cluster is several times
+    faster and smaller than building V1Pod objects.
+    """
+    inventory = get_inventory()
+    if inventory is None or not inventory.covers(namespace, label_selector):
+        inventory = PodInventory(namespace=namespace, label_selector=label_selector)
+        inventory.relist()
+    return inventory.select(namespace, label_selector)
+
+
+def start_inventory(namespace: Optional[str] = None, label_selector: Optional[str] = None) -> PodInventory:
+    global _inventory
+    if _inventory is None:
+        _inventory = PodInventory(namespace=namespace, label_selector=label_selector)
+    return _inventory.start()
+
+
+def stop_inventory() -> None:
+    global _inventory
+    if _inventory is not None:
+        _inventory.stop()
+        _inventory = None
@@ -0,0 +1,242 @@
+import codecs
+import json
+import os
+import re
+import threading
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from services import instrumentation
+
+if TYPE_CHECKING:
+    # Imported on first use (or by the startup warm-up), not when the app is imported.
+    import requests
+
+try:
+    import orjson
+except ImportError:  # Optional; decodes large query results several times faster than json.
+    orjson = None
+
+PROMETHEUS_URL = os.environ.get("PROMETHEUS_URL", "http://localhost:9090")
+PROMETHEUS_TIMEOUT_SECONDS = float(os.environ.get("PROMETHEUS_TIMEOUT_SECONDS", "10"))
+PROMETHEUS_POOL_MAXSIZE = int(os.environ.get("PROMETHEUS_POOL_MAXSIZE", "16"))
+# Most series one query may return; more almost always means a selector gone wrong. 0 disables it.
+PROMETHEUS_SERIES_LIMIT = int(os.environ.get("PROMETHEUS_SERIES_LIMIT", "200000"))
+# rate() window for the current CPU usage.
+USAGE_RATE_WINDOW = os.environ.get("USAGE_RATE_WINDOW", "5m")
+STREAM_CHUNK_BYTES = 64 * 1024
+
+_RESULT_ARRAY = re.compile(r'"result"\s*:\s*\[')
+_SKIP = re.compile(r"[\s,]*")
+
+# Container-level cAdvisor series only: container="" is the pod cgroup and "POD" the pause container.
+_CONTAINER_FILTER = 'container!="", container!="POD"'
+
+
+class PrometheusQueryError(Exception):
+    """
+    Prometheus answered, but with an error (bad query, timeout, too many points).
+    """
+
+
+_session: Optional["requests.Session"] = None
+_session_pid: Optional[int] = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> "requests.Session":
+    """
+    Keep-alive HTTP session shared by every Prometheus query of the process, with a connection pool
+    of PROMETHEUS_POOL_MAXSIZE. Rebuilt after a fork, so worker processes never share sockets.
+    """
+    global _session, _session_pid
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=PROMETHEUS_POOL_MAXSIZE)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            # Series labels repeat endlessly; gzip cuts the transfer of a large vector by ~20x.
+            session.headers["Accept-Encoding"] = "gzip"
+            _session, _session_pid = session, os.getpid()
+        return _session
+
+
+def label_value(value: str) -> str:
+    """
+    Escapes a value for use inside a double-quoted PromQL label matcher.
+    """
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+
+def matcher(label: str, values: Iterable[str]) -> str:
+    """
+    label="value" for one value, label=~"a|b|c" (an anchored RE2 alternation) for several.
+    """
+    values = sorted(set(values))
+    if len(values) == 1:
+        return f'{label}="{label_value(values[0])}"'
+    return f'{label}=~"{label_value("|".join(re.escape(v) for v in values))}"'
+
+
+def loads(body: bytes) -> Any:
+    return orjson.loads(body) if orjson is not None else json.loads(body)
+
+
+def _check(response: "requests.Response") -> None:
+    # Bad queries come back as 400/422 with a JSON error body, which is reported as PrometheusQueryError.
+    if response.status_code >= 400 and "json" not in response.headers.get("Content-Type", ""):
+        response.raise_for_status()
+
+
+def truncate_result(result: List[Dict[str, Any]], limit: int, expression: str) -> List[Dict[str, Any]]:
+    if limit and len(result) > limit:
+        print(f"Prometheus returned {len(result)} series, more than the limit of {limit}; "
+              f"the rest is dropped. Query: {expression[:200]}")
+        return result[:limit]
+    return result
+
+
+def query(expression: str, limit: Optional[int] = None, timeout: Optional[float] = None) -> List[Dict[str, Any]]:
+    """
+    Runs an instant query and returns its result vector, at most limit series (PROMETHEUS_SERIES_LIMIT
+    by default). The query is sent as a POST form, so long regex matchers never hit URL length limits.
+    Raises PrometheusQueryError if Prometheus reports an error and requests exceptions on transport errors.
+    """
+    limit = PROMETHEUS_SERIES_LIMIT if limit is None else limit
+    data = {"query": expression}
+    if limit:
+        # Prometheus 3 stops at the limit itself; older servers ignore the parameter.
+        data["limit"] = limit
+    with instrumentation.upstream("prometheus", "query"):
+        response = get_session().post(f"{PROMETHEUS_URL.rstrip('/')}/api/v1/query", data=data,
+                                      timeout=timeout or PROMETHEUS_TIMEOUT_SECONDS)
+        _check(response)
+        body = loads(response.content)
+    if body.get("status") == "error":
+        raise PrometheusQueryError(f"{body.get('errorType')}: {body.get('error')}")
+    return truncate_result(body["data"]["result"], limit, expression)
+
+
+def iter_prometheus_result(chunks: Iterable[bytes]) -> Iterator[Dict[str, Any]]:
+    """
+    Yields the items of data.result from a Prometheus API response one at a time while it is
+    still being received, so only one series is ever decoded and held in memory at once.
+
+    Raises PrometheusQueryError for an error response and ValueError for a truncated one.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    chunks = iter(chunks)
+    buffer = ""
+    exhausted = False
+
+    def fill() -> bool:
+        nonlocal buffer, exhausted
+        for chunk in chunks:
+            if chunk:
+                buffer += utf8.decode(chunk)
+                return True
+        buffer += utf8.decode(b"", final=True)
+        exhausted = True
+        return False
+
+    # Everything before the result array ("status", "resultType") is small; read up to it.
+    match = _RESULT_ARRAY.search(buffer)
+    while match is None and fill():
+        match = _RESULT_ARRAY.search(buffer)
+    if match is None:
+        body = json.loads(buffer) if buffer.strip() else {}
+        if body.get("status") == "error":
+            raise PrometheusQueryError(f"{body.get('errorType')}: {body.get('error')}")
+        return
+
+    buffer = buffer[match.end():]
+    while True:
+        position = _SKIP.match(buffer).end()
+        if position == len(buffer):
+            if not fill():
+                raise ValueError("Prometheus response ended inside the result array")
+            continue
+        if buffer[position] == "]":
+            return
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            # The item is not complete yet.
+            if not fill():
+                raise ValueError("Prometheus response ended inside a result item")
+            continue
+        buffer = buffer[end:]
+        yield item
+
+
+def stream_query(path: str, params: Dict[str, Any], timeout: Optional[float] = None,
+                 limit: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Runs a Prometheus API query (path is "/api/v1/query" or "/api/v1/query_range") and yields its
+    result items as they are decoded from the response stream, at most limit of them
+    (PROMETHEUS_SERIES_LIMIT by default). For results too large to decode in one piece.
+    """
+    limit = PROMETHEUS_SERIES_LIMIT if limit is None else limit
+    if limit:
+        params = dict(params, limit=limit)
+    url = f"{PROMETHEUS_URL.rstrip('/')}{path}"
+    # Timed until the last result item is decoded, since the body is read as it is consumed.
+    with instrumentation.upstream("prometheus", path.rsplit("/", 1)[-1]), \
+            get_session().get(url, params=params, stream=True, timeout=timeout or PROMETHEUS_TIMEOUT_SECONDS) as response:
+        _check(response)
+        for count, item in enumerate(iter_prometheus_result(response.iter_content(chunk_size=STREAM_CHUNK_BYTES)), 1):
+            if limit and count > limit:
+                print(f"Prometheus returned more than {limit} series; the rest is dropped. Query: {params.get('query', '')[:200]}")
+                return
+            yield item
+
+
+def usage_query(namespaces: Sequence[str], pods: Optional[Sequence[str]] = None,
+                rate_window: str = USAGE_RATE_WINDOW) -> str:
+    """
+    One query for the current CPU (cores) and memory (bytes) usage of every container of the given
+    namespaces, optionally narrowed to some pods. Each series carries namespace, pod and container
+    labels, and a "resource" label of "cpu" or "memory".
+    """
+    selector = f"{matcher('namespace', namespaces)}, {_CONTAINER_FILTER}"
+    if pods:
+        selector += f", {matcher('pod', pods)}"
+    cpu = f"sum by (namespace, pod, container) (rate(container_cpu_usage_seconds_total{{{selector}}}[{rate_window}]))"
+    memory = f"sum by (namespace, pod, container) (container_memory_working_set_bytes{{{selector}}})"
+    return (f'label_replace({cpu}, "resource", "cpu", "", "") or '
+            f'label_replace({memory}, "resource", "memory", "", "")')
+
+
+def parse_usage(result: Iterable[Dict[str, Any]]) -> Dict[str, Dict[Tuple[str, str], Dict[str, Any]]]:
+    """
+    Turns the result of usage_query into namespace -> {(pod_name, container_name): usage}, usage holding
+    the container name, its CPU utilization in millicores and its memory utilization in bytes.
+    """
+    usage: Dict[str, Dict[Tuple[str, str], Dict[str, Any]]] = {}
+    for item in result:
+        labels = item["metric"]
+        namespace, pod, container = labels.get("namespace"), labels.get("pod"), labels.get("container")
+        if not namespace or not pod or not container:
+            continue
+        entry = usage.setdefault(namespace, {}).setdefault(
+            (pod, container), {"name": container, "cpu_utilization_millicores": 0.0, "memory_utilization_bytes": 0.0})
+        if labels.get("resource") == "cpu":
+            entry["cpu_utilization_millicores"] = float(item["value"][1]) * 1000  # cores -> millicores
+        else:
+            entry["memory_utilization_bytes"] = float(item["value"][1])
+    return usage
+
+
+def fetch_container_usage(namespaces: Sequence[str], pods: Optional[Sequence[str]] = None,
+                          limit: Optional[int] = None) -> Dict[str, Dict[Tuple[str, str], Dict[str, Any]]]:
+    """
+    Current usage of every container of the given namespaces (and pods), with a single query.
+    Returns namespace -> {(pod_name, container_name): usage}; raises on errors.
+    """
+    if not namespaces:
+        return {}
+    return parse_usage(query(usage_query(namespaces, pods), limit=limit))
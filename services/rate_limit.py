@@ -0,0 +1,126 @@
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Callable, Optional
+
+if TYPE_CHECKING:
+    import redis
+
+# Requests per second all worker processes together may send to an upstream; 0 disables the limit.
+K8S_RATE_LIMIT_PER_SECOND = float(os.environ.get("K8S_RATE_LIMIT_PER_SECOND", "20"))
+PROMETHEUS_RATE_LIMIT_PER_SECOND = float(os.environ.get("PROMETHEUS_RATE_LIMIT_PER_SECOND", "10"))
+# The limits are counted there, in the scheduler's Redis by default. Off, or while Redis is
+# unreachable, each process applies the whole limit on its own.
+RATE_LIMIT_SHARED = os.environ.get("RATE_LIMIT_SHARED", "true").lower() in ("1", "true", "yes")
+RATE_LIMIT_REDIS_URL = os.environ.get("RATE_LIMIT_REDIS_URL", os.environ.get(
+    "SCHEDULER_REDIS_URL", os.environ.get("CELERY_BROKER_URL", "redis://localhost:6379/0")))
+RATE_LIMIT_KEY_PREFIX = os.environ.get("RATE_LIMIT_KEY_PREFIX", "rgsz:rate:")
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: on average rate acquisitions per second, with bursts of up to burst.
+    acquire() blocks until a token is available. The bucket is per process.
+    """
+
+    def __init__(self, rate: float, burst: float = 1.0, clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._updated = clock()
+
+    def acquire(self) -> float:
+        """
+        Takes one token, waiting for it if necessary. Returns the time waited in seconds.
+        """
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Taking the token up front reserves this caller's slot; later callers queue behind it.
+            self._tokens -= 1.0
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            self._sleep(wait)
+        return wait
+
+
+class SharedRateLimiter:
+    """
+    At most rate acquisitions per second summed over every process and host using the same Redis
+    key: each window of max(1, 1/rate) seconds has a counter, and a caller past the window's share
+    waits for the next window. acquire() falls back to a per-process TokenBucket when Redis fails.
+    """
+
+    def __init__(self, name: str, rate: float, client: Optional["redis.Redis"] = None,
+                 prefix: str = RATE_LIMIT_KEY_PREFIX, clock: Callable[[], float] = time.time,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.rate = rate
+        self.window = max(1.0, 1.0 / rate) if rate > 0 else 1.0
+        self.allowance = max(1, int(rate * self.window))
+        self.local = TokenBucket(rate, sleep=sleep)
+        self._client = client
+        self._key = prefix + name
+        self._clock = clock
+        self._sleep = sleep
+
+    def acquire(self) -> float:
+        """
+        Takes one of the current window's acquisitions, waiting for a later window if necessary.
+        Returns the time waited in seconds.
+        """
+        if self.rate <= 0:
+            return 0.0
+        waited = 0.0
+        try:
+            client = self._client or get_client()
+            while True:
+                now = self._clock()
+                window = int(now // self.window)
+                key = f"{self._key}:{window}"
+                pipe = client.pipeline(transaction=False)
+                pipe.incrby(key, 1)
+                pipe.expire(key, int(self.window * 2) + 1)
+                used, _ = pipe.execute()
+                if used <= self.allowance:
+                    return waited
+                wait = (window + 1) * self.window - now
+                self._sleep(wait)
+                waited += wait
+        except Exception as e:
+            print(f"An unexpected error occurred while taking the shared {self._key} rate limit, limiting this process only: {e}")
+            return waited + self.local.acquire()
+
+
+_client: Optional["redis.Redis"] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> "redis.Redis":
+    """
+    Process-wide Redis client on RATE_LIMIT_REDIS_URL.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            import redis
+
+            _client = redis.Redis.from_url(RATE_LIMIT_REDIS_URL, socket_timeout=5.0)
+        return _client
+
+
+def limiter(name: str, rate: float):
+    """
+    A limiter of rate acquisitions per second, shared by every process when RATE_LIMIT_SHARED is on.
+    """
+    return SharedRateLimiter(name, rate) if RATE_LIMIT_SHARED else TokenBucket(rate)
+
+
+k8s_limiter = limiter("kubernetes", K8S_RATE_LIMIT_PER_SECOND)
+prometheus_limiter = limiter("prometheus", PROMETHEUS_RATE_LIMIT_PER_SECOND)
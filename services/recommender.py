@@ -0,0 +1,585 @@
+import fcntl
+import math
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from services import fleet_engine
+
+# Off unless configured, like the local time-series store, so no process writes under its working directory.
+RECOMMENDER_ENABLED = os.environ.get("RECOMMENDER_ENABLED", "false").lower() in ("1", "true", "yes")
+RECOMMENDER_PATH = os.environ.get("RECOMMENDER_PATH", "data/recommender")
+# A sample's weight halves every this many hours, so recommendations follow recent usage. 0 disables decay.
+RECOMMENDER_HALF_LIFE_HOURS = float(os.environ.get("RECOMMENDER_HALF_LIFE_HOURS", "24"))
+# Containers the collector has not seen for this long (deleted pods) are dropped from the store.
+RECOMMENDER_RETENTION_HOURS = float(os.environ.get("RECOMMENDER_RETENTION_HOURS", "192"))
+# Recommended requests are the chosen percentile plus this margin; limits the peak plus the margin.
+RECOMMENDER_SAFETY_MARGIN = float(os.environ.get("RECOMMENDER_SAFETY_MARGIN", "0.15"))
+RECOMMENDER_MIN_CPU_MILLICORES = float(os.environ.get("RECOMMENDER_MIN_CPU_MILLICORES", "10"))
+RECOMMENDER_MIN_MEMORY_BYTES = float(os.environ.get("RECOMMENDER_MIN_MEMORY_BYTES", str(16 * 1024 ** 2)))
+
+PERCENTILES = {"p50": 0.5, "p90": 0.9, "p95": 0.95, "p99": 0.99, "max": None}
+
+# Bin i of a sketch counts the values in (GAMMA^(i-1), GAMMA^i], so every estimate is within 5% above
+# the true value (the bucket ratio the Kubernetes VPA recommender uses). A sketch keeps SKETCH_BINS
+# consecutive bins: values above the window move it up and everything that falls below its lowest
+# bin is counted in that bin, so only low quantiles of a container whose usage spans more than
+# GAMMA^SKETCH_BINS (about 22x) lose precision, and then they are overestimated.
+SKETCH_BINS = 64
+SKETCH_GAMMA = 1.05
+_LOG_GAMMA = math.log(SKETCH_GAMMA)
+# A new window starts with its first value this many bins below its top: usage more often grows
+# than it shrinks, and moving the window up is always possible.
+_FIRST_BIN = SKETCH_BINS - 8
+# A value below the window moves it down when the bins that would fall off its top weigh less than
+# this fraction of the new sample: old peaks that decayed away (about 7 half-lives old at 0.01).
+# Without decay a window never moves down, so the maximum is always kept.
+_STALE_WEIGHT = 0.01
+# Decay weights grow over time; all weights are scaled down before they get anywhere near float32 limits.
+_MAX_WEIGHT_EXPONENT = 32
+_FORMAT_VERSION = 2
+# Bounds of the time a sample stands for: collections closer than the first, and collector outages.
+_MIN_SAMPLE_MINUTES, _MAX_SAMPLE_MINUTES = 0.25, 5.0
+
+CPU, MEMORY = 0, 1
+_EMPTY = np.iinfo(np.int32).min
+
+ContainerKey = Tuple[str, str, str]  # (namespace, pod, container)
+WorkloadContainerKey = Tuple[str, str, str]  # (namespace, "Kind/name", container)
+
+
+class Sketches:
+    """
+    Fixed-size, mergeable quantile sketches of CPU and memory usage, one row per container.
+
+    A row holds, per resource, SKETCH_BINS float32 weights of log-spaced bins, a float32 weight of
+    zero samples and the int32 index of the lowest bin: 2 x (64 x 4 + 8) = 528 bytes per container,
+    however many samples it has seen. A quantile reads one row of bins, so it costs the same for a
+    container sampled once or for a year. Adding the samples of several containers to one row gives
+    the same row as merging their sketches, which is how replicas are merged into their workload.
+    """
+
+    def __init__(self, rows: int = 0):
+        self.offsets = np.full((rows, 2), _EMPTY, dtype=np.int32)
+        self.counts = np.zeros((rows, 2, SKETCH_BINS), dtype=np.float32)
+        self.zeros = np.zeros((rows, 2), dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def resize(self, rows: int) -> None:
+        """
+        Grows (with empty sketches) or truncates to rows.
+        """
+        grown = Sketches(rows)
+        keep = min(rows, len(self))
+        grown.offsets[:keep], grown.counts[:keep], grown.zeros[:keep] = \
+            self.offsets[:keep], self.counts[:keep], self.zeros[:keep]
+        self.offsets, self.counts, self.zeros = grown.offsets, grown.counts, grown.zeros
+
+    def take(self, rows: np.ndarray) -> "Sketches":
+        taken = Sketches()
+        taken.offsets, taken.counts, taken.zeros = self.offsets[rows], self.counts[rows], self.zeros[rows]
+        return taken
+
+    def scale(self, factor: float) -> None:
+        self.counts *= factor
+        self.zeros *= factor
+
+    def add(self, rows: np.ndarray, resource: int, values: np.ndarray, weight: Union[float, np.ndarray] = 1.0) -> None:
+        """
+        Adds one sample per entry of rows, which may repeat, with the given weight (the same for all or
+        one per entry); values <= 0 count as zero samples.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        weight = np.broadcast_to(np.asarray(weight, dtype=np.float64), values.shape)
+        zero = values <= 0
+        np.add.at(self.zeros[:, resource], rows[zero], weight[zero])
+        rows, values, weight = rows[~zero], values[~zero], weight[~zero]
+        if len(rows) == 0:
+            return
+        index = np.ceil(np.log(values) / _LOG_GAMMA).astype(np.int64)
+        # Where each window has to go is decided once per row, from the highest and lowest new value.
+        unique, inverse = np.unique(rows, return_inverse=True)
+        top = np.full(len(unique), np.iinfo(np.int64).min)
+        bottom = np.full(len(unique), np.iinfo(np.int64).max)
+        np.maximum.at(top, inverse, index)
+        np.minimum.at(bottom, inverse, index)
+        offsets = self.offsets[unique, resource].astype(np.int64)
+        empty = offsets == _EMPTY
+        offsets[empty] = top[empty] - _FIRST_BIN
+        self.offsets[unique[empty], resource] = offsets[empty]
+
+        new_offsets = np.where(top - offsets >= SKETCH_BINS, top - SKETCH_BINS + 1, offsets)
+        below = np.flatnonzero((bottom < offsets) & (new_offsets == offsets))
+        if len(below):
+            # Never so far down that the highest new value falls off the top.
+            down = np.minimum(offsets[below] - bottom[below], offsets[below] - (top[below] - SKETCH_BINS + 1))
+            top_weight = np.cumsum(self.counts[unique[below], resource, ::-1], axis=1)[
+                np.arange(len(below)), np.clip(down, 1, SKETCH_BINS) - 1]
+            # Only rows whose top bins are stale move down; the others count the value in their lowest bin.
+            unique_weight = np.zeros(len(unique))
+            np.maximum.at(unique_weight, inverse, weight)
+            stale = (down > 0) & (top_weight < _STALE_WEIGHT * unique_weight[below])
+            new_offsets[below[stale]] = offsets[below[stale]] - down[stale]
+        moving = np.flatnonzero(new_offsets != offsets)
+        if len(moving):
+            moved = unique[moving]
+            self.counts[moved, resource] = _shifted(self.counts[moved, resource], new_offsets[moving] - offsets[moving])
+            self.offsets[moved, resource] = new_offsets[moving]
+        bins = np.clip(index - new_offsets[inverse], 0, SKETCH_BINS - 1)
+        if len(unique) == len(rows):
+            self.counts[rows, resource, bins] += weight  # No repeats: plain indexing is several times faster.
+        else:
+            np.add.at(self.counts, (rows, resource, bins), weight)
+
+    def totals(self, rows: np.ndarray, resource: int) -> np.ndarray:
+        return self.zeros[rows, resource] + self.counts[rows, resource].sum(axis=1)
+
+    def quantiles(self, rows: np.ndarray, resource: int, q: Optional[float]) -> np.ndarray:
+        """
+        The q-quantile (the maximum for None) of each of rows, as the upper bound of the bin it falls
+        in; 0 for rows without samples.
+        """
+        counts = self.counts[rows, resource]
+        zeros = self.zeros[rows, resource]
+        offsets = self.offsets[rows, resource].astype(np.float64)
+        if q is None:
+            filled = counts > 0
+            position = SKETCH_BINS - 1 - np.argmax(filled[:, ::-1], axis=1)
+            return np.where(filled.any(axis=1), SKETCH_GAMMA ** (offsets + position), 0.0)
+        cumulative = zeros[:, None] + np.cumsum(counts, axis=1, dtype=np.float64)
+        rank = q * cumulative[:, -1]
+        # Relative tolerance: float32 weights do not add up exactly.
+        reached = cumulative >= (rank * (1 - 1e-6))[:, None]
+        position = np.argmax(reached, axis=1)
+        values = SKETCH_GAMMA ** (offsets + position)
+        return np.where((rank > 0) & (rank > zeros * (1 + 1e-6)), values, 0.0)
+
+
+def _shifted(counts: np.ndarray, shift: np.ndarray) -> np.ndarray:
+    """
+    Each row of counts moved shift bins down (up for a negative shift). Bins moved past either end
+    are added to the bin at that end.
+    """
+    # Bin j of the result holds the original bins up to positions[j] that earlier bins do not.
+    positions = np.clip(np.arange(SKETCH_BINS)[None, :] + shift[:, None], -1, SKETCH_BINS - 1)
+    positions[:, -1] = SKETCH_BINS - 1
+    cumulative = np.zeros((len(counts), SKETCH_BINS + 1))
+    np.cumsum(counts, axis=1, out=cumulative[:, 1:])
+    return np.diff(np.take_along_axis(cumulative, positions + 1, axis=1), axis=1, prepend=0.0).astype(np.float32)
+
+
+def _row_files(rows: int, workload_rows: int) -> Dict[str, Tuple[str, Tuple[int, ...], int]]:
+    """
+    The raw array files of a generation: name -> (dtype, shape of a row, rows).
+    """
+    files = {"state": ("<f8", (), 3), "last_seen": ("<i8", (), rows)}
+    for prefix, count in (("", rows), ("workload_", workload_rows)):
+        files[prefix + "offsets"] = ("<i4", (2,), count)
+        files[prefix + "counts"] = ("<f4", (2, SKETCH_BINS), count)
+        files[prefix + "zeros"] = ("<f4", (2,), count)
+    return files
+
+
+class RecommenderStore:
+    """
+    Usage sketches of every container the collector samples, and of every container of every
+    workload (all its replicas' samples in one sketch), from which requests and limits are recommended.
+
+    update() is called with each collection: one sample per container, weighted by the minutes since
+    the container's previous sample and so that it counts twice as much as a sample half_life_hours
+    older. Containers not sampled for retention_hours are
+    dropped, and a workload container with them once none of its replicas is left, so the store holds
+    the containers of the last retention period: 528 bytes of sketches each plus their names, and as
+    much again per workload container.
+
+    On disk, the fixed-size rows (sketches, last sample times and the decay state) are raw arrays in a
+    rows-N directory, memory-mapped and updated in place: a collection writes the rows it touched,
+    not the whole store. The names and the workload of every row are in layout.npz, rewritten (next
+    to its final place and renamed over it) only when they change. Rows added or expired start a new
+    generation N, written in full before layout.npz names it; older generations are deleted. Writers
+    serialize on a file lock and reload the layout when another process changed it; readers (the
+    API) do the same, without the lock, and only unpack the container names when a single pod is
+    asked for, so they may see a collection that is being written half applied. A pod's, a
+    namespace's or a workload's rows are found through indexes built on the first lookup after the
+    names change, not by scanning every container.
+    """
+
+    def __init__(self, path: str = RECOMMENDER_PATH, half_life_hours: float = RECOMMENDER_HALF_LIFE_HOURS,
+                 retention_hours: float = RECOMMENDER_RETENTION_HOURS):
+        self.path = path
+        self.half_life_seconds = half_life_hours * 3600
+        self.retention_seconds = retention_hours * 3600
+        os.makedirs(path, exist_ok=True)
+        self._file = os.path.join(path, "layout.npz")
+        self._lock = threading.Lock()
+        self._stamp: Optional[Tuple[int, int]] = None
+        self._reset()
+
+    def _reset(self) -> None:
+        self.reference = 0.0
+        self.updated_at = 0.0
+        # The half-life the stored weights were decayed with, which is another process's when it wrote the file.
+        self._weights_half_life = self.half_life_seconds
+        # The generation of the mapped rows (0: nothing written yet), and whether they are mapped for writing.
+        self._generation = 0
+        self._writable = True
+        self._state: Optional[np.ndarray] = None  # reference, updated_at and half-life, mapped.
+        self._keys: Optional[List[ContainerKey]] = []  # None until unpacked.
+        self._index: Dict[ContainerKey, int] = {}
+        self._groups = np.zeros(0, dtype=np.int64)  # Workload container row of each container row.
+        self._last_seen = np.zeros(0, dtype=np.int64)
+        self._sketches = Sketches()
+        self._workload_keys: List[WorkloadContainerKey] = []
+        self._workload_index: Dict[WorkloadContainerKey, int] = {}
+        self._workload_pods = np.zeros(0, dtype=np.int32)
+        self._workload_sketches = Sketches()
+        # The last frame's containers and their rows, and the names as last written.
+        self._frame_names: Optional[Tuple[list, ...]] = None
+        self._frame_rows: Optional[np.ndarray] = None
+        self._packed: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        # What the next save has to write besides the rows: the layout, or a whole new generation.
+        self._layout_changed = self._resized = False
+        self._forget_lookups()
+
+    def _forget_lookups(self) -> None:
+        # (namespace, pod) -> container rows; namespace -> (its workload container rows, "Kind/name" -> rows).
+        self._pod_rows: Optional[Dict[Tuple[str, str], List[int]]] = None
+        self._namespace_rows: Optional[Dict[str, Tuple[List[int], Dict[str, List[int]]]]] = None
+
+    # --- persistence -------------------------------------------------------------------------
+
+    def _file_stamp(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self._file)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _refresh(self, containers: bool) -> None:
+        """
+        Reloads the layout if another process replaced it. Must hold self._lock.
+        """
+        stamp = self._file_stamp()
+        if stamp != self._stamp:
+            self._stamp = stamp
+            self._reset()
+            if stamp is None:
+                return
+            with np.load(self._file, allow_pickle=False) as data:
+                version, bins, gamma, generation, rows, workload_rows = data["meta"].tolist()
+                if int(version) != _FORMAT_VERSION or int(bins) != SKETCH_BINS or gamma != SKETCH_GAMMA:
+                    print(f"Ignoring {self._file}: written with another sketch format")
+                    return
+                self._workload_keys = fleet_engine.unpack_names(data["workload_keys"])
+                self._workload_pods = data["workload_pods"]
+            try:
+                self._map(int(generation), int(rows), "r")
+            except FileNotFoundError:
+                # A writer started a new generation after the layout was read.
+                self._stamp = None
+                return self._refresh(containers)
+            self._keys = None
+        if self._state is not None:
+            self.reference, self.updated_at, self._weights_half_life = self._state.tolist()
+        if containers and self._keys is None:
+            with np.load(self._file, allow_pickle=False) as data:
+                if int(data["meta"][3]) != self._generation:
+                    self._stamp = None
+                    return self._refresh(containers)
+                self._keys = fleet_engine.unpack_names(data["keys"])
+                self._groups = data["groups"]
+            self._index = {key: i for i, key in enumerate(self._keys)}
+            self._pod_rows = None
+            self._workload_index = {key: i for i, key in enumerate(self._workload_keys)}
+
+    def _rows_path(self, generation: int) -> str:
+        return os.path.join(self.path, f"rows-{generation}")
+
+    def _map(self, generation: int, rows: int, mode: str) -> None:
+        """
+        Maps the rows of a generation, read-only ("r") or for updating in place ("r+").
+        """
+        directory = self._rows_path(generation)
+        workload_rows = len(self._workload_keys)
+        arrays = {name: fleet_engine.map_rows(os.path.join(directory, name), dtype, (count,) + shape, mode)
+                  for name, (dtype, shape, count) in _row_files(rows, workload_rows).items()}
+        self._state, self._last_seen = arrays["state"], arrays["last_seen"]
+        for prefix, sketches in (("", self._sketches), ("workload_", self._workload_sketches)):
+            sketches.offsets, sketches.counts, sketches.zeros = \
+                arrays[prefix + "offsets"], arrays[prefix + "counts"], arrays[prefix + "zeros"]
+        self._generation, self._writable = generation, mode == "r+"
+
+    def _save(self) -> None:
+        state = (self.reference, self.updated_at, self._weights_half_life)
+        if not self._resized:
+            self._state[:] = state
+            if self._layout_changed:
+                self._save_layout()
+            return
+        # Rows added or expired: every row goes to a new generation, which the layout then points to.
+        generation = self._generation + 1
+        directory = self._rows_path(generation)
+        tmp = os.path.join(self.path, f".rows-{generation}.tmp")
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        arrays = {"state": np.array(state), "last_seen": self._last_seen}
+        for prefix, sketches in (("", self._sketches), ("workload_", self._workload_sketches)):
+            arrays.update({prefix + "offsets": sketches.offsets, prefix + "counts": sketches.counts,
+                           prefix + "zeros": sketches.zeros})
+        for name, (dtype, _, _) in _row_files(len(self._keys), len(self._workload_keys)).items():
+            np.ascontiguousarray(arrays[name], dtype=dtype).tofile(os.path.join(tmp, name))
+        os.rename(tmp, directory)
+        self._generation = generation
+        self._save_layout()
+        for name in os.listdir(self.path):
+            if name.startswith("rows-") and name != os.path.basename(directory):
+                shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+        self._map(generation, len(self._keys), "r+")
+
+    def _save_layout(self) -> None:
+        if self._packed is None:
+            self._packed = (fleet_engine.pack_names(self._keys), fleet_engine.pack_names(self._workload_keys))
+        tmp = os.path.join(self.path, ".layout.npz.tmp")
+        with open(tmp, "wb") as f:
+            np.savez(
+                f, meta=np.array([_FORMAT_VERSION, SKETCH_BINS, SKETCH_GAMMA, self._generation,
+                                  len(self._keys), len(self._workload_keys)]),
+                keys=self._packed[0], groups=self._groups,
+                workload_keys=self._packed[1], workload_pods=self._workload_pods)
+        os.replace(tmp, self._file)
+        self._stamp = self._file_stamp()
+        self._layout_changed = self._resized = False
+
+    @contextmanager
+    def _writer(self):
+        with self._lock, open(os.path.join(self.path, "LOCK"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._refresh(containers=True)
+                if not self._writable:
+                    self._map(self._generation, len(self._keys), "r+")
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    # --- writing -----------------------------------------------------------------------------
+
+    def _exponent(self, ts: float) -> float:
+        if self._weights_half_life <= 0 or not self.reference:
+            return 0.0
+        return (ts - self.reference) / self._weights_half_life
+
+    def _rebase(self, exponent: float) -> None:
+        # Every weight scales by the same factor, so quantiles do not change.
+        self._sketches.scale(2.0 ** -exponent)
+        self._workload_sketches.scale(2.0 ** -exponent)
+
+    def _weight(self, ts: float) -> float:
+        if self._weights_half_life != self.half_life_seconds:
+            # Weights decayed with another half-life: rebase so the last samples weigh 1, then go on with ours.
+            self._rebase(self._exponent(self.updated_at))
+            self.reference, self._weights_half_life = self.updated_at, self.half_life_seconds
+        if self.half_life_seconds <= 0:
+            return 1.0
+        if not self.reference:
+            self.reference = ts
+        exponent = self._exponent(ts)
+        if exponent > _MAX_WEIGHT_EXPONENT:
+            self._rebase(exponent)
+            self.reference, exponent = ts, 0.0
+        return 2.0 ** exponent
+
+    def update(self, frame: fleet_engine.FleetFrame, timestamp: Optional[float] = None) -> int:
+        """
+        Adds one sample per container of the frame. Containers with neither CPU nor memory usage had
+        no usage data and are skipped. The frame's workload column (when set) names the workload of each
+        container as "Kind/name"; otherwise each pod is its own workload. Returns the samples added.
+        """
+        observed = np.flatnonzero((frame.cpu_usage > 0) | (frame.memory_usage > 0))
+        if len(observed) == 0:
+            return 0
+        workloads = frame.workload if frame.workload is not None else np.array(
+            ["Pod/" + pod for pod in frame.pod.tolist()], dtype=object)
+        names = (frame.namespace[observed].tolist(), frame.pod[observed].tolist(),
+                 frame.container[observed].tolist(), workloads[observed].tolist())
+        with self._writer():
+            ts = int(time.time() if timestamp is None else timestamp)
+            # Collections mostly list the same containers in the same order as the last one.
+            if names == self._frame_names:
+                rows = self._frame_rows
+            else:
+                rows = self._rows(*names)
+                self._frame_names, self._frame_rows = names, rows
+
+            # A sample weighs the time since the container's previous one, in collection minutes, so
+            # namespaces the scheduler samples more often while they are busy do not skew the quantiles.
+            seen = self._last_seen[rows]
+            minutes = np.where(seen > 0, np.clip((ts - seen) / 60, _MIN_SAMPLE_MINUTES, _MAX_SAMPLE_MINUTES), 1.0)
+            weight = self._weight(ts) * minutes
+            groups = self._groups[rows]
+            for resource, values in ((CPU, frame.cpu_usage[observed]), (MEMORY, frame.memory_usage[observed])):
+                self._sketches.add(rows, resource, values, weight)
+                self._workload_sketches.add(groups, resource, values, weight)
+            self._last_seen[rows] = ts
+            self.updated_at = ts
+            self._expire(ts)
+            self._save()
+            return len(rows)
+
+    def _rows(self, namespaces: List[str], pods: List[str], containers: List[str], workloads: List[str]) -> np.ndarray:
+        """
+        The row of each container, adding rows for new containers and workload containers.
+        """
+        rows = np.empty(len(namespaces), dtype=np.int64)
+        groups = self._groups.tolist()
+        index, workload_index = self._index, self._workload_index
+        for i, (namespace, pod, container, workload) in enumerate(zip(namespaces, pods, containers, workloads)):
+            key = (namespace, pod, container)
+            group = workload_index.get((namespace, workload, container))
+            if group is None:
+                group = workload_index[(namespace, workload, container)] = len(self._workload_keys)
+                self._workload_keys.append((namespace, workload, container))
+                self._packed = None
+                self._forget_lookups()
+            row = index.get(key)
+            if row is None:
+                row = index[key] = len(self._keys)
+                self._keys.append(key)
+                groups.append(group)
+                self._packed = None
+                self._forget_lookups()
+            elif groups[row] != group:
+                groups[row] = group  # A pod's workload normally never changes; if it does, follow it.
+                self._layout_changed = True
+            rows[i] = row
+        self._groups = np.asarray(groups, dtype=np.int64)
+        if len(self._keys) > len(self._sketches):
+            self._sketches.resize(len(self._keys))
+            self._last_seen = np.concatenate(
+                [self._last_seen, np.zeros(len(self._keys) - len(self._last_seen), dtype=np.int64)])
+            self._resized = True
+        if len(self._workload_keys) > len(self._workload_sketches):
+            self._workload_sketches.resize(len(self._workload_keys))
+            self._resized = True
+        self._workload_pods = np.bincount(self._groups, minlength=len(self._workload_keys)).astype(np.int32)
+        return rows
+
+    def _expire(self, ts: int) -> None:
+        keep = np.flatnonzero(self._last_seen >= ts - self.retention_seconds)
+        if len(keep) == len(self._keys):
+            return
+        self._keys = [self._keys[i] for i in keep.tolist()]
+        self._index = {key: i for i, key in enumerate(self._keys)}
+        self._last_seen = self._last_seen[keep]
+        self._sketches = self._sketches.take(keep)
+        groups = self._groups[keep]
+        # Workload containers go with their last replica; the others are renumbered.
+        pods = np.bincount(groups, minlength=len(self._workload_keys))
+        kept_groups = np.flatnonzero(pods)
+        self._groups = (np.cumsum(pods > 0) - 1)[groups]
+        self._workload_keys = [self._workload_keys[i] for i in kept_groups.tolist()]
+        self._workload_index = {key: i for i, key in enumerate(self._workload_keys)}
+        self._workload_pods = pods[kept_groups].astype(np.int32)
+        self._workload_sketches = self._workload_sketches.take(kept_groups)
+        self._frame_names = self._frame_rows = self._packed = None
+        self._resized = True
+        self._forget_lookups()
+
+    # --- reading -----------------------------------------------------------------------------
+
+    def _rows_of_pod(self, namespace: str, pod_name: str) -> List[int]:
+        if self._pod_rows is None:
+            pods: Dict[Tuple[str, str], List[int]] = {}
+            for i, (ns, pod, _) in enumerate(self._keys):
+                pods.setdefault((ns, pod), []).append(i)
+            self._pod_rows = pods
+        return self._pod_rows.get((namespace, pod_name), [])
+
+    def _rows_of_workloads(self, namespace: Optional[str], workload: Optional[str]) -> List[int]:
+        if self._namespace_rows is None:
+            namespaces: Dict[str, Tuple[List[int], Dict[str, List[int]]]] = {}
+            for i, (ns, name, _) in enumerate(self._workload_keys):
+                rows, workloads = namespaces.setdefault(ns, ([], {}))
+                rows.append(i)
+                workloads.setdefault(name, []).append(i)
+            self._namespace_rows = namespaces
+        if namespace is None:
+            if workload is None:
+                return list(range(len(self._workload_keys)))
+            return sorted(i for _, workloads in self._namespace_rows.values() for i in workloads.get(workload, ()))
+        rows, workloads = self._namespace_rows.get(namespace, ([], {}))
+        return rows if workload is None else workloads.get(workload, [])
+
+    def _recommend(self, sketches: Sketches, rows: np.ndarray, percentile: str, margin: float) -> List[Dict[str, Any]]:
+        if percentile not in PERCENTILES:
+            raise ValueError(f"Unknown percentile {percentile!r}; expected one of {', '.join(PERCENTILES)}")
+        q = PERCENTILES[percentile]
+        scale = 1 + margin
+        # Every sample adds to both resources; in units of samples as heavy as the last one.
+        samples = (sketches.totals(rows, CPU) / 2.0 ** self._exponent(self.updated_at)).tolist()
+        columns = []
+        for resource, minimum, step in ((CPU, RECOMMENDER_MIN_CPU_MILLICORES, 1.0),
+                                        (MEMORY, RECOMMENDER_MIN_MEMORY_BYTES, 1024.0 ** 2)):
+            request = np.maximum(np.ceil(sketches.quantiles(rows, resource, q) * scale / step) * step, minimum)
+            limit = np.maximum(np.ceil(sketches.quantiles(rows, resource, None) * scale / step) * step, request)
+            columns.append((request.tolist(), limit.tolist()))
+        (cpu_request, cpu_limit), (memory_request, memory_limit) = columns
+        return [{
+            "samples": round(samples[i], 1),
+            "cpu_request_millicores": cpu_request[i], "cpu_limit_millicores": cpu_limit[i],
+            "memory_request_bytes": memory_request[i], "memory_limit_bytes": memory_limit[i],
+        } for i in range(len(rows))]
+
+    def recommendations(self, namespace: Optional[str] = None, workload: Optional[str] = None,
+                        percentile: str = "p95", margin: float = RECOMMENDER_SAFETY_MARGIN) -> List[Dict[str, Any]]:
+        """
+        Recommended requests and limits of every container of every workload (of a namespace, and of one
+        workload given as "Kind/name"), from the samples of all the workload's replicas.
+        """
+        with self._lock:
+            self._refresh(containers=False)
+            selected = self._rows_of_workloads(namespace, workload)
+            recommended = self._recommend(self._workload_sketches, np.asarray(selected, dtype=np.int64), percentile, margin)
+            records = []
+            for i, record in zip(selected, recommended):
+                ns, name, container = self._workload_keys[i]
+                kind, _, workload_name = name.partition("/")
+                records.append(dict({"namespace": ns, "kind": kind, "name": workload_name, "container": container,
+                                     "pods": int(self._workload_pods[i])}, **record))
+            return records
+
+    def pod_recommendations(self, namespace: str, pod_name: str, percentile: str = "p95",
+                            margin: float = RECOMMENDER_SAFETY_MARGIN) -> List[Dict[str, Any]]:
+        """
+        Recommended requests and limits of each container of one pod, from its own samples only.
+        """
+        with self._lock:
+            self._refresh(containers=True)
+            selected = self._rows_of_pod(namespace, pod_name)
+            recommended = self._recommend(self._sketches, np.asarray(selected, dtype=np.int64), percentile, margin)
+            return [dict({"namespace": namespace, "pod_name": pod_name, "container": self._keys[i][2]}, **record)
+                    for i, record in zip(selected, recommended)]
+
+
+_store: Optional[RecommenderStore] = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> Optional[RecommenderStore]:
+    """
+    Process-wide store at RECOMMENDER_PATH, or None when RECOMMENDER_ENABLED is off.
+    """
+    global _store
+    if not RECOMMENDER_ENABLED:
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = RecommenderStore()
+        return _store
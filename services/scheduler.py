@@ -0,0 +1,331 @@
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from services import collector, fleet_engine, instrumentation
+
+if TYPE_CHECKING:
+    import redis
+
+# Adaptive collection: beat ticks every SCHEDULER_TICK_SECONDS and each tick collects only the
+# namespaces that are due. Off, every tick collects the whole scope, once a minute as before.
+SCHEDULER_ENABLED = os.environ.get("SCHEDULER_ENABLED", "true").lower() in ("1", "true", "yes")
+# The schedule, the upstream latencies and the query budget are kept there, shared by every worker.
+SCHEDULER_REDIS_URL = os.environ.get("SCHEDULER_REDIS_URL",
+                                     os.environ.get("CELERY_BROKER_URL", "redis://localhost:6379/0"))
+SCHEDULER_KEY_PREFIX = os.environ.get("SCHEDULER_KEY_PREFIX", "rgsz:schedule:")
+SCHEDULER_TICK_SECONDS = float(os.environ.get("SCHEDULER_TICK_SECONDS", "30"))
+# A namespace is sampled every min interval while hot, every base interval while warm or new, and
+# up to every max interval while stable. The max should not exceed WASTE_MAX_GAP_SECONDS.
+SCHEDULER_MIN_INTERVAL_SECONDS = float(os.environ.get("SCHEDULER_MIN_INTERVAL_SECONDS", "30"))
+SCHEDULER_BASE_INTERVAL_SECONDS = float(os.environ.get("SCHEDULER_BASE_INTERVAL_SECONDS", "60"))
+SCHEDULER_MAX_INTERVAL_SECONDS = float(os.environ.get("SCHEDULER_MAX_INTERVAL_SECONDS", "300"))
+# Hot: a container's memory at this share of its request, or a container's CPU or memory moving by
+# this share of its request (or usage, if larger) between two samples. Warm: CPU at the hot ratio,
+# or half the change.
+SCHEDULER_HOT_RATIO = float(os.environ.get("SCHEDULER_HOT_RATIO", "0.9"))
+SCHEDULER_VOLATILE_CHANGE = float(os.environ.get("SCHEDULER_VOLATILE_CHANGE", "0.25"))
+# Prometheus usage queries (collection chunks) per budget window, for all workers together. 0
+# disables the budget. Namespaces that do not fit stay due and go first at the next tick.
+SCHEDULER_QUERY_BUDGET = int(os.environ.get("SCHEDULER_QUERY_BUDGET", "60"))
+SCHEDULER_BUDGET_WINDOW_SECONDS = float(os.environ.get("SCHEDULER_BUDGET_WINDOW_SECONDS", "60"))
+# Above these average latencies (listing the pods, one chunk's usage query), intervals stretch and
+# the budget shrinks by the same factor, up to SCHEDULER_MAX_BACKOFF.
+SCHEDULER_K8S_LATENCY_TARGET_SECONDS = float(os.environ.get("SCHEDULER_K8S_LATENCY_TARGET_SECONDS", "2"))
+SCHEDULER_PROMETHEUS_LATENCY_TARGET_SECONDS = float(os.environ.get("SCHEDULER_PROMETHEUS_LATENCY_TARGET_SECONDS", "5"))
+SCHEDULER_MAX_BACKOFF = float(os.environ.get("SCHEDULER_MAX_BACKOFF", "8"))
+
+LATENCY_TARGETS = {"kubernetes": SCHEDULER_K8S_LATENCY_TARGET_SECONDS,
+                   "prometheus": SCHEDULER_PROMETHEUS_LATENCY_TARGET_SECONDS}
+# Weight of the newest call in an upstream's average latency.
+_LATENCY_WEIGHT = 0.3
+# Changes below these are noise, whatever the request.
+_CPU_FLOOR_MILLICORES = 10.0
+_MEMORY_FLOOR_BYTES = 16.0 * 2 ** 20
+
+
+def signals(cpu_request: np.ndarray, cpu_usage: np.ndarray, memory_request: np.ndarray, memory_usage: np.ndarray,
+            previous_cpu: np.ndarray, previous_memory: np.ndarray, elapsed: float) -> Tuple[float, float, float, float]:
+    """
+    What a namespace's containers did since their previous sample, elapsed seconds ago (previous_*
+    is NaN for containers without one): the highest memory and CPU usage to request ratios, the
+    largest change relative to the request (or usage, if larger), and the seconds until the first
+    container whose memory grows at its current pace reaches SCHEDULER_HOT_RATIO of its request
+    (inf if none does).
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        memory_ratio = np.where(memory_request > 0, memory_usage / memory_request, 0.0)
+        cpu_ratio = np.where(cpu_request > 0, cpu_usage / cpu_request, 0.0)
+        cpu_change = np.abs(cpu_usage - previous_cpu) / np.maximum.reduce(
+            [cpu_request, cpu_usage, previous_cpu, np.full(len(cpu_usage), _CPU_FLOOR_MILLICORES)])
+        growth = memory_usage - previous_memory
+        memory_change = np.abs(growth) / np.maximum.reduce(
+            [memory_request, memory_usage, previous_memory, np.full(len(memory_usage), _MEMORY_FLOOR_BYTES)])
+        growing = (memory_request > 0) & (growth > _MEMORY_FLOOR_BYTES / 16) & (elapsed > 0)
+        time_to_hot = (SCHEDULER_HOT_RATIO * memory_request[growing] - memory_usage[growing]) / (growth[growing] / elapsed)
+    largest = [float(np.nanmax(values, initial=0.0)) for values in (memory_ratio, cpu_ratio, cpu_change, memory_change)]
+    return largest[0], largest[1], max(largest[2], largest[3]), float(np.min(time_to_hot, initial=np.inf))
+
+
+def next_interval(interval: float, memory_ratio: float, cpu_ratio: float, change: float, time_to_hot: float = np.inf,
+                  min_interval: float = SCHEDULER_MIN_INTERVAL_SECONDS,
+                  base_interval: float = SCHEDULER_BASE_INTERVAL_SECONDS,
+                  max_interval: float = SCHEDULER_MAX_INTERVAL_SECONDS) -> float:
+    """
+    Hot namespaces drop straight to the min interval; the others double theirs with every sample,
+    up to the base interval while warm and the max interval while stable, but never past the time
+    a growing container is expected to turn them hot.
+    """
+    if memory_ratio >= SCHEDULER_HOT_RATIO or change >= SCHEDULER_VOLATILE_CHANGE:
+        return min_interval
+    ceiling = base_interval if cpu_ratio >= SCHEDULER_HOT_RATIO or change >= SCHEDULER_VOLATILE_CHANGE / 2 else max_interval
+    return max(min_interval, min(interval * 2, ceiling, time_to_hot))
+
+
+def _encode_sample(timestamp: float, pods: List[str], containers: List[str], cpu: np.ndarray,
+                   memory: np.ndarray) -> bytes:
+    values = np.stack([cpu, memory]).astype("<f8")
+    return (len(pods).to_bytes(8, "little") + np.float64(timestamp).tobytes() + values.tobytes()
+            + fleet_engine.pack_names(zip(pods, containers)).tobytes())
+
+
+def _decode_sample(blob: bytes) -> Tuple[float, Dict[Tuple[str, ...], int], np.ndarray]:
+    """
+    The time of a namespace's last sample, the index of each of its (pod, container), and their CPU
+    and memory usage as two rows.
+    """
+    count = int.from_bytes(blob[:8], "little")
+    timestamp = float(np.frombuffer(blob, dtype="<f8", count=1, offset=8)[0])
+    values = np.frombuffer(blob, dtype="<f8", count=2 * count, offset=16).reshape(2, count)
+    names = fleet_engine.unpack_names(np.frombuffer(blob, dtype=np.uint8, offset=16 + 16 * count))
+    return timestamp, {key: i for i, key in enumerate(names)}, values
+
+
+class CollectionScheduler:
+    """
+    Decides which namespaces each collection tick queries, from what the previous collections saw.
+
+    Every namespace has its own sampling interval, adjusted by observe() after each of its samples
+    (see next_interval), and a due time; plan() picks the due namespaces, most overdue first, that
+    fit in what is left of the query budget. When the API server or Prometheus answer slower than
+    their latency target, every interval is stretched and the budget shrunk by the factor they are
+    over it.
+
+    All of it lives in Redis so that beat, every worker process and every host share one schedule
+    and one budget: a sorted set of due times, a hash of intervals, a hash of average latencies, a
+    counter per budget window, and per namespace the last usage of its containers.
+    """
+
+    def __init__(self, client: "redis.Redis", prefix: str = SCHEDULER_KEY_PREFIX,
+                 budget: int = SCHEDULER_QUERY_BUDGET, budget_window: float = SCHEDULER_BUDGET_WINDOW_SECONDS,
+                 min_interval: float = SCHEDULER_MIN_INTERVAL_SECONDS,
+                 base_interval: float = SCHEDULER_BASE_INTERVAL_SECONDS,
+                 max_interval: float = SCHEDULER_MAX_INTERVAL_SECONDS,
+                 chunk_containers: Optional[int] = None):
+        self.client = client
+        self.prefix = prefix
+        self.budget = budget
+        self.budget_window = budget_window
+        self.min_interval = min_interval
+        self.base_interval = base_interval
+        self.max_interval = max_interval
+        self.chunk_containers = chunk_containers or collector.COLLECTOR_CHUNK_CONTAINERS
+        self._due = prefix + "due"
+        self._intervals = prefix + "interval"
+        self._latency = prefix + "latency"
+        self._listed = prefix + "listed"
+
+    def _sample_key(self, namespace: str) -> str:
+        return f"{self.prefix}sample:{namespace}"
+
+    def _budget_key(self, now: float) -> str:
+        return f"{self.prefix}budget:{int(now // self.budget_window)}"
+
+    def backoff(self) -> float:
+        """
+        How many times slower than its target the slowest upstream answers on average; at least 1.
+        """
+        factor = 1.0
+        for upstream, average in zip(LATENCY_TARGETS, self.client.hmget(self._latency, list(LATENCY_TARGETS))):
+            if average is not None and LATENCY_TARGETS[upstream] > 0:
+                factor = max(factor, float(average) / LATENCY_TARGETS[upstream])
+        factor = min(factor, SCHEDULER_MAX_BACKOFF)
+        if instrumentation.METRICS_ENABLED:
+            instrumentation.COLLECTION_BACKOFF.set(factor)
+        return factor
+
+    def record_latency(self, upstream: str, seconds: float) -> None:
+        """
+        Adds a call's duration to the upstream's average. Best effort: a failure is printed.
+        """
+        try:
+            previous = self.client.hget(self._latency, upstream)
+            average = seconds if previous is None else (1 - _LATENCY_WEIGHT) * float(previous) + _LATENCY_WEIGHT * seconds
+            self.client.hset(self._latency, upstream, average)
+        except Exception as e:
+            print(f"An unexpected error occurred while recording the {upstream} latency: {e}")
+
+    def collection_due(self, now: Optional[float] = None) -> bool:
+        """
+        Whether this tick has anything to collect: a namespace is due, or the pods were last listed
+        a (stretched) base interval ago, which is how new namespaces are found.
+        """
+        now = time.time() if now is None else now
+        pipe = self.client.pipeline(transaction=False)
+        pipe.zrangebyscore(self._due, "-inf", now, start=0, num=1)
+        pipe.get(self._listed)
+        due, listed = pipe.execute()
+        return bool(due) or listed is None or now - float(listed) >= self.base_interval * self.backoff()
+
+    def _allowance(self, factor: float) -> int:
+        return max(1, int(self.budget / factor))
+
+    def available(self, now: Optional[float] = None, factor: Optional[float] = None) -> Optional[int]:
+        """
+        Queries left in the current budget window, or None without a budget.
+        """
+        if self.budget <= 0:
+            return None
+        now = time.time() if now is None else now
+        factor = self.backoff() if factor is None else factor
+        return max(0, self._allowance(factor) - int(self.client.get(self._budget_key(now)) or 0))
+
+    def reserve(self, count: int, now: Optional[float] = None, factor: Optional[float] = None) -> int:
+        """
+        Takes up to count queries from the current budget window. Returns how many were granted.
+        """
+        if self.budget <= 0 or count <= 0:
+            return count
+        now = time.time() if now is None else now
+        factor = self.backoff() if factor is None else factor
+        key = self._budget_key(now)
+        pipe = self.client.pipeline(transaction=False)
+        pipe.incrby(key, count)
+        pipe.expire(key, int(self.budget_window * 2) + 1)
+        used, _ = pipe.execute()
+        # INCRBY is atomic, so concurrent planners never hand out the same query twice.
+        excess = min(count, used - self._allowance(factor))
+        if excess > 0:
+            self.client.decrby(key, excess)
+            return count - excess
+        return count
+
+    def plan(self, pod_requests: collector.PodRequests, now: Optional[float] = None) -> List[List[Any]]:
+        """
+        Chunks (as collector.plan_chunks) for the namespaces of pod_requests that are due, most
+        overdue first and within the query budget. Namespaces seen for the first time are due at
+        once; namespaces no longer listed are forgotten. Each planned namespace is due again one
+        (stretched) interval later, which observe() then adjusts to what its sample showed.
+        """
+        now = time.time() if now is None else now
+        by_namespace: Dict[str, List[Any]] = {}
+        sizes: Dict[str, int] = {}
+        for pod in pod_requests:
+            by_namespace.setdefault(pod[0], []).append(pod)
+            sizes[pod[0]] = sizes.get(pod[0], 0) + len(pod[2])
+        scheduled = {namespace.decode(): due for namespace, due in self.client.zrange(self._due, 0, -1, withscores=True)}
+        due = sorted((scheduled.get(namespace, 0.0), namespace) for namespace in by_namespace
+                     if scheduled.get(namespace, 0.0) <= now)
+
+        factor = self.backoff()
+        available = self.available(now, factor)
+        capacity = None if available is None else available * self.chunk_containers
+        selected: List[str] = []
+        containers = 0
+        for _, namespace in due:
+            if capacity is not None and containers + sizes[namespace] > capacity and (selected or capacity == 0):
+                continue
+            selected.append(namespace)
+            containers += sizes[namespace]
+        urgency = {namespace: i for i, namespace in enumerate(selected)}
+        chunks = collector.plan_chunks([pod for namespace in selected for pod in by_namespace[namespace]],
+                                       max_containers=self.chunk_containers)
+        chunks.sort(key=lambda chunk: min(urgency[pod[0]] for pod in chunk))
+        chunks = chunks[:self.reserve(len(chunks), now, factor)]
+
+        planned = list(dict.fromkeys(pod[0] for chunk in chunks for pod in chunk))
+        intervals = self.client.hmget(self._intervals, planned) if planned else []
+        gone = [namespace for namespace in scheduled if namespace not in by_namespace]
+        due_times = {namespace: now for _, namespace in due if namespace not in scheduled}  # New, still due.
+        due_times.update((namespace, now + float(interval or self.base_interval) * factor)
+                         for namespace, interval in zip(planned, intervals))
+        pipe = self.client.pipeline(transaction=False)
+        if due_times:
+            pipe.zadd(self._due, due_times)
+        if gone:
+            pipe.zrem(self._due, *gone)
+            pipe.hdel(self._intervals, *gone)
+            pipe.delete(*(self._sample_key(namespace) for namespace in gone))
+        pipe.set(self._listed, now)
+        pipe.execute()
+        instrumentation.items("scheduled_namespaces", len(planned))
+        instrumentation.items("deferred_namespaces", len(due) - len(planned))
+        return chunks
+
+    def observe(self, frame: fleet_engine.FleetFrame, timestamp: Optional[float] = None) -> int:
+        """
+        Sets the interval and next due time of each namespace in a collected frame from its
+        containers' usage, compared with their previous sample. Returns the namespaces updated.
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        rows: Dict[str, List[int]] = {}
+        for i, namespace in enumerate(frame.namespace.tolist()):
+            rows.setdefault(namespace, []).append(i)
+        if not rows:
+            return 0
+        namespaces = list(rows)
+        pods, containers = frame.pod.tolist(), frame.container.tolist()
+        blobs = self.client.mget([self._sample_key(namespace) for namespace in namespaces])
+        intervals = self.client.hmget(self._intervals, namespaces)
+        factor = self.backoff()
+        ttl = int(self.max_interval * SCHEDULER_MAX_BACKOFF * 2)
+
+        pipe = self.client.pipeline(transaction=False)
+        due = {}
+        for namespace, blob, interval in zip(namespaces, blobs, intervals):
+            index = np.asarray(rows[namespace])
+            keys = [(pods[i], containers[i]) for i in rows[namespace]]
+            cpu, memory = frame.cpu_usage[index], frame.memory_usage[index]
+            previous, elapsed = np.full((2, len(index)), np.nan), 0.0
+            if blob is not None:
+                sampled_at, known, values = _decode_sample(blob)
+                elapsed = timestamp - sampled_at
+                matched = np.fromiter((known.get(key, -1) for key in keys), dtype=np.int64, count=len(keys))
+                found = matched >= 0
+                previous[:, found] = values[:, matched[found]]
+            observed = signals(frame.cpu_request[index], cpu, frame.memory_request[index], memory,
+                               previous[0], previous[1], elapsed)
+            interval = next_interval(float(interval or self.base_interval), *observed,
+                                     self.min_interval, self.base_interval, self.max_interval)
+            if blob is None:
+                # Nothing to compare with yet: not stable until a second sample says so.
+                interval = min(interval, self.base_interval)
+            due[namespace] = timestamp + interval * factor
+            pipe.hset(self._intervals, namespace, interval)
+            pipe.set(self._sample_key(namespace),
+                     _encode_sample(timestamp, [k[0] for k in keys], [k[1] for k in keys], cpu, memory), ex=ttl)
+        pipe.zadd(self._due, due)
+        pipe.execute()
+        return len(namespaces)
+
+
+_scheduler: Optional[CollectionScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> Optional[CollectionScheduler]:
+    """
+    Process-wide scheduler on SCHEDULER_REDIS_URL, or None when SCHEDULER_ENABLED is off.
+    """
+    global _scheduler
+    if not SCHEDULER_ENABLED:
+        return None
+    with _scheduler_lock:
+        if _scheduler is None:
+            import redis
+
+            _scheduler = CollectionScheduler(redis.Redis.from_url(SCHEDULER_REDIS_URL, socket_timeout=5.0))
+        return _scheduler
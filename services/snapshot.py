@@ -0,0 +1,557 @@
+import fcntl
+import json
+import mmap
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from services import fleet_engine, streaming
+
+# Serving mode: /k8s/pod and /k8s/pods are answered from the analysis snapshot the collector writes
+# after each collection, mapped from disk and shared by every API worker process on the host.
+SNAPSHOT_ENABLED = os.environ.get("SNAPSHOT_ENABLED", "false").lower() in ("1", "true", "yes")
+SNAPSHOT_PATH = os.environ.get("SNAPSHOT_PATH", "data/snapshot")
+# An older snapshot (the collector stopped) is not served; requests are analyzed live instead.
+SNAPSHOT_MAX_AGE_SECONDS = float(os.environ.get("SNAPSHOT_MAX_AGE_SECONDS", "180"))
+# Each snapshot written is the next version. Polling clients revalidate with If-None-Match, or ask
+# /k8s/pods/changes for the containers changed since the version they have: those whose requests,
+# provisioning flags or usage bucket (steps of SNAPSHOT_USAGE_STEP, 10%, on a log scale; 0 for any
+# change) changed. Smaller moves in usage do not make a new version of a container.
+SNAPSHOT_USAGE_STEP = float(os.environ.get("SNAPSHOT_USAGE_STEP", "0.1"))
+# Versions the change log covers (6 hours of 30-second ticks); a client further behind gets every record.
+SNAPSHOT_CHANGE_LOG_VERSIONS = int(os.environ.get("SNAPSHOT_CHANGE_LOG_VERSIONS", "720"))
+
+_MAGIC = b"RGSZSNAP"
+_FORMAT_VERSION = 3
+_FILE_NAME = "analysis.snap"
+_LOG_NAME = "changes.log"
+_ARRAYS = ("pod_name_offsets", "pod_json_offsets", "namespace_pods", "record_offsets", "record_versions",
+           "record_states", "container_name_offsets")
+_BLOBS = ("pod_names", "container_names", "body")
+# Per container: CPU and memory requests (their float64 bits), CPU and memory usage buckets, flags.
+_STATE_COLUMNS = 5
+
+
+def _usage_buckets(usage: np.ndarray) -> np.ndarray:
+    usage = np.nan_to_num(np.maximum(np.asarray(usage, dtype=np.float64), 0.0))
+    if SNAPSHOT_USAGE_STEP <= 0:
+        return usage.view(np.int64)
+    return np.floor(np.log1p(usage) / np.log1p(SNAPSHOT_USAGE_STEP)).astype(np.int64)
+
+
+def _states(analysis: fleet_engine.FleetAnalysis) -> np.ndarray:
+    """
+    What a container's changes are reported on, one row of _STATE_COLUMNS per frame row.
+    """
+    frame = analysis.frame
+    flags = (analysis.cpu_over.astype(np.int64) | analysis.cpu_under.astype(np.int64) << 1
+             | analysis.memory_over.astype(np.int64) << 2 | analysis.memory_under.astype(np.int64) << 3)
+    return np.column_stack((np.asarray(frame.cpu_request, dtype=np.float64).view(np.int64),
+                            np.asarray(frame.memory_request, dtype=np.float64).view(np.int64),
+                            _usage_buckets(frame.cpu_usage), _usage_buckets(frame.memory_usage), flags))
+
+
+def parse_version(version: str) -> Tuple[int, int]:
+    """
+    (epoch, serial) of a snapshot version such as "1790812800-17". Raises ValueError if malformed.
+    """
+    epoch, serial = version.split("-")
+    return int(epoch), int(serial)
+
+
+class _Encoded:
+    """
+    A frame's records laid out as in a snapshot file, before they are written: the same attributes
+    a mapped Snapshot reads from.
+    """
+
+    def __init__(self, frame: fleet_engine.FleetFrame):
+        analysis = fleet_engine.analyze_frame(frame)
+        records = fleet_engine.to_records(analysis)
+        # Sorted by (namespace, pod), keeping each pod's containers in order. str order is UTF-8 byte
+        # order, which is what readers bisect on.
+        keys = list(zip(frame.namespace.tolist(), frame.pod.tolist()))
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        encoded = [streaming.dumps_record(records[i]) for i in order]
+        self._body = memoryview(b"".join((b"[", b",".join(encoded), b"]")))
+        # Record i starts after "[" and i earlier records each followed by a comma.
+        record_offsets = np.ones(len(encoded) + 1, dtype=np.int64)
+        np.cumsum(np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded)) + 1, out=record_offsets[1:])
+        record_offsets[1:] += 1
+        self._record_offsets = record_offsets
+        self._record_states = _states(analysis)[order]
+        # Set by write_snapshot, from the current snapshot.
+        self._record_versions = np.zeros(len(encoded), dtype=np.int64)
+        containers = frame.container.tolist()
+        self._record_keys = [(keys[i][1], containers[i]) for i in order]
+        names = [containers[i].encode() for i in order]
+        self._container_names = b"".join(names)
+        self._container_name_offsets = np.zeros(len(names) + 1, dtype=np.int64)
+        np.cumsum(np.fromiter(map(len, names), dtype=np.int64, count=len(names)), out=self._container_name_offsets[1:])
+
+        sorted_keys = [keys[i] for i in order]
+        pod_starts = [i for i in range(len(sorted_keys)) if i == 0 or sorted_keys[i] != sorted_keys[i - 1]]
+        self.namespaces: List[str] = []
+        namespace_pods: List[int] = []
+        namespace_records: List[int] = []
+        for pod, i in enumerate(pod_starts):
+            if not self.namespaces or self.namespaces[-1] != sorted_keys[i][0]:
+                self.namespaces.append(sorted_keys[i][0])
+                namespace_pods.append(pod)
+                namespace_records.append(i)
+        namespace_pods.append(len(pod_starts))
+        namespace_records.append(len(encoded))
+        self._namespace_pods = np.asarray(namespace_pods, dtype=np.int64)
+        self._namespace_records = np.asarray(namespace_records, dtype=np.int64)
+        self._namespace_containers = np.diff(namespace_records).tolist()
+        self._pod_names = "".join(sorted_keys[i][1] for i in pod_starts).encode()
+        self._pod_name_offsets = np.zeros(len(pod_starts) + 1, dtype=np.int64)
+        np.cumsum([len(sorted_keys[i][1].encode()) for i in pod_starts], out=self._pod_name_offsets[1:])
+        # Pod i's records end one byte (the comma) before pod i + 1's start, the last pod's at the "]".
+        self._pod_json_offsets = record_offsets[pod_starts + [len(encoded)]]
+
+    def _keys(self, i: int) -> List[Tuple[str, str]]:
+        """
+        (pod, container) of each record of the namespace at index i.
+        """
+        return self._record_keys[self._namespace_records[i]:self._namespace_records[i + 1]]
+
+
+def _merge(sections: List[Tuple[str, Any, int]]) -> Tuple[Dict[str, np.ndarray], Dict[str, bytes], List[int]]:
+    """
+    Lays out (namespace, source, namespace index in source) sections, in the order given, as one
+    snapshot. Each source is an _Encoded or a Snapshot; a namespace's pods, records and per-record
+    arrays are copied as ranges. Returns the arrays, the byte blobs and the containers per namespace.
+    """
+    bodies, pod_names, container_names, containers = [], [], [], []
+    arrays: Dict[str, List[np.ndarray]] = {name: [] for name in _ARRAYS}
+    arrays["pod_json_offsets"].append(np.ones(1, dtype=np.int64))
+    arrays["record_offsets"].append(np.ones(1, dtype=np.int64))
+    arrays["pod_name_offsets"].append(np.zeros(1, dtype=np.int64))
+    arrays["container_name_offsets"].append(np.zeros(1, dtype=np.int64))
+    namespace_pods = [0]
+    position, name_position, container_position = 1, 0, 0
+    for _, source, i in sections:
+        first, end = int(source._namespace_pods[i]), int(source._namespace_pods[i + 1])
+        first_record, end_record = int(source._namespace_records[i]), int(source._namespace_records[i + 1])
+        start, stop = int(source._pod_json_offsets[first]), int(source._pod_json_offsets[end]) - 1
+        bodies.append(source._body[start:stop])
+        # The pods' and records' offsets, moved to where the namespace's records start in the new body.
+        arrays["pod_json_offsets"].append(source._pod_json_offsets[first + 1:end + 1] - start + position)
+        arrays["record_offsets"].append(source._record_offsets[first_record + 1:end_record + 1] - start + position)
+        position += stop - start + 1
+        name_start, name_stop = int(source._pod_name_offsets[first]), int(source._pod_name_offsets[end])
+        pod_names.append(source._pod_names[name_start:name_stop])
+        arrays["pod_name_offsets"].append(source._pod_name_offsets[first + 1:end + 1] - name_start + name_position)
+        name_position += name_stop - name_start
+        name_start = int(source._container_name_offsets[first_record])
+        name_stop = int(source._container_name_offsets[end_record])
+        container_names.append(source._container_names[name_start:name_stop])
+        arrays["container_name_offsets"].append(
+            source._container_name_offsets[first_record + 1:end_record + 1] - name_start + container_position)
+        container_position += name_stop - name_start
+        arrays["record_versions"].append(source._record_versions[first_record:end_record])
+        arrays["record_states"].append(source._record_states[first_record:end_record].ravel())
+        namespace_pods.append(namespace_pods[-1] + end - first)
+        containers.append(source._namespace_containers[i])
+    merged = {name: np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64) for name, parts in arrays.items()}
+    merged["namespace_pods"] = np.asarray(namespace_pods, dtype=np.int64)
+    blobs = {"body": b"".join((b"[", b",".join(bodies), b"]")), "pod_names": b"".join(pod_names),
+             "container_names": b"".join(container_names)}
+    return merged, blobs, containers
+
+
+def write_snapshot(frame: fleet_engine.FleetFrame, taken_at: Optional[float] = None,
+                   scope: Optional[str] = None, path: Optional[str] = None,
+                   listed: Optional[Sequence[str]] = None) -> int:
+    """
+    Analyzes a frame and writes the records, already encoded as the API returns them, as the new
+    snapshot. scope is the namespace the frame was collected for, None for the whole cluster.
+    listed, when the frame holds only some of the namespaces in scope (the scheduler collects each at
+    its own interval), names them all: those the frame has no containers for keep their records from
+    the current snapshot, and those not listed are left out. Returns the number of containers written.
+
+    The new snapshot is the current one's next version. Each record keeps the version it last
+    changed in; containers that are gone are appended to the change log next to the snapshot. When
+    there is no readable current snapshot, versions start over in a new epoch.
+
+    The file is written next to the current one and renamed over it: a reader maps either the old
+    or the new file, never a partial one, and keeps its old mapping valid until it lets it go.
+
+    Layout: magic, header length (uint64), JSON header, then int64 arrays and the byte blobs at the
+    offsets the header lists. Pods are sorted by (namespace, name), so a namespace is a contiguous
+    range of pods and its records one contiguous slice of the JSON body.
+    """
+    path = path or SNAPSHOT_PATH
+    taken_at = time.time() if taken_at is None else taken_at
+    encoded = _Encoded(frame)
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, "LOCK"), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            return _write(encoded, taken_at, scope, path, listed)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _write(encoded: _Encoded, taken_at: float, scope: Optional[str], path: str,
+           listed: Optional[Sequence[str]]) -> int:
+    current = _open(os.path.join(path, _FILE_NAME))
+    if current is None:
+        epoch, serial, oldest = int(taken_at), 1, 1
+    else:
+        epoch, serial = current.epoch, current.serial + 1
+        oldest = max(current.oldest, serial - SNAPSHOT_CHANGE_LOG_VERSIONS)
+
+    sections = [(namespace, encoded, i) for i, namespace in enumerate(encoded.namespaces)]
+    if listed is not None and current is not None:
+        collected = set(encoded.namespaces)
+        sections += [(namespace, current, current._namespaces[namespace]) for namespace in listed
+                     if namespace not in collected and namespace in current._namespaces]
+        sections.sort(key=lambda section: section[0])
+    changed, removed = _compare(encoded, current, serial)
+    if current is not None:
+        written = {namespace for namespace, _, _ in sections}
+        for namespace in current.namespaces:
+            if namespace not in written:
+                removed += [(namespace, pod, container) for pod, container in current._keys(current._namespaces[namespace])]
+    namespace_changed = [changed[namespace] if source is encoded else source._namespace_changed[i]
+                         for namespace, source, i in sections]
+    last_change = serial if removed or serial in namespace_changed or current is None else current.changed
+    arrays, blobs, containers = _merge(sections)
+
+    data, layout, offset = [], {}, 0
+    for name in _ARRAYS:
+        array = np.asarray(arrays[name], dtype="<i8").tobytes()
+        layout[name] = (offset, len(arrays[name]))
+        data.append(array)
+        offset += len(array)
+    for name in _BLOBS:
+        layout[name] = (offset, len(blobs[name]))
+        data.append(blobs[name])
+        offset += len(blobs[name])
+    header = json.dumps({"version": _FORMAT_VERSION, "taken_at": taken_at, "scope": scope,
+                         "epoch": epoch, "serial": serial, "oldest": oldest, "changed": last_change,
+                         "containers": sum(containers), "namespaces": [namespace for namespace, _, _ in sections],
+                         "namespace_containers": containers, "namespace_changed": namespace_changed,
+                         "layout": layout}).encode()
+    header += b" " * (-(len(_MAGIC) + 8 + len(header)) % 8)  # The arrays start 8-byte aligned.
+
+    # The log is written first: a reader that maps the new snapshot finds its removals there.
+    _log_removals(path, epoch, serial, oldest, removed, new_epoch=current is None)
+    fd, tmp = tempfile.mkstemp(dir=path, prefix=".analysis.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(_MAGIC + len(header).to_bytes(8, "little") + header)
+            for blob in data:
+                f.write(blob)
+        os.replace(tmp, os.path.join(path, _FILE_NAME))
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return sum(containers)
+
+
+def _compare(encoded: _Encoded, current: Optional["Snapshot"],
+             serial: int) -> Tuple[Dict[str, int], List[Tuple[str, str, str]]]:
+    """
+    Sets the version of each of encoded's records: the one it has in the current snapshot if its
+    state is the same there, else serial. Returns the version each collected namespace last changed
+    in, and the (namespace, pod, container) the current snapshot has in them but encoded does not.
+    """
+    encoded._record_versions[:] = serial
+    changed: Dict[str, int] = {}
+    removed: List[Tuple[str, str, str]] = []
+    for i, namespace in enumerate(encoded.namespaces):
+        j = None if current is None else current._namespaces.get(namespace)
+        if j is None:
+            changed[namespace] = serial
+            continue
+        first = int(current._namespace_records[j])
+        previous = {key: row for row, key in enumerate(current._keys(j), first)}
+        rows, previous_rows = [], []
+        for row, key in enumerate(encoded._keys(i), int(encoded._namespace_records[i])):
+            previous_row = previous.pop(key, None)
+            if previous_row is not None:
+                rows.append(row)
+                previous_rows.append(previous_row)
+        same = (encoded._record_states[rows] == current._record_states[previous_rows]).all(axis=1)
+        encoded._record_versions[np.asarray(rows, dtype=np.int64)[same]] = \
+            current._record_versions[np.asarray(previous_rows, dtype=np.int64)[same]]
+        removed += [(namespace, pod, container) for pod, container in previous]
+        unchanged = not previous and same.all() and len(rows) == encoded._namespace_containers[i]
+        changed[namespace] = current._namespace_changed[j] if unchanged else serial
+    return changed, removed
+
+
+def _log_removals(path: str, epoch: int, serial: int, oldest: int, removed: List[Tuple[str, str, str]],
+                  new_epoch: bool) -> None:
+    """
+    Appends serial's removed containers to the change log, one JSON line per version. A new epoch
+    starts a new log; every SNAPSHOT_CHANGE_LOG_VERSIONS versions, lines up to oldest are dropped.
+    """
+    file = os.path.join(path, _LOG_NAME)
+    lines: List[bytes] = []
+    if not new_epoch and SNAPSHOT_CHANGE_LOG_VERSIONS > 0 and serial % SNAPSHOT_CHANGE_LOG_VERSIONS == 0:
+        lines = [line for line in _read_log(file) if json.loads(line)["serial"] > oldest]
+        new_epoch = True
+    if removed:
+        lines.append(json.dumps({"epoch": epoch, "serial": serial, "removed": removed}).encode() + b"\n")
+    if new_epoch:
+        tmp = file + ".tmp"
+        with open(tmp, "wb") as f:
+            f.writelines(lines)
+        os.replace(tmp, file)
+    elif lines:
+        with open(file, "ab") as f:
+            f.writelines(lines)
+
+
+def _read_log(file: str) -> List[bytes]:
+    try:
+        with open(file, "rb") as f:
+            return [line for line in f if line.endswith(b"\n")]
+    except FileNotFoundError:
+        return []
+
+
+def _open(file: str) -> Optional["Snapshot"]:
+    """
+    The snapshot in file, or None if there is none or it cannot be read.
+    """
+    try:
+        return Snapshot(file)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f"An unexpected error occurred while mapping the analysis snapshot: {e}")
+        return None
+
+
+class Snapshot:
+    """
+    One mapped snapshot file. Lookups are views into the mapping: the pages are the page cache's,
+    shared by every process that maps the file, and nothing is decoded until a response is built.
+    """
+
+    def __init__(self, file: str):
+        with open(file, "rb") as f:
+            stat = os.fstat(f.fileno())
+            self.stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(_MAGIC)] != _MAGIC:
+            raise ValueError(f"{file} is not an analysis snapshot")
+        header_length = int.from_bytes(self._map[len(_MAGIC):len(_MAGIC) + 8], "little")
+        start = len(_MAGIC) + 8 + header_length
+        header = json.loads(self._map[len(_MAGIC) + 8:start])
+        if header["version"] != _FORMAT_VERSION:
+            raise ValueError(f"{file} was written with another snapshot format")
+        self.taken_at: float = header["taken_at"]
+        self.scope: Optional[str] = header["scope"]
+        self.containers: int = header["containers"]
+        # This snapshot is version serial of epoch; oldest is the first version changes() can start
+        # from, changed the last version anything in it changed in.
+        self.epoch: int = header["epoch"]
+        self.serial: int = header["serial"]
+        self.oldest: int = header["oldest"]
+        self.changed: int = header["changed"]
+        layout = header["layout"]
+        view = memoryview(self._map)
+        (self._pod_name_offsets, self._pod_json_offsets, self._namespace_pods, self._record_offsets,
+         self._record_versions, record_states, self._container_name_offsets) = (
+            np.frombuffer(self._map, dtype="<i8", count=layout[name][1], offset=start + layout[name][0])
+            for name in _ARRAYS
+        )
+        self._record_states = record_states.reshape(-1, _STATE_COLUMNS)
+        self._pod_names, self._container_names, self._body = (
+            view[start + layout[name][0]:start + sum(layout[name])] for name in _BLOBS
+        )
+        self.namespaces: List[str] = header["namespaces"]
+        self._namespaces = {namespace: i for i, namespace in enumerate(self.namespaces)}
+        self._namespace_containers: List[int] = header["namespace_containers"]
+        self._namespace_records = np.zeros(len(self.namespaces) + 1, dtype=np.int64)
+        np.cumsum(self._namespace_containers, out=self._namespace_records[1:])
+        self._namespace_changed: List[int] = header["namespace_changed"]
+        self._log = os.path.join(os.path.dirname(file), _LOG_NAME)
+        self._removals: Optional[List[Tuple[int, str, str, str]]] = None
+
+    @property
+    def version(self) -> str:
+        return f"{self.epoch}-{self.serial}"
+
+    def age(self) -> float:
+        return time.time() - self.taken_at
+
+    def _records(self, first_pod: int, end_pod: int) -> bytes:
+        if first_pod == end_pod:
+            return b"[]"
+        start, end = int(self._pod_json_offsets[first_pod]), int(self._pod_json_offsets[end_pod]) - 1
+        return b"".join((b"[", self._body[start:end], b"]"))
+
+    def _pod_name(self, pod: int) -> bytes:
+        return self._pod_names[int(self._pod_name_offsets[pod]):int(self._pod_name_offsets[pod + 1])].tobytes()
+
+    def _pod(self, namespace: str, pod_name: str) -> Optional[int]:
+        i = self._namespaces.get(namespace)
+        if i is None:
+            return None
+        first, end = int(self._namespace_pods[i]), int(self._namespace_pods[i + 1])
+        name = pod_name.encode()
+        pod = bisect_left(range(first, end), name, key=self._pod_name) + first
+        if pod == end or self._pod_name(pod) != name:
+            return None
+        return pod
+
+    def _keys(self, i: int) -> List[Tuple[str, str]]:
+        """
+        (pod, container) of each record of the namespace at index i.
+        """
+        first, end = int(self._namespace_records[i]), int(self._namespace_records[i + 1])
+        pods = np.searchsorted(self._pod_json_offsets, self._record_offsets[first:end], side="right") - 1
+        pod_names = {pod: self._pod_name(pod).decode()
+                     for pod in range(int(self._namespace_pods[i]), int(self._namespace_pods[i + 1]))}
+        offsets = self._container_name_offsets[first:end + 1].tolist()
+        names = self._container_names[offsets[0]:offsets[-1]].tobytes()
+        base = offsets[0]
+        return [(pod_names[pod], names[offsets[k] - base:offsets[k + 1] - base].decode())
+                for k, pod in enumerate(pods.tolist())]
+
+    def cluster_json(self) -> Optional[bytes]:
+        """
+        Every record as a JSON array, or None if the snapshot covers a single namespace.
+        """
+        return self._body.tobytes() if self.scope is None else None
+
+    def namespace_json(self, namespace: str) -> Optional[bytes]:
+        """
+        The namespace's records as a JSON array, or None if it is not in the snapshot.
+        """
+        i = self._namespaces.get(namespace)
+        if i is None:
+            return None
+        return self._records(int(self._namespace_pods[i]), int(self._namespace_pods[i + 1]))
+
+    def pod_json(self, namespace: str, pod_name: str) -> Optional[bytes]:
+        """
+        The pod's records as a JSON array, or None if it is not in the snapshot (e.g. a new pod).
+        """
+        pod = self._pod(namespace, pod_name)
+        return None if pod is None else self._records(pod, pod + 1)
+
+    def etag(self, namespace: Optional[str] = None, pod_name: Optional[str] = None) -> Optional[str]:
+        """
+        A weak ETag for the records of the cluster, a namespace or a pod, or None if they are not in
+        the snapshot. It is the version they last changed in, so it only changes with a container's
+        requests, flags or usage bucket: within a bucket, usage may differ from the response it tagged.
+        """
+        if namespace is None:
+            return None if self.scope is not None else f'W/"{self.epoch}-{self.changed}"'
+        i = self._namespaces.get(namespace)
+        if i is None or (pod_name is not None and self._pod(namespace, pod_name) is None):
+            return None
+        return f'W/"{self.epoch}-{self._namespace_changed[i]}"'
+
+    def _removed_since(self, serial: int) -> List[Tuple[str, str, str]]:
+        if self._removals is None:
+            removals = []
+            for line in _read_log(self._log):
+                entry = json.loads(line)
+                if entry["epoch"] == self.epoch and entry["serial"] <= self.serial:
+                    removals += [(entry["serial"], *key) for key in entry["removed"]]
+            self._removals = removals
+        return list(dict.fromkeys(tuple(key) for removed_at, *key in self._removals if removed_at > serial))
+
+    def changes(self, since: Optional[str] = None, namespace: Optional[str] = None) -> Optional[bytes]:
+        """
+        The records of the cluster or of a namespace that changed after version since, and the
+        containers removed since, as a JSON object with this snapshot's version. When since is None,
+        of another epoch, or older than the change log goes back, every record is returned and
+        "full" is true. None if the namespace (or, for a single-namespace snapshot, the cluster) is
+        not in the snapshot. Raises ValueError if since is not a version.
+        """
+        if namespace is None:
+            if self.scope is not None:
+                return None
+            first, end = 0, len(self._record_versions)
+        else:
+            i = self._namespaces.get(namespace)
+            if i is None:
+                return None
+            first, end = int(self._namespace_records[i]), int(self._namespace_records[i + 1])
+        epoch, serial = parse_version(since) if since is not None else (None, None)
+        full = epoch != self.epoch or not self.oldest <= serial <= self.serial
+        if full:
+            rows = range(first, end)
+            body = self._body[int(self._record_offsets[first]):int(self._record_offsets[end]) - 1] if end > first else b""
+            removed = []
+        else:
+            rows = (np.flatnonzero(self._record_versions[first:end] > serial) + first).tolist()
+            offsets = self._record_offsets
+            body = b",".join([self._body[int(offsets[row]):int(offsets[row + 1]) - 1] for row in rows])
+            removed = [key for key in self._removed_since(serial) if namespace is None or key[0] == namespace]
+            if removed:
+                # Containers removed, then back since: their current record is in the changes.
+                present = set()
+                for name in {key[0] for key in removed} & self._namespaces.keys():
+                    present.update((name, pod, container) for pod, container in self._keys(self._namespaces[name]))
+                removed = [key for key in removed if key not in present]
+        head = json.dumps({"version": self.version, "full": full, "changed": len(rows),
+                           "removed": [{"namespace": ns, "pod_name": pod, "name": name} for ns, pod, name in removed]})
+        return b"".join((head[:-1].encode(), b', "records": [', body, b"]}"))
+
+
+class SnapshotReader:
+    """
+    The current snapshot at path for one process. Each call checks the file with one stat and maps
+    the new one when the collector replaced it; callers holding the previous Snapshot keep reading it.
+    """
+
+    def __init__(self, path: str = SNAPSHOT_PATH, max_age_seconds: float = SNAPSHOT_MAX_AGE_SECONDS):
+        self.max_age_seconds = max_age_seconds
+        self._file = os.path.join(path, _FILE_NAME)
+        self._snapshot: Optional[Snapshot] = None
+        self._lock = threading.Lock()
+
+    def current(self) -> Optional[Snapshot]:
+        """
+        The latest snapshot, or None if there is none or it is older than max_age_seconds.
+        """
+        try:
+            stat = os.stat(self._file)
+        except FileNotFoundError:
+            return None
+        stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.stamp != stamp:
+            with self._lock:
+                if self._snapshot is None or self._snapshot.stamp != stamp:
+                    snapshot = _open(self._file)
+                    if snapshot is None:
+                        return None
+                    self._snapshot = snapshot
+                snapshot = self._snapshot
+        if snapshot.age() > self.max_age_seconds:
+            return None
+        return snapshot
+
+
+_reader: Optional[SnapshotReader] = None
+_reader_lock = threading.Lock()
+
+
+def get_reader() -> Optional[SnapshotReader]:
+    """
+    Process-wide reader of the snapshot at SNAPSHOT_PATH, or None when SNAPSHOT_ENABLED is off.
+    """
+    global _reader
+    if not SNAPSHOT_ENABLED:
+        return None
+    with _reader_lock:
+        if _reader is None:
+            _reader = SnapshotReader()
+        return _reader
@@ -0,0 +1,134 @@
+import asyncio
+import importlib
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+# Cold-start phases are measured from here: main.py and the Celery app import this module first.
+_STARTED = time.perf_counter()
+
+# How a process gets its upstream clients ready. "background" (the default) imports and builds them
+# in a thread once the process serves, "blocking" before it serves, "off" leaves it to the first
+# request that needs them.
+STARTUP_WARMUP = os.environ.get("STARTUP_WARMUP", "background").lower()
+# Cold-start budget: from the first import until the API serves, and for the first request it
+# answers. A phase over its budget is reported; every phase is exported as rgsz_startup_seconds.
+STARTUP_READY_BUDGET_SECONDS = float(os.environ.get("STARTUP_READY_BUDGET_SECONDS", "1.5"))
+STARTUP_FIRST_REQUEST_BUDGET_SECONDS = float(os.environ.get("STARTUP_FIRST_REQUEST_BUDGET_SECONDS", "0.5"))
+
+# Imported by the hot paths on first use; none of them is needed to start serving.
+CLIENT_MODULES = ("kubernetes.client", "kubernetes.config", "kubernetes.watch", "aiohttp", "requests")
+
+timings: Dict[str, float] = {}
+_budgets = {"ready": STARTUP_READY_BUDGET_SECONDS, "first_request": STARTUP_FIRST_REQUEST_BUDGET_SECONDS}
+
+
+def record(phase: str, seconds: float) -> None:
+    """
+    Records how long a startup phase took, and reports it if it went over its budget.
+    """
+    from services import instrumentation
+
+    timings[phase] = seconds
+    if instrumentation.METRICS_ENABLED:
+        instrumentation.STARTUP_SECONDS.labels(phase).set(seconds)
+    budget = _budgets.get(phase)
+    if budget is not None and seconds > budget:
+        print(f"Startup phase '{phase}' took {seconds:.2f} s, over its {budget:.2f} s budget")
+
+
+def mark(phase: str) -> None:
+    """
+    Records a phase that ends now and started with the process.
+    """
+    record(phase, time.perf_counter() - _STARTED)
+
+
+def import_clients() -> None:
+    """
+    Imports the upstream client libraries. Safe before a fork: it opens no connection.
+    """
+    for module in CLIENT_MODULES:
+        importlib.import_module(module)
+
+
+def init_clients() -> None:
+    """
+    Builds this process's Kubernetes client (configuration, TLS, connection pool) and Prometheus
+    session. A failure is printed and left to the first request to retry.
+    """
+    from services import k8s_client, prometheus_query
+
+    try:
+        k8s_client.get_client_manager().core_v1()
+    except Exception as e:
+        print(f"An unexpected error occurred while preparing the Kubernetes client: {e}")
+    prometheus_query.get_session()
+
+
+def warm_up() -> None:
+    begin = time.perf_counter()
+    import_clients()
+    init_clients()
+    record("warmup", time.perf_counter() - begin)
+
+
+def start_warm_up(mode: Optional[str] = None) -> Optional[threading.Thread]:
+    """
+    Runs warm_up() as STARTUP_WARMUP (or mode) says: in a daemon thread, which is returned, right
+    away, or not at all.
+    """
+    mode = mode or STARTUP_WARMUP
+    if mode == "blocking":
+        warm_up()
+    elif mode == "background":
+        thread = threading.Thread(target=warm_up, name="rgsz-warmup", daemon=True)
+        thread.start()
+        return thread
+    return None
+
+
+async def _warm_up_api() -> None:
+    from services import async_analyzer
+
+    await asyncio.to_thread(warm_up)
+    try:
+        async_analyzer.get_upstreams().warm()
+    except Exception as e:
+        print(f"An unexpected error occurred while preparing the upstream sessions: {e}")
+
+
+async def warm_up_api(mode: Optional[str] = None) -> Optional[asyncio.Task]:
+    """
+    warm_up() for an API process, followed by its async upstream sessions on the serving loop. With
+    "blocking" it is done when this returns; with "background" it is the returned task.
+    """
+    mode = mode or STARTUP_WARMUP
+    if mode == "blocking":
+        await _warm_up_api()
+    elif mode == "background":
+        return asyncio.get_running_loop().create_task(_warm_up_api())
+    return None
+
+
+class FirstRequestTimer:
+    """
+    ASGI middleware recording the duration of the process's first HTTP request as the
+    "first_request" startup phase; a single flag check for every request after it.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.pending = True
+
+    async def __call__(self, scope, receive, send):
+        if not self.pending or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        self.pending = False
+        begin = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            record("first_request", time.perf_counter() - begin)
@@ -0,0 +1,93 @@
+import io
+import json
+import math
+from typing import Any, Dict, Iterable, Iterator
+
+from services import fleet_engine
+
+try:
+    import orjson
+except ImportError:  # Optional; several times faster than json for these records.
+    orjson = None
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+_RATIO_FIELDS = ("cpu_usage_vs_request_ratio", "memory_usage_vs_request_ratio")
+
+
+def _dumps(record: Dict[str, Any]) -> bytes:
+    # JSON has no Infinity: an infinite ratio (usage without a request) is written as null, like
+    # orjson does; the *_under_provisioned flag of the same record is true in that case.
+    for field in _RATIO_FIELDS:
+        value = record[field]
+        if value is not None and math.isinf(value):
+            record[field] = None
+    return json.dumps(record, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def dumps_record(record: Dict[str, Any]) -> bytes:
+    """
+    One analysis record as compact JSON, with orjson when it is installed.
+    """
+    return orjson.dumps(record) if orjson is not None else _dumps(record)
+
+
+def ndjson_stream(analyses: Iterable[fleet_engine.FleetAnalysis]) -> Iterator[bytes]:
+    """
+    Encodes analysis chunks as newline-delimited JSON, one record per line and one write per chunk.
+    """
+    for analysis in analyses:
+        records = fleet_engine.to_records(analysis)
+        if records:
+            yield b"\n".join(dumps_record(record) for record in records) + b"\n"
+
+
+def arrow_stream(analyses: Iterable[fleet_engine.FleetAnalysis]) -> Iterator[bytes]:
+    """
+    Encodes analysis chunks as an Arrow IPC stream, one record batch per chunk, built straight from
+    the analysis arrays. Ratios keep inf; a missing ratio (no request and no usage) is null.
+    Requires pyarrow; raises ImportError before anything is written if it is not installed.
+    """
+    import pyarrow as pa
+
+    schema = pa.schema([
+        ("pod_name", pa.string()), ("namespace", pa.string()), ("name", pa.string()),
+        ("cpu_request_millicores", pa.float64()), ("cpu_utilization_millicores", pa.float64()),
+        ("cpu_usage_vs_request_ratio", pa.float64()), ("cpu_over_provisioned", pa.bool_()),
+        ("cpu_under_provisioned", pa.bool_()),
+        ("memory_request_bytes", pa.float64()), ("memory_utilization_bytes", pa.float64()),
+        ("memory_usage_vs_request_ratio", pa.float64()), ("memory_over_provisioned", pa.bool_()),
+        ("memory_under_provisioned", pa.bool_()),
+    ])
+    return _arrow_batches(pa, schema, analyses)
+
+
+def _arrow_batches(pa, schema, analyses: Iterable[fleet_engine.FleetAnalysis]) -> Iterator[bytes]:
+    sink = io.BytesIO()
+    writer = pa.ipc.new_stream(sink, schema)
+
+    def flush() -> bytes:
+        data = sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+        return data
+
+    yield flush()  # The schema message, so clients can set up before the first batch.
+    for analysis in analyses:
+        frame = analysis.frame
+        if len(frame) == 0:
+            continue
+        columns = [
+            frame.pod, frame.namespace, frame.container,
+            frame.cpu_request, frame.cpu_usage, analysis.cpu_ratio, analysis.cpu_over, analysis.cpu_under,
+            frame.memory_request, frame.memory_usage, analysis.memory_ratio, analysis.memory_over, analysis.memory_under,
+        ]
+        arrays = [
+            pa.array(column, type=field.type, from_pandas=field.name in _RATIO_FIELDS)  # NaN -> null
+            for column, field in zip(columns, schema)
+        ]
+        writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+        yield flush()
+    writer.close()
+    yield flush()
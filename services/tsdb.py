@@ -0,0 +1,517 @@
+import fcntl
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from services import fleet_engine
+
+# Off unless configured, so the API does not create a store under whatever directory it runs in.
+TSDB_ENABLED = os.environ.get("TSDB_ENABLED", "false").lower() in ("1", "true", "yes")
+TSDB_PATH = os.environ.get("TSDB_PATH", "data/tsdb")
+# Raw (one sample per collection) segments are kept this long, hourly rollups much longer.
+TSDB_RAW_RETENTION_HOURS = int(os.environ.get("TSDB_RAW_RETENTION_HOURS", "168"))
+TSDB_ROLLUP_RETENTION_DAYS = int(os.environ.get("TSDB_ROLLUP_RETENTION_DAYS", "90"))
+# Queries over longer windows read hourly rollups instead of raw samples.
+TSDB_RAW_QUERY_MAX_SECONDS = int(os.environ.get("TSDB_RAW_QUERY_MAX_SECONDS", str(2 * 86400)))
+
+RAW = "raw"
+ROLLUP = "1h"
+
+# One file per column; a row is one container at one collection time.
+_COLUMNS = {
+    RAW: {
+        "ts": "<i8", "series": "<u4",
+        "cpu_request": "<f4", "cpu_usage": "<f4",
+        "memory_request": "<f4", "memory_usage": "<f4",
+    },
+    # One row per container per hour: last request, mean and max usage, number of raw samples.
+    ROLLUP: {
+        "ts": "<i8", "series": "<u4",
+        "cpu_request": "<f4", "cpu_usage": "<f4", "cpu_usage_max": "<f4",
+        "memory_request": "<f4", "memory_usage": "<f4", "memory_usage_max": "<f4",
+        "samples": "<u2",
+    },
+}
+# Segment names sort in time order: one raw segment per UTC hour, one rollup segment per UTC day.
+_SEGMENT_FORMAT = {RAW: "%Y%m%d%H", ROLLUP: "%Y%m%d"}
+_INDEX = "index.json"
+
+PERCENTILES = {"p50": 0.5, "p95": 0.95, "p99": 0.99, "max": None}
+
+
+def segment_name(resolution: str, ts: float) -> str:
+    return time.strftime(_SEGMENT_FORMAT[resolution], time.gmtime(ts))
+
+
+def _group_starts(*keys: np.ndarray) -> np.ndarray:
+    """
+    Start offsets of the runs of equal keys in rows sorted by those keys.
+    """
+    n = len(keys[0])
+    if n == 0:
+        return np.zeros(0, dtype=np.intp)
+    change = np.zeros(n, dtype=bool)
+    change[0] = True
+    for key in keys:
+        change[1:] |= key[1:] != key[:-1]
+    return np.flatnonzero(change)
+
+
+def rollup(columns: Dict[str, np.ndarray], primary: Optional[np.ndarray] = None) -> Tuple[Dict[str, np.ndarray], np.ndarray]:
+    """
+    Downsamples raw columns to one row per series per hour. Rows are ordered by (primary, series, hour);
+    returns the rollup columns and the primary key of each rollup row.
+    """
+    hour = columns["ts"] - columns["ts"] % 3600
+    primary = np.zeros(len(hour), dtype=np.int64) if primary is None else primary
+    order = np.lexsort((columns["ts"], hour, columns["series"], primary))
+    series, hour, primary = columns["series"][order], hour[order], primary[order]
+    starts = _group_starts(primary, series, hour)
+    if len(starts) == 0:
+        return {name: np.zeros(0, dtype=dtype) for name, dtype in _COLUMNS[ROLLUP].items()}, primary
+    ends = np.r_[starts[1:], len(order)]
+    samples = ends - starts
+
+    result = {"ts": hour[starts], "series": series[starts], "samples": samples.astype("<u2")}
+    for resource in ("cpu", "memory"):
+        usage = columns[f"{resource}_usage"][order].astype(np.float64)
+        result[f"{resource}_request"] = columns[f"{resource}_request"][order][ends - 1]
+        result[f"{resource}_usage"] = np.add.reduceat(usage, starts) / samples
+        result[f"{resource}_usage_max"] = np.maximum.reduceat(usage, starts)
+    return {name: np.asarray(result[name], dtype=dtype) for name, dtype in _COLUMNS[ROLLUP].items()}, primary[starts]
+
+
+def grouped_percentiles(series: np.ndarray, values: np.ndarray) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """
+    PERCENTILES of values per series, interpolated like Prometheus' quantile_over_time.
+    Returns the distinct series and one array per statistic aligned with them.
+    """
+    order = np.lexsort((values, series))
+    series, values = series[order], values[order].astype(np.float64)
+    starts = _group_starts(series)
+    last = np.r_[starts[1:], len(series)] - 1
+    stats = {}
+    for stat, q in PERCENTILES.items():
+        if q is None:
+            stats[stat] = values[last]
+            continue
+        rank = starts + q * (last - starts)
+        low = np.floor(rank).astype(np.intp)
+        high = np.minimum(low + 1, last)
+        stats[stat] = values[low] + (values[high] - values[low]) * (rank - low)
+    return series[starts], stats
+
+
+class TimeSeriesStore:
+    """
+    Append-only, memory-mapped columnar store for per-container requests and usage samples.
+
+    Layout under path:
+      series.jsonl       [namespace, pod, container] per line; the line number is the series ID.
+      raw/YYYYMMDDHH/    one column file per field, appended to during that hour.
+      1h/YYYYMMDD/       hourly rollups of a finished day.
+
+    A finished hour is sealed by compact(): its rows are re-written sorted by (namespace, series, ts)
+    together with an index.json of the row range of every namespace, so reading one namespace out
+    of a sealed segment is one contiguous slice of an mmap. Finished days are rolled up the same way,
+    and segments past their retention are deleted. Sealed segments are never modified again.
+
+    Writers (the collector) serialize on a file lock, so several worker processes can share a store.
+    Readers take no lock: they only open sealed segments and the rows of the open hour that every
+    column file already contains.
+    """
+
+    def __init__(self, path: str = TSDB_PATH, raw_retention_hours: int = TSDB_RAW_RETENTION_HOURS,
+                 rollup_retention_days: int = TSDB_ROLLUP_RETENTION_DAYS, clock=time.time):
+        self.path = path
+        self.raw_retention_hours = raw_retention_hours
+        self.rollup_retention_days = rollup_retention_days
+        self._clock = clock
+        for resolution in (RAW, ROLLUP):
+            os.makedirs(os.path.join(path, resolution), exist_ok=True)
+        self._series_path = os.path.join(path, "series.jsonl")
+        self._lock = threading.Lock()
+        self._series_keys: List[Tuple[str, str, str]] = []
+        self._series_index: Dict[Tuple[str, str, str], int] = {}
+        self._series_offset = 0
+        self._namespace_codes: Dict[str, int] = {}
+        self._series_namespace: List[int] = []
+        self._series_namespace_array = np.zeros(0, dtype=np.int32)
+        self._sealed: Dict[str, Tuple[float, Dict[str, Any], Dict[str, np.ndarray]]] = {}
+
+    # --- series dictionary -------------------------------------------------------------------
+
+    def _add_series(self, key: Tuple[str, str, str]) -> int:
+        series_id = len(self._series_keys)
+        self._series_keys.append(key)
+        self._series_index[key] = series_id
+        self._series_namespace.append(self._namespace_codes.setdefault(key[0], len(self._namespace_codes)))
+        return series_id
+
+    def _load_series(self) -> None:
+        """
+        Reads series added by other processes since the last call. Must hold self._lock.
+        """
+        try:
+            size = os.path.getsize(self._series_path)
+        except FileNotFoundError:
+            return
+        if size > self._series_offset:
+            with open(self._series_path, "rb") as f:
+                f.seek(self._series_offset)
+                data = f.read(size - self._series_offset)
+            complete = data[:data.rfind(b"\n") + 1]
+            for line in complete.splitlines():
+                self._add_series(tuple(json.loads(line)))
+            self._series_offset += len(complete)
+
+    def _namespace_of_series(self) -> np.ndarray:
+        if len(self._series_namespace_array) != len(self._series_namespace):
+            self._series_namespace_array = np.asarray(self._series_namespace, dtype=np.int32)
+        return self._series_namespace_array
+
+    def series_labels(self, series_ids: Iterable[int]) -> List[Tuple[str, str, str]]:
+        with self._lock:
+            self._load_series()
+            return [self._series_keys[i] for i in series_ids]
+
+    # --- writing -----------------------------------------------------------------------------
+
+    @contextmanager
+    def _writer(self):
+        with self._lock, open(os.path.join(self.path, "LOCK"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._load_series()
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def append(self, frame: fleet_engine.FleetFrame, timestamp: Optional[float] = None) -> int:
+        """
+        Appends one sample per container of the frame to the open hour. Returns the number of rows.
+        """
+        if len(frame) == 0:
+            return 0
+        with self._writer():
+            ts = int(self._clock() if timestamp is None else timestamp)
+            ids = []
+            new_series = []
+            index = self._series_index
+            for key in zip(frame.namespace.tolist(), frame.pod.tolist(), frame.container.tolist()):
+                series_id = index.get(key)
+                if series_id is None:
+                    series_id = self._add_series(key)
+                    new_series.append(json.dumps(key) + "\n")
+                ids.append(series_id)
+            if new_series:
+                data = "".join(new_series).encode()
+                with open(self._series_path, "ab") as f:
+                    f.write(data)
+                self._series_offset += len(data)
+
+            columns = {
+                "ts": np.full(len(ids), ts), "series": ids,
+                "cpu_request": frame.cpu_request, "cpu_usage": frame.cpu_usage,
+                "memory_request": frame.memory_request, "memory_usage": frame.memory_usage,
+            }
+            name = segment_name(RAW, ts)
+            if self._is_sealed(RAW, name):
+                # A collection that finished after its hour was sealed; sealed segments never change.
+                print(f"Dropping {len(ids)} samples for {name}: the segment is already sealed.")
+                return 0
+            segment = os.path.join(self.path, RAW, name)
+            os.makedirs(segment, exist_ok=True)
+            # A crash between two column writes leaves one column longer; drop the partial row first.
+            rows = self._row_count(segment, RAW)
+            for name, dtype in _COLUMNS[RAW].items():
+                with open(os.path.join(segment, name), "ab") as f:
+                    f.truncate(rows * np.dtype(dtype).itemsize)
+                    np.asarray(columns[name], dtype=dtype).tofile(f)
+            return len(ids)
+
+    def compact(self) -> None:
+        """
+        Seals finished hours, rolls up finished days and applies retention. Cheap when there is nothing to do.
+        """
+        with self._writer():
+            now = self._clock()
+            current_hour = segment_name(RAW, now)
+            today = segment_name(ROLLUP, now)
+            raw_segments = self.segments(RAW)
+            for name in raw_segments:
+                if name < current_hour and not self._is_sealed(RAW, name):
+                    self._seal(name)
+
+            rolled_up = set(self.segments(ROLLUP))
+            for day in sorted({name[:8] for name in raw_segments if name[:8] < today} - rolled_up):
+                columns, namespaces = self._rollup_day(day)
+                self._write_segment(ROLLUP, day, columns, namespaces)
+
+            raw_cutoff = segment_name(RAW, now - self.raw_retention_hours * 3600)
+            rollup_cutoff = segment_name(ROLLUP, now - self.rollup_retention_days * 86400)
+            for resolution, cutoff in ((RAW, raw_cutoff), (ROLLUP, rollup_cutoff)):
+                for name in self.segments(resolution):
+                    if name < cutoff:
+                        shutil.rmtree(os.path.join(self.path, resolution, name), ignore_errors=True)
+
+    def _seal(self, name: str) -> None:
+        columns = self._load_columns(os.path.join(self.path, RAW, name), RAW)
+        ranks = self._namespace_ranks()[self._namespace_of_series()[columns["series"]]]
+        order = np.lexsort((columns["ts"], columns["series"], ranks))
+        self._write_segment(RAW, name, {c: v[order] for c, v in columns.items()}, ranks[order])
+
+    def _rollup_day(self, day: str) -> Tuple[Dict[str, np.ndarray], np.ndarray]:
+        parts = [self._load_columns(os.path.join(self.path, RAW, name), RAW)
+                 for name in self.segments(RAW) if name.startswith(day)]
+        columns = {c: np.concatenate([p[c] for p in parts]) for c in _COLUMNS[RAW]}
+        ranks = self._namespace_ranks()[self._namespace_of_series()[columns["series"]]]
+        return rollup(columns, primary=ranks)
+
+    def _namespace_ranks(self) -> np.ndarray:
+        """
+        Maps namespace codes to the position of the namespace in sorted order.
+        """
+        names = sorted(self._namespace_codes, key=self._namespace_codes.get)
+        ranks = np.zeros(len(names), dtype=np.int64)
+        for rank, namespace in enumerate(sorted(names)):
+            ranks[self._namespace_codes[namespace]] = rank
+        return ranks
+
+    def _write_segment(self, resolution: str, name: str, columns: Dict[str, np.ndarray], ranks: np.ndarray) -> None:
+        """
+        Writes a sealed segment next to its final place and swaps it in.
+        """
+        namespaces = sorted(self._namespace_codes)
+        starts = _group_starts(ranks)
+        ends = np.r_[starts[1:], len(ranks)]
+        index = {"rows": int(len(ranks)),
+                 "namespaces": {namespaces[ranks[s]]: [int(s), int(e)] for s, e in zip(starts, ends)}}
+
+        directory = os.path.join(self.path, resolution)
+        target = os.path.join(directory, name)
+        tmp = os.path.join(directory, f".{name}.tmp")
+        old = os.path.join(directory, f".{name}.old")
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for column, dtype in _COLUMNS[resolution].items():
+            np.asarray(columns[column], dtype=dtype).tofile(os.path.join(tmp, column))
+        with open(os.path.join(tmp, _INDEX), "w") as f:
+            json.dump(index, f)
+        if os.path.exists(target):
+            os.rename(target, old)
+        os.rename(tmp, target)
+        shutil.rmtree(old, ignore_errors=True)
+
+    # --- reading -----------------------------------------------------------------------------
+
+    def segments(self, resolution: str) -> List[str]:
+        return sorted(name for name in os.listdir(os.path.join(self.path, resolution)) if not name.startswith("."))
+
+    def _is_sealed(self, resolution: str, name: str) -> bool:
+        return os.path.exists(os.path.join(self.path, resolution, name, _INDEX))
+
+    @staticmethod
+    def _row_count(segment: str, resolution: str) -> int:
+        rows = None
+        for name, dtype in _COLUMNS[resolution].items():
+            try:
+                n = os.path.getsize(os.path.join(segment, name)) // np.dtype(dtype).itemsize
+            except FileNotFoundError:
+                n = 0
+            rows = n if rows is None else min(rows, n)
+        return rows or 0
+
+    @classmethod
+    def _load_columns(cls, segment: str, resolution: str) -> Dict[str, np.ndarray]:
+        """
+        Memory-maps every column of a segment, up to the rows all of them already contain.
+        """
+        rows = cls._row_count(segment, resolution)
+        if rows == 0:
+            return {name: np.zeros(0, dtype=dtype) for name, dtype in _COLUMNS[resolution].items()}
+        return {name: np.memmap(os.path.join(segment, name), dtype=dtype, mode="r", shape=(rows,))
+                for name, dtype in _COLUMNS[resolution].items()}
+
+    def _sealed_segment(self, resolution: str, name: str):
+        """
+        Index and column maps of a sealed segment, kept open across queries.
+        """
+        segment = os.path.join(self.path, resolution, name)
+        try:
+            mtime = os.stat(os.path.join(segment, _INDEX)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        cached = self._sealed.get(segment)
+        if cached is None or cached[0] != mtime:
+            with open(os.path.join(segment, _INDEX)) as f:
+                index = json.load(f)
+            cached = self._sealed[segment] = (mtime, index, self._load_columns(segment, resolution))
+        return cached[1], cached[2]
+
+    def _read_segment(self, resolution: str, name: str, namespace: str) -> Optional[Dict[str, np.ndarray]]:
+        sealed = self._sealed_segment(resolution, name)
+        if sealed is not None:
+            index, columns = sealed
+            rows = index["namespaces"].get(namespace)
+            if rows is None:
+                return None
+            return {c: v[rows[0]:rows[1]] for c, v in columns.items()}
+
+        # The open hour is unsorted: select the namespace's rows by the namespace of their series.
+        columns = self._load_columns(os.path.join(self.path, resolution, name), resolution)
+        code = self._namespace_codes.get(namespace)
+        if code is None or len(columns["series"]) == 0:
+            return None
+        # Rows written after the series dictionary was last read belong to series not known yet.
+        namespace_of_series = self._namespace_of_series()
+        series = columns["series"]
+        known = series < len(namespace_of_series)
+        mask = known & (namespace_of_series[np.minimum(series, len(namespace_of_series) - 1)] == code)
+        return {c: v[mask] for c, v in columns.items()}
+
+    def read(self, namespace: str, start: float, end: float, resolution: Optional[str] = None,
+             pod_name: Optional[str] = None) -> Dict[str, np.ndarray]:
+        """
+        Columns of every sample of a namespace (or one of its pods) with start <= ts <= end.
+        resolution is RAW or ROLLUP; by default raw for windows up to TSDB_RAW_QUERY_MAX_SECONDS.
+        Hours and days not sealed or rolled up yet are read from the open raw segments.
+        """
+        resolution = resolution or (RAW if end - start <= TSDB_RAW_QUERY_MAX_SECONDS else ROLLUP)
+        with self._lock:
+            self._load_series()
+            self._namespace_of_series()
+        # Drop the maps of segments deleted by retention so their disk space is released.
+        for segment in [s for s in self._sealed if not os.path.exists(s)]:
+            self._sealed.pop(segment, None)
+
+        parts = []
+        if resolution == RAW:
+            first, last = segment_name(RAW, start), segment_name(RAW, end)
+            for name in self.segments(RAW):
+                if first <= name <= last:
+                    parts.append(self._read_segment(RAW, name, namespace))
+        else:
+            first, last = segment_name(ROLLUP, start), segment_name(ROLLUP, end)
+            rolled_up = set(self.segments(ROLLUP))
+            pending = {}
+            for name in self.segments(RAW):
+                if first <= name[:8] <= last and name[:8] not in rolled_up:
+                    pending.setdefault(name[:8], []).append(self._read_segment(RAW, name, namespace))
+            for day in sorted(rolled_up | set(pending)):
+                if not first <= day <= last:
+                    continue
+                if day in rolled_up:
+                    parts.append(self._read_segment(ROLLUP, day, namespace))
+                else:
+                    raw = [p for p in pending[day] if p is not None]
+                    if raw:
+                        parts.append(rollup({c: np.concatenate([p[c] for p in raw]) for c in _COLUMNS[RAW]})[0])
+
+        parts = [p for p in parts if p is not None and len(p["ts"])]
+        if not parts:
+            return {name: np.zeros(0, dtype=dtype) for name, dtype in _COLUMNS[resolution].items()}
+        columns = {c: np.concatenate([p[c] for p in parts]) for c in _COLUMNS[resolution]}
+
+        mask = (columns["ts"] >= start) & (columns["ts"] <= end)
+        if pod_name is not None:
+            ids = [i for i, key in enumerate(self._series_keys) if key[0] == namespace and key[1] == pod_name]
+            mask &= np.isin(columns["series"], ids)
+        return {c: v[mask] for c, v in columns.items()}
+
+    def first_timestamp(self, namespace: Optional[str] = None) -> Optional[int]:
+        """
+        Time of the oldest sample still stored, at any resolution, of a namespace or of any.
+        """
+        if namespace is not None:
+            with self._lock:
+                self._load_series()
+                self._namespace_of_series()
+        for resolution in (ROLLUP, RAW):
+            for name in self.segments(resolution):
+                if namespace is None:
+                    ts = self._load_columns(os.path.join(self.path, resolution, name), resolution)["ts"]
+                else:
+                    columns = self._read_segment(resolution, name, namespace)
+                    ts = columns["ts"] if columns is not None else ()
+                if len(ts):
+                    return int(ts.min())
+        return None
+
+    def covers(self, start: float, namespace: Optional[str] = None) -> bool:
+        """
+        True if the store has been collecting the namespace (or anything, by default) since start,
+        give or take one collection interval. A namespace first collected later is not covered.
+        """
+        first = self.first_timestamp(namespace)
+        return first is not None and first <= start + 60
+
+    def usage_percentiles(self, namespace: str, start: float, end: float,
+                          pod_name: Optional[str] = None) -> Dict[Tuple[str, str], Dict[str, Any]]:
+        """
+        p50/p95/p99/max usage per container over [start, end], in the format of
+        usage_history.fetch_usage_percentiles. Percentiles are taken over raw samples when they are
+        still kept for the whole window, otherwise over hourly means (max is always the true max).
+        """
+        raw_start = self._clock() - self.raw_retention_hours * 3600
+        resolution = RAW if start >= raw_start and end - start <= TSDB_RAW_QUERY_MAX_SECONDS else ROLLUP
+        columns = self.read(namespace, start, end, resolution, pod_name)
+        if len(columns["ts"]) == 0:
+            return {}
+
+        result = {}
+        labels = None
+        for resource, field in (("cpu", "cpu_millicores"), ("memory", "memory_bytes")):
+            series, stats = grouped_percentiles(columns["series"], columns[f"{resource}_usage"])
+            if resolution == ROLLUP:
+                maxima = grouped_percentiles(columns["series"], columns[f"{resource}_usage_max"])[1]
+                stats["max"] = maxima["max"]
+            labels = labels or dict(zip(series.tolist(), self.series_labels(series.tolist())))
+            for i, series_id in enumerate(series.tolist()):
+                _, pod, container = labels[series_id]
+                entry = result.setdefault((pod, container), {"name": container, "cpu_millicores": {}, "memory_bytes": {}})
+                entry[field] = {stat: float(values[i]) for stat, values in stats.items()}
+        return result
+
+    def trend(self, namespace: str, start: float, end: float, resolution: Optional[str] = None,
+              pod_name: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Stored samples of every container of a namespace (or pod) over [start, end], one entry per
+        container with aligned lists of timestamps, usage and requests.
+        """
+        columns = self.read(namespace, start, end, resolution, pod_name)
+        order = np.lexsort((columns["ts"], columns["series"]))
+        columns = {c: v[order] for c, v in columns.items()}
+        starts = _group_starts(columns["series"])
+        ends = np.r_[starts[1:], len(order)]
+        labels = self.series_labels(columns["series"][starts].tolist())
+
+        fields = [c for c in columns if c not in ("series", "samples")]
+        return [
+            dict({"pod_name": pod, "name": container},
+                 **{("timestamps" if c == "ts" else c): columns[c][s:e].tolist() for c in fields})
+            for (_, pod, container), s, e in zip(labels, starts, ends)
+        ]
+
+
+_store: Optional[TimeSeriesStore] = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> Optional[TimeSeriesStore]:
+    """
+    Process-wide store at TSDB_PATH, or None when TSDB_ENABLED is off.
+    """
+    global _store
+    if not TSDB_ENABLED:
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = TimeSeriesStore()
+        return _store
@@ -0,0 +1,212 @@
+import math
+import os
+import re
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from services import cache, prometheus_query, tsdb
+# Re-exported, for callers that handle history query errors.
+from services.prometheus_query import PrometheusQueryError, iter_prometheus_result
+
+# Window used when the caller does not choose one, as a Prometheus duration.
+HISTORY_DEFAULT_WINDOW = os.environ.get("HISTORY_DEFAULT_WINDOW", "7d")
+# Upper bound on points evaluated per series; the step grows with the window to stay under it.
+# Prometheus itself refuses range queries above 11000 points per series.
+HISTORY_MAX_POINTS = int(os.environ.get("HISTORY_MAX_POINTS", "2500"))
+# Smallest useful step: evaluating more often than Prometheus scrapes only repeats samples.
+PROMETHEUS_SCRAPE_INTERVAL_SECONDS = int(os.environ.get("PROMETHEUS_SCRAPE_INTERVAL_SECONDS", "30"))
+# Week-long subqueries are much slower than instant queries.
+HISTORY_TIMEOUT_SECONDS = float(os.environ.get("HISTORY_TIMEOUT_SECONDS", "30"))
+
+# Statistics returned per container, in order; "max" is max_over_time, the rest quantile_over_time.
+PERCENTILES = {"p50": 0.5, "p95": 0.95, "p99": 0.99, "max": None}
+
+# Steps are rounded up to one of these so that cache keys and Prometheus' own query cache line up.
+_NICE_STEPS = (15, 30, 60, 120, 300, 600, 900, 1800, 3600, 7200, 10800, 21600, 43200, 86400)
+
+_DURATION_PART = re.compile(r"(\d+)(ms|s|m|h|d|w|y)")
+_DURATION_SECONDS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800, "y": 31536000}
+
+
+def parse_duration(window: str) -> int:
+    """
+    Parses a Prometheus duration ("7d", "12h", "1h30m") into whole seconds. Raises ValueError otherwise.
+    """
+    position = 0
+    seconds = 0.0
+    for match in _DURATION_PART.finditer(window):
+        if match.start() != position:
+            break
+        seconds += int(match.group(1)) * _DURATION_SECONDS[match.group(2)]
+        position = match.end()
+    if not window or position != len(window) or seconds < 1:
+        raise ValueError(f"Invalid duration: {window!r}")
+    return int(seconds)
+
+
+def choose_step(window_seconds: int, max_points: int = HISTORY_MAX_POINTS,
+                min_step: int = PROMETHEUS_SCRAPE_INTERVAL_SECONDS) -> int:
+    """
+    Picks the evaluation step for a window: as fine as the scrape interval allows while keeping at
+    most max_points per series, rounded up to a "nice" step (1h -> 30s, 1d -> 1m, 7d -> 5m, 30d -> 30m).
+    """
+    step = max(min_step, math.ceil(window_seconds / max_points))
+    for nice in _NICE_STEPS:
+        if nice >= step:
+            return nice
+    return step
+
+
+def _selector(namespace: str, pod_name: Optional[str]) -> str:
+    # The same container series as the current usage query, so history never counts pause containers.
+    selector = f"{prometheus_query.matcher('namespace', [namespace])}, {prometheus_query._CONTAINER_FILTER}"
+    if pod_name:
+        selector += f", {prometheus_query.matcher('pod', [pod_name])}"
+    return selector
+
+
+def usage_expressions(namespace: str, pod_name: Optional[str], step: int) -> Dict[str, str]:
+    """
+    Per-(pod, container) usage expressions to evaluate over a window, CPU in cores and memory in bytes.
+    The rate window is at least one step so that no sample falls between two evaluations.
+    """
+    selector = _selector(namespace, pod_name)
+    rate_window = max(step, 4 * PROMETHEUS_SCRAPE_INTERVAL_SECONDS)
+    return {
+        "cpu": f'sum(rate(container_cpu_usage_seconds_total{{{selector}}}[{rate_window}s])) by (pod, container)',
+        "memory": f'sum(container_memory_working_set_bytes{{{selector}}}) by (pod, container)',
+    }
+
+
+def percentile_query(expression: str, window_seconds: int, step: int) -> str:
+    """
+    One query returning every statistic of PERCENTILES for every series of expression.
+
+    Each statistic is computed by Prometheus over a [window:step] subquery and tagged with a "stat"
+    label, so a week of samples never leaves the server and one round trip covers all of them.
+    """
+    parts = []
+    for stat, q in PERCENTILES.items():
+        over_time = (f"max_over_time(({expression})[{window_seconds}s:{step}s])" if q is None
+                     else f"quantile_over_time({q}, ({expression})[{window_seconds}s:{step}s])")
+        parts.append(f'label_replace({over_time}, "stat", "{stat}", "", "")')
+    return " or ".join(parts)
+
+
+def stream_query(path: str, params: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """
+    Streams the result items of a history query, with the longer timeout history queries need.
+    """
+    return prometheus_query.stream_query(path, params, timeout=HISTORY_TIMEOUT_SECONDS)
+
+
+def fetch_usage_percentiles(namespace: str, pod_name: Optional[str] = None,
+                            window: str = HISTORY_DEFAULT_WINDOW) -> Dict[Tuple[str, str], Dict[str, Any]]:
+    """
+    Fetches p50/p95/p99/max CPU and memory usage of every container in a namespace (or in one pod)
+    over a window, with one query per resource.
+
+    Returns a dictionary keyed by (pod_name, container_name), each value holding the container name,
+    "cpu_millicores" and "memory_bytes", each a dict of statistic -> value. Statistics Prometheus has
+    no samples for are missing. Returns {} on error.
+
+    When the collector's local store has been recording the namespace for the whole window, it is
+    read instead and Prometheus is not queried.
+    """
+    try:
+        window_seconds = parse_duration(window)
+        store = tsdb.get_store()
+        end = time.time()
+        if store is not None and store.covers(end - window_seconds, namespace):
+            local = store.usage_percentiles(namespace, end - window_seconds, end, pod_name=pod_name)
+            if local:
+                return local
+
+        step = choose_step(window_seconds)
+        container_stats = {}  # (pod, container) -> stats
+        for resource, expression in usage_expressions(namespace, pod_name, step).items():
+            field, scale = ("cpu_millicores", 1000) if resource == "cpu" else ("memory_bytes", 1)
+            query = percentile_query(expression, window_seconds, step)
+            for item in stream_query("/api/v1/query", {"query": query}):
+                labels = item["metric"]
+                key = (labels.get("pod"), labels.get("container"))
+                if not key[0] or not key[1]:
+                    continue
+                entry = container_stats.setdefault(key, {"name": key[1], "cpu_millicores": {}, "memory_bytes": {}})
+                entry[field][labels.get("stat")] = float(item["value"][1]) * scale
+
+        if not container_stats:
+            print(f"No Prometheus usage history found for {pod_name or '*'} in namespace '{namespace}' over {window}.")
+        return container_stats
+
+    except Exception as e:
+        print(f"An error occurred while fetching usage percentiles for {pod_name or '*'} in namespace '{namespace}': {e}")
+        return {}
+
+
+def extract_pod_usage_percentiles(pod_name: str, namespace: str, window: str = HISTORY_DEFAULT_WINDOW,
+                                  use_cache: bool = True) -> List[Dict[str, Any]]:
+    """
+    Usage percentiles of every container of a pod, served from the history cache when fresh.
+    """
+    stats = cache.history_cache.get_or_load(
+        ("pod_percentiles", namespace, pod_name, window),
+        lambda: fetch_usage_percentiles(namespace, pod_name, window), bypass=not use_cache)
+    return list(stats.values())
+
+
+def extract_namespace_usage_percentiles(namespace: str, window: str = HISTORY_DEFAULT_WINDOW,
+                                        use_cache: bool = True) -> Dict[Tuple[str, str], Dict[str, Any]]:
+    """
+    Usage percentiles of every container in a namespace, served from the history cache when fresh.
+    """
+    return cache.history_cache.get_or_load(
+        ("namespace_percentiles", namespace, window),
+        lambda: fetch_usage_percentiles(namespace, None, window), bypass=not use_cache)
+
+
+def as_utilization(stats: Dict[str, Any], percentile: str) -> Dict[str, Any]:
+    """
+    Picks one statistic out of a percentiles entry, in the format of the instant utilization.
+    """
+    if percentile not in PERCENTILES:
+        raise ValueError(f"Unknown percentile {percentile!r}; expected one of {', '.join(PERCENTILES)}")
+    return {
+        "name": stats["name"],
+        "cpu_utilization_millicores": stats["cpu_millicores"].get(percentile, 0.0),
+        "memory_utilization_bytes": stats["memory_bytes"].get(percentile, 0.0),
+    }
+
+
+def fetch_pod_usage_series(pod_name: str, namespace: str, window: str = HISTORY_DEFAULT_WINDOW,
+                           max_points: int = HISTORY_MAX_POINTS, end: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Fetches the CPU and memory usage of every container of a pod over a window with query_range,
+    at a step chosen so that no series exceeds max_points.
+
+    Returns {"step_seconds": step, "containers": [{"name", "cpu_millicores": [[ts, value], ...],
+    "memory_bytes": [[ts, value], ...]}, ...]}, or {} on error.
+    """
+    try:
+        window_seconds = parse_duration(window)
+        step = choose_step(window_seconds, max_points=max_points)
+        end = time.time() if end is None else end
+        # Align to the step so repeated calls evaluate the same timestamps.
+        end -= end % step
+        params = {"start": end - window_seconds, "end": end, "step": step}
+
+        containers = {}
+        for resource, expression in usage_expressions(namespace, pod_name, step).items():
+            field, scale = ("cpu_millicores", 1000) if resource == "cpu" else ("memory_bytes", 1)
+            for item in stream_query("/api/v1/query_range", dict(params, query=expression)):
+                name = item["metric"].get("container")
+                if not name:
+                    continue
+                entry = containers.setdefault(name, {"name": name, "cpu_millicores": [], "memory_bytes": []})
+                entry[field] = [[ts, float(value) * scale] for ts, value in item["values"]]
+
+        return {"step_seconds": step, "containers": list(containers.values())}
+
+    except Exception as e:
+        print(f"An error occurred while fetching usage history for pod '{pod_name}' in namespace '{namespace}': {e}")
+        return {}
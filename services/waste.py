@@ -0,0 +1,434 @@
+import fcntl
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from services import fleet_engine
+
+# Off by default, so processes do not write under a relative WASTE_PATH wherever they start.
+WASTE_ENABLED = os.environ.get("WASTE_ENABLED", "false").lower() in ("1", "true", "yes")
+WASTE_PATH = os.environ.get("WASTE_PATH", "data/waste")
+# Waste and throttling are summed over this many hours, in hourly slots. Containers not seen for that
+# long are dropped.
+WASTE_WINDOW_HOURS = int(os.environ.get("WASTE_WINDOW_HOURS", "24"))
+# A sample stands for the time since the container's previous one, up to this long (collector outages);
+# keep it at or above SCHEDULER_MAX_INTERVAL_SECONDS.
+WASTE_MAX_GAP_SECONDS = float(os.environ.get("WASTE_MAX_GAP_SECONDS", "300"))
+# CPU usage at or above this fraction of the request counts as time at risk of throttling.
+WASTE_THROTTLE_THRESHOLD = float(os.environ.get("WASTE_THROTTLE_THRESHOLD", "0.9"))
+# A container is flagged when it spent at least this share of the window at risk.
+WASTE_THROTTLE_SHARE = float(os.environ.get("WASTE_THROTTLE_SHARE", "0.25"))
+# The memory trend weighs a sample half as much as one this many hours newer.
+WASTE_TREND_HALF_LIFE_HOURS = float(os.environ.get("WASTE_TREND_HALF_LIFE_HOURS", "6"))
+# A container is flagged when its memory trend reaches its request within this many hours.
+WASTE_OOM_HORIZON_HOURS = float(os.environ.get("WASTE_OOM_HORIZON_HOURS", "24"))
+# Fewer (decay-weighted) samples than this are too few to trust a trend.
+WASTE_TREND_MIN_SAMPLES = float(os.environ.get("WASTE_TREND_MIN_SAMPLES", "10"))
+
+RANKINGS = ("cpu_waste", "memory_waste", "oom_risk", "throttle_risk")
+
+# Columns of the hourly slots and of the window totals.
+CPU_WASTE, MEMORY_WASTE, HOT_HOURS, OBSERVED_HOURS = range(4)
+# Decayed least-squares sums of the memory trend, with t in hours relative to the container's last sample.
+_W, _T, _X, _TT, _TX = range(5)
+_FORMAT_VERSION = 2
+
+ContainerKey = Tuple[str, str, str]  # (namespace, pod, container)
+
+
+class WasteStore:
+    """
+    Rolling waste, throttling-risk and memory-trend state of every container the collector samples,
+    ranked on demand.
+
+    update() takes one collection and costs time proportional to it, not to the history: each sample
+    adds (request - usage) x the time since the previous collection to the container's current hourly
+    slot and to its window totals, and folds its memory usage into decayed linear-regression sums. When
+    the hour changes, the slot that leaves the window is cleared and the totals are summed again from the
+    remaining slots, so they never drift.
+
+    Waste is in absolute units, millicore-hours and GiB-hours of requested but unused resources, so a
+    large idle deployment outranks a small one at the same ratio.
+
+    Limits are not collected, so risks are measured against the requests:
+    - Throttling risk is the share of time CPU usage was at or near the request. Above it, a
+      container no longer gets its guaranteed share under contention, and it is throttled at its
+      limit.
+    - OOM risk is a memory trend that reaches the request within WASTE_OOM_HORIZON_HOURS. A pod above
+      its request is the first to be OOM-killed or evicted when its node runs short of memory.
+
+    Persistence follows RecommenderStore: the rows are raw arrays of a rows-N generation, memory-mapped
+    and updated in place, under a file lock, by the collector; layout.npz names the generation and its
+    containers and is only rewritten when containers are added or dropped. Readers (the API) reload the
+    layout when it changed, and recompute their ranking columns after each collection.
+    """
+
+    def __init__(self, path: str = WASTE_PATH, window_hours: int = WASTE_WINDOW_HOURS,
+                 trend_half_life_hours: float = WASTE_TREND_HALF_LIFE_HOURS):
+        self.path = path
+        self.window_hours = window_hours
+        self.trend_half_life_hours = trend_half_life_hours
+        os.makedirs(path, exist_ok=True)
+        self._file = os.path.join(path, "layout.npz")
+        self._lock = threading.Lock()
+        self._stamp: Optional[Tuple[int, int]] = None
+        self._reset()
+
+    def _reset(self) -> None:
+        self.updated_at = 0
+        # The generation of the mapped rows (0: nothing written yet), and whether they are mapped for writing.
+        self._generation = 0
+        self._writable = True
+        self._state: Optional[np.ndarray] = None  # updated_at, then the hour each slot holds; mapped.
+        self._keys: List[ContainerKey] = []
+        self._index: Optional[Dict[ContainerKey, int]] = None
+        self._last_seen = np.zeros(0, dtype=np.int64)
+        self._slot_hours = np.full(self.window_hours, -1, dtype=np.int64)  # The hour each slot holds.
+        self._slots = np.zeros((0, self.window_hours, 4), dtype=np.float32)
+        self._totals = np.zeros((0, 4))
+        self._trend = np.zeros((0, 5))
+        self._last = np.zeros((0, 4))  # cpu_request, cpu_usage, memory_request, memory_usage of the last sample.
+        self._ranking: Optional[Dict[str, Any]] = None
+        self._ranking_at = 0  # The collection the ranking columns were computed after.
+        # The last frame's containers and their rows, and the names as last written.
+        self._frame_names: Optional[Tuple[list, ...]] = None
+        self._frame_rows: Optional[np.ndarray] = None
+        self._packed: Optional[np.ndarray] = None
+        self._resized = False  # Containers added or dropped: the next save writes a new generation.
+
+    # --- persistence -------------------------------------------------------------------------
+
+    def _file_stamp(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self._file)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _refresh(self) -> None:
+        """
+        Reloads the layout if another process replaced it. Must hold self._lock.
+        """
+        stamp = self._file_stamp()
+        if stamp != self._stamp:
+            self._stamp = stamp
+            self._reset()
+            if stamp is None:
+                return
+            with np.load(self._file, allow_pickle=False) as data:
+                version, window_hours, generation, rows = data["meta"].tolist()
+                if version != _FORMAT_VERSION or window_hours != self.window_hours:
+                    print(f"Ignoring {self._file}: written with another format or window")
+                    return
+                self._keys = fleet_engine.unpack_names(data["keys"])
+            try:
+                self._map(generation, "r")
+            except FileNotFoundError:
+                # A writer started a new generation after the layout was read.
+                self._stamp = None
+                return self._refresh()
+        if self._state is not None:
+            self.updated_at = int(self._state[0])
+
+    def _rows_path(self, generation: int) -> str:
+        return os.path.join(self.path, f"rows-{generation}")
+
+    def _row_files(self) -> Dict[str, Tuple[str, Tuple[int, ...]]]:
+        """
+        The raw array files of a generation: name -> (dtype, shape).
+        """
+        rows = len(self._keys)
+        return {"state": ("<i8", (1 + self.window_hours,)), "last_seen": ("<i8", (rows,)),
+                "slots": ("<f4", (rows, self.window_hours, 4)), "totals": ("<f8", (rows, 4)),
+                "trend": ("<f8", (rows, 5)), "last": ("<f8", (rows, 4))}
+
+    def _map(self, generation: int, mode: str) -> None:
+        """
+        Maps the rows of a generation, read-only ("r") or for updating in place ("r+").
+        """
+        directory = self._rows_path(generation)
+        arrays = {name: fleet_engine.map_rows(os.path.join(directory, name), dtype, shape, mode)
+                  for name, (dtype, shape) in self._row_files().items()}
+        self._state = arrays["state"]
+        self._slot_hours = self._state[1:]
+        self._last_seen, self._slots, self._totals = arrays["last_seen"], arrays["slots"], arrays["totals"]
+        self._trend, self._last = arrays["trend"], arrays["last"]
+        self._generation, self._writable = generation, mode == "r+"
+
+    def _save(self) -> None:
+        if not self._resized:
+            self._state[0] = self.updated_at
+            return
+        # Containers added or dropped: every row goes to a new generation, which the layout then points to.
+        generation = self._generation + 1
+        directory = self._rows_path(generation)
+        tmp = os.path.join(self.path, f".rows-{generation}.tmp")
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        arrays = {"state": np.concatenate([[self.updated_at], self._slot_hours]), "last_seen": self._last_seen,
+                  "slots": self._slots, "totals": self._totals, "trend": self._trend, "last": self._last}
+        for name, (dtype, _) in self._row_files().items():
+            np.ascontiguousarray(arrays[name], dtype=dtype).tofile(os.path.join(tmp, name))
+        os.rename(tmp, directory)
+
+        if self._packed is None:
+            self._packed = fleet_engine.pack_names(self._keys)
+        tmp = os.path.join(self.path, ".layout.npz.tmp")
+        with open(tmp, "wb") as f:
+            np.savez(f, meta=np.array([_FORMAT_VERSION, self.window_hours, generation, len(self._keys)]),
+                     keys=self._packed)
+        os.replace(tmp, self._file)
+        self._stamp = self._file_stamp()
+        for name in os.listdir(self.path):
+            if name.startswith("rows-") and name != os.path.basename(directory):
+                shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+        self._resized = False
+        self._map(generation, "r+")
+
+    @contextmanager
+    def _writer(self):
+        with self._lock, open(os.path.join(self.path, "LOCK"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._refresh()
+                if not self._writable:
+                    self._map(self._generation, "r+")
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    # --- writing -----------------------------------------------------------------------------
+
+    def update(self, frame: fleet_engine.FleetFrame, timestamp: Optional[float] = None) -> int:
+        """
+        Adds one collection. Containers with neither CPU nor memory usage had no usage data and are
+        skipped. Returns the containers added.
+        """
+        observed = np.flatnonzero((frame.cpu_usage > 0) | (frame.memory_usage > 0))
+        if len(observed) == 0:
+            return 0
+        names = (frame.namespace[observed].tolist(), frame.pod[observed].tolist(), frame.container[observed].tolist())
+        last = np.stack([frame.cpu_request[observed], frame.cpu_usage[observed],
+                         frame.memory_request[observed], frame.memory_usage[observed]], axis=1)
+        with self._writer():
+            ts = int(time.time() if timestamp is None else timestamp)
+            # Collections mostly list the same containers in the same order as the last one.
+            if names == self._frame_names:
+                rows = self._frame_rows
+            else:
+                rows = self._rows(zip(*names))
+                self._frame_names, self._frame_rows = names, rows
+            self._roll(ts // 3600)
+            # A sample counts for the time since the container's previous one, so namespaces the scheduler
+            # collects at different intervals add up alike. A container's first sample only starts its clock.
+            seen = self._last_seen[rows]
+            hours = np.where(seen > 0, np.clip(ts - seen, 0, WASTE_MAX_GAP_SECONDS), 0) / 3600
+            cpu_request, cpu_usage, memory_request, memory_usage = last.T
+            added = np.empty((len(rows), 4))
+            np.maximum(cpu_request - cpu_usage, 0, out=added[:, CPU_WASTE])
+            np.maximum(memory_request - memory_usage, 0, out=added[:, MEMORY_WASTE])
+            added[:, MEMORY_WASTE] /= 2.0 ** 30
+            added[:, HOT_HOURS] = (cpu_request > 0) & (cpu_usage >= cpu_request * WASTE_THROTTLE_THRESHOLD)
+            added[:, OBSERVED_HOURS] = 1.0
+            added *= hours[:, None]
+            self._slots[rows, (ts // 3600) % self.window_hours] += added.astype(np.float32)
+            self._totals[rows] += added
+
+            self._add_trend(rows, ts, memory_usage)
+            self._last[rows] = last
+            self._last_seen[rows] = ts
+            self.updated_at = ts
+            self._expire(ts)
+            self._ranking = None
+            self._save()
+            return len(rows)
+
+    def _rows(self, names) -> np.ndarray:
+        """
+        The row of each container, adding rows for new ones.
+        """
+        if self._index is None:
+            self._index = {key: i for i, key in enumerate(self._keys)}
+        index, keys = self._index, self._keys
+        rows = []
+        for key in names:
+            row = index.get(key)
+            if row is None:
+                row = index[key] = len(keys)
+                keys.append(key)
+                self._packed = None
+            rows.append(row)
+        added = len(keys) - len(self._last_seen)
+        if added:
+            self._last_seen = np.concatenate([self._last_seen, np.zeros(added, dtype=np.int64)])
+            self._slots = np.concatenate([self._slots, np.zeros((added,) + self._slots.shape[1:], dtype=np.float32)])
+            self._totals = np.concatenate([self._totals, np.zeros((added, 4))])
+            self._trend = np.concatenate([self._trend, np.zeros((added, 5))])
+            self._last = np.concatenate([self._last, np.zeros((added, 4))])
+            self._resized = True
+        return np.asarray(rows, dtype=np.int64)
+
+    def _roll(self, hour: int) -> None:
+        slot = hour % self.window_hours
+        if self._slot_hours[slot] == hour:
+            return
+        self._slots[:, slot] = 0
+        self._slot_hours[slot] = hour
+        # Hours that left the window (including ones skipped while nothing was collected) drop out.
+        current = self._slot_hours > hour - self.window_hours
+        self._totals[:] = self._slots[:, current].sum(axis=1, dtype=np.float64)
+
+    def _add_trend(self, rows: np.ndarray, ts: int, memory_usage: np.ndarray) -> None:
+        trend = self._trend[rows]
+        # Move t = 0 to this sample (earlier samples go d hours further back), decay, then add it at t = 0.
+        d = (ts - self._last_seen[rows]) / 3600
+        w, t, x = trend[:, _W].copy(), trend[:, _T].copy(), trend[:, _X]
+        trend[:, _TT] += d * (d * w - 2 * t)
+        trend[:, _TX] -= d * x
+        trend[:, _T] -= d * w
+        if self.trend_half_life_hours > 0:
+            trend *= (0.5 ** (d / self.trend_half_life_hours))[:, None]
+        trend[:, _W] += 1
+        trend[:, _X] += memory_usage
+        self._trend[rows] = trend
+
+    def _expire(self, ts: int) -> None:
+        keep = np.flatnonzero(self._last_seen >= ts - self.window_hours * 3600)
+        if len(keep) == len(self._keys):
+            return
+        self._keys = [self._keys[i] for i in keep.tolist()]
+        self._index = self._frame_names = self._frame_rows = self._packed = None
+        self._last_seen, self._slots, self._totals = self._last_seen[keep], self._slots[keep], self._totals[keep]
+        self._trend, self._last = self._trend[keep], self._last[keep]
+        self._resized = True
+
+    # --- reading -----------------------------------------------------------------------------
+
+    def _rank_columns(self) -> Dict[str, Any]:
+        """
+        Everything a ranking reads, computed once per collection. Must hold self._lock.
+        """
+        if self._ranking is not None and self._ranking_at == self.updated_at:
+            return self._ranking
+        totals, trend = self._totals, self._trend
+        w, t, x, tt, tx = trend.T
+        with np.errstate(divide="ignore", invalid="ignore"):
+            slope = np.where(w * tt - t * t > 0, (w * tx - t * x) / (w * tt - t * t), 0.0)
+            level = np.where(w > 0, (x - slope * t) / np.where(w > 0, w, 1), 0.0)
+            throttle = np.where(totals[:, OBSERVED_HOURS] > 0, totals[:, HOT_HOURS] / totals[:, OBSERVED_HOURS], 0.0)
+        slope[w < WASTE_TREND_MIN_SAMPLES] = 0.0
+        memory_request = self._last[:, 2]
+        # Hours until the trend reaches the request: 0 once above it, inf when it is not growing towards it.
+        hours_to_request = np.full(len(w), np.inf)
+        growing = (memory_request > 0) & (slope > 0)
+        hours_to_request[growing] = np.maximum(memory_request[growing] - level[growing], 0) / slope[growing]
+        hours_to_request[(memory_request > 0) & (level >= memory_request) & (w >= WASTE_TREND_MIN_SAMPLES)] = 0.0
+        namespaces: Dict[str, int] = {}
+        namespace_ids = np.fromiter((namespaces.setdefault(key[0], len(namespaces)) for key in self._keys),
+                                    dtype=np.int64, count=len(self._keys))
+        self._ranking_at = self.updated_at
+        self._ranking = {
+            "namespaces": namespaces, "namespace_ids": namespace_ids,
+            "slope": slope, "throttle": throttle, "hours_to_request": hours_to_request,
+            "oom_risk": hours_to_request <= WASTE_OOM_HORIZON_HOURS,
+            "throttle_risk": (throttle >= WASTE_THROTTLE_SHARE) & (totals[:, OBSERVED_HOURS] >= 1.0),
+        }
+        return self._ranking
+
+    def _scores(self, by: str, columns: Dict[str, Any]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The score of every container for a ranking (higher first) and the containers it ranks.
+        """
+        if by == "cpu_waste" or by == "memory_waste":
+            score = self._totals[:, CPU_WASTE if by == "cpu_waste" else MEMORY_WASTE]
+            return score, np.flatnonzero(score > 0)
+        if by == "oom_risk":
+            return -columns["hours_to_request"], np.flatnonzero(columns["oom_risk"])
+        if by == "throttle_risk":
+            return columns["throttle"], np.flatnonzero(columns["throttle_risk"])
+        raise ValueError(f"Unknown ranking {by!r}; expected one of {', '.join(RANKINGS)}")
+
+    def _records(self, rows: np.ndarray, columns: Dict[str, Any]) -> List[Dict[str, Any]]:
+        totals, last = self._totals[rows], self._last[rows]
+        hours_to_request = columns["hours_to_request"][rows]
+        values = (totals[:, CPU_WASTE].round(1).tolist(), totals[:, MEMORY_WASTE].round(3).tolist(),
+                  totals[:, OBSERVED_HOURS].round(2).tolist(), last.tolist(),
+                  columns["throttle"][rows].round(3).tolist(), columns["throttle_risk"][rows].tolist(),
+                  columns["slope"][rows].round().tolist(),
+                  [None if h == np.inf else round(h, 1) for h in hours_to_request.tolist()],
+                  columns["oom_risk"][rows].tolist())
+        records = []
+        for row, (cpu_waste, memory_waste, observed, (cpu_request, cpu_usage, memory_request, memory_usage),
+                  throttle, throttle_risk, slope, hours, oom_risk) in zip(rows.tolist(), zip(*values)):
+            namespace, pod, container = self._keys[row]
+            records.append({
+                "namespace": namespace, "pod_name": pod, "name": container,
+                "cpu_waste_millicore_hours": cpu_waste, "memory_waste_gib_hours": memory_waste,
+                "observed_hours": observed,
+                "cpu_request_millicores": cpu_request, "cpu_utilization_millicores": cpu_usage,
+                "memory_request_bytes": memory_request, "memory_utilization_bytes": memory_usage,
+                "cpu_throttle_share": throttle, "cpu_throttle_risk": throttle_risk,
+                "memory_trend_bytes_per_hour": slope, "memory_hours_to_request": hours, "oom_risk": oom_risk,
+            })
+        return records
+
+    def ranking(self, by: str = "cpu_waste", namespace: Optional[str] = None, top: int = 100) -> List[Dict[str, Any]]:
+        """
+        The top containers of the cluster (or of a namespace) by one of RANKINGS: most CPU or memory
+        wasted over the window, soonest to reach their memory request, or longest at their CPU request.
+        """
+        with self._lock:
+            self._refresh()
+            columns = self._rank_columns()
+            score, candidates = self._scores(by, columns)
+            if namespace is not None:
+                if namespace not in columns["namespaces"]:
+                    return []
+                candidates = candidates[columns["namespace_ids"][candidates] == columns["namespaces"][namespace]]
+            # Selection, not a sort: O(containers), then only the top are ordered.
+            if len(candidates) > top:
+                candidates = candidates[np.argpartition(-score[candidates], top - 1)[:top]]
+            candidates = candidates[np.argsort(-score[candidates], kind="stable")]
+            return self._records(candidates, columns)
+
+    def namespace_rankings(self, by: str = "cpu_waste", top: int = 10) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        The top containers of every namespace, in one pass over the fleet.
+        """
+        with self._lock:
+            self._refresh()
+            columns = self._rank_columns()
+            score, candidates = self._scores(by, columns)
+            namespace_ids = columns["namespace_ids"][candidates]
+            order = np.lexsort((-score[candidates], namespace_ids))
+            candidates, namespace_ids = candidates[order], namespace_ids[order]
+            # Position of each container within its namespace's run.
+            starts = np.flatnonzero(np.diff(namespace_ids, prepend=-1))
+            rank = np.arange(len(candidates)) - np.repeat(starts, np.diff(np.append(starts, len(candidates))))
+            selected = rank < top
+            rankings: Dict[str, List[Dict[str, Any]]] = {}
+            for record in self._records(candidates[selected], columns):
+                rankings.setdefault(record["namespace"], []).append(record)
+            return rankings
+
+
+_store: Optional[WasteStore] = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> Optional[WasteStore]:
+    """
+    Process-wide store at WASTE_PATH, or None when WASTE_ENABLED is off.
+    """
+    global _store
+    if not WASTE_ENABLED:
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = WasteStore()
+        return _store
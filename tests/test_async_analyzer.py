@@ -0,0 +1,114 @@
+import asyncio
+import time
+
+import pytest
+
+from services import async_analyzer, cache
+
+POD = {
+    "metadata": {"name": "web-1", "namespace": "shop"},
+    "spec": {"containers": [
+        {"name": "app", "resources": {"requests": {"cpu": "200m", "memory": "128Mi"}}},
+        {"name": "sidecar", "resources": {}},
+    ]},
+}
+
+
+@pytest.fixture(autouse=True)
+def empty_caches():
+    cache.pod_spec_cache.clear()
+    cache.usage_cache.clear()
+
+
+class FakeUpstreams(async_analyzer.AsyncUpstreams):
+    """
+    Serves a fixed pod and usage, each after a fixed delay, without any network.
+    """
+
+    def __init__(self, delay: float):
+        super().__init__()
+        self.delay = delay
+
+    async def get_pod(self, pod_name, namespace):
+        await asyncio.sleep(self.delay)
+        return POD if pod_name == "web-1" else None
+
+    async def query_prometheus(self, query):
+        await asyncio.sleep(self.delay)
+        self.queries = getattr(self, "queries", 0) + 1
+        labels = {"namespace": "shop", "pod": "web-1", "container": "app"}
+        return [{"metric": dict(labels, resource="cpu"), "value": [0, "0.1"]},
+                {"metric": dict(labels, resource="memory"), "value": [0, str(256 * 1024 * 1024)]}]
+
+
+def test_spec_and_usage_are_fetched_concurrently():
+    upstreams = FakeUpstreams(delay=0.2)
+
+    start = time.perf_counter()
+    results = asyncio.run(async_analyzer.analyze_pod_resource_usage_async("web-1", "shop", upstreams))
+    elapsed = time.perf_counter() - start
+
+    # Two upstream calls of 0.2 s each (CPU and memory share one query); run one after the other they would take 0.4 s.
+    assert elapsed < 0.3
+    assert upstreams.queries == 1
+    assert [r["name"] for r in results] == ["app", "sidecar"]
+
+    app = results[0]
+    assert app["pod_name"] == "web-1" and app["namespace"] == "shop"
+    assert app["cpu_request_millicores"] == 200
+    assert app["cpu_utilization_millicores"] == 100.0
+    assert app["cpu_over_provisioned"] is True
+    assert app["memory_usage_vs_request_ratio"] == 2.0
+    assert app["memory_under_provisioned"] is True
+
+    sidecar = results[1]
+    assert sidecar["cpu_request_millicores"] == 0.0
+    assert sidecar["cpu_usage_vs_request_ratio"] is None
+
+
+def test_missing_pod_returns_empty_list():
+    upstreams = FakeUpstreams(delay=0)
+
+    assert asyncio.run(async_analyzer.analyze_pod_resource_usage_async("missing", "shop", upstreams)) == []
+
+
+def test_pod_names_cannot_reach_other_api_paths(monkeypatch):
+    from fastapi.testclient import TestClient
+
+    from main import app
+
+    requested = []
+
+    class Response:
+        status = 404
+
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc_info):
+            return False
+
+    class Session:
+        def get(self, url, headers):
+            requested.append(url)
+            return Response()
+
+    class Configuration:
+        host = "https://api.example:6443/"
+
+        def get_api_key_with_prefix(self, name):
+            return "Bearer token"
+
+    upstreams = async_analyzer.AsyncUpstreams()
+    monkeypatch.setattr(upstreams, "_k8s_client", lambda: (Session(), Configuration()))
+    assert asyncio.run(upstreams.get_pod("../../secrets/x", "kube-system/secrets")) is None
+    assert requested == ["https://api.example:6443/api/v1/namespaces/kube-system%2Fsecrets/pods/..%2F..%2Fsecrets%2Fx"]
+
+    client = TestClient(app)
+    for params in ({"pod_name": "../../secrets/x", "namespace": "shop"}, {"pod_name": "web-1", "namespace": "a/b"},
+                   {"pod_name": "Web-1", "namespace": "shop"}):
+        assert client.get("/k8s/pod", params=params).status_code == 400
+        assert client.get("/k8s/pod/history", params=params).status_code == 400
+        assert client.get("/k8s/recommendations", params=params).status_code == 400
+    for route in ("/k8s/pods", "/k8s/pods/stream", "/k8s/pods/changes", "/k8s/history", "/k8s/waste"):
+        assert client.get(route, params={"namespace": "../kube-system"}).status_code == 400
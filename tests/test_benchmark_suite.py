@@ -0,0 +1,43 @@
+from benchmarks import fixtures, suite
+
+
+def test_fixtures_are_reproducible():
+    first, second = fixtures.generate(40, seed=3), fixtures.generate(40, seed=3)
+
+    assert first.pods == second.pods and first.usage == second.usage
+    assert fixtures.generate(40, seed=4).pods != first.pods
+    assert len(first.namespaces) == 1 and first.containers == len(first.usage)
+
+
+def test_fixture_round_trips_through_a_recording(tmp_path):
+    fixture = fixtures.generate(25)
+    fixture.save(str(tmp_path / "cluster.json.gz"))
+
+    loaded = fixtures.fixture_for(str(tmp_path / "cluster.json.gz"))
+    assert loaded.pods == fixture.pods and loaded.usage == fixture.usage
+
+
+def test_every_scenario_runs_against_the_stub_cluster():
+    results = suite.run_suite("small", repeat=1)
+
+    assert set(results["scenarios"]) == set(suite.SCENARIOS)
+    for name, result in results["scenarios"].items():
+        assert result["items"] > 0 and result["median_ms"] > 0, name
+
+
+def test_regressions_are_reported_against_the_baseline():
+    def result(items, median_ms, peak_mib):
+        return {"items": items, "min_ms": median_ms, "median_ms": median_ms, "throughput_per_s": items / median_ms * 1000, "peak_mib": peak_mib}
+
+    baseline = {"scenarios": {"a": result(100, 10.0, 10.0), "b": result(100, 10.0, 10.0), "tiny": result(100, 0.1, 0.1),
+                              "resized": result(100, 10.0, 10.0)}}
+    results = {"scenarios": {"a": result(100, 11.0, 11.0), "b": result(100, 20.0, 20.0),
+                             # 0.3 ms and 0.3 MiB more is three times the baseline, but below the noise floor.
+                             "tiny": result(100, 0.4, 0.4),
+                             # Twice the items in the same time: faster, not slower.
+                             "resized": result(200, 10.0, 10.0), "new": result(1, 1.0, 1.0)}}
+
+    assert suite.compare(results, baseline) == ["b: min_ms +100%", "b: peak_mib +100%"]
+    results["scenarios"]["resized"] = result(200, 40.0, 10.0)
+    assert suite.compare(results, baseline)[-2:] == ["resized: min_ms +300%", "resized: throughput_per_s -50%"]
+    assert suite.compare(results, None) == []
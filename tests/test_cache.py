@@ -0,0 +1,178 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from services.cache import TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_entries_expire_after_ttl():
+    clock = FakeClock()
+    cache = TTLCache("test", ttl=10, clock=clock)
+    calls = []
+
+    def loader():
+        calls.append(clock.now)
+        return {"value": len(calls)}
+
+    assert cache.get_or_load("pod", loader) == {"value": 1}
+    clock.now = 9.9
+    assert cache.get_or_load("pod", loader) == {"value": 1}
+    clock.now = 10.0
+    assert cache.get_or_load("pod", loader) == {"value": 2}
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["expirations"]) == (1, 2, 1)
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache("test", ttl=60, maxsize=2)
+    cache.get_or_load("a", lambda: "A")
+    cache.get_or_load("b", lambda: "B")
+    cache.get_or_load("a", lambda: "unused")  # touch a, so b is now the oldest
+    cache.get_or_load("c", lambda: "C")
+
+    assert cache.get_or_load("a", lambda: "reloaded") == "A"
+    assert cache.get_or_load("b", lambda: "reloaded") == "reloaded"
+    assert cache.stats()["evictions"] == 2
+
+
+def test_empty_results_are_not_cached():
+    cache = TTLCache("test", ttl=60)
+    results = iter([None, [], [{"name": "app"}]])
+
+    assert cache.get_or_load("pod", lambda: next(results)) is None
+    assert cache.get_or_load("pod", lambda: next(results)) == []
+    assert cache.get_or_load("pod", lambda: next(results)) == [{"name": "app"}]
+    assert cache.stats()["size"] == 1
+
+
+def test_bypass_always_loads_and_refreshes_the_cache():
+    cache = TTLCache("test", ttl=60)
+    cache.get_or_load("pod", lambda: "old")
+
+    assert cache.get_or_load("pod", lambda: "new", bypass=True) == "new"
+    assert cache.get_or_load("pod", lambda: "unused") == "new"
+    assert cache.stats()["bypasses"] == 1
+
+
+def test_concurrent_threads_share_one_load():
+    cache = TTLCache("test", ttl=60)
+    calls = []
+    start = threading.Barrier(100)
+
+    def loader():
+        calls.append(1)
+        time.sleep(0.2)
+        return "spec"
+
+    results = []
+
+    def worker():
+        start.wait()
+        results.append(cache.get_or_load("pod", loader))
+
+    threads = [threading.Thread(target=worker) for _ in range(100)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(calls) == 1
+    assert results == ["spec"] * 100
+
+
+def test_errors_reach_every_waiting_thread_and_are_not_cached():
+    cache = TTLCache("test", ttl=60)
+    entered = threading.Event()
+    release = threading.Event()
+
+    def failing_loader():
+        entered.set()
+        release.wait()
+        raise RuntimeError("upstream down")
+
+    errors = []
+
+    def worker():
+        try:
+            cache.get_or_load("pod", failing_loader)
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    leader = threading.Thread(target=worker)
+    leader.start()
+    entered.wait()
+    follower = threading.Thread(target=worker)
+    follower.start()
+    while cache.stats()["coalesced"] == 0:
+        time.sleep(0.001)
+    release.set()
+    leader.join()
+    follower.join()
+
+    assert errors == ["upstream down", "upstream down"]
+    assert cache.get_or_load("pod", lambda: "recovered") == "recovered"
+
+
+def test_concurrent_tasks_share_one_load():
+    cache = TTLCache("test", ttl=60)
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return ["usage"]
+
+    async def main():
+        return await asyncio.gather(*(cache.aget_or_load("pod", loader) for _ in range(100)))
+
+    results = asyncio.run(main())
+
+    assert len(calls) == 1
+    assert results == [["usage"]] * 100
+    stats = cache.stats()
+    assert (stats["misses"], stats["coalesced"]) == (1, 99)
+
+
+def test_cancelled_task_does_not_cancel_shared_load():
+    cache = TTLCache("test", ttl=60)
+
+    async def loader():
+        await asyncio.sleep(0.05)
+        return "spec"
+
+    async def main():
+        first = asyncio.ensure_future(cache.aget_or_load("pod", loader))
+        second = asyncio.ensure_future(cache.aget_or_load("pod", loader))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(main()) == "spec"
+
+
+def test_batch_load_fetches_only_the_missing_keys():
+    cache = TTLCache("test", ttl=60)
+    cache.get_or_load("a", lambda: "A")
+    batches = []
+
+    def loader(keys):
+        batches.append(keys)
+        return {key: key.upper() for key in keys if key != "empty"}
+
+    assert cache.get_many_or_load(["a", "b", "c", "b", "empty"], loader) == {"a": "A", "b": "B", "c": "C", "empty": None}
+    assert cache.get_many_or_load(["b", "c"], loader) == {"b": "B", "c": "C"}
+    cache.get_many_or_load(["a"], loader, bypass=True)
+    assert batches == [["b", "c", "empty"], ["a"]]
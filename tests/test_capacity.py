@@ -0,0 +1,129 @@
+import numpy as np
+from fastapi.testclient import TestClient
+
+from benchmarks import fixtures, suite
+from services import capacity, pod_inventory
+
+GIB = 1024.0 ** 3
+
+
+def pod(namespace, name, node, workload, *containers):
+    return capacity.PodUsage(namespace, name, node, workload, tuple(containers))
+
+
+def test_workload_is_found_through_owner_references():
+    def owned(kind, name, **labels):
+        return {"name": "web-7d4b9-x2x1z", "labels": labels,
+                "ownerReferences": [{"kind": kind, "name": name, "controller": True}]}
+
+    assert pod_inventory.workload_of(owned("ReplicaSet", "web-7d4b9", **{"pod-template-hash": "7d4b9"})) == ("Deployment", "web")
+    assert pod_inventory.workload_of(owned("ReplicaSet", "legacy-rs")) == ("ReplicaSet", "legacy-rs")
+    assert pod_inventory.workload_of(owned("StatefulSet", "db")) == ("StatefulSet", "db")
+    assert pod_inventory.workload_of({"name": "debug"}) == ("Pod", "debug")
+
+
+def test_packing_is_first_fit_decreasing():
+    # Two 600m pods cannot share a 1000m node; the 300m pods fill the gaps they leave, then a third node.
+    used_cpu, used_memory, unplaceable = capacity.pack(
+        np.array([300.0, 600.0, 2000.0]), np.array([1.0, 1.0, 1.0]), np.array([5, 2, 1]), 1000.0, 10.0)
+
+    assert used_cpu.tolist() == [900.0, 900.0, 900.0]
+    assert used_memory.tolist() == [2.0, 2.0, 3.0]
+    assert unplaceable == 1
+
+
+def test_model_totals_right_sizing_and_simulation():
+    model = capacity.CapacityModel(headroom=0.0, cpu_step=100.0, memory_step=GIB)
+    model.set_nodes({"node-a": (4000.0, 16 * GIB), "node-b": (4000.0, 16 * GIB)})
+    web = ("Deployment", "web")
+    pods = [
+        pod("shop", "web-1", "node-a", web, ("app", 1000.0, 2 * GIB, 250.0, 0.5 * GIB)),
+        pod("shop", "web-2", "node-b", web, ("app", 1000.0, 2 * GIB, 410.0, 0.7 * GIB)),
+        pod("shop", "agent-a", "node-a", ("DaemonSet", "agent"), ("agent", 100.0, 0.25 * GIB, 50.0, 0.1 * GIB)),
+        pod("data", "db-0", "node-b", ("StatefulSet", "db"), ("db", 2000.0, 8 * GIB, 1500.0, 6 * GIB)),
+    ]
+
+    assert model.sync(pods) == 4
+    report = model.report()
+
+    node_a = report["nodes"][0]
+    assert (node_a["name"], node_a["pods"], node_a["cpu_request_millicores"]) == ("node-a", 2, 1100.0)
+    assert node_a["cpu_request_ratio"] == 1100.0 / 4000.0
+    assert [(n["namespace"], n["pods"], n["right_sized_cpu_millicores"]) for n in report["namespaces"]] == [
+        ("data", 1, 1500.0), ("shop", 3, 1100.0)]
+    web_report = next(w for w in report["workloads"] if w["name"] == "web")
+    # Sized for the busier replica, rounded up to the steps.
+    assert web_report["pods"] == 2
+    assert (web_report["right_sized_cpu_millicores"], web_report["right_sized_memory_bytes"]) == (500.0, GIB)
+
+    simulation = report["simulation"]
+    assert simulation["daemonset_cpu_millicores_per_node"] == 100.0
+    # 2 x 500m + 1500m on one node of 4000m less the 100m agent; memory 2 + 6 GiB of 15 GiB.
+    assert (simulation["current_nodes"], simulation["nodes_needed"]) == (2, 1)
+    assert simulation["right_sized_cpu_millicores"] == 2500.0
+
+
+def test_only_changed_pods_are_recomputed():
+    model = capacity.CapacityModel(headroom=0.0, cpu_step=100.0, memory_step=GIB)
+    model.set_nodes({"node-a": (4000.0, 16 * GIB)})
+    pods = [pod("shop", f"web-{i}", "node-a", ("Deployment", "web"), ("app", 500.0, GIB, 200.0, 0.5 * GIB))
+            for i in range(3)]
+    model.sync(pods)
+    first = model.simulate()
+
+    # Usage moves but rounds to the same right-sized request: the packing is reused as is.
+    pods[0] = pod("shop", "web-0", "node-a", ("Deployment", "web"), ("app", 500.0, GIB, 150.0, 0.5 * GIB))
+    assert model.sync(pods) == 1
+    assert model.simulate() is first
+    assert model.report()["nodes"][0]["cpu_utilization_millicores"] == 550.0
+
+    # One replica gone: totals shrink and the packing is redone.
+    assert model.sync(pods[1:]) == 1
+    report = model.report()
+    assert report["nodes"][0]["pods"] == 2 and report["simulation"] is not first
+    assert report["simulation"]["right_sized_cpu_millicores"] == 400.0
+
+
+def test_capacity_report_against_the_stub_cluster():
+    fixture = fixtures.generate(300)
+    capacity._models.clear()
+
+    with suite.StubCluster(fixture) as cluster:
+        report = cluster.client().get("/k8s/capacity", params={"use_cache": "false"}).json()
+        bad = cluster.client().get("/k8s/capacity", params={"node_cpu": "lots"})
+
+    assert bad.status_code == 400
+    assert len(report["nodes"]) == len(fixture.nodes)
+    assert sum(n["pods"] for n in report["nodes"]) == len(fixture.pods)
+    assert {w["kind"] for w in report["workloads"]} == {"Deployment", "StatefulSet"}
+    assert len(report["workloads"]) == len(fixture.pods) // 5
+    simulation = report["simulation"]
+    assert simulation["current_nodes"] == len(fixture.nodes) and simulation["nodes_needed"] > 0
+    assert simulation["containers_without_usage"] == 0
+
+
+def test_completed_pods_hold_no_node_resources(monkeypatch):
+    inventory = pod_inventory.PodInventory()
+    listed = [inventory._record_from_pod({
+        "metadata": {"namespace": "batch", "name": name},
+        "spec": {"nodeName": "node-a", "containers": [{"name": "job", "resources": {"requests": {"cpu": "1"}}}]},
+        "status": {"phase": phase},
+    }, {}) for name, phase in (("job-1", "Running"), ("job-0", "Succeeded"), ("job-x", "Failed"), ("job-2", "Pending"))]
+    assert [record.active for record in listed] == [True, False, False, True]
+
+    capacity._models.clear()
+    monkeypatch.setattr(pod_inventory, "pods_in_scope", lambda: listed)
+    monkeypatch.setattr(capacity.metrics_analyzer, "namespace_utilization", lambda namespaces, **kwargs: {})
+    monkeypatch.setattr(capacity, "get_node_allocatable", lambda use_cache=True: {"node-a": (4000.0, 16 * GIB)})
+    [node] = capacity.analyze_cluster_capacity()["nodes"]
+    assert node["pods"] == 2 and node["cpu_request_millicores"] == 2000.0
+
+
+def test_models_are_kept_per_duration_and_bounded(monkeypatch):
+    capacity._models.clear()
+    monkeypatch.setattr(capacity, "CAPACITY_MODELS", 2)
+    hour = capacity.get_model("p95", "1h")
+    assert capacity.get_model("p95", "60m") is hour and capacity.get_model("p95", "3600s") is hour
+    assert capacity.get_model(None, "1h") is capacity.get_model()  # The window only matters for a percentile.
+    capacity.get_model("p99", "1h")
+    assert len(capacity._models) == 2 and capacity.get_model("p95", "1h") is not hour
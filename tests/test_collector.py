@@ -0,0 +1,197 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+import redis
+
+from benchmarks.stubs import start_redis
+from services import (Celery_tasks, collector, metrics_analyzer, pod_inventory, rate_limit, recommender, scheduler, tsdb,
+                      waste)
+
+
+def requests_for(count):
+    return [{"name": f"c{i}", "cpu_request_millicores": 100.0, "memory_request_bytes": 2.0 ** 20} for i in range(count)]
+
+
+POD_REQUESTS = [
+    ("shop", "web-1", requests_for(2)),
+    ("shop", "web-2", requests_for(2)),
+    ("data", "db-0", requests_for(1)),
+    ("batch", "job-0", requests_for(3)),
+    ("batch", "job-1", requests_for(3)),
+    ("tiny", "cron-0", requests_for(1)),
+]
+
+
+def test_chunks_keep_namespaces_whole_and_balanced():
+    chunks = collector.plan_chunks(POD_REQUESTS, max_containers=5)
+
+    assert sorted(p for chunk in chunks for p in chunk) == sorted(POD_REQUESTS)
+    namespaces = [{ns for ns, _, _ in chunk} for chunk in chunks]
+    assert all(not (a & b) for i, a in enumerate(namespaces) for b in namespaces[i + 1:])
+    # 12 containers in chunks of about 5: batch (6) alone, the rest spread over the other two.
+    assert sorted(sum(len(r) for _, _, r in chunk) for chunk in chunks) == [2, 4, 6]
+
+    assert collector.plan_chunks([]) == []
+    assert len(collector.plan_chunks(POD_REQUESTS, max_containers=1000)) == 1
+
+
+def test_token_bucket_spaces_out_acquisitions():
+    now = [0.0]
+    waits = []
+
+    def sleep(seconds):
+        waits.append(seconds)
+        now[0] += seconds
+
+    bucket = rate_limit.TokenBucket(rate=4, burst=2, clock=lambda: now[0], sleep=sleep)
+    for _ in range(6):
+        bucket.acquire()
+
+    # Two tokens of burst, then one every 0.25 s.
+    assert waits == [0.25, 0.25, 0.25, 0.25]
+    assert rate_limit.TokenBucket(rate=0).acquire() == 0.0
+
+
+def test_shared_rate_limit_counts_every_process():
+    server, url = start_redis()
+    try:
+        client = redis.Redis.from_url(url)
+        now = [100.0]
+        waits = []
+
+        def sleep(seconds):
+            waits.append(seconds)
+            now[0] += seconds
+
+        # Two worker processes, 4 queries a second between them.
+        workers = [rate_limit.SharedRateLimiter("prometheus", rate=4, client=client, clock=lambda: now[0], sleep=sleep)
+                   for _ in range(2)]
+        for i in range(6):
+            workers[i % 2].acquire()
+        assert waits == [1.0]
+
+        # Without Redis, each process falls back to the limit on its own.
+        down = rate_limit.SharedRateLimiter("prometheus", rate=4, client=redis.Redis(port=1, socket_connect_timeout=0.1))
+        assert down.acquire() == 0.0
+    finally:
+        server.shutdown()
+
+
+@pytest.fixture
+def eager_celery():
+    conf = Celery_tasks.celery_app.conf
+    previous = conf.task_always_eager
+    conf.task_always_eager = True
+    yield
+    conf.task_always_eager = previous
+
+
+def test_fan_out_collects_every_namespace_into_one_store_write(eager_celery, monkeypatch, tmp_path):
+    queried = []
+
+    def fake_namespace_usage(namespace):
+        if namespace == "data":
+            return {}  # Prometheus had nothing for it: no sample, rather than zero usage.
+        return {(pod, r["name"]): {"name": r["name"], "cpu_utilization_millicores": 50.0, "memory_utilization_bytes": 2.0 ** 19}
+                for ns, pod, requests_data in POD_REQUESTS if ns == namespace for r in requests_data}
+
+    def fake_usage(namespaces):
+        queried.append(sorted(namespaces))
+        return {namespace: fake_namespace_usage(namespace) for namespace in namespaces}
+
+    store = tsdb.TimeSeriesStore(str(tmp_path))
+    appends = []
+    original_append = store.append
+    monkeypatch.setattr(store, "append", lambda frame, timestamp=None: appends.append(timestamp) or original_append(frame, timestamp))
+    monkeypatch.setattr(tsdb, "get_store", lambda: store)
+    sketches = recommender.RecommenderStore(str(tmp_path / "recommender"))
+    monkeypatch.setattr(recommender, "get_store", lambda: sketches)
+    ranking = waste.WasteStore(str(tmp_path / "waste"))
+    monkeypatch.setattr(waste, "get_store", lambda: ranking)
+    records = [pod_inventory.PodRecord(ns, pod, None, (), tuple((r["name"], r["cpu_request_millicores"], r["memory_request_bytes"])
+                                                                for r in requests_data),
+                                       ("Deployment", pod.rsplit("-", 1)[0]) if ns == "shop" else None)
+               for ns, pod, requests_data in POD_REQUESTS]
+    monkeypatch.setattr(pod_inventory, "pods_in_scope", lambda namespace=None, label_selector=None: records)
+    monkeypatch.setattr(metrics_analyzer, "fetch_namespaces_utilization_from_prometheus", fake_usage)
+    monkeypatch.setattr(collector, "COLLECTOR_CHUNK_CONTAINERS", 5)
+    monkeypatch.setattr(rate_limit, "k8s_limiter", rate_limit.TokenBucket(rate=0))
+    monkeypatch.setattr(rate_limit, "prometheus_limiter", rate_limit.TokenBucket(rate=0))
+    monkeypatch.setattr(scheduler, "get_scheduler", lambda: None)  # Every namespace, every tick.
+
+    assert Celery_tasks.collect_pod_utilization.delay().get() == 3
+
+    # One usage query per chunk, covering each namespace once; one store append for the whole collection.
+    assert len(queried) == 3
+    assert sorted(namespace for chunk in queried for namespace in chunk) == ["batch", "data", "shop", "tiny"]
+    assert len(appends) == 1
+    ts = appends[0]
+    shop = store.read("shop", ts, ts, tsdb.RAW)
+    assert len(shop["ts"]) == 4 and set(shop["cpu_usage"].tolist()) == {50.0}
+    assert len(store.read("data", ts, ts, tsdb.RAW)["ts"]) == 0
+    assert sum(len(store.read(ns, ts, ts, tsdb.RAW)["ts"]) for ns in ("shop", "data", "batch", "tiny")) == 11
+
+    # The same samples fed the usage sketches; the two web replicas are merged into one workload.
+    web = sketches.recommendations(namespace="shop")
+    assert [(r["kind"], r["name"], r["container"], r["pods"]) for r in web] == [("Deployment", "web", "c0", 2), ("Deployment", "web", "c1", 2)]
+    assert sketches.recommendations(namespace="data") == []  # No usage data, nothing to recommend from.
+    # And the waste ranking: one collection starts its clock, so nothing is wasted yet.
+    assert len(ranking._keys) == 11 and ranking.ranking("cpu_waste") == []
+
+
+def test_chunks_past_the_deadline_do_not_fail_the_collection(eager_celery, monkeypatch, tmp_path):
+    now = [1790812800.0]
+    queried = []
+
+    def slow_usage(namespaces):
+        queried.append(sorted(namespaces))
+        now[0] += collector.COLLECTOR_DEADLINE_SECONDS + 1  # Every chunk after this one starts too late.
+        return {namespace: {(pod, r["name"]): {"name": r["name"], "cpu_utilization_millicores": 50.0,
+                                               "memory_utilization_bytes": 2.0 ** 19}
+                            for ns, pod, requests_data in POD_REQUESTS if ns == namespace for r in requests_data}
+                for namespace in namespaces}
+
+    store = tsdb.TimeSeriesStore(str(tmp_path), clock=lambda: now[0])
+    monkeypatch.setattr(tsdb, "get_store", lambda: store)
+    for module in (recommender, waste):
+        monkeypatch.setattr(module, "get_store", lambda: None)
+    records = [pod_inventory.PodRecord(ns, pod, None, (), tuple((r["name"], r["cpu_request_millicores"], r["memory_request_bytes"])
+                                                                for r in requests_data), None)
+               for ns, pod, requests_data in POD_REQUESTS]
+    monkeypatch.setattr(pod_inventory, "pods_in_scope", lambda namespace=None, label_selector=None: records)
+    monkeypatch.setattr(metrics_analyzer, "fetch_namespaces_utilization_from_prometheus", slow_usage)
+    monkeypatch.setattr(collector, "COLLECTOR_CHUNK_CONTAINERS", 5)
+    monkeypatch.setattr(rate_limit, "k8s_limiter", rate_limit.TokenBucket(rate=0))
+    monkeypatch.setattr(rate_limit, "prometheus_limiter", rate_limit.TokenBucket(rate=0))
+    monkeypatch.setattr(scheduler, "get_scheduler", lambda: None)
+    monkeypatch.setattr(Celery_tasks, "time", SimpleNamespace(time=lambda: now[0], perf_counter=time.perf_counter))
+
+    assert Celery_tasks.collect_pod_utilization.delay().get() == 3
+
+    # The other two chunks were skipped, and the first one was still stored.
+    assert len(queried) == 1
+    ts = 1790812800
+    stored = {ns: len(store.read(ns, ts, ts, tsdb.RAW)["ts"]) for ns in ("shop", "data", "batch", "tiny")}
+    assert sum(stored.values()) == sum(len(r) for ns, _, r in POD_REQUESTS if ns in queried[0])
+    assert all(stored[ns] == 0 for ns in stored if ns not in queried[0])
+
+
+def test_a_prometheus_outage_is_not_stored_as_idle_containers(monkeypatch, tmp_path):
+    # What fetch_namespaces_utilization_from_prometheus returns when the query fails.
+    monkeypatch.setattr(metrics_analyzer, "fetch_namespaces_utilization_from_prometheus", lambda namespaces: {})
+    monkeypatch.setattr(rate_limit, "prometheus_limiter", rate_limit.TokenBucket(rate=0))
+    columns = collector.collect_chunk(POD_REQUESTS)
+    assert len(columns["cpu_usage"]) == 12 and all(value != value for value in columns["cpu_usage"])
+
+    store = tsdb.TimeSeriesStore(str(tmp_path))
+    monkeypatch.setattr(tsdb, "get_store", lambda: store)
+    sketches = recommender.RecommenderStore(str(tmp_path / "recommender"))
+    monkeypatch.setattr(recommender, "get_store", lambda: sketches)
+    ranking = waste.WasteStore(str(tmp_path / "waste"))
+    monkeypatch.setattr(waste, "get_store", lambda: ranking)
+    monkeypatch.setattr(scheduler, "get_scheduler", lambda: None)
+
+    assert Celery_tasks.store_collected_chunks([columns], 1790812800) == 0
+    assert len(store.read("shop", 1790812800, 1790812800, tsdb.RAW)["ts"]) == 0
+    assert sketches.recommendations() == [] and len(ranking._keys) == 0
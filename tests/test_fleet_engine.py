@@ -0,0 +1,48 @@
+import math
+
+from services import fleet_engine, metrics_analyzer
+
+POD_REQUESTS = [
+    ("shop", "web-1", [
+        {"name": "app", "cpu_request_millicores": 200, "memory_request_bytes": 128 * 2**20},
+        {"name": "no-request", "cpu_request_millicores": 0.0, "memory_request_bytes": 0.0},
+        {"name": "idle", "cpu_request_millicores": 0.0, "memory_request_bytes": 0.0},
+    ]),
+    ("data", "db-0", [
+        {"name": "postgres", "cpu_request_millicores": 1000, "memory_request_bytes": 2**30},
+    ]),
+]
+UTILIZATION = {
+    "shop": {
+        ("web-1", "app"): {"name": "app", "cpu_utilization_millicores": 300.0, "memory_utilization_bytes": 64 * 2**20},
+        ("web-1", "no-request"): {"name": "no-request", "cpu_utilization_millicores": 5.0, "memory_utilization_bytes": 1e6},
+    },
+    "data": {},
+}
+
+
+def test_vectorized_records_match_per_container_analysis():
+    expected = [
+        metrics_analyzer.analyze_container_usage(pod_name, namespace, req, UTILIZATION[namespace].get((pod_name, req["name"])))
+        for namespace, pod_name, requests_data in POD_REQUESTS
+        for req in requests_data
+    ]
+
+    analysis = fleet_engine.analyze_frame(fleet_engine.build_frame(POD_REQUESTS, UTILIZATION))
+    records = fleet_engine.to_records(analysis)
+
+    assert records == expected
+    no_request = records[1]
+    assert math.isinf(no_request["cpu_usage_vs_request_ratio"])
+    assert records[2]["cpu_usage_vs_request_ratio"] is None
+    assert list(records[0].keys()) == list(expected[0].keys())
+
+
+def test_rows_select_a_subset_and_ids_map_back_to_containers():
+    frame = fleet_engine.build_frame(POD_REQUESTS, UTILIZATION)
+    analysis = fleet_engine.analyze_frame(frame)
+
+    row = frame.row("data", "db-0", "postgres")
+    assert row == 3
+    assert [r["name"] for r in fleet_engine.to_records(analysis, rows=[row, 0])] == ["postgres", "app"]
+    assert fleet_engine.to_records(fleet_engine.analyze_frame(fleet_engine.build_frame([], {}))) == []
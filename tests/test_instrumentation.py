@@ -0,0 +1,84 @@
+import pytest
+import requests
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+
+from main import app
+from services import cache, instrumentation, metrics_analyzer
+
+client = TestClient(app)
+
+POD_REQUESTS = [
+    ("shop", f"web-{i}", [{"name": "app", "cpu_request_millicores": 200.0, "memory_request_bytes": 2.0 ** 27}])
+    for i in range(5)
+]
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+@pytest.fixture(autouse=True)
+def fake_cluster(monkeypatch):
+    cache.usage_cache.clear()
+    monkeypatch.setattr(metrics_analyzer, "list_pod_requests", lambda namespace=None, label_selector=None: POD_REQUESTS)
+    monkeypatch.setattr(metrics_analyzer, "fetch_namespaces_utilization_from_prometheus", lambda namespaces: {})
+
+
+def test_analysis_stages_and_items_are_recorded():
+    analyses = sample("rgsz_stage_duration_seconds_count", stage="analysis")
+    pods = sample("rgsz_items_processed_total", kind="pods")
+
+    assert client.get("/k8s/pods?namespace=shop").status_code == 200
+
+    assert sample("rgsz_stage_duration_seconds_count", stage="analysis") == analyses + 1
+    assert sample("rgsz_stage_duration_seconds_count", stage="namespace_usage") >= 1
+    assert sample("rgsz_items_processed_total", kind="pods") == pods + len(POD_REQUESTS)
+
+
+def test_upstream_errors_are_counted_by_type():
+    def not_found():
+        response = requests.Response()
+        response.status_code = 404
+        raise requests.HTTPError("404 Client Error", response=response)
+
+    def timed_out():
+        raise requests.ReadTimeout()
+
+    def crashed():
+        return 1 / 0
+
+    calls = sample("rgsz_upstream_requests_total", upstream="test", operation="get")
+    for failure in (not_found, timed_out, crashed):
+        with pytest.raises(Exception):
+            with instrumentation.upstream("test", "get"):
+                failure()
+
+    assert sample("rgsz_upstream_requests_total", upstream="test", operation="get") == calls + 3
+    for error in ("http_404", "timeout", "ZeroDivisionError"):
+        assert sample("rgsz_upstream_errors_total", upstream="test", operation="get", error=error) >= 1
+
+
+def test_metrics_endpoint_exposes_cache_ratio_and_route_latency():
+    client.get("/k8s/pods?namespace=shop")
+    client.get("/k8s/pods?namespace=shop")
+    client.get("/no/such/path")
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    assert 'rgsz_cache_hit_ratio{cache="usage"}' in body
+    assert 'rgsz_cache_lookups_total{cache="usage",result="hits"}' in body
+    # Latency is labelled by route template, never by raw path.
+    assert 'rgsz_http_request_duration_seconds_count{method="GET",route="/k8s/pods",status="200"}' in body
+    assert 'route="unmatched",status="404"' in body
+    assert "/no/such/path" not in body
+
+
+def test_disabled_metrics_record_nothing(monkeypatch):
+    monkeypatch.setattr(instrumentation, "METRICS_ENABLED", False)
+    before = sample("rgsz_stage_duration_seconds_count", stage="disabled")
+    with instrumentation.stage("disabled"):
+        pass
+    assert sample("rgsz_stage_duration_seconds_count", stage="disabled") == before
@@ -0,0 +1,43 @@
+import os
+
+from services.k8s_client import KubeClientManager
+
+KUBECONFIG = """apiVersion: v1
+kind: Config
+clusters:
+- name: local
+  cluster:
+    server: {server}
+contexts:
+- name: local
+  context:
+    cluster: local
+    user: local
+current-context: local
+users:
+- name: local
+  user:
+    token: test
+"""
+
+
+def test_client_is_shared_and_reloaded_when_kubeconfig_changes(tmp_path, monkeypatch):
+    monkeypatch.delenv("KUBERNETES_SERVICE_HOST", raising=False)
+    path = tmp_path / "config"
+    path.write_text(KUBECONFIG.format(server="http://127.0.0.1:1"))
+
+    manager = KubeClientManager(pool_maxsize=7, reload_check_interval=0, config_file=str(path))
+    v1 = manager.core_v1()
+
+    assert manager.core_v1() is v1
+    assert v1.api_client.configuration.host == "http://127.0.0.1:1"
+    assert v1.api_client.configuration.connection_pool_maxsize == 7
+
+    path.write_text(KUBECONFIG.format(server="http://127.0.0.1:2"))
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    reloaded = manager.core_v1()
+    assert reloaded is not v1
+    assert reloaded.api_client.configuration.host == "http://127.0.0.1:2"
+    manager.close()
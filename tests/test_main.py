@@ -92,4 +92,24 @@ def test_get_pod_metrics_missing_required_parameters():
     assert any("pod_name" in err.get("loc", []) for err in data["detail"]), \
         f"Expected error for 'pod_name', but got: {data['detail']}"
     assert any("namespace" in err.get("loc", []) for err in data["detail"]), \
-        f"Expected error for 'namespace', but got: {data['detail']}"
\ No newline at end of file
+        f"Expected error for 'namespace', but got: {data['detail']}"
+
+def test_get_namespace_metrics_for_system_namespace():
+    """
+    Tests the /k8s/pods endpoint for a whole namespace.
+    Like the single pod test, this relies on a reachable cluster; without one the analyzer
+    returns an empty list and the endpoint still answers 200.
+    """
+    namespace = "kube-system"
+
+    response = client.get(f"/k8s/pods?namespace={namespace}")
+
+    assert response.status_code == 200, \
+        f"Expected status code 200, but got {response.status_code}. Response: {response.json()}"
+    assert response.headers["content-type"] == "application/json"
+
+    data = response.json()
+    assert isinstance(data, list), f"Expected response to be a list, but got {type(data)}: {data}"
+    for container_metrics in data:
+        assert container_metrics["namespace"] == namespace
+        assert "pod_name" in container_metrics and "name" in container_metrics
@@ -0,0 +1,76 @@
+from types import SimpleNamespace
+
+from services import metrics_analyzer
+
+
+def make_pod(name, namespace, containers):
+    """
+    Builds a minimal stand-in for a V1Pod with the attributes the analyzer reads.
+    containers is a list of (container_name, requests_dict) tuples.
+    """
+    return SimpleNamespace(
+        metadata=SimpleNamespace(name=name, namespace=namespace),
+        spec=SimpleNamespace(containers=[
+            SimpleNamespace(name=c_name, resources=SimpleNamespace(requests=requests))
+            for c_name, requests in containers
+        ]),
+    )
+
+
+def test_batch_analysis_joins_usage_per_namespace(monkeypatch):
+    """
+    Pods from two namespaces are joined with one utilization fetch per namespace,
+    and each record matches what analyze_container_usage builds for a single pod.
+    """
+    pods = [
+        make_pod("web-1", "shop", [("app", {"cpu": "200m", "memory": "128Mi"}), ("sidecar", {"cpu": "50m"})]),
+        make_pod("web-2", "shop", [("app", {"cpu": "200m", "memory": "128Mi"})]),
+        make_pod("db-0", "data", [("postgres", {"cpu": "1", "memory": "1Gi"})]),
+    ]
+    usage = {
+        "shop": {
+            ("web-1", "app"): {"name": "app", "cpu_utilization_millicores": 300.0, "memory_utilization_bytes": 64 * 1024 * 1024},
+            ("web-2", "app"): {"name": "app", "cpu_utilization_millicores": 100.0, "memory_utilization_bytes": 0.0},
+        },
+        "data": {
+            ("db-0", "postgres"): {"name": "postgres", "cpu_utilization_millicores": 500.0, "memory_utilization_bytes": 2 * 1024 ** 3},
+        },
+    }
+    fetched = []
+
+    def fake_usage(namespaces):
+        fetched.append(sorted(namespaces))
+        return {namespace: usage[namespace] for namespace in namespaces}
+
+    monkeypatch.setattr(metrics_analyzer, "fetch_namespaces_utilization_from_prometheus", fake_usage)
+
+    results = metrics_analyzer.analyze_pods_resource_usage(pods, use_cache=False)
+
+    # Both namespaces in a single query.
+    assert fetched == [["data", "shop"]]
+    assert [(r["namespace"], r["pod_name"], r["name"]) for r in results] == [
+        ("shop", "web-1", "app"), ("shop", "web-1", "sidecar"), ("shop", "web-2", "app"), ("data", "db-0", "postgres"),
+    ]
+
+    web1_app = results[0]
+    assert web1_app["cpu_request_millicores"] == 200
+    assert web1_app["cpu_usage_vs_request_ratio"] == 1.5
+    assert web1_app["cpu_under_provisioned"] is True
+    assert web1_app["memory_usage_vs_request_ratio"] == 0.5
+    assert web1_app["memory_over_provisioned"] is True
+
+    # A container without usage series is still reported, with zero utilization.
+    sidecar = results[1]
+    assert sidecar["cpu_utilization_millicores"] == 0.0
+    assert sidecar["cpu_over_provisioned"] is True
+
+    postgres = results[3]
+    assert postgres["memory_usage_vs_request_ratio"] == 2.0
+    assert postgres["memory_under_provisioned"] is True
+
+
+def test_namespace_analysis_returns_empty_list_without_pods(monkeypatch):
+    monkeypatch.setattr(metrics_analyzer.pod_inventory, "pods_in_scope", lambda namespace=None, label_selector=None: [])
+
+    assert metrics_analyzer.analyze_namespace_resource_usage("empty") == []
+    assert metrics_analyzer.analyze_cluster_resource_usage() == []
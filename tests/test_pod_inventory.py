@@ -0,0 +1,171 @@
+from services import metrics_analyzer, pod_inventory
+from services.pod_inventory import PodInventory, ResourceVersionExpired, parse_label_selector
+
+
+def pod(name, namespace="shop", node="node-a", labels=None, cpu="100m", memory="64Mi", rv="1"):
+    return {
+        "metadata": {"name": name, "namespace": namespace, "labels": labels or {}, "resourceVersion": rv},
+        "spec": {"nodeName": node, "containers": [
+            {"name": "app", "resources": {"requests": {"cpu": cpu, "memory": memory}}},
+        ]},
+    }
+
+
+class FakeApi:
+    """
+    Serves a paginated pod list and scripted watch streams, recording the resourceVersion of each watch.
+    """
+
+    def __init__(self, pages, streams):
+        self.pages = pages
+        self.streams = list(streams)
+        self.list_calls = 0
+        self.watched_from = []
+
+    def list(self, limit, continue_token):
+        self.list_calls += 1
+        index = int(continue_token or 0)
+        page = {"items": self.pages[index], "metadata": {"resourceVersion": "100"}}
+        if index + 1 < len(self.pages):
+            page["metadata"]["continue"] = str(index + 1)
+        return page
+
+    def watch(self, resource_version, timeout_seconds):
+        self.watched_from.append(resource_version)
+        return iter(self.streams.pop(0))
+
+
+def make_inventory(api, **kwargs):
+    return PodInventory(list_func=api.list, watch_func=api.watch, **kwargs)
+
+
+def test_relist_follows_pages_and_builds_indexes():
+    api = FakeApi(pages=[
+        [pod("web-1", labels={"app": "web"}), pod("web-2", node="node-b", labels={"app": "web"})],
+        [pod("db-0", namespace="data", labels={"app": "db"}, cpu="1500m", memory="1Gi")],
+    ], streams=[])
+    inventory = make_inventory(api, page_size=2)
+
+    inventory.relist()
+
+    assert inventory.synced.is_set()
+    assert inventory.resource_version == "100"
+    assert len(inventory) == 3
+    assert inventory.get("data", "db-0").requests() == [
+        {"name": "app", "cpu_request_millicores": 1500, "memory_request_bytes": 1024 ** 3},
+    ]
+    assert sorted(r.name for r in inventory.select("shop")) == ["web-1", "web-2"]
+    assert sorted(r.name for r in inventory.select(label_selector="app=web")) == ["web-1", "web-2"]
+    assert [r.name for r in inventory.pods_on_node("node-b")] == ["web-2"]
+    # Replicas with identical specs share one containers tuple.
+    assert inventory.get("shop", "web-1").containers is inventory.get("shop", "web-2").containers
+
+
+def test_watch_events_update_indexes_and_resume_from_last_version():
+    api = FakeApi(pages=[[pod("web-1", labels={"app": "web"})]], streams=[
+        [
+            {"type": "ADDED", "object": pod("web-2", labels={"app": "web"}, rv="101")},
+            {"type": "MODIFIED", "object": pod("web-1", node="node-b", labels={"app": "api"}, cpu="250m", rv="102")},
+        ],
+        [
+            {"type": "BOOKMARK", "object": {"metadata": {"resourceVersion": "150"}}},
+            {"type": "DELETED", "object": pod("web-2", rv="151")},
+        ],
+    ])
+    inventory = make_inventory(api)
+    inventory.relist()
+
+    inventory.watch_once()
+    inventory.watch_once()
+
+    assert api.watched_from == ["100", "102"]
+    assert inventory.resource_version == "151"
+    assert inventory.get("shop", "web-2") is None
+    web1 = inventory.get("shop", "web-1")
+    assert web1.node_name == "node-b"
+    assert web1.requests()[0]["cpu_request_millicores"] == 250
+    assert inventory.select(label_selector="app=web") == []
+    assert inventory.select(label_selector="app=api") == [web1]
+    assert inventory.pods_on_node("node-a") == []
+
+
+def test_values_of_deleted_pods_do_not_stay_interned():
+    api = FakeApi(pages=[[pod("web-1", labels={"app": "web"})]], streams=[])
+    inventory = make_inventory(api)
+    inventory.relist()
+
+    # Churn: every pod has labels of its own (a new template hash per rollout) and is deleted again.
+    for i in range(5000):
+        batch = pod(f"job-{i}", labels={"app": "job", "pod-template-hash": str(i)}, rv=str(200 + i))
+        inventory.apply_event({"type": "ADDED", "object": batch})
+        inventory.apply_event({"type": "DELETED", "object": batch})
+
+    assert len(inventory._interned) <= 2 * 2 + pod_inventory._INTERNED_SLACK + 1
+    # Live pods keep sharing their interned values.
+    inventory.apply_event({"type": "ADDED", "object": pod("web-2", labels={"app": "web"}, rv="9000")})
+    assert inventory.get("shop", "web-2").labels is inventory.get("shop", "web-1").labels
+
+
+def test_gone_error_triggers_relist():
+    api = FakeApi(pages=[[pod("web-1")]], streams=[
+        [{"type": "ERROR", "object": {"code": 410, "reason": "Expired", "message": "too old resource version"}}],
+        [],
+    ])
+    inventory = make_inventory(api)
+    inventory.relist()
+
+    try:
+        inventory.watch_once()
+        assert False, "expected ResourceVersionExpired"
+    except ResourceVersionExpired:
+        pass
+
+    # run() reacts the same way: drop the version, list again, then watch from the fresh version.
+    inventory.resource_version = None
+    inventory.relist()
+    inventory.watch_once()
+    assert api.list_calls == 2
+    assert api.watched_from == ["100", "100"]
+
+
+def test_label_selector_parsing_and_matching():
+    terms = parse_label_selector("app=web, tier!=db, env in (prod, staging), canary, !legacy")
+    assert terms[0] == ("=", "app", "web")
+    assert terms[1] == ("!=", "tier", "db")
+    assert terms[2] == ("in", "env", frozenset({"prod", "staging"}))
+    assert terms[3] == ("exists", "canary", None)
+    assert terms[4] == ("!exists", "legacy", None)
+
+    api = FakeApi(pages=[[
+        pod("a", labels={"app": "web", "env": "prod", "canary": "1"}),
+        pod("b", labels={"app": "web", "env": "dev", "canary": "1"}),
+        pod("c", labels={"app": "web", "env": "prod", "canary": "1", "legacy": "1"}),
+    ]], streams=[])
+    inventory = make_inventory(api)
+    inventory.relist()
+
+    assert [r.name for r in inventory.select("shop", "app=web,env in (prod,staging),canary,!legacy")] == ["a"]
+
+
+def test_analyzer_reads_requests_from_inventory(monkeypatch):
+    api = FakeApi(pages=[[pod("web-1", cpu="300m")]], streams=[])
+    inventory = make_inventory(api)
+    inventory.relist()
+    monkeypatch.setattr(pod_inventory, "_inventory", inventory)
+
+    def no_network(*args, **kwargs):
+        raise AssertionError("the Kubernetes API must not be called")
+
+    monkeypatch.setattr(metrics_analyzer, "fetch_k8s_pod_data", no_network)
+    monkeypatch.setattr(metrics_analyzer, "list_k8s_pods", no_network)
+
+    assert metrics_analyzer.extract_pod_requests("web-1", "shop", use_cache=False)[0]["cpu_request_millicores"] == 300
+    assert metrics_analyzer.extract_pod_requests("missing", "shop", use_cache=False) == []
+    assert metrics_analyzer.list_pod_requests("shop") == [("shop", "web-1", inventory.get("shop", "web-1").requests())]
+
+    # Without the inventory, pods are listed once in raw JSON, never as V1Pod objects.
+    monkeypatch.setattr(pod_inventory, "_inventory", None)
+    monkeypatch.setattr(pod_inventory.PodInventory, "_api_list", lambda self, limit, continue_token: api.list(limit, continue_token))
+    api.pages = [[pod("web-2", cpu="250m")]]
+    assert metrics_analyzer.list_pod_requests("shop") == [
+        ("shop", "web-2", [{"name": "app", "cpu_request_millicores": 250.0, "memory_request_bytes": 64.0 * 2 ** 20}])]
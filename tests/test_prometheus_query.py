@@ -0,0 +1,69 @@
+import pytest
+
+from benchmarks import fixtures
+from benchmarks.stubs import ClusterPrometheusHandler, server_url, start_server
+from services import metrics_analyzer, prometheus_query
+
+
+@pytest.fixture
+def prometheus(monkeypatch):
+    cluster = fixtures.generate(600)
+    server = start_server(ClusterPrometheusHandler, cluster=cluster)
+    monkeypatch.setattr(prometheus_query, "PROMETHEUS_URL", server_url(server))
+    yield cluster
+    server.shutdown()
+
+
+def test_usage_query_merges_cpu_and_memory_with_regex_matchers():
+    query = prometheus_query.usage_query(["shop", "data-eu.1"], ["web-1"])
+
+    assert 'namespace=~"data\\\\-eu\\\\.1|shop"' in query
+    assert 'pod="web-1"' in query and 'container!="", container!="POD"' in query
+    assert query.count("sum by (namespace, pod, container)") == 2
+    assert '"resource", "cpu"' in query and '"resource", "memory"' in query
+
+
+def test_parse_usage_joins_the_series_of_a_container():
+    labels = {"namespace": "shop", "pod": "web-1", "container": "app"}
+    usage = prometheus_query.parse_usage([
+        {"metric": dict(labels, resource="cpu"), "value": [0, "0.25"]},
+        {"metric": dict(labels, resource="memory"), "value": [0, "1024"]},
+        {"metric": {"namespace": "shop", "pod": "web-1"}, "value": [0, "1"]},  # Pod cgroup, no container.
+    ])
+
+    assert usage == {"shop": {("web-1", "app"): {"name": "app", "cpu_utilization_millicores": 250.0,
+                                                 "memory_utilization_bytes": 1024.0}}}
+
+
+def test_one_query_covers_every_namespace(prometheus):
+    namespaces = prometheus.namespaces
+    queries = []
+    original = prometheus_query.query
+
+    def counted_query(expression, **kwargs):
+        queries.append(expression)
+        return original(expression, **kwargs)
+
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(prometheus_query, "query", counted_query)
+        usage = metrics_analyzer.fetch_namespaces_utilization_from_prometheus(namespaces)
+
+    assert len(queries) == 1 and len(namespaces) == 3
+    assert sum(len(containers) for containers in usage.values()) == len(prometheus.usage)
+    (namespace, pod, container), (cpu, memory) = next(iter(prometheus.usage.items()))
+    assert usage[namespace][(pod, container)]["cpu_utilization_millicores"] == pytest.approx(cpu * 1000)
+    assert usage[namespace][(pod, container)]["memory_utilization_bytes"] == memory
+
+
+def test_pod_usage_comes_from_a_single_query(prometheus):
+    pod = prometheus.pods[0]["metadata"]
+
+    containers = metrics_analyzer.fetch_pod_utilization_from_prometheus(pod["name"], pod["namespace"])
+
+    assert sorted(c["name"] for c in containers) == sorted(c["name"] for c in prometheus.pods[0]["spec"]["containers"])
+
+
+def test_results_over_the_series_limit_are_truncated(prometheus):
+    result = prometheus_query.query(prometheus_query.usage_query(prometheus.namespaces[:1]), limit=10)
+
+    assert len(result) == 10
@@ -0,0 +1,74 @@
+from decimal import Decimal
+
+import pytest
+from hypothesis import given, strategies as st
+
+from services import quantity
+from services.metrics_analyzer import convert_cpu_to_millicores, convert_mem_to_bytes
+
+BINARY_SI = {"Ki": 2**10, "Mi": 2**20, "Gi": 2**30, "Ti": 2**40, "Pi": 2**50, "Ei": 2**60}
+DECIMAL_SI = {"n": Decimal("1e-9"), "u": Decimal("1e-6"), "m": Decimal("1e-3"), "": Decimal(1),
+              "k": Decimal("1e3"), "M": Decimal("1e6"), "G": Decimal("1e9"), "T": Decimal("1e12"),
+              "P": Decimal("1e15"), "E": Decimal("1e18")}
+
+# <signedNumber> ::= <sign> <number> | <number>, with <number> ::= <digits> | <digits>.<digits> | <digits>. | .<digits>
+digits = st.text(alphabet="0123456789", min_size=1, max_size=6)
+numbers = st.one_of(
+    digits,
+    st.tuples(digits, digits).map(lambda t: f"{t[0]}.{t[1]}"),
+    digits.map(lambda d: f"{d}."),
+    digits.map(lambda d: f".{d}"),
+)
+signed_numbers = st.tuples(st.sampled_from(["", "+", "-"]), numbers).map("".join)
+
+
+@given(signed_numbers, st.sampled_from(sorted(BINARY_SI)))
+def test_binary_si_suffixes(number, suffix):
+    assert quantity.parse_quantity(number + suffix) == Decimal(number) * BINARY_SI[suffix]
+
+
+@given(signed_numbers, st.sampled_from(sorted(DECIMAL_SI)))
+def test_decimal_si_suffixes(number, suffix):
+    assert quantity.parse_quantity(number + suffix) == Decimal(number) * DECIMAL_SI[suffix]
+
+
+@given(signed_numbers, st.sampled_from(["e", "E"]), st.sampled_from(["", "+", "-"]), st.integers(0, 20))
+def test_decimal_exponents(number, e, sign, exponent):
+    parsed = quantity.parse_quantity(f"{number}{e}{sign}{exponent}")
+    assert parsed == Decimal(number) * Decimal(10) ** int(f"{sign}{exponent}")
+
+
+@given(st.integers(0, 10**9))
+def test_cpu_and_memory_units(n):
+    assert convert_cpu_to_millicores(f"{n}m") == n
+    assert convert_cpu_to_millicores(str(n)) == n * 1000
+    assert convert_mem_to_bytes(f"{n}Mi") == n * 2**20
+    assert convert_mem_to_bytes(f"{n}k") == n * 1000
+
+
+@given(signed_numbers, st.sampled_from(["Kib", "mi", "ki", "x", "B", "iB", "e", "E+", "m m", "Mii"]))
+def test_strings_outside_the_grammar_are_rejected(number, suffix):
+    with pytest.raises(ValueError):
+        quantity.parse_quantity(number + suffix)
+
+
+def test_fractions_and_exponents_no_longer_fail():
+    assert convert_cpu_to_millicores("0.5") == 500
+    assert convert_cpu_to_millicores("1.5m") == 1.5
+    assert convert_cpu_to_millicores("0.1") == 100
+    assert convert_cpu_to_millicores("250000n") == 0.25
+    assert convert_mem_to_bytes("1e3") == 1000
+    assert convert_mem_to_bytes("1.5Gi") == 1.5 * 2**30
+    assert convert_mem_to_bytes("1E") == 10**18
+
+
+@given(st.lists(st.sampled_from(["100m", "0.5", "1", "128Mi", "1Gi", "", None, "bogus", "2e2"]), max_size=50))
+def test_bulk_matches_single_parsing(values):
+    def single(convert, value):
+        try:
+            return convert(value) if value else 0.0
+        except ValueError:
+            return 0.0
+
+    assert quantity.cpu_to_millicores_bulk(values).tolist() == [single(quantity.cpu_to_millicores, v) for v in values]
+    assert quantity.memory_to_bytes_bulk(values).tolist() == [single(quantity.memory_to_bytes, v) for v in values]
@@ -0,0 +1,186 @@
+import os
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from services import fleet_engine, recommender
+from services.recommender import CPU, MEMORY, SKETCH_BINS, SKETCH_GAMMA, RecommenderStore, Sketches
+
+HOUR = 3600
+# 2026-10-01T00:00:00Z
+T0 = 1790812800
+
+
+def sketch_of(values, rows=1):
+    sketches = Sketches(rows)
+    for value in values:
+        sketches.add(np.zeros(1, dtype=np.int64), CPU, [value])
+    return sketches
+
+
+def test_quantiles_are_within_the_bucket_ratio_above_the_truth():
+    values = np.random.default_rng(1).lognormal(mean=5, sigma=0.5, size=5000)
+    sketches = sketch_of(values)
+    row = np.zeros(1, dtype=np.int64)
+
+    for q in (0.5, 0.9, 0.95, 0.99):
+        estimate = sketches.quantiles(row, CPU, q)[0]
+        truth = np.quantile(values, q, method="inverted_cdf")
+        assert truth <= estimate * (1 + 1e-9) <= truth * SKETCH_GAMMA * (1 + 1e-9)
+    assert values.max() <= sketches.quantiles(row, CPU, None)[0] <= values.max() * SKETCH_GAMMA
+    # Fixed size whatever the number of samples.
+    assert sketches.counts.shape == (1, 2, SKETCH_BINS) and sketches.totals(row, CPU)[0] == 5000
+
+
+def test_window_moves_up_and_collapses_the_low_end():
+    # 1000x range, more than the window covers: the high quantiles stay exact to the bucket ratio,
+    # the lowest ones are overestimated, never under.
+    values = np.geomspace(1, 1000, 2000)
+    sketches = sketch_of(values)
+    row = np.zeros(1, dtype=np.int64)
+
+    p99 = sketches.quantiles(row, CPU, 0.99)[0]
+    assert np.quantile(values, 0.99, method="inverted_cdf") <= p99 <= np.quantile(values, 0.99) * SKETCH_GAMMA
+    assert sketches.quantiles(row, CPU, 0.01)[0] >= np.quantile(values, 0.01)
+    assert sketches.counts.sum() == 2000
+
+    # Zero samples have their own count.
+    for _ in range(3000):
+        sketches.add(row, CPU, [0.0])
+    assert sketches.quantiles(row, CPU, 0.5)[0] == 0.0
+    assert sketches.quantiles(row, CPU, 0.99)[0] > 0
+
+
+def test_replicas_added_together_equal_one_sketch_of_all_samples():
+    # Each collection adds one sample per replica to the workload's row, several to the same row at once.
+    rng = np.random.default_rng(2)
+    low, high = rng.uniform(100, 300, 500), rng.uniform(250, 9000, 500)
+    workload = Sketches(2)
+    for a, b in zip(low, high):
+        workload.add(np.array([0, 0, 1]), MEMORY, [a, b, 5.0])
+    together = Sketches(1)
+    for value in np.concatenate([low, high]):
+        together.add(np.array([0]), MEMORY, [value])
+
+    for q in (0.01, 0.5, 0.95, None):
+        assert workload.quantiles(np.array([0]), MEMORY, q)[0] == pytest.approx(together.quantiles(np.array([0]), MEMORY, q)[0])
+    assert workload.quantiles(np.array([1]), MEMORY, None)[0] == pytest.approx(SKETCH_GAMMA ** np.ceil(np.log(5.0) / np.log(SKETCH_GAMMA)))
+
+
+def frame(rows, workloads=None):
+    """
+    rows: (namespace, pod, container, cpu_usage, memory_usage) tuples.
+    """
+    columns = list(zip(*rows))
+    zeros = np.zeros(len(rows))
+    return fleet_engine.FleetFrame(
+        *(np.array(c, dtype=object) for c in columns[:3]),
+        cpu_request=zeros, cpu_usage=np.array(columns[3], dtype=np.float64),
+        memory_request=zeros, memory_usage=np.array(columns[4], dtype=np.float64),
+        workload=None if workloads is None else np.array(workloads, dtype=object),
+    )
+
+
+def test_store_recommends_per_workload_and_persists(tmp_path):
+    store = RecommenderStore(str(tmp_path), half_life_hours=0, retention_hours=24)
+    for minute in range(100):
+        store.update(frame([
+            ("shop", "web-1", "app", 100.0 + minute, 512 * 2.0 ** 20),
+            ("shop", "web-2", "app", 200.0 + minute, 256 * 2.0 ** 20),
+            ("shop", "debug", "sh", 0.0, 0.0),  # No usage data at all: skipped.
+        ], workloads=["Deployment/web", "Deployment/web", "Pod/debug"]), timestamp=T0 + minute * 60)
+
+    # A fresh process reads the same recommendations from the file.
+    [web] = RecommenderStore(str(tmp_path)).recommendations(namespace="shop", percentile="p50", margin=0.0)
+    assert (web["kind"], web["name"], web["container"], web["pods"], web["samples"]) == ("Deployment", "web", "app", 2, 200.0)
+    assert 200 <= web["cpu_request_millicores"] <= 200 * SKETCH_GAMMA + 1
+    assert 299 <= web["cpu_limit_millicores"] <= 299 * SKETCH_GAMMA + 1
+    assert 512 * 2 ** 20 <= web["memory_limit_bytes"] <= 512 * 2 ** 20 * SKETCH_GAMMA + 2 ** 20
+
+    [with_margin] = store.recommendations(workload="Deployment/web", percentile="p50", margin=0.5)
+    assert with_margin["cpu_request_millicores"] == pytest.approx(web["cpu_request_millicores"] * 1.5, abs=1)
+    [pod] = store.pod_recommendations("shop", "web-1", percentile="max", margin=0.0)
+    assert pod["container"] == "app" and 199 <= pod["cpu_request_millicores"] <= 199 * SKETCH_GAMMA + 1
+    with pytest.raises(ValueError):
+        store.recommendations(percentile="p42")
+
+    # web-2 goes away: past the retention its own sketches are dropped, its samples stay in the workload's.
+    store.update(frame([("shop", "web-1", "app", 100.0, 512 * 2.0 ** 20)], ["Deployment/web"]), timestamp=T0 + 26 * HOUR)
+    assert store.pod_recommendations("shop", "web-2") == []
+    [web] = store.recommendations(namespace="shop", percentile="p50", margin=0.0)
+    # A sample stands for the time since the previous one, up to 5 minutes after an outage.
+    assert web["pods"] == 1 and web["samples"] == 205.0 and web["cpu_request_millicores"] >= 200
+    # The last replica gone, the workload goes too.
+    store.update(frame([("shop", "api-1", "app", 100.0, 2.0 ** 20)]), timestamp=T0 + 52 * HOUR)
+    assert [r["name"] for r in store.recommendations(namespace="shop")] == ["api-1"]
+    # The lookups follow the containers that came and went.
+    assert [r["container"] for r in store.pod_recommendations("shop", "api-1")] == ["app"]
+    assert store.pod_recommendations("shop", "web-1") == [] and store.recommendations(workload="Deployment/web") == []
+    assert store.recommendations(namespace="data") == []
+
+
+def test_collections_update_the_rows_in_place(tmp_path):
+    store = RecommenderStore(str(tmp_path), half_life_hours=0)
+    web = [("shop", "web-1", "app", 100.0, 2.0 ** 20), ("shop", "web-2", "app", 100.0, 2.0 ** 20)]
+    store.update(frame(web, ["Deployment/web"] * 2), timestamp=T0)
+    layout = os.stat(tmp_path / "layout.npz").st_mtime_ns
+    reader = RecommenderStore(str(tmp_path))
+    assert reader.recommendations()[0]["samples"] == 2.0
+
+    # Known containers: the mapped rows change, the layout and the generation do not.
+    for minute in range(1, 5):
+        store.update(frame(web[:1], ["Deployment/web"]), timestamp=T0 + minute * 60)
+    assert os.stat(tmp_path / "layout.npz").st_mtime_ns == layout
+    assert sorted(os.listdir(tmp_path)) == ["LOCK", "layout.npz", "rows-1"]
+    assert reader.recommendations()[0]["samples"] == 6.0
+
+    # A new container starts a new generation, which replaces the old one.
+    store.update(frame([("shop", "web-3", "app", 100.0, 2.0 ** 20)], ["Deployment/web"]), timestamp=T0 + 300)
+    assert sorted(os.listdir(tmp_path)) == ["LOCK", "layout.npz", "rows-2"]
+    [record] = reader.recommendations()
+    assert (record["pods"], record["samples"]) == (3, 7.0)
+    assert [r["container"] for r in reader.pod_recommendations("shop", "web-3")] == ["app"]
+
+
+def test_decay_follows_recent_usage(tmp_path):
+    store = RecommenderStore(str(tmp_path), half_life_hours=1, retention_hours=1000)
+    ts = T0
+    for step in range(200):  # A day of high usage...
+        store.update(frame([("shop", "web-1", "app", 1000.0, 2.0 ** 30)]), timestamp=ts)
+        ts += 7 * 60
+    for step in range(100):  # ...then much less, the last hours.
+        store.update(frame([("shop", "web-1", "app", 100.0, 2.0 ** 28)]), timestamp=ts)
+        ts += 5 * 60
+    [web] = store.recommendations(percentile="p95", margin=0.0)
+    assert (web["kind"], web["name"]) == ("Pod", "web-1")
+    assert 100 <= web["cpu_request_millicores"] <= 100 * SKETCH_GAMMA + 1
+    assert web["cpu_limit_millicores"] >= 1000  # The peak is still remembered.
+
+    # 100x less than the first samples is below the window; it moves down once the old peak has decayed.
+    for step in range(150):
+        store.update(frame([("shop", "web-1", "app", 10.0, 2.0 ** 28)]), timestamp=ts)
+        ts += 5 * 60
+    [web] = store.recommendations(percentile="p95", margin=0.0)
+    assert 10 <= web["cpu_request_millicores"] <= 11
+    # Weights are rebased from time to time; the sketches stay finite.
+    assert np.isfinite(store._sketches.counts).all()
+
+
+def test_recommendations_route(tmp_path, monkeypatch):
+    from main import app
+
+    store = RecommenderStore(str(tmp_path))
+    store.update(frame([("shop", "web-1", "app", 1.0, 2.0 ** 20)], ["Deployment/web"]), timestamp=T0)
+    monkeypatch.setattr(recommender, "get_store", lambda: store)
+    client = TestClient(app)
+
+    response = client.get("/k8s/recommendations", params={"namespace": "shop"})
+    assert response.status_code == 200
+    # Below the minimums, the minimums are recommended.
+    assert response.json()[0]["cpu_request_millicores"] == recommender.RECOMMENDER_MIN_CPU_MILLICORES
+    assert response.json()[0]["memory_request_bytes"] == recommender.RECOMMENDER_MIN_MEMORY_BYTES
+    assert client.get("/k8s/recommendations", params={"namespace": "shop", "pod_name": "web-1"}).json()[0]["pod_name"] == "web-1"
+    assert client.get("/k8s/recommendations", params={"percentile": "p42"}).status_code == 400
+    assert client.get("/k8s/recommendations", params={"safety_margin": "-1"}).status_code == 400
+    assert client.get("/k8s/recommendations", params={"pod_name": "web-1"}).status_code == 400
@@ -0,0 +1,179 @@
+import json
+
+import numpy as np
+import pytest
+import redis
+
+from benchmarks.stubs import start_redis
+from services import (Celery_tasks, collector, fleet_engine, metrics_analyzer, pod_inventory, rate_limit, recommender,
+                      scheduler, snapshot, tsdb, waste)
+from services.scheduler import CollectionScheduler
+
+GIB = 2.0 ** 30
+T0 = 1790812800
+
+
+@pytest.fixture(scope="module")
+def redis_url():
+    server, url = start_redis()
+    yield url
+    server.shutdown()
+
+
+@pytest.fixture
+def client(redis_url):
+    client = redis.Redis.from_url(redis_url)
+    client.execute_command("FLUSHALL")
+    return client
+
+
+def pods(namespaces, containers=2):
+    return [(namespace, f"{namespace}-pod", [{"name": f"c{i}", "cpu_request_millicores": 100.0, "memory_request_bytes": GIB}
+                                             for i in range(containers)]) for namespace in namespaces]
+
+
+def frame(namespace, memory, cpu=50.0):
+    """
+    One pod of len(memory) containers, each requesting 100m and 1 GiB.
+    """
+    count = len(memory)
+    return fleet_engine.FleetFrame(
+        namespace=np.full(count, namespace, dtype=object), pod=np.full(count, f"{namespace}-pod", dtype=object),
+        container=np.array([f"c{i}" for i in range(count)], dtype=object),
+        cpu_request=np.full(count, 100.0), cpu_usage=np.full(count, cpu),
+        memory_request=np.full(count, GIB), memory_usage=np.asarray(memory, dtype=np.float64) * GIB,
+    )
+
+
+def planned(chunks):
+    return sorted({pod[0] for chunk in chunks for pod in chunk})
+
+
+def test_intervals_follow_what_the_containers_do():
+    # Stable namespaces double their interval up to the max; warm ones stop at the base interval.
+    assert scheduler.next_interval(60, 0.5, 0.5, 0.01) == 120
+    assert scheduler.next_interval(240, 0.5, 0.5, 0.01) == 300
+    assert scheduler.next_interval(120, 0.5, 0.95, 0.01) == 60
+    assert scheduler.next_interval(300, 0.5, 0.5, 0.15) == 60
+    # Hot ones (memory near its request, or large moves) drop to the min interval at once.
+    assert scheduler.next_interval(300, 0.92, 0.5, 0.0) == 30
+    assert scheduler.next_interval(300, 0.5, 0.5, 0.3) == 30
+    # Memory growing towards the request: sampled again around when it gets there.
+    assert scheduler.next_interval(300, 0.7, 0.5, 0.05, time_to_hot=100) == 100
+    assert scheduler.next_interval(300, 0.7, 0.5, 0.05, time_to_hot=5) == 30
+
+    request, usage = np.array([GIB, GIB]), np.array([0.5, 0.8]) * GIB
+    memory_ratio, cpu_ratio, change, time_to_hot = scheduler.signals(
+        np.array([100.0, 0.0]), np.array([50.0, 500.0]), request, usage, np.array([50.0, np.nan]),
+        np.array([0.5, 0.7]) * GIB, elapsed=60)
+    assert (memory_ratio, cpu_ratio) == (0.8, 0.5)  # No CPU request: no ratio.
+    assert change == pytest.approx(0.1) and time_to_hot == pytest.approx(60)
+
+
+def test_plan_collects_due_namespaces_within_the_budget(client):
+    schedule = CollectionScheduler(client, budget=2, chunk_containers=4)
+    listed = pods(["a", "b", "c"], containers=3)
+    assert schedule.collection_due(T0)
+
+    # Everything is new, so due; two queries of up to 4 containers fit two of them.
+    assert planned(schedule.plan(listed, T0)) == ["a", "b"]
+    assert schedule.collection_due(T0 + 1)
+    # The budget is spent for this window; c goes first in the next one.
+    assert schedule.plan(listed, T0 + 30) == []
+    # a and b are due again one base interval later; c, overdue longest, goes first, then a.
+    assert planned(schedule.plan(listed, T0 + 60)) == ["a", "c"]
+    assert schedule.plan(listed, T0 + 90) == []
+    assert planned(schedule.plan(listed, T0 + 120)) == ["a", "b"]
+
+    # A namespace that is gone is forgotten.
+    schedule.plan(pods(["a", "b"], containers=3), T0 + 200)
+    assert [namespace for namespace, _ in client.zrange(schedule._due, 0, -1, withscores=True)] == [b"a", b"b"]
+
+
+def test_workers_share_one_budget(client):
+    workers = [CollectionScheduler(client, budget=5) for _ in range(3)]
+    granted = [worker.reserve(2, T0) for worker in workers]
+    assert granted == [2, 2, 1]
+    assert workers[0].available(T0) == 0 and workers[0].available(T0 + 60) == 5
+    assert CollectionScheduler(client, budget=0).reserve(50, T0) == 50
+
+
+def test_observe_samples_hot_and_volatile_namespaces_more_often(client):
+    schedule = CollectionScheduler(client)
+    schedule.plan(pods(["stable", "leaky", "noisy"]), T0)
+    for minute in range(0, 16, 5):
+        ts = T0 + minute * 60
+        schedule.observe(frame("stable", [0.5, 0.5]), ts)
+        schedule.observe(frame("leaky", [0.5, 0.5 + 0.025 * minute]), ts)
+        schedule.observe(frame("noisy", [0.5, 0.5], cpu=50.0 if minute % 10 else 90.0), ts)
+    intervals = {name.decode(): float(value) for name, value in client.hgetall(schedule._intervals).items()}
+    assert intervals["stable"] == 300 and intervals["noisy"] == 30
+    # 0.875 GiB of 1 after 15 minutes, at 0.025 GiB a minute: turns hot a minute later.
+    assert intervals["leaky"] == pytest.approx(60)
+    due = dict(client.zrange(schedule._due, 0, -1, withscores=True))
+    assert due[b"leaky"] == pytest.approx(T0 + 16 * 60)
+
+
+def test_slow_upstreams_stretch_intervals_and_shrink_the_budget(client):
+    schedule = CollectionScheduler(client, budget=8, chunk_containers=2)
+    assert schedule.backoff() == 1.0
+    for _ in range(20):
+        schedule.record_latency("prometheus", scheduler.SCHEDULER_PROMETHEUS_LATENCY_TARGET_SECONDS * 4)
+    assert schedule.backoff() == pytest.approx(4, rel=0.01)
+    assert schedule.available(T0) == 2
+
+    chunks = schedule.plan(pods([f"ns-{i}" for i in range(5)]), T0)
+    assert len(chunks) == 2
+    due = dict(client.zrange(schedule._due, 0, -1, withscores=True))
+    assert due[b"ns-0"] == pytest.approx(T0 + 4 * scheduler.SCHEDULER_BASE_INTERVAL_SECONDS, rel=0.01)
+
+
+@pytest.fixture
+def eager_celery():
+    conf = Celery_tasks.celery_app.conf
+    previous = conf.task_always_eager
+    conf.task_always_eager = True
+    yield
+    conf.task_always_eager = previous
+
+
+def test_ticks_collect_only_due_namespaces_and_the_snapshot_keeps_the_others(eager_celery, client, monkeypatch, tmp_path):
+    records = [pod_inventory.PodRecord(ns, pod, None, (), tuple((r["name"], r["cpu_request_millicores"], r["memory_request_bytes"])
+                                                                for r in requests_data), None)
+               for ns, pod, requests_data in pods(["shop", "data"])]
+    queried = []
+
+    def fake_usage(namespaces):
+        queried.append(sorted(namespaces))
+        return {namespace: {(f"{namespace}-pod", f"c{i}"): {"name": f"c{i}", "cpu_utilization_millicores": 50.0,
+                                                            "memory_utilization_bytes": GIB / 2} for i in range(2)}
+                for namespace in namespaces}
+
+    monkeypatch.setattr(pod_inventory, "pods_in_scope", lambda namespace=None, label_selector=None: records)
+    monkeypatch.setattr(metrics_analyzer, "fetch_namespaces_utilization_from_prometheus", fake_usage)
+    monkeypatch.setattr(rate_limit, "k8s_limiter", rate_limit.TokenBucket(rate=0))
+    monkeypatch.setattr(rate_limit, "prometheus_limiter", rate_limit.TokenBucket(rate=0))
+    schedule = CollectionScheduler(client)
+    monkeypatch.setattr(scheduler, "get_scheduler", lambda: schedule)
+    for module in (tsdb, recommender, waste):
+        monkeypatch.setattr(module, "get_store", lambda: None)
+    monkeypatch.setattr(snapshot, "SNAPSHOT_ENABLED", True)
+    monkeypatch.setattr(snapshot, "SNAPSHOT_PATH", str(tmp_path))
+
+    assert Celery_tasks.collect_pod_utilization.delay().get() == 1
+    assert queried == [["data", "shop"]]
+    current = snapshot.SnapshotReader(str(tmp_path)).current()
+    assert current.namespaces == ["data", "shop"] and current.containers == 4
+
+    # Nothing is due yet: the next tick does not even list the pods.
+    with monkeypatch.context() as patched:
+        patched.setattr(collector, "list_targets", lambda namespace=None: pytest.fail("listed"))
+        assert Celery_tasks.collect_pod_utilization.delay().get() == 0
+
+    # Once shop alone is due, only shop is queried, and the snapshot keeps data's records.
+    client.zadd(schedule._due, {"shop": 0})
+    assert Celery_tasks.collect_pod_utilization.delay().get() == 1
+    assert queried[1:] == [["shop"]]
+    current = snapshot.SnapshotReader(str(tmp_path)).current()
+    assert current.namespaces == ["data", "shop"] and current.containers == 4
+    assert [record["pod_name"] for record in json.loads(current.cluster_json())] == ["data-pod"] * 2 + ["shop-pod"] * 2
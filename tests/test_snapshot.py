@@ -0,0 +1,201 @@
+import json
+import os
+import time
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from services import fleet_engine, metrics_analyzer, snapshot
+from services.snapshot import SnapshotReader, write_snapshot
+
+
+def frame(rows):
+    """
+    rows: (namespace, pod, container, cpu_request, cpu_usage, memory_request, memory_usage) tuples.
+    """
+    columns = list(zip(*rows))
+    return fleet_engine.FleetFrame(*(np.array(c, dtype=object) for c in columns[:3]),
+                                   *(np.array(c, dtype=np.float64) for c in columns[3:]))
+
+
+ROWS = [
+    ("shop", "web-2", "app", 200.0, 300.0, 2.0 ** 27, 2.0 ** 26),
+    ("shop", "web-2", "sidecar", 0.0, 5.0, 0.0, 0.0),  # Usage without a request: an infinite ratio, null in JSON.
+    ("data", "db-0", "postgres", 1000.0, 100.0, 2.0 ** 30, 2.0 ** 29),
+    ("shop", "web-1", "app", 200.0, 100.0, 2.0 ** 27, 2.0 ** 27),
+    ("shop", "ünïcode", "app", 0.0, 0.0, 0.0, 0.0),
+]
+
+
+def records(rows):
+    analyzed = fleet_engine.to_records(fleet_engine.analyze_frame(frame(rows)))
+    return [json.loads(json.dumps(record).replace("Infinity", "null")) for record in analyzed]
+
+
+def test_snapshot_serves_pods_namespaces_and_the_cluster(tmp_path):
+    assert write_snapshot(frame(ROWS), path=str(tmp_path)) == 5
+    current = SnapshotReader(str(tmp_path)).current()
+
+    assert json.loads(current.pod_json("shop", "web-2")) == records(ROWS[:2])
+    assert json.loads(current.pod_json("shop", "ünïcode")) == records(ROWS[4:])
+    assert json.loads(current.namespace_json("shop")) == records([ROWS[3], ROWS[0], ROWS[1], ROWS[4]])
+    # Namespaces then pods in name order, containers in their pod's order.
+    assert json.loads(current.cluster_json()) == records([ROWS[2], ROWS[3], ROWS[0], ROWS[1], ROWS[4]])
+    # Not in the snapshot: the caller analyzes live.
+    assert current.pod_json("shop", "web-3") is None and current.pod_json("shop", "web-") is None
+    assert current.namespace_json("new") is None and current.pod_json("new", "web-1") is None
+
+
+def test_snapshot_of_one_namespace_or_of_nothing(tmp_path):
+    write_snapshot(frame(ROWS[2:3]), path=str(tmp_path / "data"), scope="data")
+    current = SnapshotReader(str(tmp_path / "data")).current()
+    assert current.cluster_json() is None and json.loads(current.namespace_json("data")) == records(ROWS[2:3])
+
+    write_snapshot(fleet_engine.build_frame([], {}), path=str(tmp_path / "empty"))
+    assert json.loads(SnapshotReader(str(tmp_path / "empty")).current().cluster_json()) == []
+
+
+def test_readers_swap_to_a_new_snapshot_and_keep_the_old_one_valid(tmp_path):
+    reader = SnapshotReader(str(tmp_path), max_age_seconds=60)
+    assert reader.current() is None
+    write_snapshot(frame(ROWS), path=str(tmp_path))
+    old = reader.current()
+    assert reader.current() is old  # Unchanged file: one stat, no new mapping.
+
+    changed = [("shop", "web-1", "app", 200.0, 900.0, 2.0 ** 27, 2.0 ** 27)]
+    write_snapshot(frame(changed), path=str(tmp_path))
+    new = reader.current()
+    assert new is not old and json.loads(new.cluster_json()) == records(changed)
+    # A response being built from the old snapshot still reads the old records.
+    assert json.loads(old.namespace_json("shop")) == records([ROWS[3], ROWS[0], ROWS[1], ROWS[4]])
+    assert sorted(os.listdir(tmp_path)) == ["LOCK", "analysis.snap", "changes.log"]  # No temporary files left.
+
+    write_snapshot(frame(changed), taken_at=time.time() - 120, path=str(tmp_path))
+    assert reader.current() is None  # Stale.
+
+
+def test_routes_serve_the_snapshot_in_serving_mode(tmp_path, monkeypatch):
+    from main import app
+
+    write_snapshot(frame(ROWS), path=str(tmp_path))
+    monkeypatch.setattr(snapshot, "get_reader", lambda: SnapshotReader(str(tmp_path)))
+
+    def live(*args, **kwargs):
+        return [{"live": True}]
+    monkeypatch.setattr(metrics_analyzer, "analyze_namespace_resource_usage", live)
+    monkeypatch.setattr(metrics_analyzer, "analyze_cluster_resource_usage", live)
+    client = TestClient(app)
+
+    response = client.get("/k8s/pods", params={"namespace": "shop"})
+    assert response.status_code == 200 and "age" in response.headers
+    assert response.json() == records([ROWS[3], ROWS[0], ROWS[1], ROWS[4]])
+    assert client.get("/k8s/pods").json() == records([ROWS[2], ROWS[3], ROWS[0], ROWS[1], ROWS[4]])
+    assert client.get("/k8s/pod", params={"namespace": "data", "pod_name": "db-0"}).json() == records(ROWS[2:3])
+    # Label selectors, use_cache=false and namespaces the snapshot does not have are analyzed live.
+    assert client.get("/k8s/pods", params={"namespace": "shop", "label_selector": "app=web"}).json() == [{"live": True}]
+    assert client.get("/k8s/pods", params={"use_cache": "false"}).json() == [{"live": True}]
+    assert client.get("/k8s/pods", params={"namespace": "new"}).json() == [{"live": True}]
+
+
+@pytest.mark.parametrize("content", [b"", b"not a snapshot"])
+def test_a_broken_file_is_not_served(tmp_path, content):
+    (tmp_path / "analysis.snap").write_bytes(content)
+    assert SnapshotReader(str(tmp_path)).current() is None
+
+
+def changes(current, since=None, namespace=None):
+    return json.loads(current.changes(since, namespace))
+
+
+def test_versions_report_only_containers_that_changed(tmp_path):
+    reader = SnapshotReader(str(tmp_path))
+    write_snapshot(frame(ROWS), path=str(tmp_path))
+    first = reader.current()
+    assert changes(first)["full"] and changes(first)["records"] == records([ROWS[2], ROWS[3], ROWS[0], ROWS[1], ROWS[4]])
+
+    # 1% more CPU stays in its usage bucket: a new version, but nothing changed in it.
+    moved = [(ns, pod, c, cpu_req, cpu * 1.01, mem_req, mem) for ns, pod, c, cpu_req, cpu, mem_req, mem in ROWS]
+    write_snapshot(frame(moved), path=str(tmp_path))
+    second = reader.current()
+    assert second.version != first.version and second.etag() == first.etag() and second.etag("shop") == first.etag("shop")
+    assert changes(second, first.version) == {"version": second.version, "full": False, "changed": 0, "removed": [],
+                                              "records": []}
+
+    # db-0 is resized, web-2's sidecar is gone and web-1 gets one.
+    resized = [("data", "db-0", "postgres", 500.0, 100.0, 2.0 ** 30, 2.0 ** 29)]
+    rows = resized + [moved[0], moved[3], ("shop", "web-1", "sidecar", 0.0, 5.0, 0.0, 0.0), moved[4]]
+    write_snapshot(frame(rows), path=str(tmp_path))
+    third = reader.current()
+    assert third.etag() != second.etag() and third.etag("data", "db-0") != second.etag("data", "db-0")
+    delta = changes(third, first.version)
+    assert not delta["full"] and delta["records"] == records([resized[0], rows[3]])
+    assert delta["removed"] == [{"namespace": "shop", "pod_name": "web-2", "name": "sidecar"}]
+    assert changes(third, second.version, namespace="data")["records"] == records(resized)
+    assert changes(third, third.version)["records"] == []
+
+    # The sidecar comes back: a change, no longer a removal.
+    write_snapshot(frame(rows + [moved[1]]), path=str(tmp_path))
+    delta = changes(reader.current(), first.version)
+    assert delta["removed"] == [] and len(delta["records"]) == 3
+
+
+def test_clients_too_far_behind_get_every_record(tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshot, "SNAPSHOT_CHANGE_LOG_VERSIONS", 2)
+    reader = SnapshotReader(str(tmp_path))
+    versions = []
+    for cpu in (100.0, 200.0, 400.0, 800.0):
+        write_snapshot(frame([("data", "db-0", "postgres", 1000.0, cpu, 2.0 ** 30, 2.0 ** 29)]), path=str(tmp_path))
+        versions.append(reader.current().version)
+    current = reader.current()
+    assert not changes(current, versions[1])["full"] and changes(current, versions[0])["full"]
+    # A version of another epoch (the snapshot was lost and versions started over), or from the future.
+    epoch, serial = snapshot.parse_version(current.version)
+    assert changes(current, f"{epoch - 1}-{serial}")["full"] and changes(current, f"{epoch}-{serial + 1}")["full"]
+    with pytest.raises(ValueError):
+        current.changes("latest")
+    assert current.changes(namespace="new") is None
+
+
+def test_namespaces_kept_from_the_last_snapshot_keep_their_versions(tmp_path):
+    reader = SnapshotReader(str(tmp_path))
+    write_snapshot(frame(ROWS), path=str(tmp_path))
+    first = reader.current()
+    write_snapshot(frame([("data", "db-0", "postgres", 500.0, 100.0, 2.0 ** 30, 2.0 ** 29)]), path=str(tmp_path),
+                   listed=["data", "shop"])
+    second = reader.current()
+    assert second.etag("shop") == first.etag("shop") and second.etag("data") != first.etag("data")
+    assert [record["pod_name"] for record in changes(second, first.version)["records"]] == ["db-0"]
+
+    # A namespace that is no longer listed is removed.
+    write_snapshot(fleet_engine.build_frame([], {}), path=str(tmp_path), listed=["data"])
+    removed = changes(reader.current(), second.version)["removed"]
+    assert [(r["pod_name"], r["name"]) for r in removed] == [("web-1", "app"), ("web-2", "app"), ("web-2", "sidecar"),
+                                                              ("ünïcode", "app")]
+
+
+def test_routes_revalidate_and_serve_changes(tmp_path, monkeypatch):
+    from main import app
+
+    client = TestClient(app)
+    monkeypatch.setattr(snapshot, "get_reader", lambda: None)
+    assert client.get("/k8s/pods/changes").status_code == 503
+
+    write_snapshot(frame(ROWS), path=str(tmp_path))
+    monkeypatch.setattr(snapshot, "get_reader", lambda: SnapshotReader(str(tmp_path)))
+    response = client.get("/k8s/pods", params={"namespace": "shop"})
+    etag = response.headers["etag"]
+    assert etag.startswith('W/"')
+    revalidated = client.get("/k8s/pods", params={"namespace": "shop"}, headers={"If-None-Match": etag})
+    assert revalidated.status_code == 304 and revalidated.content == b"" and revalidated.headers["etag"] == etag
+    pod = client.get("/k8s/pod", params={"namespace": "shop", "pod_name": "web-1"}, headers={"If-None-Match": f'"x", {etag}'})
+    assert pod.status_code == 304
+
+    full = client.get("/k8s/pods/changes").json()
+    assert full["full"] and len(full["records"]) == 5
+    write_snapshot(frame(ROWS[:4]), path=str(tmp_path))
+    assert client.get("/k8s/pods", params={"namespace": "shop"}, headers={"If-None-Match": etag}).status_code == 200
+    delta = client.get("/k8s/pods/changes", params={"since": full["version"], "namespace": "shop"}).json()
+    assert delta["records"] == [] and delta["removed"] == [{"namespace": "shop", "pod_name": "ünïcode", "name": "app"}]
+    assert client.get("/k8s/pods/changes", params={"since": "yesterday"}).status_code == 400
+    assert client.get("/k8s/pods/changes", params={"namespace": "new"}).status_code == 404
@@ -0,0 +1,84 @@
+import subprocess
+import sys
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from services import async_analyzer, k8s_client, pod_inventory, prometheus_query, startup
+
+
+@pytest.fixture(autouse=True)
+def clean_timings(monkeypatch):
+    monkeypatch.setattr(startup, "timings", {})
+
+
+def test_importing_the_app_does_not_import_the_client_libraries():
+    loaded = subprocess.check_output([sys.executable, "-c", (
+        "import sys, main; "
+        f"print(' '.join(m for m in {startup.CLIENT_MODULES!r} + ('kubernetes',) if m in sys.modules))"
+    )], text=True)
+    assert loaded.strip() == ""
+
+
+def test_warm_up_builds_the_clients_and_records_its_duration(monkeypatch):
+    built = []
+    manager = k8s_client.KubeClientManager()
+    monkeypatch.setattr(manager, "core_v1", lambda: built.append("k8s"))
+    monkeypatch.setattr(k8s_client, "get_client_manager", lambda: manager)
+    monkeypatch.setattr(prometheus_query, "get_session", lambda: built.append("prometheus"))
+
+    startup.start_warm_up("background").join()
+    assert built == ["k8s", "prometheus"]
+    assert startup.timings["warmup"] >= 0
+    assert startup.start_warm_up("off") is None and built == ["k8s", "prometheus"]
+
+
+def test_warm_up_failure_is_left_to_the_first_request(monkeypatch, capsys):
+    def unreachable():
+        raise RuntimeError("no kubeconfig")
+
+    monkeypatch.setattr(k8s_client.get_client_manager(), "core_v1", unreachable)
+    monkeypatch.setattr(prometheus_query, "get_session", lambda: None)
+    startup.warm_up()
+    assert "no kubeconfig" in capsys.readouterr().out
+    assert "warmup" in startup.timings
+
+
+def test_phase_over_budget_is_reported(monkeypatch, capsys):
+    monkeypatch.setitem(startup._budgets, "ready", 1.0)
+    startup.record("ready", 0.5)
+    assert capsys.readouterr().out == ""
+    startup.record("ready", 2.0)
+    assert "over its 1.00 s budget" in capsys.readouterr().out
+
+
+def test_only_the_first_request_is_timed(monkeypatch):
+    app = FastAPI()
+    app.add_middleware(startup.FirstRequestTimer)
+    app.get("/ping")(lambda: "pong")
+    recorded = []
+    monkeypatch.setattr(startup, "record", lambda phase, seconds: recorded.append(phase))
+
+    client = TestClient(app)
+    assert client.get("/ping").json() == "pong"
+    assert client.get("/ping").json() == "pong"
+    assert recorded == ["first_request"]
+
+
+@pytest.mark.parametrize("mode, warmed", [("blocking", True), ("background", True), ("off", False)])
+def test_lifespan_warms_up_as_configured(monkeypatch, mode, warmed):
+    from main import app
+
+    calls = []
+    monkeypatch.setattr(startup, "STARTUP_WARMUP", mode)
+    monkeypatch.setattr(pod_inventory, "POD_INVENTORY_ENABLED", False)
+    monkeypatch.setattr(startup, "warm_up", lambda: calls.append("clients"))
+    monkeypatch.setattr(async_analyzer.AsyncUpstreams, "warm", lambda self: calls.append("sessions"))
+
+    with TestClient(app):
+        if mode == "blocking":
+            assert calls == ["clients", "sessions"]
+        assert {"import", "ready"} <= set(startup.timings)
+    # A background warm-up is awaited on shutdown.
+    assert calls == (["clients", "sessions"] if warmed else [])
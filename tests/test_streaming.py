@@ -0,0 +1,79 @@
+import json
+import math
+
+import pytest
+from fastapi.testclient import TestClient
+
+from main import app
+from services import cache, metrics_analyzer
+
+client = TestClient(app)
+
+POD_REQUESTS = [
+    ("shop", f"web-{i}", [{"name": "app", "cpu_request_millicores": 200.0, "memory_request_bytes": 2.0 ** 27},
+                          {"name": "sidecar", "cpu_request_millicores": 0.0, "memory_request_bytes": 0.0}])
+    for i in range(300)
+] + [("data", "db-0", [{"name": "postgres", "cpu_request_millicores": 1000.0, "memory_request_bytes": 2.0 ** 30}])]
+
+
+def fake_namespace_usage(namespace):
+    usage = {}
+    for ns, pod, requests_data in POD_REQUESTS:
+        if ns == namespace:
+            # The sidecar uses CPU without requesting any: an infinite ratio.
+            usage[(pod, "app")] = {"name": "app", "cpu_utilization_millicores": 300.0, "memory_utilization_bytes": 2.0 ** 26}
+            usage[(pod, "sidecar")] = {"name": "sidecar", "cpu_utilization_millicores": 5.0, "memory_utilization_bytes": 0.0}
+    return usage
+
+
+@pytest.fixture(autouse=True)
+def fake_cluster(monkeypatch):
+    cache.usage_cache.clear()
+    monkeypatch.setattr(metrics_analyzer, "list_pod_requests", lambda namespace=None, label_selector=None: POD_REQUESTS)
+    monkeypatch.setattr(metrics_analyzer, "fetch_namespaces_utilization_from_prometheus",
+                        lambda namespaces: {namespace: fake_namespace_usage(namespace) for namespace in namespaces})
+
+
+def expected_records():
+    records = metrics_analyzer.analyze_pod_requests_usage(POD_REQUESTS)
+    for record in records:
+        for field in ("cpu_usage_vs_request_ratio", "memory_usage_vs_request_ratio"):
+            if record[field] is not None and math.isinf(record[field]):
+                record[field] = None
+    return records
+
+
+def test_ndjson_stream_has_the_same_records_as_the_list_endpoint():
+    with client.stream("GET", "/k8s/pods/stream") as response:
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/x-ndjson"
+        lines = list(response.iter_lines())
+
+    records = [json.loads(line) for line in lines]
+    assert records == expected_records()
+    assert records[1]["cpu_under_provisioned"] is True and records[1]["cpu_usage_vs_request_ratio"] is None
+
+
+def test_chunks_start_small_and_grow():
+    sizes = [len(a.frame) for a in metrics_analyzer.iter_pod_requests_analysis(POD_REQUESTS, chunk_containers=200)]
+
+    # 600 containers in "shop", then "data" in a chunk of its own.
+    assert sizes == [64, 128, 200, 200, 8, 1]
+
+
+def test_arrow_stream_round_trips():
+    pa = pytest.importorskip("pyarrow")
+
+    response = client.get("/k8s/pods/stream?format=arrow")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/vnd.apache.arrow.stream"
+
+    table = pa.ipc.open_stream(response.content).read_all()
+    assert table.num_rows == len(POD_REQUESTS) * 2 - 1
+    rows = table.to_pylist()
+    assert rows[0] == expected_records()[0]
+    assert rows[1]["cpu_usage_vs_request_ratio"] == math.inf
+
+
+def test_unknown_format_is_rejected():
+    assert client.get("/k8s/pods/stream?format=xml").status_code == 400
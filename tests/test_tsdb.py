@@ -0,0 +1,146 @@
+import os
+
+import numpy as np
+import pytest
+
+from services import fleet_engine, tsdb
+
+DAY = 86400
+# 2026-10-01T00:00:00Z
+T0 = 1790812800
+
+
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def make_frame(rows):
+    """
+    rows: (namespace, pod, container, cpu_request, cpu_usage, memory_request, memory_usage) tuples.
+    """
+    columns = list(zip(*rows))
+    return fleet_engine.FleetFrame(
+        *(np.array(c, dtype=object) for c in columns[:3]),
+        cpu_request=np.array(columns[3], dtype=np.float64), cpu_usage=np.array(columns[4], dtype=np.float64),
+        memory_request=np.array(columns[5], dtype=np.float64), memory_usage=np.array(columns[6], dtype=np.float64),
+    )
+
+
+def collect(store, clock, start, minutes, step=60):
+    """
+    One sample per container every step seconds; web usage ramps 0..minutes-1, db stays flat.
+    """
+    for i in range(minutes):
+        clock.now = start + i * step
+        store.append(make_frame([
+            ("shop", "web-1", "app", 200.0, float(i), 2.0 ** 20, 1000.0 + i),
+            ("shop", "web-1", "sidecar", 50.0, 1.0, 0.0, 10.0),
+            ("data", "db-0", "postgres", 1000.0, 500.0, 2.0 ** 30, 2.0 ** 29),
+        ]))
+
+
+@pytest.fixture
+def clock():
+    return Clock(T0)
+
+
+@pytest.fixture
+def store(tmp_path, clock):
+    return tsdb.TimeSeriesStore(str(tmp_path), raw_retention_hours=48, rollup_retention_days=30, clock=clock)
+
+
+def test_open_hour_is_readable_per_namespace(store, clock):
+    collect(store, clock, T0, 10)
+
+    shop = store.read("shop", T0, T0 + 3600, tsdb.RAW)
+    assert len(shop["ts"]) == 20
+    assert store.series_labels(np.unique(shop["series"]).tolist()) == [("shop", "web-1", "app"), ("shop", "web-1", "sidecar")]
+    assert len(store.read("data", T0, T0 + 3600, tsdb.RAW)["ts"]) == 10
+    assert len(store.read("shop", T0, T0 + 3600, tsdb.RAW, pod_name="web-2")["ts"]) == 0
+    assert len(store.read("missing", T0, T0 + 3600, tsdb.RAW)["ts"]) == 0
+
+
+def test_compact_seals_hours_rolls_up_days_and_applies_retention(store, clock):
+    # Two full days at one sample every 10 minutes, then one sample on the third day.
+    collect(store, clock, T0, 2 * 144, step=600)
+    clock.now = T0 + 2 * DAY
+    collect(store, clock, clock.now, 1)
+    store.compact()
+
+    assert store.segments(tsdb.ROLLUP) == ["20261001", "20261002"]
+    sealed = [name for name in store.segments(tsdb.RAW) if os.path.exists(os.path.join(store.path, "raw", name, "index.json"))]
+    assert len(sealed) == 48 and store.segments(tsdb.RAW)[-1] == "2026100300"
+
+    # Hourly rollup: 6 samples per hour, usage mean and max kept.
+    hourly = store.read("shop", T0, T0 + 2 * DAY - 1, tsdb.ROLLUP, pod_name="web-1")
+    app = hourly["series"] == store._series_index[("shop", "web-1", "app")]
+    assert app.sum() == 48
+    assert hourly["samples"][app].tolist() == [6] * 48
+    assert hourly["cpu_usage"][app][:2].tolist() == [2.5, 8.5]
+    assert hourly["cpu_usage_max"][app][:2].tolist() == [5.0, 11.0]
+
+    # The same window read raw from sealed segments: each namespace is a contiguous slice.
+    raw = store.read("data", T0, T0 + 2 * DAY - 1, tsdb.RAW)
+    assert len(raw["ts"]) == 288 and set(raw["memory_usage"].tolist()) == {2.0 ** 29}
+
+    # With 48 hours of raw retention, a day later the first day's raw hours are gone; the rollups stay.
+    clock.now = T0 + 3 * DAY + 3600
+    store.compact()
+    assert store.segments(tsdb.RAW)[0] == "2026100201"
+    assert store.segments(tsdb.ROLLUP) == ["20261001", "20261002", "20261003"]
+    assert len(store.read("shop", T0, T0 + DAY - 1, tsdb.ROLLUP)["ts"]) == 48
+
+
+def test_coverage_is_per_namespace(store, clock):
+    collect(store, clock, T0, 10)
+    clock.now = T0 + 2 * 3600
+    store.append(make_frame([("batch", "job-1", "worker", 100.0, 50.0, 2.0 ** 20, 2.0 ** 19)]))
+    store.compact()
+
+    assert store.covers(T0)
+    assert store.covers(T0, "shop")
+    # Samples of other namespaces do not make a namespace first seen later look collected.
+    assert store.first_timestamp("batch") == T0 + 2 * 3600
+    assert not store.covers(T0, "batch")
+    assert store.covers(T0 + 2 * 3600, "batch")
+    assert not store.covers(T0, "missing")
+
+
+def test_percentiles_match_numpy(store, clock):
+    collect(store, clock, T0, 100)
+    clock.now = T0 + 100 * 60
+
+    stats = store.usage_percentiles("shop", T0, clock.now)
+    usage = np.arange(100.0)
+    app = stats[("web-1", "app")]
+    for stat, q in (("p50", 50), ("p95", 95), ("p99", 99)):
+        assert app["cpu_millicores"][stat] == pytest.approx(np.percentile(usage, q))
+    assert app["cpu_millicores"]["max"] == 99.0
+    assert app["memory_bytes"]["max"] == 1099.0
+    assert stats[("web-1", "sidecar")]["cpu_millicores"] == {"p50": 1.0, "p95": 1.0, "p99": 1.0, "max": 1.0}
+    assert ("db-0", "postgres") not in stats
+
+
+def test_processes_share_series_and_survive_a_torn_append(tmp_path, clock):
+    writer = tsdb.TimeSeriesStore(str(tmp_path), clock=clock)
+    collect(writer, clock, T0, 2)
+
+    # A crash half-way through an append left one column a row short of the others.
+    segment = os.path.join(str(tmp_path), "raw", tsdb.segment_name(tsdb.RAW, T0))
+    with open(os.path.join(segment, "cpu_usage"), "ab") as f:
+        f.truncate(os.path.getsize(os.path.join(segment, "cpu_usage")) - 4)
+
+    other = tsdb.TimeSeriesStore(str(tmp_path), clock=clock)
+    clock.now = T0 + 180
+    other.append(make_frame([("data", "db-0", "postgres", 1000.0, 700.0, 0.0, 0.0),
+                             ("data", "db-1", "postgres", 1000.0, 800.0, 0.0, 0.0)]))
+
+    # The reader sees the new series and rows written by the other process; the torn row is gone.
+    data = writer.read("data", T0, T0 + 3600, tsdb.RAW)
+    assert data["cpu_usage"].tolist() == [500.0, 700.0, 800.0]
+    assert writer.series_labels(data["series"].tolist())[-1] == ("data", "db-1", "postgres")
+    assert len(writer.read("shop", T0, T0 + 3600, tsdb.RAW)["ts"]) == 4
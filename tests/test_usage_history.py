@@ -0,0 +1,120 @@
+import json
+
+import pytest
+
+from services import cache, metrics_analyzer, tsdb, usage_history
+
+
+@pytest.fixture(autouse=True)
+def empty_caches(monkeypatch):
+    cache.usage_cache.clear()
+    cache.history_cache.clear()
+    # History comes from Prometheus here, not from a local store.
+    monkeypatch.setattr(tsdb, "TSDB_ENABLED", False)
+
+
+def chunked(body: bytes, size: int):
+    return [body[i:i + size] for i in range(0, len(body), size)]
+
+
+def test_stream_decoder_yields_items_across_any_chunking():
+    result = [
+        {"metric": {"pod": "web-1", "container": "app", "stat": "p95"}, "value": [1700000000, "0.25"]},
+        {"metric": {"pod": "wéb-2", "container": "app", "stat": "max"}, "value": [1700000000, "1.5"]},
+    ]
+    body = json.dumps({"status": "success", "data": {"resultType": "vector", "result": result}},
+                      ensure_ascii=False).encode()
+
+    # One byte at a time also splits the two-byte "é" between chunks.
+    for size in (1, 7, len(body)):
+        assert list(usage_history.iter_prometheus_result(chunked(body, size))) == result
+
+    empty = b'{"status":"success","data":{"resultType":"vector","result":[]}}'
+    assert list(usage_history.iter_prometheus_result(chunked(empty, 3))) == []
+
+
+def test_stream_decoder_reports_errors_and_truncation():
+    error = b'{"status":"error","errorType":"bad_data","error":"parse error at char 3"}'
+    with pytest.raises(usage_history.PrometheusQueryError, match="bad_data"):
+        list(usage_history.iter_prometheus_result(chunked(error, 5)))
+
+    truncated = b'{"status":"success","data":{"resultType":"vector","result":[{"metric":{},"value":[1,"2"]},{"metric":'
+    items = usage_history.iter_prometheus_result(chunked(truncated, 4))
+    assert next(items) == {"metric": {}, "value": [1, "2"]}
+    with pytest.raises(ValueError):
+        next(items)
+
+
+@pytest.mark.parametrize("window, step", [("1h", 30), ("1d", 60), ("7d", 300), ("30d", 1800), ("1h30m", 30)])
+def test_step_grows_with_window(window, step):
+    seconds = usage_history.parse_duration(window)
+    assert usage_history.choose_step(seconds) == step
+    assert seconds / step <= usage_history.HISTORY_MAX_POINTS
+
+
+@pytest.mark.parametrize("window", ["", "7", "d", "7d;drop", "1h 30m", "0s"])
+def test_invalid_windows_are_rejected(window):
+    with pytest.raises(ValueError):
+        usage_history.parse_duration(window)
+
+
+def test_percentile_query_computes_every_statistic_server_side():
+    expression = usage_history.usage_expressions("shop", "web-1", 300)["cpu"]
+    query = usage_history.percentile_query(expression, 604800, 300)
+
+    assert 'namespace="shop"' in expression and 'pod="web-1"' in expression and 'container!="", container!="POD"' in expression
+    assert "[300s]" in expression
+    assert query.count("[604800s:300s]") == 4
+    for q in ("0.5", "0.95", "0.99"):
+        assert f"quantile_over_time({q}," in query
+    assert "max_over_time(" in query
+    assert [f'"stat", "{stat}"' in query for stat in usage_history.PERCENTILES] == [True] * 4
+
+
+def test_percentiles_are_grouped_per_container(monkeypatch):
+    def fake_stream_query(path, params):
+        assert path == "/api/v1/query"
+        cores = "memory" not in params["query"]
+        values = {"p50": 0.1, "p95": 0.3, "p99": 0.4, "max": 0.5} if cores else {"p95": 2 ** 20, "max": 2 ** 21}
+        for stat, value in values.items():
+            yield {"metric": {"pod": "web-1", "container": "app", "stat": stat}, "value": [0, str(value)]}
+
+    monkeypatch.setattr(usage_history, "stream_query", fake_stream_query)
+
+    stats = usage_history.extract_pod_usage_percentiles("web-1", "shop", "7d")
+
+    assert stats == [{
+        "name": "app",
+        "cpu_millicores": {"p50": 100.0, "p95": 300.0, "p99": 400.0, "max": 500.0},
+        "memory_bytes": {"p95": 2.0 ** 20, "max": 2.0 ** 21},
+    }]
+    assert usage_history.as_utilization(stats[0], "p99") == {
+        "name": "app", "cpu_utilization_millicores": 400.0, "memory_utilization_bytes": 0.0}
+
+
+def test_pod_analysis_compares_requests_with_a_percentile(monkeypatch):
+    requests_data = [{"name": "app", "cpu_request_millicores": 200.0, "memory_request_bytes": 2.0 ** 20}]
+    history = {("web-1", "app"): {
+        "name": "app",
+        "cpu_millicores": {"p50": 100.0, "p95": 300.0, "p99": 400.0, "max": 500.0},
+        "memory_bytes": {"p50": 2.0 ** 19, "p95": 2.0 ** 20, "p99": 2.0 ** 20, "max": 2.0 ** 21},
+    }}
+    windows = []
+
+    def fake_fetch(namespace, pod_name, window):
+        windows.append(window)
+        return history
+
+    monkeypatch.setattr(metrics_analyzer, "extract_pod_requests", lambda *args, **kwargs: requests_data)
+    monkeypatch.setattr(usage_history, "fetch_usage_percentiles", fake_fetch)
+
+    p50 = metrics_analyzer.analyze_pod_resource_usage("web-1", "shop", percentile="p50", window="14d")[0]
+    assert p50["cpu_utilization_millicores"] == 100.0 and p50["cpu_over_provisioned"] is True
+    assert p50["memory_usage_vs_request_ratio"] == 0.5
+
+    p95 = metrics_analyzer.analyze_pod_resource_usage("web-1", "shop", percentile="p95", window="14d")[0]
+    assert p95["cpu_usage_vs_request_ratio"] == 1.5 and p95["cpu_under_provisioned"] is True
+    assert p95["memory_over_provisioned"] is False and p95["memory_under_provisioned"] is False
+
+    # Both percentiles come from the same cached history query.
+    assert windows == ["14d"]
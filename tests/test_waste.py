@@ -0,0 +1,150 @@
+import os
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from services import fleet_engine, waste
+from services.waste import WasteStore
+
+HOUR = 3600
+GIB = 2.0 ** 30
+# 2026-10-01T00:00:00Z
+T0 = 1790812800
+
+
+def frame(rows):
+    """
+    rows: (namespace, pod, container, cpu_request, cpu_usage, memory_request, memory_usage) tuples.
+    """
+    columns = list(zip(*rows))
+    return fleet_engine.FleetFrame(*(np.array(c, dtype=object) for c in columns[:3]),
+                                   *(np.array(c, dtype=np.float64) for c in columns[3:]))
+
+
+def collect(store, minutes, rows, start=T0):
+    for minute in range(minutes):
+        store.update(frame(rows(minute) if callable(rows) else rows), timestamp=start + minute * 60)
+    return start + minutes * 60
+
+
+def test_waste_is_ranked_in_absolute_units(tmp_path):
+    store = WasteStore(str(tmp_path))
+    collect(store, 61, [
+        # 20% used of a large request wastes more than 10% used of a small one.
+        ("shop", "big-1", "app", 4000.0, 800.0, 8 * GIB, 2 * GIB),
+        ("shop", "small-1", "app", 100.0, 10.0, GIB, 0.9 * GIB),
+        ("data", "db-0", "postgres", 1000.0, 1200.0, 4 * GIB, 4 * GIB),  # Above its request: no waste.
+        ("data", "idle-0", "app", 0.0, 0.0, GIB, 0.0),  # No usage data: not counted.
+    ])
+
+    big, small = store.ranking("cpu_waste")
+    assert (big["pod_name"], small["pod_name"]) == ("big-1", "small-1")
+    # An hour of samples a minute apart.
+    assert big["observed_hours"] == pytest.approx(1.0)
+    assert big["cpu_waste_millicore_hours"] == pytest.approx(3200.0, rel=1e-3)
+    assert big["memory_waste_gib_hours"] == pytest.approx(6.0, rel=1e-3)
+    assert small["cpu_waste_millicore_hours"] == pytest.approx(90.0, rel=1e-3)
+    assert [r["pod_name"] for r in store.ranking("memory_waste", top=1)] == ["big-1"]
+    assert store.ranking("cpu_waste", namespace="data") == [] and store.ranking("cpu_waste", namespace="none") == []
+    # A reader in another process sees the same ranking.
+    assert WasteStore(str(tmp_path)).ranking("cpu_waste") == [big, small]
+    with pytest.raises(ValueError):
+        store.ranking("cost")
+
+
+def test_collections_update_the_rows_in_place(tmp_path):
+    store = WasteStore(str(tmp_path))
+    ts = collect(store, 2, [("shop", "web-1", "app", 1000.0, 400.0, GIB, GIB)])
+    reader = WasteStore(str(tmp_path))
+    [before] = reader.ranking("cpu_waste")
+    layout = os.stat(tmp_path / "layout.npz").st_mtime_ns
+
+    # The same container: its row changes in place, the layout and the generation do not.
+    collect(store, 30, [("shop", "web-1", "app", 1000.0, 400.0, GIB, GIB)], start=ts)
+    assert os.stat(tmp_path / "layout.npz").st_mtime_ns == layout
+    assert sorted(os.listdir(tmp_path)) == ["LOCK", "layout.npz", "rows-1"]
+    [after] = reader.ranking("cpu_waste")
+    assert after["cpu_waste_millicore_hours"] == pytest.approx(before["cpu_waste_millicore_hours"] * 31, rel=1e-3)
+
+    # A new container starts a new generation, which replaces the old one.
+    rows = [("shop", "web-1", "app", 1000.0, 400.0, GIB, GIB), ("shop", "web-2", "app", 500.0, 100.0, GIB, GIB)]
+    collect(store, 2, rows, start=ts + 30 * 60)
+    assert sorted(os.listdir(tmp_path)) == ["LOCK", "layout.npz", "rows-2"]
+    assert [r["pod_name"] for r in reader.ranking("cpu_waste")] == ["web-1", "web-2"]
+
+
+def test_window_rolls_and_forgets_old_waste(tmp_path):
+    store = WasteStore(str(tmp_path), window_hours=3)
+    # Two hours of waste, then the container is right-sized.
+    ts = collect(store, 120, [("shop", "web-1", "app", 1000.0, 500.0, GIB, GIB)])
+    [web] = store.ranking("cpu_waste")
+    assert web["cpu_waste_millicore_hours"] == pytest.approx(1000.0, rel=1e-2)
+    ts = collect(store, 120, [("shop", "web-1", "app", 500.0, 500.0, GIB, GIB)], start=ts)
+    [web] = store.ranking("cpu_waste")
+    assert web["cpu_waste_millicore_hours"] == pytest.approx(500.0, rel=1e-2)  # Only the last hour of waste is left.
+    assert web["observed_hours"] == pytest.approx(3.0, rel=1e-2)
+    collect(store, 90, [("shop", "web-1", "app", 500.0, 500.0, GIB, GIB)], start=ts)
+    assert store.ranking("cpu_waste") == []
+
+    # A container not seen for the whole window is dropped.
+    store.update(frame([("shop", "web-2", "app", 500.0, 100.0, GIB, GIB)]), timestamp=ts + 10 * HOUR)
+    assert [key[1] for key in store._keys] == ["web-2"]
+
+
+def test_memory_growing_towards_the_request_is_an_oom_risk(tmp_path):
+    store = WasteStore(str(tmp_path))
+    collect(store, 120, lambda minute: [
+        # +0.5 GiB an hour, 2 GiB below the request: there in about 4 hours.
+        ("shop", "leaky-1", "app", 100.0, 50.0, 4 * GIB, GIB + minute / 120 * GIB),
+        # Slower: about 40 hours to go, beyond the horizon.
+        ("shop", "slow-1", "app", 100.0, 50.0, 4 * GIB, 2 * GIB + minute / 120 * 0.05 * GIB),
+        ("shop", "flat-1", "app", 100.0, 50.0, 4 * GIB, 3.9 * GIB),
+        ("shop", "over-1", "app", 100.0, 50.0, GIB, 1.5 * GIB),  # Already above its request.
+    ])
+
+    over, leaky = store.ranking("oom_risk")
+    assert (over["pod_name"], over["memory_hours_to_request"]) == ("over-1", 0.0)
+    assert leaky["pod_name"] == "leaky-1" and leaky["oom_risk"] is True
+    assert leaky["memory_trend_bytes_per_hour"] == pytest.approx(0.5 * GIB, rel=1e-3)
+    assert leaky["memory_hours_to_request"] == pytest.approx(4.0, abs=0.1)
+    records = {r["pod_name"]: r for r in store.namespace_rankings("memory_waste", top=10)["shop"]}
+    assert records["slow-1"]["oom_risk"] is False and records["slow-1"]["memory_hours_to_request"] > 24
+    assert records["flat-1"]["memory_hours_to_request"] is None
+
+
+def test_cpu_at_its_request_is_a_throttling_risk(tmp_path):
+    store = WasteStore(str(tmp_path))
+    collect(store, 120, lambda minute: [
+        ("shop", "busy-1", "app", 500.0, 480.0 if minute % 2 else 100.0, GIB, GIB),  # Half the time.
+        ("shop", "spiky-1", "app", 500.0, 600.0 if minute % 10 == 0 else 100.0, GIB, GIB),  # A tenth.
+        ("data", "hot-0", "app", 500.0, 900.0, GIB, GIB),
+    ])
+    assert [(r["pod_name"], r["cpu_throttle_share"]) for r in store.ranking("throttle_risk")] == \
+        [("hot-0", 1.0), ("busy-1", pytest.approx(0.5, abs=0.01))]
+
+
+def test_top_per_namespace(tmp_path):
+    store = WasteStore(str(tmp_path))
+    rows = [(f"ns-{i % 3}", f"pod-{i}", "app", 1000.0, float(i), GIB, GIB) for i in range(1, 31)]
+    collect(store, 2, rows)
+
+    rankings = store.namespace_rankings("cpu_waste", top=2)
+    assert {ns: [r["pod_name"] for r in records] for ns, records in rankings.items()} == {
+        "ns-0": ["pod-3", "pod-6"], "ns-1": ["pod-1", "pod-4"], "ns-2": ["pod-2", "pod-5"]}
+    assert [r["pod_name"] for r in store.ranking("cpu_waste", top=4)] == ["pod-1", "pod-2", "pod-3", "pod-4"]
+
+
+def test_waste_route(tmp_path, monkeypatch):
+    from main import app
+
+    store = WasteStore(str(tmp_path))
+    collect(store, 3, [("shop", "web-1", "app", 1000.0, 100.0, GIB, GIB)])
+    monkeypatch.setattr(waste, "get_store", lambda: store)
+    client = TestClient(app)
+
+    [web] = client.get("/k8s/waste", params={"namespace": "shop"}).json()
+    assert web["pod_name"] == "web-1" and web["cpu_waste_millicore_hours"] == pytest.approx(30.0, rel=1e-2)
+    assert list(client.get("/k8s/waste", params={"per_namespace": "true", "top": 5}).json()) == ["shop"]
+    assert client.get("/k8s/waste", params={"by": "cost"}).status_code == 400
+    assert client.get("/k8s/waste", params={"top": 0}).status_code == 400